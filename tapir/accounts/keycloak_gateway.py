@@ -0,0 +1,176 @@
+"""
+Access to the keycloak admin API.
+
+There is one admin client per process. It reuses its HTTP connections (with a connection pool big enough for the
+bulk operations), keeps its admin token until shortly before it expires and uses a timeout for every request.
+The bulk functions send the requests for many users in parallel from a thread pool; they don't touch the DB,
+so they can run outside of any transaction.
+"""
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable
+
+from django.conf import settings
+from django.db import transaction
+from keycloak import KeycloakAdmin, KeycloakOpenIDConnection
+from requests.adapters import HTTPAdapter
+
+log = logging.getLogger(__name__)
+
+_keycloak_admin: KeycloakAdmin | None = None
+_keycloak_admin_lock = threading.Lock()
+
+
+def get_keycloak_request_timeout() -> int:
+    return getattr(settings, "KEYCLOAK_REQUEST_TIMEOUT", 10)
+
+
+def get_keycloak_bulk_workers() -> int:
+    return getattr(settings, "KEYCLOAK_BULK_WORKERS", 8)
+
+
+def get_keycloak_admin() -> KeycloakAdmin:
+    """
+    :return: the admin client of this process, created on first use
+    """
+    global _keycloak_admin
+
+    with _keycloak_admin_lock:
+        if _keycloak_admin is None:
+            config = settings.KEYCLOAK_ADMIN_CONFIG
+            keycloak_connection = KeycloakOpenIDConnection(
+                server_url=config["SERVER_URL"],
+                realm_name=config["REALM_NAME"],
+                client_id=config["CLIENT_ID"],
+                client_secret_key=config["CLIENT_SECRET_KEY"],
+                verify=True,
+                timeout=get_keycloak_request_timeout(),
+            )
+            # the default adapters keep at most 10 connections, enough for the thread pool of the bulk operations
+            pool_size = max(10, get_keycloak_bulk_workers())
+            for protocol in ("https://", "http://"):
+                keycloak_connection._s.mount(
+                    protocol,
+                    HTTPAdapter(
+                        pool_connections=pool_size,
+                        pool_maxsize=pool_size,
+                        max_retries=keycloak_connection._s.get_adapter(
+                            protocol
+                        ).max_retries,
+                    ),
+                )
+            _keycloak_admin = KeycloakAdmin(connection=keycloak_connection)
+
+        return _keycloak_admin
+
+
+def run_in_parallel(function: Callable, arguments: Iterable) -> list:
+    """
+    Calls the function once per argument, from a thread pool.
+
+    :param function: the function to call, must not use the DB
+    :param arguments: one argument per call
+    :return: the results in the order of the arguments. If a call raised an exception, the exception is returned instead.
+    """
+
+    def call(argument):
+        try:
+            return function(argument)
+        except Exception as e:
+            return e
+
+    arguments = list(arguments)
+    if len(arguments) <= 1:
+        return [call(argument) for argument in arguments]
+
+    with ThreadPoolExecutor(
+        max_workers=min(get_keycloak_bulk_workers(), len(arguments))
+    ) as executor:
+        return list(executor.map(call, arguments))
+
+
+def bulk_get_users(keycloak_admin: KeycloakAdmin, keycloak_ids: list[str]) -> list:
+    """
+    :return: per keycloak id, the user representation or the exception raised by keycloak (e.g. if the user doesn't exist)
+    """
+    return run_in_parallel(keycloak_admin.get_user, keycloak_ids)
+
+
+def bulk_get_user_ids(keycloak_admin: KeycloakAdmin, usernames: list[str]) -> list:
+    """
+    :return: per username, the keycloak id, None if there is no such user, or the exception raised by keycloak
+    """
+    return run_in_parallel(keycloak_admin.get_user_id, usernames)
+
+
+def bulk_create_users(keycloak_admin: KeycloakAdmin, payloads: list[dict]) -> list:
+    """
+    :return: per payload, the keycloak id of the created user or the exception raised by keycloak
+    """
+    return run_in_parallel(keycloak_admin.create_user, payloads)
+
+
+def bulk_update_users(
+    keycloak_admin: KeycloakAdmin, payloads: list[tuple[str, dict]]
+) -> list:
+    """
+    :param payloads: list of (keycloak id, payload)
+    :return: per payload, None or the exception raised by keycloak
+    """
+
+    def update_user(args):
+        keycloak_admin.update_user(user_id=args[0], payload=args[1])
+
+    return run_in_parallel(update_user, payloads)
+
+
+def bulk_send_verify_emails(
+    keycloak_admin: KeycloakAdmin, keycloak_ids: list[str]
+) -> list:
+    """
+    :return: per keycloak id, None or the exception raised by keycloak
+    """
+
+    def send_verify_email(keycloak_id):
+        keycloak_admin.send_verify_email(
+            user_id=keycloak_id,
+            redirect_uri=settings.SITE_URL,
+            client_id=settings.KEYCLOAK_ADMIN_CONFIG["FRONTEND_CLIENT_ID"],
+        )
+
+    return run_in_parallel(send_verify_email, keycloak_ids)
+
+
+def call_after_commit(
+    description: str,
+    function: Callable,
+    *args,
+    on_failure: Callable = None,
+    **kwargs,
+):
+    """
+    Outbox for keycloak requests: the function is called once the current transaction is committed
+    (immediately if there is none), and not at all if it is rolled back. This way no row locks are held while
+    waiting for keycloak. Errors are logged, since the transaction they belong to is already committed.
+
+    :param description: used in the error message
+    :param on_failure: optional, called without arguments if the function raised, to record that the request has to be
+        sent again (e.g. KeycloakUser.mark_keycloak_sync_pending)
+    """
+
+    def call():
+        try:
+            function(*args, **kwargs)
+        except Exception:
+            log.exception(f"Keycloak request failed ({description})")
+            if on_failure is not None:
+                try:
+                    on_failure()
+                except Exception:
+                    log.exception(
+                        f"Could not record the failed keycloak request ({description})"
+                    )
+
+    transaction.on_commit(call)
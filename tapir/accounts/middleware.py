@@ -1,16 +1,155 @@
+import hashlib
 import logging
+import threading
 import time
+from collections import OrderedDict
+from dataclasses import dataclass
 
+import jwt
+import requests
 from django.conf import settings
+from django.db import router
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.utils.deprecation import MiddlewareMixin
 from jwt import decode
 from keycloak import KeycloakOpenID
 
 from tapir.accounts.models import TapirUser
+from tapir.wirgarten.models import Member
 
 logger = logging.getLogger(__name__)
 
 
+class JwksKeyCache:
+    """
+    In-memory cache of the signing keys published by keycloak (JWKS endpoint of the realm).
+
+    The keys are fetched on first use. If a token is signed with an unknown key id (key rotation), the keys are fetched
+    again, but at most once per `min_refresh_interval` seconds, so that tokens with made up key ids can't flood keycloak.
+    """
+
+    def __init__(self, jwks_url: str, min_refresh_interval: int = 60):
+        self.jwks_url = jwks_url
+        self.min_refresh_interval = min_refresh_interval
+        self._keys = {}
+        self._last_fetch = None
+        self._lock = threading.Lock()
+
+    def fetch_keys(self) -> dict:
+        response = requests.get(self.jwks_url, timeout=5)
+        response.raise_for_status()
+        return {
+            jwk.key_id: jwk.key for jwk in jwt.PyJWKSet.from_dict(response.json()).keys
+        }
+
+    def get_key(self, key_id: str):
+        with self._lock:
+            if key_id not in self._keys and (
+                self._last_fetch is None
+                or time.monotonic() - self._last_fetch >= self.min_refresh_interval
+            ):
+                self._last_fetch = time.monotonic()
+                self._keys = self.fetch_keys()
+
+            if key_id not in self._keys:
+                raise jwt.InvalidKeyError(f"Unknown signing key: {key_id}")
+            return self._keys[key_id]
+
+
+@dataclass
+class CachedTokenUser:
+    expires_at: float
+    user_field_values: list
+    roles: list[str]
+    email_verified: bool
+
+
+class TokenUserCache:
+    """
+    Small LRU cache of the users resolved from access tokens, so that requests with a token that was seen before need
+    neither the signature check nor the user query.
+
+    The entries are keyed by a hash of the whole token, so only the exact same token gets a hit.
+    They expire with the token, but at the latest after `max_age` seconds so that changes made by other processes
+    show up eventually. Changes made in this process drop the entries of the user immediately.
+    """
+
+    def __init__(self, max_size: int = 1024, max_age: int = 60):
+        self.max_size = max_size
+        self.max_age = max_age
+        self._entries: OrderedDict[str, CachedTokenUser] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_key(access_token: str) -> str:
+        return hashlib.sha256(access_token.encode()).hexdigest()
+
+    def get(self, access_token: str) -> CachedTokenUser | None:
+        key = self.get_key(access_token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(
+        self,
+        access_token: str,
+        token_expires_at: float,
+        user: TapirUser,
+        roles: list[str],
+        email_verified: bool,
+    ):
+        entry = CachedTokenUser(
+            expires_at=min(token_expires_at, time.time() + self.max_age),
+            user_field_values=[
+                getattr(user, field.attname) for field in user._meta.concrete_fields
+            ],
+            roles=roles,
+            email_verified=email_verified,
+        )
+        with self._lock:
+            self._entries[self.get_key(access_token)] = entry
+            self._entries.move_to_end(self.get_key(access_token))
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate_user(self, user_id: str):
+        pk_index = [field.attname for field in TapirUser._meta.concrete_fields].index(
+            TapirUser._meta.pk.attname
+        )
+        with self._lock:
+            for key in [
+                key
+                for key, entry in self._entries.items()
+                if entry.user_field_values[pk_index] == user_id
+            ]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+token_user_cache = TokenUserCache(
+    max_size=getattr(settings, "KEYCLOAK_TOKEN_CACHE_SIZE", 1024),
+    max_age=getattr(settings, "KEYCLOAK_TOKEN_CACHE_MAX_AGE", 60),
+)
+
+
+@receiver(post_save, sender=TapirUser)
+@receiver(post_delete, sender=TapirUser)
+@receiver(post_save, sender=Member)
+@receiver(post_delete, sender=Member)
+def on_tapir_user_changed(sender, instance, **kwargs):
+    token_user_cache.invalidate_user(instance.id)
+
+
 class KeycloakMiddleware(MiddlewareMixin):
     """KeyCloak Middleware for authentication and authorization."""
 
@@ -33,6 +172,10 @@ class KeycloakMiddleware(MiddlewareMixin):
             realm_name=self.config["REALM_NAME"],
             client_id=self.config["FRONTEND_CLIENT_ID"],
         )
+        self.verify_signature = settings.KEYCLOAK_VERIFY_TOKEN_SIGNATURE
+        self.jwks_key_cache = JwksKeyCache(
+            f"{self.config['SERVER_URL']}/realms/{self.config['REALM_NAME']}/protocol/openid-connect/certs"
+        )
 
     def __call__(self, request):
         # Check for authentication and try to get user from keycloak.
@@ -41,18 +184,56 @@ class KeycloakMiddleware(MiddlewareMixin):
             logger.debug(f"No authorization found. Using public user.")
         else:
             access_token = request.COOKIES.get("token")
-            try:
-                data = decode(access_token, options={"verify_signature": False})
-                if data["exp"] < int(time.time()):
-                    self.auth_failed("Token expired on: " + data["exp"])
-                else:
-                    self.set_user(request, data)
-            except Exception as e:
-                self.auth_failed("Could not decode token", e)
+            cached = token_user_cache.get(access_token)
+            if cached is not None:
+                self.set_cached_user(request, cached)
+            else:
+                try:
+                    data = self.decode_token(access_token)
+                    if data["exp"] < int(time.time()):
+                        self.auth_failed("Token expired on", data["exp"])
+                    else:
+                        self.set_user(request, data)
+                        user = getattr(request, "user", None)
+                        if (
+                            data.get("sub") is not None
+                            and getattr(user, "keycloak_id", None) == data["sub"]
+                        ):
+                            token_user_cache.set(
+                                access_token,
+                                data["exp"],
+                                user,
+                                user.roles,
+                                user.email_verified,
+                            )
+                except Exception as e:
+                    self.auth_failed("Could not decode token", e)
 
         # Continue processing the request
         return self.get_response(request)
 
+    def decode_token(self, access_token: str) -> dict:
+        if not self.verify_signature:
+            return decode(access_token, options={"verify_signature": False})
+
+        key_id = jwt.get_unverified_header(access_token).get("kid")
+        return decode(
+            access_token,
+            key=self.jwks_key_cache.get_key(key_id),
+            algorithms=["RS256"],
+            options={"verify_aud": False},
+        )
+
+    @staticmethod
+    def set_cached_user(request, cached: CachedTokenUser):
+        request.user = TapirUser.from_db(
+            router.db_for_read(TapirUser),
+            [field.attname for field in TapirUser._meta.concrete_fields],
+            cached.user_field_values,
+        )
+        request.user.email_verified = cached.email_verified
+        request.user.roles = list(cached.roles)
+
     def set_user(self, request, data):
         keycloak_id = data.get("sub", None)
         if keycloak_id is None:
@@ -60,7 +241,9 @@ class KeycloakMiddleware(MiddlewareMixin):
         else:
             try:
                 request.user = TapirUser.objects.get(keycloak_id=keycloak_id)
-                request.user.email_verified = data.get("email_verified", False)
+                email_verified = data.get("email_verified", False)
+                request.user.update_keycloak_email_verified(email_verified)
+                request.user.email_verified = email_verified
                 roles = data.get("realm_access", {}).get("roles", [])
                 request.user.roles = [
                     role
@@ -0,0 +1,55 @@
+from django.db import migrations, models
+
+PAGE_SIZE = 500
+
+
+def copy_email_verified_from_keycloak(apps, schema_editor):
+    TapirUser = apps.get_model("accounts", "TapirUser")
+    if not TapirUser.objects.filter(keycloak_id__isnull=False).exists():
+        return
+
+    from tapir.accounts.keycloak_gateway import get_keycloak_admin
+
+    try:
+        kc = get_keycloak_admin()
+        first = 0
+        while True:
+            keycloak_users = kc.get_users(
+                {"first": first, "max": PAGE_SIZE, "briefRepresentation": True}
+            )
+            TapirUser.objects.filter(
+                keycloak_id__in=[
+                    keycloak_user["id"]
+                    for keycloak_user in keycloak_users
+                    if keycloak_user.get("emailVerified", False)
+                ]
+            ).update(keycloak_email_verified=True)
+            if len(keycloak_users) < PAGE_SIZE:
+                return
+            first += PAGE_SIZE
+    except Exception as e:
+        # the column is filled by the hourly sync_email_verified_from_keycloak task then
+        print(
+            "Could not copy the email verification status from keycloak, run the task sync_email_verified_from_keycloak: ",
+            e,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0004_auto_20230329_1532"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="tapiruser",
+            name="keycloak_email_verified",
+            field=models.BooleanField(
+                db_index=True, default=False, verbose_name="Email verified"
+            ),
+        ),
+        migrations.RunPython(
+            copy_email_verified_from_keycloak, migrations.RunPython.noop
+        ),
+    ]
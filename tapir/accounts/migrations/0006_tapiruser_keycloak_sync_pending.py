@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0005_tapiruser_keycloak_email_verified"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="tapiruser",
+            name="keycloak_sync_pending",
+            field=models.BooleanField(default=False),
+        ),
+    ]
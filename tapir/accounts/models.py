@@ -9,13 +9,21 @@ from django.db import models, transaction
 from django.urls import reverse, reverse_lazy
 from django.utils import translation
 from django.utils.translation import gettext_lazy as _
-from keycloak import KeycloakAdmin, KeycloakOpenIDConnection
+from keycloak import KeycloakAdmin
 from keycloak.exceptions import KeycloakDeleteError
 from nanoid import generate
 from phonenumber_field.modelfields import PhoneNumberField
 from tapir_mail.triggers.transactional_trigger import TransactionalTrigger
 
 from tapir import utils
+from tapir.accounts.keycloak_gateway import (
+    bulk_create_users,
+    bulk_get_user_ids,
+    bulk_send_verify_emails,
+    bulk_update_users,
+    call_after_commit,
+    get_keycloak_admin,
+)
 from tapir.core.models import ID_LENGTH, TapirModel, generate_id
 from tapir.log.models import TextLogEntry, UpdateModelLogEntry
 from tapir.settings import DEBUG
@@ -24,6 +32,8 @@ from tapir.utils.user_utils import UserUtils
 
 log = logging.getLogger(__name__)
 
+KEYCLOAK_USER_SYNC_PAGE_SIZE = 500
+
 
 class KeycloakUserQuerySet(models.QuerySet):
     def delete(self, *args, **kwargs):
@@ -42,7 +52,6 @@ class KeycloakUserManager(models.Manager.from_queryset(KeycloakUserQuerySet)):
 class KeycloakUser(AbstractUser):
     objects = KeycloakUserManager()
 
-    _kc: KeycloakAdmin = None
     roles: [str] = []
     email_verified = False
 
@@ -56,31 +65,77 @@ class KeycloakUser(AbstractUser):
     keycloak_id = models.CharField(
         max_length=64, unique=True, primary_key=False, null=True
     )
+    # local copy of the "emailVerified" flag of the keycloak user, so that users can be filtered by it without
+    # asking keycloak for every single user. See sync_email_verified_from_keycloak and KeycloakMiddleware.set_user
+    keycloak_email_verified = models.BooleanField(
+        _("Email verified"), default=False, db_index=True
+    )
+    # set if sending changed user data to keycloak failed, see retry_pending_keycloak_updates
+    keycloak_sync_pending = models.BooleanField(default=False)
 
     def email_verified(self):
         kc = self.get_keycloak_client()
         try:
             kc_user = kc.get_user(self.keycloak_id)
-            return kc_user["emailVerified"]
         except Exception:
             return False
 
+        email_verified = kc_user["emailVerified"]
+        self.update_keycloak_email_verified(email_verified)
+        return email_verified
+
+    def update_keycloak_email_verified(self, email_verified: bool):
+        """
+        Updates the local copy of the keycloak "emailVerified" flag if it changed, without saving the rest of the user.
+        """
+        if self.keycloak_email_verified == email_verified:
+            return
+        self.keycloak_email_verified = email_verified
+        if not self._state.adding:
+            type(self).objects.filter(id=self.id).update(
+                keycloak_email_verified=email_verified
+            )
+
     @classmethod
-    def get_keycloak_client(self):
-        if not self._kc:
-            config = settings.KEYCLOAK_ADMIN_CONFIG
-
-            keycloak_connection = KeycloakOpenIDConnection(
-                server_url=config["SERVER_URL"],
-                realm_name=config["REALM_NAME"],
-                client_id=config["CLIENT_ID"],
-                client_secret_key=config["CLIENT_SECRET_KEY"],
-                verify=True,
+    def sync_email_verified_from_keycloak(
+        cls, page_size: int = KEYCLOAK_USER_SYNC_PAGE_SIZE
+    ) -> dict:
+        """
+        Copies the "emailVerified" flag of all keycloak users to the local users.
+        The keycloak users are fetched page by page, each page is written with at most two UPDATE queries.
+
+        :param page_size: the number of keycloak users fetched per request
+        :return: statistics about the sync
+        """
+        kc = cls.get_keycloak_client()
+        statistics = {"keycloak_users": 0, "updated_users": 0}
+
+        first = 0
+        while True:
+            keycloak_users = kc.get_users(
+                {"first": first, "max": page_size, "briefRepresentation": True}
             )
+            for email_verified in [True, False]:
+                keycloak_ids = [
+                    keycloak_user["id"]
+                    for keycloak_user in keycloak_users
+                    if keycloak_user.get("emailVerified", False) == email_verified
+                ]
+                if keycloak_ids:
+                    statistics["updated_users"] += (
+                        cls.objects.filter(keycloak_id__in=keycloak_ids)
+                        .exclude(keycloak_email_verified=email_verified)
+                        .update(keycloak_email_verified=email_verified)
+                    )
+            statistics["keycloak_users"] += len(keycloak_users)
 
-            self._kc = KeycloakAdmin(connection=keycloak_connection)
+            if len(keycloak_users) < page_size:
+                return statistics
+            first += page_size
 
-        return self._kc
+    @classmethod
+    def get_keycloak_client(cls) -> KeycloakAdmin:
+        return get_keycloak_admin()
 
     def send_verify_email(self):
         kc = self.get_keycloak_client()
@@ -89,6 +144,9 @@ class KeycloakUser(AbstractUser):
             redirect_uri=settings.SITE_URL,
             client_id=settings.KEYCLOAK_ADMIN_CONFIG["FRONTEND_CLIENT_ID"],
         )
+        self.log_verify_email_sent()
+
+    def log_verify_email_sent(self):
         TextLogEntry().populate(
             text='Keycloak Email gesendet: "Aktivierung des Benutzerkontos"', user=self
         ).save()
@@ -112,93 +170,254 @@ class KeycloakUser(AbstractUser):
             super().save(*args, **kwargs)
             return
 
-        kc = self.get_keycloak_client()
-        has_kc_account = self.keycloak_id is not None
-        if has_kc_account:
-            try:  # try fetch the keycloak user to see if it exists
-                kc.get_user(self.keycloak_id)
-            except:
-                has_kc_account = False
-
-        if not has_kc_account:  # Keycloak User does not exist yet --> create
-            data = {
-                "username": self.email,
-                "email": self.email,
-                "firstName": self.first_name,
-                "lastName": self.last_name,
+        # The keycloak requests are sent after the transaction is committed, see call_after_commit.
+        if self.keycloak_id is None:
+            if initial_password:
+                self.keycloak_email_verified = True
+            super().save(*args, **kwargs)
+            call_after_commit(
+                f"create account for {self.email}",
+                type(self).create_keycloak_accounts,
+                [self],
+                initial_passwords={self.id: initial_password},
+            )
+            return
+        if self._state.adding:
+            # new user for an existing keycloak account, nothing to send
+            super().save(*args, **kwargs)
+            return
+
+        # Update --> change of keycloak data if necessary
+        original = type(self).objects.get(id=self.id)
+        payload = {}
+        if original.first_name != self.first_name:
+            payload["firstName"] = self.first_name
+        if original.last_name != self.last_name:
+            payload["lastName"] = self.last_name
+
+        send_verify_email = False
+        if original.email != self.email:
+            # the local copy, so that keycloak isn't called while the transaction is open
+            if self.keycloak_email_verified:
+                self.start_email_change_process(self.email, original.email)
+                # important: reset the email to the original email before persisting. The actual change happens after the user click the confirmation link
+                self.email = original.email
+            else:  # in this case, don't start the email change process, just send the keycloak email to the new address and resend the link
+                payload["email"] = self.email
+                self.keycloak_email_verified = False
+                send_verify_email = True
+
+        super().save(*args, **kwargs)
+
+        # also without changes, so that a keycloak account that doesn't exist (anymore) is re-created
+        call_after_commit(
+            f"update account of {self.email}",
+            type(self).update_keycloak_account,
+            self.id,
+            payload,
+            send_verify_email,
+            on_failure=partial(type(self).mark_keycloak_sync_pending, self.id),
+        )
+
+    @classmethod
+    def update_keycloak_account(
+        cls, user_id: str, payload: dict, send_verify_email: bool
+    ):
+        """
+        Sends changed user data to keycloak. If the keycloak account doesn't exist (anymore), it is created.
+        """
+        user = cls.objects.get(id=user_id)
+        kc = cls.get_keycloak_client()
+        try:  # try fetch the keycloak user to see if it exists
+            kc.get_user(user.keycloak_id)
+        except Exception:
+            cls.create_keycloak_accounts([user])
+            return
+
+        if payload:
+            kc.update_user(user_id=user.keycloak_id, payload=payload)
+        if send_verify_email:
+            user.send_verify_email()
+
+    @classmethod
+    def mark_keycloak_sync_pending(cls, user_id: str):
+        cls.objects.filter(id=user_id).update(keycloak_sync_pending=True)
+
+    @classmethod
+    def retry_pending_keycloak_updates(cls) -> dict:
+        """
+        Sends the current data of the users whose last keycloak update failed to keycloak again.
+
+        :return: statistics about the retried updates
+        """
+        statistics = {"updated": 0, "failed": 0}
+        for user in cls.objects.filter(keycloak_sync_pending=True):
+            try:
+                cls.update_keycloak_account(
+                    user.id,
+                    {
+                        "firstName": user.first_name,
+                        "lastName": user.last_name,
+                        "email": user.email,
+                    },
+                    False,
+                )
+            except Exception:
+                log.exception(
+                    f"Keycloak request failed (update account of {user.email})"
+                )
+                statistics["failed"] += 1
+                continue
+            cls.objects.filter(id=user.id).update(keycloak_sync_pending=False)
+            statistics["updated"] += 1
+        return statistics
+
+    @classmethod
+    def create_keycloak_accounts(
+        cls, users: list, initial_passwords: dict = None
+    ) -> dict:
+        """
+        Creates the keycloak accounts of the given users, with the requests for all users sent in parallel.
+        If a keycloak account with the same email exists and isn't linked to another user yet, it is linked instead.
+        The new keycloak ids are saved with one query, the verification emails are sent to the newly created accounts.
+
+        :param users: the users without keycloak account. Users with an email that another user of the list already has are counted as failed.
+        :param initial_passwords: optional, user id -> password. Accounts with a password don't need to verify their email.
+        :return: statistics about the created, linked and failed accounts
+        """
+        initial_passwords = initial_passwords or {}
+        kc = cls.get_keycloak_client()
+        statistics = {"created": 0, "linked": 0, "failed": 0}
+
+        # keycloak usernames are case-insensitive, only the first user per email gets an account
+        users_by_email = {}
+        for user in users:
+            email = KeycloakUserManager.normalize_email(user.email)
+            if email in users_by_email:
+                print(
+                    f"Keycloak user {user.email} is already requested for another user"
+                )
+                statistics["failed"] += 1
+            else:
+                users_by_email[email] = user
+        users = list(users_by_email.values())
+
+        existing_keycloak_ids = bulk_get_user_ids(kc, [user.email for user in users])
+        linked_keycloak_ids = set(
+            TapirUser.objects.filter(
+                keycloak_id__in=[
+                    keycloak_id
+                    for keycloak_id in existing_keycloak_ids
+                    if isinstance(keycloak_id, str)
+                ]
+            ).values_list("keycloak_id", flat=True)
+        )
+
+        superuser_group = None
+        if any(user.is_superuser for user in users):
+            superuser_group = kc.get_group_by_path(path="/superuser")
+
+        users_to_link = []
+        users_to_create = []
+        for user, keycloak_id in zip(users, existing_keycloak_ids):
+            if isinstance(keycloak_id, Exception):
+                print(f"Could not look up keycloak user {user.email}: ", keycloak_id)
+                statistics["failed"] += 1
+            elif keycloak_id is None:
+                users_to_create.append(user)
+            elif keycloak_id not in linked_keycloak_ids:
+                user.keycloak_id = keycloak_id
+                users_to_link.append(user)
+            else:
+                print(f"Keycloak user {user.email} is already linked to another user")
+                statistics["failed"] += 1
+
+        def get_payload(user) -> dict:
+            return {
+                "username": user.email,
+                "email": user.email,
+                "firstName": user.first_name,
+                "lastName": user.last_name,
                 "enabled": True,
             }
-            print("Creating Keycloak user: ", data)
 
-            keycloak_id = kc.get_user_id(self.email)
-            if keycloak_id is not None:
-                if not TapirUser.objects.filter(keycloak_id=keycloak_id).exists():
-                    self.keycloak_id = keycloak_id
-                    kc.update_user(user_id=self.keycloak_id, payload=data)
+        for user, result in zip(
+            users_to_link,
+            bulk_update_users(
+                kc, [(user.keycloak_id, get_payload(user)) for user in users_to_link]
+            ),
+        ):
+            if isinstance(result, Exception):
+                print(f"Could not update keycloak user {user.email}: ", result)
+        statistics["linked"] = len(users_to_link)
+
+        payloads = []
+        for user in users_to_create:
+            data = get_payload(user)
+            initial_password = initial_passwords.get(user.id)
+            if initial_password:
+                data["credentials"] = [{"value": initial_password, "type": "password"}]
+                data["emailVerified"] = True
             else:
-                if initial_password:
-                    data["credentials"] = [
-                        {"value": initial_password, "type": "password"}
-                    ]
-                    data["emailVerified"] = True
-                else:
-                    data["requiredActions"] = ["VERIFY_EMAIL", "UPDATE_PASSWORD"]
-
-                if self.is_superuser:
-                    group = kc.get_group_by_path(path="/superuser")
-                    if group:
-                        data["groups"] = ["superuser"]
-
-                self.keycloak_id = kc.create_user(data)
-
-                try:
-                    self.send_verify_email()
-                except Exception as e:
-                    print(
-                        f"Failed to send verify email to new user: ",
-                        e,
-                        f" (email: '{self.email}', id: '{self.id}', keycloak_id: '{self.keycloak_id}'): ",
-                    )
-
-        else:  # Update --> change of keycloak data if necessary
-            original = type(self).objects.get(id=self.id)
-            email_changed = original.email != self.email
-            first_name_changed = original.first_name != self.first_name
-            last_name_changed = original.last_name != self.last_name
-
-            if first_name_changed or last_name_changed:
-                data = {"firstName": self.first_name, "lastName": self.last_name}
-                kc.update_user(user_id=self.keycloak_id, payload=data)
-
-            if email_changed:
-                if self.email_verified():
-                    self.start_email_change_process(self.email, original.email)
-                    # important: reset the email to the original email before persisting. The actual change happens after the user click the confirmation link
-                    self.email = original.email
-                else:  # in this case, don't start the email change process, just send the keycloak email to the new address and resend the link
-                    kc.update_user(
-                        user_id=self.keycloak_id, payload={"email": self.email}
-                    )
-                    self.send_verify_email()
+                data["requiredActions"] = ["VERIFY_EMAIL", "UPDATE_PASSWORD"]
+            if user.is_superuser and superuser_group:
+                data["groups"] = ["superuser"]
+            print("Creating Keycloak user: ", {**data, "credentials": None})
+            payloads.append(data)
+
+        created_users = []
+        for user, result in zip(users_to_create, bulk_create_users(kc, payloads)):
+            if isinstance(result, Exception):
+                print(f"Could not create keycloak user {user.email}: ", result)
+                statistics["failed"] += 1
+            else:
+                user.keycloak_id = result
+                created_users.append(user)
+        statistics["created"] = len(created_users)
+
+        cls.objects.bulk_update(users_to_link + created_users, ["keycloak_id"])
+
+        for user, result in zip(
+            created_users,
+            bulk_send_verify_emails(kc, [user.keycloak_id for user in created_users]),
+        ):
+            if isinstance(result, Exception):
+                print(
+                    f"Failed to send verify email to new user: ",
+                    result,
+                    f" (email: '{user.email}', id: '{user.id}', keycloak_id: '{user.keycloak_id}'): ",
+                )
+            else:
+                user.log_verify_email_sent()
 
-        super().save(*args, **kwargs)
+        return statistics
 
     def delete(self, *args, **kwargs):
-        kc = self.get_keycloak_client()
         if self.keycloak_id:
-            try:
-                kc.delete_user(self.keycloak_id)
-            except KeycloakDeleteError as e:
-                print("Error deleting Keycloak user: ", e)
+            call_after_commit(
+                f"delete account of {self.email}",
+                self.delete_keycloak_account,
+                self.keycloak_id,
+            )
         super().delete(*args, **kwargs)
 
+    @classmethod
+    def delete_keycloak_account(cls, keycloak_id: str):
+        try:
+            cls.get_keycloak_client().delete_user(keycloak_id)
+        except KeycloakDeleteError as e:
+            print("Error deleting Keycloak user: ", e)
+
     def change_email(self, new_email: str):
         kc = self.get_keycloak_client()
-        kc.update_user(
+        call_after_commit(
+            f"change email of {self.email}",
+            kc.update_user,
             user_id=self.keycloak_id,
             payload={
                 "email": new_email,
             },
+            on_failure=partial(type(self).mark_keycloak_sync_pending, self.id),
         )
 
     @transaction.atomic
@@ -10,6 +10,16 @@ class TapirParameterDatatype(Enum):
     STRING = "string"
 
 
+class TapirParameterQuerySet(models.QuerySet):
+    def update(self, **kwargs):
+        # bulk updates don't send post_save signals, so the parameter cache has to be invalidated here
+        from tapir.configuration.parameter import parameter_cache
+
+        rows = super().update(**kwargs)
+        parameter_cache.invalidate()
+        return rows
+
+
 class TapirParameter(models.Model):
     key = models.CharField(max_length=256, primary_key=True, editable=False)
     label = models.CharField(max_length=256, null=False)
@@ -21,6 +31,8 @@ class TapirParameter(models.Model):
     options: [tuple] = None
     validators: [callable] = []
 
+    objects = TapirParameterQuerySet.as_manager()
+
     def full_clean(self):
         for validator in self.validators:
             validator(self.value)
@@ -1,6 +1,13 @@
 import re
+import threading
+import time
 
+from django.conf import settings
+from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist, ValidationError
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 
 from tapir.configuration.models import (
     TapirParameter,
@@ -70,12 +77,131 @@ def get_parameter_meta(key: str) -> ParameterMeta | None:
     return meta_info.parameters[key]
 
 
+class ParameterCache:
+    """
+    Process-local cache of all parameter values, already converted to their datatype.
+
+    All TapirParameter rows are loaded at once on first access. Other processes (gunicorn workers, celery workers)
+    are notified of changes via a version counter in the shared Django cache, which is checked at most every
+    PARAMETER_CACHE_VERSION_CHECK_INTERVAL seconds.
+
+    Values read in a transaction that changed parameters are only kept for that transaction (in the current thread),
+    so that they are not used anymore if the transaction is rolled back. They are reloaded whenever a savepoint was
+    created, released or rolled back since they were read.
+    """
+
+    VERSION_CACHE_KEY = "tapir.configuration.parameter_cache_version"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values: dict | None = None
+        self._version = None
+        self._next_version_check = 0.0
+        self._transaction_local = threading.local()
+
+    def get(self, key: str):
+        values = self._get_values()
+        if key not in values:
+            raise KeyError("Parameter with key '{key}' does not exist.".format(key=key))
+        return values[key]
+
+    def clear(self):
+        """Drops the values of this process only. They are reloaded on the next access."""
+        self._transaction_local.values = None
+        with self._lock:
+            self._values = None
+            self._version = None
+
+    def invalidate(self):
+        """Drops the values of this process and notifies all other processes once the current transaction is committed."""
+        self.clear()
+        if not transaction.get_autocommit():
+            self._transaction_local.pending = True
+        transaction.on_commit(self._increment_version)
+
+    def _has_pending_invalidation(self) -> bool:
+        """
+        :return: whether the current transaction changed parameters and is not committed yet
+        """
+        if not getattr(self._transaction_local, "pending", False):
+            return False
+        if not transaction.get_autocommit():
+            return True
+        # the transaction ended without calling _increment_version, so it was rolled back
+        self._transaction_local.pending = False
+        self._transaction_local.values = None
+        return False
+
+    def _increment_version(self):
+        self._transaction_local.pending = False
+        self.clear()
+        try:
+            cache.incr(self.VERSION_CACHE_KEY)
+        except ValueError:  # key does not exist (yet), e.g. after the cache was flushed
+            cache.add(self.VERSION_CACHE_KEY, time.time_ns())
+        except Exception as e:
+            print("Could not increment the parameter cache version: ", e)
+
+    def _get_remote_version(self):
+        try:
+            version = cache.get(self.VERSION_CACHE_KEY)
+            if version is None:
+                cache.add(self.VERSION_CACHE_KEY, time.time_ns())
+                version = cache.get(self.VERSION_CACHE_KEY)
+            return version
+        except Exception as e:
+            print("Could not read the parameter cache version: ", e)
+            return None
+
+    def _get_values(self) -> dict:
+        if self._has_pending_invalidation():
+            # changed in the current, uncommitted transaction
+            savepoint_ids = tuple(transaction.get_connection().savepoint_ids)
+            values = getattr(self._transaction_local, "values", None)
+            if values is None or self._transaction_local.savepoint_ids != savepoint_ids:
+                values = self._transaction_local.values = self._load_values()
+                self._transaction_local.savepoint_ids = savepoint_ids
+            return values
+        self._transaction_local.values = None
+
+        now = time.monotonic()
+        values = self._values
+        if values is not None and now < self._next_version_check:
+            return values
+
+        with self._lock:
+            # the version must be read before the values, otherwise a concurrent change could get lost
+            version = self._get_remote_version()
+            if version is None:
+                # shared cache unavailable: don't keep anything, every access reads from the DB
+                self._values = None
+                return self._load_values()
+
+            if self._values is None or version != self._version:
+                self._values = self._load_values()
+                self._version = version
+
+            self._next_version_check = now + getattr(
+                settings, "PARAMETER_CACHE_VERSION_CHECK_INTERVAL", 5
+            )
+            return self._values
+
+    @staticmethod
+    def _load_values() -> dict:
+        return {param.key: param.get_value() for param in TapirParameter.objects.all()}
+
+
+parameter_cache = ParameterCache()
+
+
+@receiver(post_save, sender=TapirParameter)
+@receiver(post_delete, sender=TapirParameter)
+def _invalidate_parameter_cache(**kwargs):
+    parameter_cache.invalidate()
+
+
 def get_parameter_value(key: str):
-    try:
-        param = TapirParameter.objects.get(key=key)
-        return param.get_value()
-    except ObjectDoesNotExist:
-        raise KeyError("Parameter with key '{key}' does not exist.".format(key=key))
+    return parameter_cache.get(key)
 
 
 def parameter_definition(
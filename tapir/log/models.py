@@ -1,13 +1,18 @@
+import datetime
+
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.postgres.fields import HStoreField
 from django.core.exceptions import ValidationError
 from django.core.mail import EmailMessage
 from django.db import models
+from django.db.models import Q
 from django.template.loader import render_to_string
 from django.utils.translation import gettext_lazy as _
 
 from tapir.log.util import freeze_for_log
 
+LOG_ENTRY_PAGE_SIZE = 20
+
 
 class LogEntry(models.Model):
     created_date = models.DateTimeField(
@@ -30,6 +35,9 @@ class LogEntry(models.Model):
         ContentType, on_delete=models.PROTECT, related_name="+"
     )
 
+    # fields that are not needed to render the entry in the log list
+    list_deferred_fields = []
+
     # Not abstract to be able to query all log entries, see https://stackoverflow.com/questions/3797982/how-to-query-abstract-class-based-objects-in-django
 
     def clean(self):
@@ -64,6 +72,73 @@ class LogEntry(models.Model):
         else:
             return self
 
+    @staticmethod
+    def load_leaf_classes(entries: list["LogEntry"]) -> list["LogEntry"]:
+        """
+        Same as calling as_leaf_class() on every entry, but with one query per log entry class instead of one per entry.
+        The order of the entries is kept.
+        """
+        pks_by_class_type_id = {}
+        for entry in entries:
+            pks_by_class_type_id.setdefault(entry.log_class_type_id, []).append(
+                entry.pk
+            )
+
+        leaf_entries = {}
+        for class_type_id, pks in pks_by_class_type_id.items():
+            model_class = ContentType.objects.get_for_id(class_type_id).model_class()
+            if model_class is None:
+                continue
+            for leaf_entry in (
+                model_class.objects.filter(pk__in=pks)
+                .select_related("actor")
+                .defer(*model_class.list_deferred_fields)
+            ):
+                leaf_entries[leaf_entry.pk] = leaf_entry
+
+        return [leaf_entries.get(entry.pk, entry) for entry in entries]
+
+    @staticmethod
+    def parse_cursor(cursor: str) -> tuple[datetime.datetime, int]:
+        """
+        :param cursor: cursor returned by get_user_log_entries
+        :return: the creation date and the id of the last entry of the previous page
+        :raises ValueError: if the cursor is malformed
+        """
+        created_date, pk = cursor.rsplit("_", 1)
+        return datetime.datetime.fromisoformat(created_date), int(pk)
+
+    @classmethod
+    def get_user_log_entries(
+        cls,
+        user,
+        before: tuple[datetime.datetime, int] = None,
+        limit: int = LOG_ENTRY_PAGE_SIZE,
+    ) -> tuple[list["LogEntry"], str | None]:
+        """
+        Returns one page of the log entries of a user, newest first, as leaf classes.
+
+        :param user: the user
+        :param before: cursor returned for the previous page, parsed with parse_cursor. None for the first page
+        :param limit: the page size
+        :return: the log entries and the cursor of the next page (None if this is the last page)
+        """
+        entries = cls.objects.filter(user=user).order_by("-created_date", "-id")
+        if before:
+            created_date, pk = before
+            entries = entries.filter(
+                Q(created_date__lt=created_date)
+                | Q(created_date=created_date, id__lt=pk)
+            )
+
+        entries = list(entries[: limit + 1])
+        next_cursor = None
+        if len(entries) > limit:
+            entries = entries[:limit]
+            next_cursor = f"{entries[-1].created_date.isoformat()}_{entries[-1].pk}"
+
+        return cls.load_leaf_classes(entries), next_cursor
+
     def populate(self, actor=None, user=None, share_owner=None):
         """Populate the log entry model fields.
 
@@ -99,6 +174,7 @@ class EmailLogEntry(LogEntry):
     """EmailLogEntry logs a sent email message."""
 
     template_name = "log/email_log_entry.html"
+    list_deferred_fields = ["email_content"]
 
     subject = models.CharField(max_length=128)
     email_content = models.BinaryField()
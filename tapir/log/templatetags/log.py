@@ -8,9 +8,12 @@ register = template.Library()
 
 @register.inclusion_tag("log/log_entry_list_tag.html", takes_context=True)
 def user_log_entry_list(context, selected_user):
-    raw_entries = LogEntry.objects.filter(user=selected_user).order_by("-created_date")
-    log_entries = [entry.as_leaf_class() for entry in raw_entries]
+    log_entries, next_cursor = LogEntry.get_user_log_entries(selected_user)
     context["log_entries"] = log_entries
+    context["next_cursor"] = next_cursor
+    context["more_log_entries_url"] = reverse(
+        "log:user_log_entries", args=[selected_user.pk]
+    )
 
     context["create_text_log_entry_action_url"] = "%s?next=%s" % (
         reverse("log:create_user_text_log_entry", args=[selected_user.pk]),
@@ -9,6 +9,11 @@ urlpatterns = [
         views.email_log_entry_content,
         name="email_log_entry_content",
     ),
+    path(
+        "user/<str:user_pk>/entries",
+        views.user_log_entries,
+        name="user_log_entries",
+    ),
     path(
         "text/create/user/<str:user_pk>",
         views.create_text_log_entry,
@@ -1,11 +1,12 @@
 from django.contrib.auth.decorators import permission_required
 from django.http import HttpResponse, HttpResponseBadRequest
 from django.shortcuts import get_object_or_404
+from django.template.loader import render_to_string
 from django.views.decorators.http import require_GET, require_POST
 
 from tapir.accounts.models import TapirUser
 from tapir.log.forms import CreateTextLogEntryForm
-from tapir.log.models import EmailLogEntry, TextLogEntry
+from tapir.log.models import EmailLogEntry, LogEntry, TextLogEntry
 from tapir.log.util import freeze_for_log
 from tapir.utils.shortcuts import safe_redirect
 
@@ -20,6 +21,33 @@ def email_log_entry_content(request, pk):
     return response
 
 
+@require_GET
+@permission_required("accounts.manage")
+def user_log_entries(request, user_pk):
+    """
+    Returns the table rows of the next page of log entries of the user, for the "load more" button of the log list.
+    The cursor of the following page is returned in the X-Next-Cursor header.
+    """
+    user = get_object_or_404(TapirUser, pk=user_pk)
+    before = request.GET.get("before")
+    if before:
+        try:
+            before = LogEntry.parse_cursor(before)
+        except ValueError:
+            return HttpResponseBadRequest(f"Invalid cursor: {before}")
+
+    log_entries, next_cursor = LogEntry.get_user_log_entries(user, before=before)
+
+    response = HttpResponse(
+        render_to_string(
+            "log/log_entry_rows.html", {"log_entries": log_entries}, request=request
+        )
+    )
+    if next_cursor:
+        response["X-Next-Cursor"] = next_cursor
+    return response
+
+
 class UpdateViewLogMixin:
     def get_object(self, *args, **kwargs):
         result = super().get_object(*args, **kwargs)
@@ -63,6 +63,7 @@ if ENABLE_SILK_PROFILING:
     INSTALLED_APPS.append("silk")
 
 MIDDLEWARE = [
+    "tapir.wirgarten.middleware.query_metrics.QueryMetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -74,6 +75,7 @@ MIDDLEWARE = [
     "tapir.accounts.middleware.KeycloakMiddleware",
     "tapir.wirgarten.middleware.error.GlobalServerErrorHandlerMiddleware",
     "tapir.wirgarten.middleware.mailing.TapirMailPermissionMiddleware",
+    "tapir.wirgarten.middleware.product_prices.ProductPriceTableMiddleware",
 ]
 
 X_FRAME_OPTIONS = "ALLOWALL"
@@ -36,9 +36,11 @@ CELERY_RESULT_BACKEND = env.str("CELERY_RESULT_BACKEND", default="redis://redis:
 CELERY_BEAT_SCHEDULE = {
     "execute_scheduled_tasks": {
         "task": "tapir.wirgarten.tasks.execute_scheduled_tasks",
-        "schedule": celery.schedules.crontab(
-            minute=[5],
-        ),  # every hour
+        "schedule": datetime.timedelta(minutes=1),
+    },
+    "prune_scheduled_tasks": {
+        "task": "tapir.wirgarten.tasks.prune_scheduled_tasks",
+        "schedule": celery.schedules.crontab(minute=30, hour=4),  # every day at 04:30
     },
     "export_supplier_list_csv": {
         "task": "tapir.wirgarten.tasks.export_supplier_list_csv",
@@ -66,6 +68,26 @@ CELERY_BEAT_SCHEDULE = {
         "task": "tapir.wirgarten.tasks.generate_member_numbers",
         "schedule": celery.schedules.crontab(day_of_month=1, minute=0, hour=3),
     },
+    "sync_email_verified_from_keycloak": {
+        "task": "tapir.wirgarten.tasks.sync_email_verified_from_keycloak",
+        "schedule": celery.schedules.crontab(minute=[35]),  # every hour
+    },
+    "retry_pending_keycloak_updates": {
+        "task": "tapir.wirgarten.tasks.retry_pending_keycloak_updates",
+        "schedule": celery.schedules.crontab(minute=[40]),  # every hour
+    },
+    "update_segment_memberships": {
+        "task": "tapir.wirgarten.tasks.update_segment_memberships",
+        "schedule": celery.schedules.crontab(minute=5, hour=0),  # every day at 00:05
+    },
+    "synchronize_waitlist_segments": {
+        "task": "tapir.wirgarten.tasks.synchronize_waitlist_segments",
+        "schedule": celery.schedules.crontab(minute=15, hour=0),  # every day at 00:15
+    },
+    "precompute_dashboard_kpis": {
+        "task": "tapir.wirgarten.tasks.precompute_dashboard_kpis",
+        "schedule": datetime.timedelta(minutes=5),
+    },
     "resolve_segment_and_create_email_dispatches_task": {
         "task": "tapir_mail.tasks.resolve_segment_and_create_email_dispatches_task",
         "schedule": datetime.timedelta(minutes=1),
@@ -133,6 +155,18 @@ KEYCLOAK_ADMIN_CONFIG = dict(
     CLIENT_SECRET_KEY=env.str("KEYCLOAK_ADMIN_CLIENT_SECRET_KEY", default="**********"),
 )
 
+# timeout in seconds of each request to the keycloak admin API
+KEYCLOAK_REQUEST_TIMEOUT = env.int("KEYCLOAK_REQUEST_TIMEOUT", default=10)
+# number of parallel requests of the bulk operations on keycloak users
+KEYCLOAK_BULK_WORKERS = env.int("KEYCLOAK_BULK_WORKERS", default=8)
+# check the signature of the access tokens against the keys published by keycloak
+KEYCLOAK_VERIFY_TOKEN_SIGNATURE = env.bool(
+    "KEYCLOAK_VERIFY_TOKEN_SIGNATURE", default=True
+)
+# how many resolved access tokens are kept in memory per process, and for how many seconds at most
+KEYCLOAK_TOKEN_CACHE_SIZE = env.int("KEYCLOAK_TOKEN_CACHE_SIZE", default=1024)
+KEYCLOAK_TOKEN_CACHE_MAX_AGE = env.int("KEYCLOAK_TOKEN_CACHE_MAX_AGE", default=60)
+
 CSP_FRAME_SRC = ["'self'", KEYCLOAK_ADMIN_CONFIG["PUBLIC_URL"]]
 
 
@@ -167,6 +201,38 @@ CACHES = {
     }
 }
 
+# max. seconds until a parameter change made in another process (e.g. another gunicorn worker) becomes visible
+PARAMETER_CACHE_VERSION_CHECK_INTERVAL = env.int(
+    "PARAMETER_CACHE_VERSION_CHECK_INTERVAL", default=5
+)
+
+# seconds until the capacity reserved by an unfinished order (e.g. an open registration wizard) is released again
+CAPACITY_RESERVATION_TIMEOUT = env.int("CAPACITY_RESERVATION_TIMEOUT", default=60 * 30)
+# seconds until an unused capacity ledger is dropped from redis and rebuilt from the DB on the next access
+CAPACITY_LEDGER_TTL = env.int("CAPACITY_LEDGER_TTL", default=60 * 60 * 24)
+# maximum number of scheduled tasks (see ScheduledTask) executed at the same time
+SCHEDULED_TASK_CONCURRENCY = env.int("SCHEDULED_TASK_CONCURRENCY", default=8)
+# seconds after which a running scheduled task is stopped and counted as failed attempt
+SCHEDULED_TASK_RUN_TIMEOUT = env.int("SCHEDULED_TASK_RUN_TIMEOUT", default=60 * 30)
+# seconds to wait before retrying a failed scheduled task, doubled with every failed attempt
+SCHEDULED_TASK_RETRY_DELAY = env.int("SCHEDULED_TASK_RETRY_DELAY", default=60 * 5)
+# days until done and failed scheduled tasks are deleted
+SCHEDULED_TASK_RETENTION_DAYS = env.int("SCHEDULED_TASK_RETENTION_DAYS", default=180)
+
+# seconds until the cached admin dashboard figures are recomputed, even if none of their inputs changed
+DASHBOARD_KPI_CACHE_TIMEOUT = env.int("DASHBOARD_KPI_CACHE_TIMEOUT", default=60 * 10)
+DELIVERY_CALENDAR_CACHE_TIMEOUT = env.int(
+    "DELIVERY_CALENDAR_CACHE_TIMEOUT", default=60 * 60 * 24
+)
+
+# requests and celery tasks taking longer than this many seconds are logged with their query statistics
+SLOW_REQUEST_THRESHOLD = env.float("SLOW_REQUEST_THRESHOLD", default=1.0)
+SLOW_TASK_THRESHOLD = env.float("SLOW_TASK_THRESHOLD", default=60.0)
+# if True, a request above the query budget of its view (see QUERY_BUDGETS) fails instead of being logged
+QUERY_BUDGET_STRICT = env.bool("QUERY_BUDGET_STRICT", default=False)
+# bearer token for the /metrics endpoint, the endpoint is disabled if empty
+METRICS_TOKEN = env.str("METRICS_TOKEN", default="")
+
 TAPIR_MAIL_PATH = "/tapirmail"
 os.environ["REACT_APP_API_ROOT"] = SITE_URL + TAPIR_MAIL_PATH
 os.environ["REACT_APP_BASENAME"] = TAPIR_MAIL_PATH
@@ -23,6 +23,7 @@ from django.views import generic
 
 from tapir.wirgarten.views.default_redirect import wirgarten_redirect_view
 from tapir.wirgarten.views.mailing import TapirMailView
+from tapir.wirgarten.views.metrics import metrics_view
 
 handler403 = "tapir.wirgarten.views.default_redirect.handle_403"
 tapir_mail_path = (
@@ -43,6 +44,7 @@ urlpatterns = [
     path("log/", include("tapir.log.urls")),
     path("config/", include("tapir.configuration.urls")),
     path("wirgarten/", include("tapir.wirgarten.urls")),
+    path("metrics", metrics_view, name="metrics"),
     path(
         "mailing/",
         TapirMailView.as_view(),
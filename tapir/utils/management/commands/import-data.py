@@ -52,6 +52,7 @@ class Command(BaseCommand):
             if type == "members":
                 if delete_all:
                     Member.objects.all().delete()
+                imported_members = []
                 for row in reader:
                     # identify pickup location ID
                     try:
@@ -85,12 +86,20 @@ class Command(BaseCommand):
                         valid_from=row["AO_gueltig_ab"],
                     )
                     try:
-                        m.save(bypass_keycloak=False)
+                        # the keycloak accounts are created for all members at once below
+                        m.save(bypass_keycloak=True)
                         if picloc is not None:
                             mp.save()
                     except Exception as e:
                         print(e)
                         continue
+                    if m.email:
+                        imported_members.append(m)
+
+                statistics = Member.create_keycloak_accounts(imported_members)
+                print(
+                    f"Created {statistics['created']}, linked {statistics['linked']}, failed {statistics['failed']} keycloak accounts."
+                )
             if type == "shares":
                 if delete_all:
                     CoopShareTransaction.objects.all().delete()
@@ -6,6 +6,21 @@ class WirgartenConfig(AppConfig):
     name = "tapir.wirgarten"
 
     def ready(self) -> None:
+        # connects the signal receivers that keep the capacity ledgers up to date
+        from .service import capacity_ledger  # noqa: F401
+
+        # connects the signal receivers that drop the cached dashboard figures
+        from .service import dashboard  # noqa: F401
+
+        # connects the signal receivers that drop the cached member deliveries
+        from .service import delivery  # noqa: F401
+
+        # connects the signal receivers that keep the materialized mail segments up to date
+        from .service import segment_membership  # noqa: F401
+
+        # connects the celery signal receivers that record the task metrics
+        from .service import query_metrics  # noqa: F401
+
         try:
             from .tapirmail import configure_mail_module
 
@@ -0,0 +1,224 @@
+import json
+import statistics
+import time
+from dataclasses import dataclass
+from typing import Callable
+
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from tapir.accounts.models import TapirUser
+from tapir.configuration.parameter import get_parameter_value
+from tapir.wirgarten.constants import Permission
+from tapir.wirgarten.models import Member, ProductType
+from tapir.wirgarten.parameters import Parameter
+from tapir.wirgarten.service.capacity_ledger import delete_ledgers
+from tapir.wirgarten.service.dashboard import (
+    compute_dashboard_kpis,
+    invalidate_dashboard_kpis,
+)
+from tapir.wirgarten.service.delivery import (
+    generate_future_deliveries,
+    invalidate_all_deliveries,
+)
+from tapir.wirgarten.service.member import get_next_contract_start_date
+from tapir.wirgarten.service.payment import (
+    generate_new_payments,
+    get_next_payment_date,
+)
+from tapir.wirgarten.service.products import get_free_product_capacity
+from tapir.wirgarten.tasks import _export_pick_list
+from tapir.wirgarten.views.admin_dashboard import AdminDashboardView
+from tapir.wirgarten.views.member.list.member_list import MemberListView
+
+DELIVERY_SAMPLE_SIZE = 50
+# wall time differences below this many seconds are never reported as regression, they are mostly noise
+TIME_TOLERANCE_SECONDS = 0.05
+
+
+@dataclass
+class Benchmark:
+    name: str
+    function: Callable[[], object]
+    # called before every run, not included in the measurement
+    setup: Callable[[], None] | None = None
+
+
+@dataclass
+class BenchmarkResult:
+    name: str
+    seconds: float | None = None
+    queries: int | None = None
+    error: str | None = None
+
+    def as_dict(self) -> dict:
+        return {"seconds": self.seconds, "queries": self.queries}
+
+
+def _clear_capacity_ledgers():
+    try:
+        delete_ledgers()
+    except Exception as e:
+        print("Could not delete the capacity ledgers: ", e)
+
+
+def _get_base_product_type() -> ProductType:
+    return ProductType.objects.get(
+        id=get_parameter_value(Parameter.COOP_BASE_PRODUCT_TYPE)
+    )
+
+
+def _benchmark_free_product_capacity():
+    return get_free_product_capacity(
+        get_parameter_value(Parameter.COOP_BASE_PRODUCT_TYPE),
+        get_next_contract_start_date(),
+    )
+
+
+def _benchmark_generate_new_payments():
+    return generate_new_payments(get_next_payment_date())
+
+
+def _benchmark_export_pick_list():
+    return _export_pick_list(_get_base_product_type())
+
+
+def _benchmark_future_deliveries():
+    members = Member.objects.order_by("id")[:DELIVERY_SAMPLE_SIZE]
+    return [generate_future_deliveries(member) for member in members]
+
+
+def _render_view(view_class, url_name: str):
+    path = reverse(url_name)
+    request = RequestFactory().get(path)
+    request.user = TapirUser(
+        id="benchmark", email="benchmark@example.com", is_active=True
+    )
+    request.user.roles = [Permission.Accounts.VIEW, Permission.Coop.VIEW]
+    response = view_class.as_view()(request)
+    response.render()
+    if response.status_code != 200:
+        raise Exception(f"Unexpected status code {response.status_code} for {path}")
+    return response
+
+
+def _benchmark_member_list():
+    return _render_view(MemberListView, "wirgarten:member_list")
+
+
+def _benchmark_admin_dashboard():
+    return _render_view(AdminDashboardView, "wirgarten:admin_dashboard")
+
+
+BENCHMARKS = [
+    Benchmark(
+        "get_free_product_capacity",
+        _benchmark_free_product_capacity,
+        setup=_clear_capacity_ledgers,
+    ),
+    Benchmark("generate_new_payments", _benchmark_generate_new_payments),
+    Benchmark("export_pick_list", _benchmark_export_pick_list),
+    Benchmark(
+        "generate_future_deliveries",
+        _benchmark_future_deliveries,
+        setup=invalidate_all_deliveries,
+    ),
+    Benchmark("compute_dashboard_kpis", compute_dashboard_kpis),
+    Benchmark("member_list_view", _benchmark_member_list),
+    Benchmark(
+        "admin_dashboard_view",
+        _benchmark_admin_dashboard,
+        setup=invalidate_dashboard_kpis,
+    ),
+]
+
+
+def run_benchmark(benchmark: Benchmark, repeat: int = 3) -> BenchmarkResult:
+    """
+    Runs the benchmark repeat times, every run in its own transaction that is rolled back afterwards,
+    so that the runs don't change the data for each other.
+
+    :return: the median wall time and the query count of the last run
+    """
+    timings = []
+    queries = None
+    try:
+        for _ in range(repeat):
+            with transaction.atomic():
+                if benchmark.setup is not None:
+                    benchmark.setup()
+                with CaptureQueriesContext(connection) as captured:
+                    start = time.perf_counter()
+                    benchmark.function()
+                    timings.append(time.perf_counter() - start)
+                queries = len(captured.captured_queries)
+                transaction.set_rollback(True)
+    except Exception as e:
+        return BenchmarkResult(benchmark.name, error=f"{type(e).__name__}: {e}")
+
+    return BenchmarkResult(
+        benchmark.name, seconds=statistics.median(timings), queries=queries
+    )
+
+
+def run_benchmarks(names: list[str] = None, repeat: int = 3) -> list[BenchmarkResult]:
+    """
+    :param names: the names of the benchmarks to run, all benchmarks if None
+    """
+    unknown_names = set(names or []) - {benchmark.name for benchmark in BENCHMARKS}
+    if unknown_names:
+        raise ValueError(f"Unknown benchmarks: {', '.join(sorted(unknown_names))}")
+
+    return [
+        run_benchmark(benchmark, repeat)
+        for benchmark in BENCHMARKS
+        if names is None or benchmark.name in names
+    ]
+
+
+def find_regressions(
+    results: list[BenchmarkResult], baseline: dict, threshold: float
+) -> list[str]:
+    """
+    Compares the results with the baseline. More queries than in the baseline are always a regression,
+    the wall time is a regression if it is more than threshold (e.g. 0.2 = 20%) above the baseline.
+
+    :param baseline: as written by write_baseline
+    :return: a description of every regression
+    """
+    regressions = []
+    for result in results:
+        expected = baseline.get(result.name)
+        if expected is None or result.error is not None:
+            continue
+
+        if result.queries > expected["queries"]:
+            regressions.append(
+                f"{result.name}: {result.queries} queries, baseline {expected['queries']}"
+            )
+        max_seconds = expected["seconds"] * (1 + threshold) + TIME_TOLERANCE_SECONDS
+        if result.seconds > max_seconds:
+            regressions.append(
+                f"{result.name}: {result.seconds:.3f}s, baseline {expected['seconds']:.3f}s"
+            )
+    return regressions
+
+
+def read_baseline(path: str) -> dict:
+    with open(path, encoding="UTF-8") as file:
+        return json.load(file)
+
+
+def write_baseline(path: str, results: list[BenchmarkResult], baseline: dict = None):
+    """
+    Writes the results to the baseline file. Entries of benchmarks that were not run are kept from the given baseline.
+    """
+    baseline = dict(baseline or {})
+    for result in results:
+        if result.error is None:
+            baseline[result.name] = result.as_dict()
+
+    with open(path, "w", encoding="UTF-8") as file:
+        json.dump(baseline, file, indent=2, sort_keys=True)
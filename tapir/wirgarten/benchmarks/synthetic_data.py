@@ -0,0 +1,474 @@
+import datetime
+import random
+from collections import defaultdict
+from dataclasses import dataclass
+from decimal import Decimal
+
+from dateutil.relativedelta import relativedelta
+from django.contrib.contenttypes.models import ContentType
+from django.db import models, router, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from tapir.accounts.models import TapirUser
+from tapir.configuration.models import TapirParameter
+from tapir.core.models import ID_LENGTH
+from tapir.log.models import LogEntry, TextLogEntry
+from tapir.wirgarten.constants import EVEN_WEEKS, WEEKLY
+from tapir.wirgarten.models import (
+    CoopShareTransaction,
+    Deliveries,
+    GrowingPeriod,
+    MandateReference,
+    Member,
+    MemberPickupLocation,
+    Payment,
+    PickupLocation,
+    PickupLocationCapability,
+    PickupLocationOpeningTime,
+    Product,
+    ProductCapacity,
+    ProductPrice,
+    ProductType,
+    Subscription,
+)
+from tapir.wirgarten.parameters import Parameter
+from tapir.wirgarten.service.capacity_ledger import delete_ledgers
+from tapir.wirgarten.service.cashflow import COOP_SHARES_PAYMENT_TYPE
+from tapir.wirgarten.service.dashboard import invalidate_dashboard_kpis
+from tapir.wirgarten.service.delivery import invalidate_all_deliveries
+from tapir.wirgarten.service.segment_membership import update_segment_memberships
+from tapir.wirgarten.utils import get_today
+
+# All generated members, subscriptions, payments etc. get an ID with this prefix, so that they can be told apart from
+# real data and deleted again, see clear_synthetic_data.
+SYNTHETIC_ID_PREFIX = "sy"
+BATCH_SIZE = 1000
+
+SYNTHETIC_IBAN = "DE02120300000000202051"
+SHARE_PRICE = Decimal("50.00")
+FIRST_NAMES = ["Anna", "Ben", "Clara", "David", "Emma", "Felix", "Greta", "Hannes"]
+LAST_NAMES = ["Müller", "Schmidt", "Schneider", "Fischer", "Weber", "Meyer", "Wagner"]
+
+BASE_PRODUCT_TYPE_NAME = "Ernteanteile"
+BASE_PRODUCT_SIZES = {"S": 0.66, "M": 1, "L": 1.33, "XL": 1.66}
+BASE_PRODUCT_PRICE = Decimal("90.00")  # monthly price of an M share in the first period
+ADDITIONAL_PRODUCT_TYPE_NAME = "Hühneranteile"
+ADDITIONAL_PRODUCT_PRICE = Decimal("18.00")
+YEARLY_PRICE_INCREASE = Decimal("1.03")
+
+
+@dataclass
+class SyntheticDataSize:
+    members: int = 1000
+    pickup_locations: int = 20
+    growing_periods: int = 3
+    log_entries_per_member: int = 5
+
+
+def synthetic_id(model_letter: str, index: int) -> str:
+    digits = ID_LENGTH - len(SYNTHETIC_ID_PREFIX) - len(model_letter)
+    return f"{SYNTHETIC_ID_PREFIX}{model_letter}{index:0{digits}d}"
+
+
+def bulk_create_inherited(objects: list[models.Model], batch_size: int = BATCH_SIZE):
+    """
+    bulk_create for models with multi-table inheritance (e.g. Member and TextLogEntry), which Django doesn't support:
+    the parent rows are bulk created first, then the rows of the child table are inserted with the parent keys.
+    Only one level of inheritance is supported, no signals are sent.
+
+    :param objects: unsaved instances of the same child model
+    """
+    if not objects:
+        return
+
+    model = type(objects[0])
+    parent_model, parent_link = next(iter(model._meta.parents.items()))
+    parent_fields = parent_model._meta.concrete_fields
+    parents = [
+        parent_model(
+            **{field.attname: getattr(obj, field.attname) for field in parent_fields}
+        )
+        for obj in objects
+    ]
+    parent_model.objects.bulk_create(parents, batch_size=batch_size)
+
+    for obj, parent in zip(objects, parents):
+        setattr(obj, parent_link.attname, parent.pk)
+        obj.pk = parent.pk
+
+    db = router.db_for_write(model)
+    for start in range(0, len(objects), batch_size):
+        model._base_manager._insert(
+            objects[start : start + batch_size],
+            fields=model._meta.local_concrete_fields,
+            using=db,
+        )
+
+
+def clear_synthetic_data():
+    """
+    Deletes the members generated by SyntheticDataGenerator together with everything that belongs to them.
+    Products, pickup locations and growing periods are kept, the generator reuses them.
+    """
+    synthetic_members = Member.objects.filter(id__startswith=SYNTHETIC_ID_PREFIX)
+    with transaction.atomic():
+        LogEntry.objects.filter(user__in=synthetic_members).delete()
+        Deliveries.objects.filter(member__in=synthetic_members).delete()
+        CoopShareTransaction.objects.filter(member__in=synthetic_members).delete()
+        Subscription.objects.filter(member__in=synthetic_members).delete()
+        Payment.objects.filter(mandate_ref__member__in=synthetic_members).delete()
+        MandateReference.objects.filter(member__in=synthetic_members).delete()
+        MemberPickupLocation.objects.filter(member__in=synthetic_members).delete()
+        # the queryset of the users deletes every user from keycloak one by one, the synthetic users only exist here
+        models.QuerySet.delete(synthetic_members)
+        models.QuerySet.delete(
+            TapirUser.objects.filter(id__startswith=SYNTHETIC_ID_PREFIX)
+        )
+
+
+class SyntheticDataGenerator:
+    """
+    Generates a reproducible dataset of configurable size: the same seed and size give the same dataset on the same day.
+    Everything is written with bulk inserts, so no signals are sent. The data derived from the inserted rows
+    (segment memberships, capacity ledgers, cached deliveries and dashboard figures) is updated at the end.
+    Meant for an empty database or one filled by a previous run, see clear_synthetic_data.
+    """
+
+    def __init__(self, size: SyntheticDataSize, seed: int = 0):
+        self.size = size
+        self.random = random.Random(seed)
+        self.today = get_today()
+        self.created = defaultdict(int)
+        self.id_counters = defaultdict(int)
+        self.periods: list[GrowingPeriod] = []
+        self.products: dict[ProductType, list[Product]] = {}
+        self.prices: dict[tuple[str, str], Decimal] = {}
+        self.pickup_locations: list[PickupLocation] = []
+
+    def generate(self) -> dict[str, int]:
+        """
+        :return: the number of created rows per model
+        """
+        with transaction.atomic():
+            self.create_growing_periods()
+            self.create_products()
+            self.create_pickup_locations()
+            self.create_members()
+        self.update_derived_data()
+        return dict(self.created)
+
+    def create_growing_periods(self):
+        first_year = self.today.year - self.size.growing_periods + 1
+        for year in range(first_year, self.today.year + 1):
+            period, _ = GrowingPeriod.objects.get_or_create(
+                start_date=datetime.date(year, 1, 1),
+                end_date=datetime.date(year, 12, 31),
+            )
+            self.periods.append(period)
+
+    def create_products(self):
+        base_type = self.create_product_type(
+            BASE_PRODUCT_TYPE_NAME, WEEKLY[0], BASE_PRODUCT_SIZES, BASE_PRODUCT_PRICE
+        )
+        self.create_product_type(
+            ADDITIONAL_PRODUCT_TYPE_NAME,
+            EVEN_WEEKS[0],
+            {ADDITIONAL_PRODUCT_TYPE_NAME: 1},
+            ADDITIONAL_PRODUCT_PRICE,
+        )
+
+        # saved through the model to invalidate the parameter cache
+        parameter = TapirParameter.objects.get(key=Parameter.COOP_BASE_PRODUCT_TYPE)
+        parameter.value = base_type.id
+        parameter.save()
+
+    def create_product_type(
+        self, name: str, delivery_cycle: str, sizes: dict, base_price: Decimal
+    ) -> ProductType:
+        product_type, _ = ProductType.objects.get_or_create(
+            name=name, defaults={"delivery_cycle": delivery_cycle}
+        )
+        products = []
+        for product_name, size in sizes.items():
+            product, _ = Product.objects.get_or_create(
+                type=product_type,
+                name=product_name,
+                defaults={"base": size == 1},
+            )
+            products.append(product)
+
+            price = base_price * Decimal(str(size))
+            for period in self.periods:
+                product_price, _ = ProductPrice.objects.get_or_create(
+                    product=product,
+                    valid_from=period.start_date,
+                    defaults={"price": round(price, 2), "size": size},
+                )
+                self.prices[(product.id, period.id)] = product_price.price
+                price *= YEARLY_PRICE_INCREASE
+
+        # room for about 1.5 M-equivalents per member, so that the capacity never runs out
+        capacity = round(self.size.members * 1.5 * base_price, 2)
+        for period in self.periods:
+            ProductCapacity.objects.get_or_create(
+                period=period,
+                product_type=product_type,
+                defaults={"capacity": capacity},
+            )
+        self.products[product_type] = products
+        return product_type
+
+    def create_pickup_locations(self):
+        max_capacity = (self.size.members // self.size.pickup_locations + 1) * 2
+        for index in range(self.size.pickup_locations):
+            pickup_location, created = PickupLocation.objects.get_or_create(
+                id=synthetic_id("L", index),
+                defaults={
+                    "name": f"Abholort {index + 1}",
+                    "coords_lon": Decimal("8.5") + Decimal(index) / 1000,
+                    "coords_lat": Decimal("50.1") + Decimal(index) / 1000,
+                    "street": f"Hauptstraße {index + 1}",
+                    "postcode": "60311",
+                    "city": "Frankfurt am Main",
+                },
+            )
+            self.pickup_locations.append(pickup_location)
+            if not created:
+                continue
+
+            PickupLocationOpeningTime.objects.create(
+                pickup_location=pickup_location,
+                day_of_week=2,
+                open_time=datetime.time(16),
+                close_time=datetime.time(19),
+            )
+            for product_type in self.products.keys():
+                PickupLocationCapability.objects.create(
+                    pickup_location=pickup_location,
+                    product_type=product_type,
+                    max_capacity=max_capacity,
+                )
+
+    def create_members(self):
+        self.log_class_type = ContentType.objects.get_for_model(
+            TextLogEntry, for_concrete_model=False
+        )
+        self.payment_due_day = int(
+            TapirParameter.objects.get(key=Parameter.PAYMENT_DUE_DAY).get_value()
+        )
+        self.first_member_no = (
+            Member.objects.aggregate(max_member_no=Max("member_no"))["max_member_no"]
+            or 0
+        ) + 1
+
+        for start in range(0, self.size.members, BATCH_SIZE):
+            rows = defaultdict(list)
+            for index in range(start, min(start + BATCH_SIZE, self.size.members)):
+                self.build_member(index, rows)
+
+            bulk_create_inherited(rows[Member])
+            for model in [
+                MandateReference,
+                MemberPickupLocation,
+                Payment,
+                CoopShareTransaction,
+                Subscription,
+            ]:
+                model.objects.bulk_create(rows[model], batch_size=BATCH_SIZE)
+            bulk_create_inherited(rows[TextLogEntry])
+
+            for model, objects in rows.items():
+                self.created[model.__name__] += len(objects)
+
+    def build_member(self, index: int, rows: dict[type, list]):
+        member_id = synthetic_id("M", index)
+        join_date = self.random_date(self.periods[0].start_date, self.today)
+        joined_at = self.aware(join_date)
+        first_name = self.random.choice(FIRST_NAMES)
+        last_name = self.random.choice(LAST_NAMES)
+        email = f"{member_id}@example.com"
+
+        rows[Member].append(
+            Member(
+                id=member_id,
+                username=email,
+                email=email,
+                password="!",
+                first_name=first_name,
+                last_name=last_name,
+                date_joined=joined_at,
+                account_owner=f"{first_name} {last_name}",
+                iban=SYNTHETIC_IBAN,
+                sepa_consent=joined_at,
+                privacy_consent=joined_at,
+                withdrawal_consent=joined_at,
+                member_no=self.first_member_no + index,
+                is_student=self.random.random() < 0.05,
+            )
+        )
+        mandate_ref = MandateReference(
+            ref=f"{member_id}/{join_date:%Y%m%d}",
+            member_id=member_id,
+            start_ts=joined_at,
+        )
+        rows[MandateReference].append(mandate_ref)
+        rows[MemberPickupLocation].append(
+            MemberPickupLocation(
+                id=synthetic_id("P", index),
+                member_id=member_id,
+                pickup_location=self.random.choice(self.pickup_locations),
+                valid_from=join_date,
+            )
+        )
+
+        self.build_coop_shares(member_id, mandate_ref, join_date, rows)
+        self.build_subscriptions(member_id, mandate_ref, join_date, rows)
+
+        for log_index in range(self.size.log_entries_per_member):
+            rows[TextLogEntry].append(
+                TextLogEntry(
+                    user_id=member_id,
+                    log_class_type=self.log_class_type,
+                    text=f"Synthetischer Eintrag {log_index + 1}",
+                )
+            )
+
+    def build_coop_shares(
+        self,
+        member_id: str,
+        mandate_ref: MandateReference,
+        join_date: datetime.date,
+        rows: dict[type, list],
+    ):
+        transactions = [(join_date, self.random.randint(1, 10))]
+        if self.random.random() < 0.1:
+            transactions.append(
+                (self.random_date(join_date, self.today), self.random.randint(1, 5))
+            )
+
+        for valid_at, quantity in transactions:
+            payment = Payment(
+                id=self.next_id("C"),
+                due_date=valid_at,
+                mandate_ref=mandate_ref,
+                amount=quantity * SHARE_PRICE,
+                status=Payment.PaymentStatus.PAID,
+                type=COOP_SHARES_PAYMENT_TYPE,
+            )
+            rows[Payment].append(payment)
+            rows[CoopShareTransaction].append(
+                CoopShareTransaction(
+                    id=self.next_id("S"),
+                    transaction_type=CoopShareTransaction.CoopShareTransactionType.PURCHASE,
+                    member_id=member_id,
+                    quantity=quantity,
+                    share_price=SHARE_PRICE,
+                    timestamp=self.aware(valid_at),
+                    valid_at=valid_at,
+                    mandate_ref=mandate_ref,
+                    payment=payment,
+                )
+            )
+
+        if self.random.random() < 0.05:
+            cancelled_at = self.random_date(join_date, self.today)
+            rows[CoopShareTransaction].append(
+                CoopShareTransaction(
+                    id=self.next_id("S"),
+                    transaction_type=CoopShareTransaction.CoopShareTransactionType.CANCELLATION,
+                    member_id=member_id,
+                    quantity=-transactions[0][1],
+                    share_price=SHARE_PRICE,
+                    timestamp=self.aware(cancelled_at),
+                    valid_at=cancelled_at,
+                    mandate_ref=mandate_ref,
+                )
+            )
+
+    def build_subscriptions(
+        self,
+        member_id: str,
+        mandate_ref: MandateReference,
+        join_date: datetime.date,
+        rows: dict[type, list],
+    ):
+        monthly_amounts = defaultdict(Decimal)
+        for period in self.periods:
+            if period.end_date < join_date:
+                continue
+            start_date = max(
+                period.start_date, join_date.replace(day=1) + relativedelta(months=1)
+            )
+            if start_date > period.end_date:
+                continue
+
+            for product_type, products in self.products.items():
+                is_base_product_type = len(products) > 1
+                if self.random.random() > (0.8 if is_base_product_type else 0.3):
+                    continue
+
+                product = self.random.choice(products)
+                quantity = 2 if self.random.random() < 0.1 else 1
+                solidarity_price = self.random.choice([0.0, 0.0, 0.05, 0.1, -0.05])
+                subscription = Subscription(
+                    id=self.next_id("A"),
+                    member_id=member_id,
+                    product=product,
+                    period=period,
+                    quantity=quantity,
+                    start_date=start_date,
+                    end_date=period.end_date,
+                    solidarity_price=solidarity_price,
+                    mandate_ref=mandate_ref,
+                    created_at=self.aware(min(join_date, start_date)),
+                    consent_ts=self.aware(min(join_date, start_date)),
+                )
+                if period == self.periods[-1] and self.random.random() < 0.05:
+                    subscription.cancellation_ts = self.aware(
+                        self.random_date(start_date, max(start_date, self.today))
+                    )
+                rows[Subscription].append(subscription)
+
+                price = self.prices[(product.id, period.id)]
+                monthly_amount = price * quantity * (1 + Decimal(str(solidarity_price)))
+                due_date = start_date.replace(day=self.payment_due_day)
+                while due_date <= min(period.end_date, self.today):
+                    monthly_amounts[(product_type.name, due_date)] += monthly_amount
+                    due_date += relativedelta(months=1)
+
+        for (payment_type, due_date), amount in sorted(monthly_amounts.items()):
+            rows[Payment].append(
+                Payment(
+                    id=self.next_id("Y"),
+                    due_date=due_date,
+                    mandate_ref=mandate_ref,
+                    amount=round(amount, 2),
+                    status=Payment.PaymentStatus.PAID,
+                    type=payment_type,
+                )
+            )
+
+    @staticmethod
+    def update_derived_data():
+        update_segment_memberships()
+        try:
+            delete_ledgers()
+        except Exception as e:
+            print("Could not delete the capacity ledgers: ", e)
+        invalidate_all_deliveries()
+        invalidate_dashboard_kpis()
+
+    def next_id(self, model_letter: str) -> str:
+        index = self.id_counters[model_letter]
+        self.id_counters[model_letter] += 1
+        return synthetic_id(model_letter, index)
+
+    def random_date(self, start: datetime.date, end: datetime.date) -> datetime.date:
+        return start + datetime.timedelta(
+            days=self.random.randint(0, max(0, (end - start).days))
+        )
+
+    @staticmethod
+    def aware(date: datetime.date) -> datetime.datetime:
+        return timezone.make_aware(datetime.datetime.combine(date, datetime.time(12)))
@@ -15,7 +15,6 @@ from tapir.wirgarten.models import (
     PickupLocation,
     PickupLocationCapability,
     PickupLocationOpeningTime,
-    Product,
     ProductPrice,
     ProductType,
 )
@@ -24,6 +23,7 @@ from tapir.wirgarten.service.delivery import (
     get_active_pickup_location_capabilities,
     get_next_delivery_date,
 )
+from tapir.wirgarten.service.pickup_location_occupancy import PickupLocationOccupancy
 from tapir.wirgarten.service.products import (
     get_active_subscriptions,
     get_product_price,
@@ -31,10 +31,15 @@ from tapir.wirgarten.service.products import (
 from tapir.wirgarten.utils import get_today
 
 
-def get_pickup_locations_map_data(pickup_locations, location_capabilities):
+def get_pickup_locations_map_data(
+    pickup_locations, location_capabilities, occupancy=None
+):
+    if occupancy is None:
+        occupancy = PickupLocationOccupancy()
+
     return json.dumps(
         {
-            f"{pl.id}": pickup_location_to_dict(location_capabilities, pl)
+            f"{pl.id}": pickup_location_to_dict(location_capabilities, pl, occupancy)
             for pl in list(pickup_locations)
         }
     )
@@ -52,10 +57,8 @@ def get_current_capacity_usage(
         reference_date = get_today()
 
     latest_member_pickup_location = (
-        MemberPickupLocation.objects.filter(
-            member=OuterRef("member"), valid_from__lte=reference_date
-        )
-        .order_by("-valid_from")
+        MemberPickupLocation.objects.filter(member=OuterRef("member"))
+        .valid_at(reference_date)
         .values("pickup_location_id")[:1]
     )
 
@@ -99,40 +102,32 @@ def get_current_capacity_usage(
     return float(total_size) if total_size else 0
 
 
-def pickup_location_to_dict(location_capabilities, pickup_location):
+def pickup_location_to_dict(
+    location_capabilities,
+    pickup_location,
+    occupancy: PickupLocationOccupancy = None,
+):
+    """
+    :param occupancy: the usage of the pickup locations, pass the same instance when rendering several locations
+    """
     next_delivery_date = get_next_delivery_date()
     next_month = next_delivery_date + relativedelta(day=1, months=1)
+    if occupancy is None:
+        occupancy = PickupLocationOccupancy(pickup_location_ids=[pickup_location.id])
 
     def map_capa(capa):
         max_capa = capa["max_capacity"]
-        try:
-            base_product = Product.objects.get(
-                type_id=capa["product_type_id"], base=True
-            )
-        except Product.DoesNotExist:
-            return None
-
-        current_capa = round(
-            get_current_capacity_usage(capa, next_delivery_date)
-            / float(
-                get_product_price(
-                    base_product,
-                    next_delivery_date,
-                ).size
-            ),
-            2,
+        current_usage = occupancy.get_usage_in_base_product_units(
+            pickup_location.id, capa["product_type_id"], next_delivery_date
         )
-
-        next_month_capa = round(
-            get_current_capacity_usage(capa, next_month)
-            / float(
-                get_product_price(
-                    base_product,
-                    next_month,
-                ).size
-            ),
-            2,
+        next_month_usage = occupancy.get_usage_in_base_product_units(
+            pickup_location.id, capa["product_type_id"], next_month
         )
+        if current_usage is None or next_month_usage is None:
+            return None
+
+        current_capa = round(current_usage, 2)
+        next_month_capa = round(next_month_usage, 2)
 
         capa_diff = round(next_month_capa - current_capa, 2)
         return {
@@ -163,22 +158,7 @@ def pickup_location_to_dict(location_capabilities, pickup_location):
                 if x is not None
             ]
         ),
-        "members": get_active_subscriptions(next_delivery_date)
-        .annotate(
-            latest_pickup_location_id=Subquery(
-                MemberPickupLocation.objects.filter(
-                    member=OuterRef("member"), valid_from__lte=next_delivery_date
-                )
-                .order_by("-valid_from")
-                .values("pickup_location_id")[:1]
-            )
-        )
-        .filter(
-            latest_pickup_location_id=pickup_location.id,
-        )
-        .values("member_id")
-        .distinct()
-        .count(),
+        "members": occupancy.get_member_count(pickup_location.id, next_delivery_date),
         "coords": f"{pickup_location.coords_lon},{pickup_location.coords_lat}",
     }
 
@@ -193,13 +173,14 @@ class PickupLocationWidget(forms.Select):
         selected_product_types,
         initial,
         *args,
+        occupancy=None,
         **kwargs,
     ):
         super(PickupLocationWidget, self).__init__(*args, **kwargs)
 
         self.attrs["selected_product_types"] = selected_product_types
         self.attrs["data"] = get_pickup_locations_map_data(
-            pickup_locations, location_capabilities
+            pickup_locations, location_capabilities, occupancy
         )
         self.attrs["initial"] = initial
 
@@ -247,6 +228,7 @@ class PickupLocationChoiceField(forms.ModelChoiceField):
             )
         )
         next_month = get_today() + relativedelta(months=1, day=1)
+        occupancy = PickupLocationOccupancy()
 
         for product_type_name in selected_product_types:
             possible_locations = possible_locations.filter(
@@ -268,8 +250,10 @@ class PickupLocationChoiceField(forms.ModelChoiceField):
                     ):
                         continue
 
-                    current_capacity_usage = get_current_capacity_usage(
-                        location_capability, next_month
+                    current_capacity_usage = occupancy.get_usage(
+                        possible_location.id,
+                        location_capability["product_type_id"],
+                        next_month,
                     )
                     max_capacity = location_capability["max_capacity"] + 0.1
                     free_capacity = max_capacity - current_capacity_usage
@@ -287,6 +271,7 @@ class PickupLocationChoiceField(forms.ModelChoiceField):
                 location_capabilities=location_capabilities,
                 selected_product_types=selected_product_types,
                 initial=initial.get("initial", None),
+                occupancy=occupancy,
             ),
             **kwargs,
         )
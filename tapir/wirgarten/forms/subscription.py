@@ -1,5 +1,6 @@
 from collections import OrderedDict
 from datetime import date
+from functools import partial
 
 from dateutil.relativedelta import relativedelta
 from django import forms
@@ -10,10 +11,7 @@ from django.utils.translation import gettext_lazy as _
 
 from tapir.configuration.parameter import get_parameter_value
 from tapir.utils.forms import DateInput
-from tapir.wirgarten.forms.pickup_location import (
-    PickupLocationChoiceField,
-    get_current_capacity_usage,
-)
+from tapir.wirgarten.forms.pickup_location import PickupLocationChoiceField
 from tapir.wirgarten.models import (
     GrowingPeriod,
     HarvestShareProduct,
@@ -25,9 +23,16 @@ from tapir.wirgarten.models import (
     Subscription,
 )
 from tapir.wirgarten.parameters import Parameter
+from tapir.wirgarten.service.capacity_ledger import (
+    PickupLocationCapacityLedger,
+    ProductCapacityLedger,
+    on_subscriptions_bulk_created,
+    release_capacity_reservations,
+)
 from tapir.wirgarten.service.delivery import (
     get_active_pickup_location_capabilities,
     get_next_delivery_date,
+    invalidate_member_deliveries,
 )
 from tapir.wirgarten.service.member import (
     change_pickup_location,
@@ -47,6 +52,8 @@ from tapir.wirgarten.service.products import (
     get_total_price_for_subs,
     get_next_growing_period,
 )
+from tapir.wirgarten.service.segment_membership import update_segment_memberships
+from tapir.wirgarten.triggers.onboarding_trigger import queue_onboarding_update
 from tapir.wirgarten.utils import format_date, get_now, get_today
 
 SOLIDARITY_PRICES = [
@@ -86,6 +93,10 @@ class BaseProductForm(forms.Form):
         self.is_admin = kwargs.pop("is_admin", False)
         self.require_at_least_one = kwargs.pop("enable_validation", False)
         self.choose_growing_period = kwargs.pop("choose_growing_period", False)
+        self.capacity_reservation_id = kwargs.pop(
+            "capacity_reservation_id", None
+        ) or get_capacity_reservation_id(self.member_id)
+        self.capacity_ledgers = []
         initial = kwargs.get("initial", {})
 
         self.start_date = kwargs.pop(
@@ -373,6 +384,15 @@ class BaseProductForm(forms.Form):
 
             self.subs.append(sub)
 
+        # registered after the subscriptions, so that their on_commit ledger updates run before the release
+        transaction.on_commit(
+            partial(
+                release_capacity_reservations,
+                self.capacity_ledgers,
+                self.capacity_reservation_id,
+            )
+        )
+
         member = Member.objects.get(id=member_id)
         member.sepa_consent = now
         member.save()
@@ -422,19 +442,10 @@ class BaseProductForm(forms.Form):
         if pickup_location:
             return pickup_location
 
-        member_pickup_locations = MemberPickupLocation.objects.filter(
-            member_id=self.member_id
-        )
-        if member_pickup_locations.count() == 1:
-            return member_pickup_locations.get().pickup_location
-
         next_month = get_today() + relativedelta(months=1, day=1)
-        return (
-            member_pickup_locations.filter(valid_from__lte=next_month)
-            .order_by("-valid_from")
-            .first()
-            .pickup_location
-        )
+        return MemberPickupLocation.get_pickup_locations(
+            [self.member_id], next_month
+        ).get(self.member_id)
 
     def calculate_capacity_used_by_the_ordered_products(
         self, return_capacity_in_euros: bool = False
@@ -486,10 +497,7 @@ class BaseProductForm(forms.Form):
 
     def validate_total_capacity(self):
         base_product_type_id = get_parameter_value(Parameter.COOP_BASE_PRODUCT_TYPE)
-        free_capacity = get_free_product_capacity(
-            product_type_id=base_product_type_id,
-            reference_date=self.start_date,
-        )
+        ledger = ProductCapacityLedger(base_product_type_id, self.start_date)
         ordered_capacity = self.calculate_capacity_used_by_the_ordered_products()
         currently_used_capacity = float(
             self.calculate_capacity_used_by_the_current_subscriptions(
@@ -497,7 +505,11 @@ class BaseProductForm(forms.Form):
             )
         )
 
-        if free_capacity < (ordered_capacity - currently_used_capacity):
+        self.capacity_ledgers.append(ledger)
+        if not ledger.reserve(
+            ordered_capacity - currently_used_capacity, self.capacity_reservation_id
+        ):
+            free_capacity = ledger.get_free_capacity(self.capacity_reservation_id)
             self.add_error(
                 None,
                 f"Die ausgewählte Ernteanteile sind größer als die verfügbare Kapazität! Verfügbar: {round(free_capacity, 2)}",
@@ -589,6 +601,17 @@ class BaseProductForm(forms.Form):
         return subscriptions.exists()
 
 
+def get_capacity_reservation_id(member_id: str = None) -> str | None:
+    """
+    Reservations of the same member replace each other. Anonymous orders only reserve capacity if the caller passes
+    an id that stays the same across the validations of the order (see RegistrationWizardViewBase),
+    otherwise the capacity is only checked.
+    """
+    if member_id:
+        return f"member-{member_id}"
+    return None
+
+
 def validate_pickup_location_capacity(
     form, capability, product_type, start_date, total_member_amount, member_id
 ):
@@ -607,11 +630,11 @@ def validate_pickup_location_capacity(
         )
     )
     diff_member_amount = total_member_amount - current_member_amount
-    new_total_amount = (
-        get_current_capacity_usage(capability, start_date) + diff_member_amount
-    )
 
-    if new_total_amount > capability.max_capacity:
+    ledger = PickupLocationCapacityLedger(capability, start_date)
+    form.capacity_ledgers.append(ledger)
+
+    if not ledger.reserve(diff_member_amount, form.capacity_reservation_id):
         form.add_error("pickup_location", "Abholort ist voll")  # this is not displayed
         form.add_error(
             None,
@@ -625,6 +648,10 @@ class AdditionalProductForm(forms.Form):
     def __init__(self, *args, **kwargs):
         self.is_admin = kwargs.pop("is_admin", False)
         self.member_id = kwargs.pop("member_id", None)
+        self.capacity_reservation_id = kwargs.pop(
+            "capacity_reservation_id", None
+        ) or get_capacity_reservation_id(self.member_id)
+        self.capacity_ledgers = []
         initial = kwargs.get("initial", {})
         product_type_id = kwargs.pop(
             "product_type_id", initial.pop("product_type_id", None)
@@ -833,6 +860,19 @@ class AdditionalProductForm(forms.Form):
                 )
 
         Subscription.objects.bulk_create(self.subs)
+        on_subscriptions_bulk_created(self.subs)
+        # bulk_create doesn't send post_save, which invalidates the cached deliveries otherwise
+        transaction.on_commit(partial(invalidate_member_deliveries, member_id))
+        # registered after the ledger updates, so that the order is counted as used before its reservation is released
+        transaction.on_commit(
+            partial(
+                release_capacity_reservations,
+                self.capacity_ledgers,
+                self.capacity_reservation_id,
+            )
+        )
+        update_segment_memberships([member_id])
+        queue_onboarding_update(member_id)
         Member.objects.filter(id=member_id).update(sepa_consent=get_now())
 
         new_pickup_location = self.cleaned_data.get("pickup_location")
@@ -880,10 +920,9 @@ class AdditionalProductForm(forms.Form):
 
         next_month = get_today() + relativedelta(months=1, day=1)
         latest_member_pickup_location = (
-            MemberPickupLocation.objects.filter(
-                member_id=self.member_id, valid_from__lte=next_month
-            )
-            .order_by("-valid_from")
+            MemberPickupLocation.objects.filter(member_id=self.member_id)
+            .valid_at(next_month)
+            .select_related("pickup_location")
             .first()
         )
         if not latest_member_pickup_location:
@@ -0,0 +1,51 @@
+from django.core.management import BaseCommand
+
+from tapir.wirgarten.benchmarks.synthetic_data import (
+    SyntheticDataGenerator,
+    SyntheticDataSize,
+    clear_synthetic_data,
+)
+from tapir.wirgarten.parameters import ParameterDefinitions
+
+
+class Command(BaseCommand):
+    help = "Generates a reproducible synthetic dataset of the given size, e.g. for the run_benchmarks command"
+
+    def add_arguments(self, parser):
+        defaults = SyntheticDataSize()
+        parser.add_argument("--members", type=int, default=defaults.members)
+        parser.add_argument(
+            "--pickup-locations", type=int, default=defaults.pickup_locations
+        )
+        parser.add_argument(
+            "--growing-periods",
+            type=int,
+            default=defaults.growing_periods,
+            help="Number of yearly growing periods, the last one is the current one",
+        )
+        parser.add_argument(
+            "--log-entries", type=int, default=defaults.log_entries_per_member
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--clear",
+            action="store_true",
+            help="Delete the previously generated synthetic members first",
+        )
+
+    def handle(self, *args, **options):
+        if options["clear"]:
+            clear_synthetic_data()
+            self.stdout.write("Deleted the previously generated synthetic data")
+
+        ParameterDefinitions().import_definitions()
+
+        size = SyntheticDataSize(
+            members=options["members"],
+            pickup_locations=options["pickup_locations"],
+            growing_periods=options["growing_periods"],
+            log_entries_per_member=options["log_entries"],
+        )
+        created = SyntheticDataGenerator(size, seed=options["seed"]).generate()
+        for model_name, count in sorted(created.items()):
+            self.stdout.write(f"{model_name}: {count}")
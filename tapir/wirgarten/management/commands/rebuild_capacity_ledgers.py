@@ -0,0 +1,37 @@
+from django.core.management import BaseCommand
+
+from tapir.wirgarten.service.capacity_ledger import (
+    PickupLocationCapacityLedger,
+    ProductCapacityLedger,
+    delete_ledgers,
+)
+from tapir.wirgarten.service.delivery import get_active_pickup_location_capabilities
+from tapir.wirgarten.service.member import get_next_contract_start_date
+from tapir.wirgarten.service.products import get_active_product_capacities
+
+
+class Command(BaseCommand):
+    help = "Drops all capacity ledgers and rebuilds the ledgers for the next contract start date from the database"
+
+    def handle(self, *args, **options):
+        deleted_keys = delete_ledgers()
+        self.stdout.write(f"Deleted {deleted_keys} capacity ledger keys")
+
+        reference_date = get_next_contract_start_date()
+        for product_capacity in get_active_product_capacities(reference_date):
+            ledger = ProductCapacityLedger(
+                product_capacity.product_type_id, reference_date
+            )
+            used_capacity = ledger.rebuild()
+            self.stdout.write(
+                f"{product_capacity.product_type.name}: {used_capacity:.2f} / {ledger.capacity:.2f}"
+            )
+
+        for capability in get_active_pickup_location_capabilities(
+            reference_date
+        ).filter(max_capacity__isnull=False):
+            ledger = PickupLocationCapacityLedger(capability, reference_date)
+            used_capacity = ledger.rebuild()
+            self.stdout.write(
+                f"{capability.pickup_location.name} - {capability.product_type.name}: {used_capacity:.2f} / {ledger.capacity:.2f}"
+            )
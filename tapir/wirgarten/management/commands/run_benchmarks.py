@@ -0,0 +1,68 @@
+import os
+
+from django.core.management import BaseCommand, CommandError
+
+from tapir.wirgarten.benchmarks.suite import (
+    find_regressions,
+    read_baseline,
+    run_benchmarks,
+    write_baseline,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures wall time and query count of the key service functions and views against the current database "
+        "(see generate_synthetic_data) and fails if they regressed compared to the baseline file"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--baseline", default="benchmark_baseline.json")
+        parser.add_argument(
+            "--update-baseline",
+            action="store_true",
+            help="Write the results to the baseline file instead of comparing them",
+        )
+        parser.add_argument(
+            "--threshold",
+            type=float,
+            default=0.2,
+            help="Allowed relative increase of the wall time, 0.2 = 20%%",
+        )
+        parser.add_argument("--repeat", type=int, default=3)
+        parser.add_argument(
+            "--only", nargs="+", help="Names of the benchmarks to run, default all"
+        )
+
+    def handle(self, *args, **options):
+        try:
+            results = run_benchmarks(options["only"], repeat=options["repeat"])
+        except ValueError as e:
+            raise CommandError(e)
+
+        for result in results:
+            if result.error is not None:
+                self.stdout.write(f"{result.name}: ERROR {result.error}")
+            else:
+                self.stdout.write(
+                    f"{result.name}: {result.seconds:.3f}s, {result.queries} queries"
+                )
+
+        baseline_path = options["baseline"]
+        baseline = read_baseline(baseline_path) if os.path.exists(baseline_path) else {}
+        if options["update_baseline"]:
+            write_baseline(baseline_path, results, baseline)
+            self.stdout.write(f"Baseline written to {baseline_path}")
+        elif not baseline:
+            self.stdout.write(
+                f"No baseline at {baseline_path}, run with --update-baseline to create it"
+            )
+
+        errors = [result.name for result in results if result.error is not None]
+        if errors:
+            raise CommandError(f"Benchmarks failed: {', '.join(errors)}")
+
+        if not options["update_baseline"]:
+            regressions = find_regressions(results, baseline, options["threshold"])
+            if regressions:
+                raise CommandError("Regressions:\n" + "\n".join(regressions))
@@ -46,12 +46,12 @@ class Command(BaseCommand):
 
         def send_emails(members):
             if confirm_member_group(members):
-                for m in members:
-                    try:
-                        m.save(bypass_keycloak=False)
-                    except Exception as e:
-                        print(e)
-                        continue
+                statistics = Member.create_keycloak_accounts(
+                    [m for m in members if m.email]
+                )
+                print(
+                    f"Created {statistics['created']}, linked {statistics['linked']}, failed {statistics['failed']} keycloak accounts."
+                )
 
         qs = Member.objects.filter(keycloak_id=None)
         if options["with_subscription"]:
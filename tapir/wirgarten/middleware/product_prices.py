@@ -0,0 +1,15 @@
+from tapir.wirgarten.service.products import use_product_price_table
+
+
+class ProductPriceTableMiddleware:
+    """
+    Resolves all product prices of a request from one request-scoped ProductPriceTable, so that each product's price
+    history is queried at most once per request.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with use_product_price_table():
+            return self.get_response(request)
@@ -0,0 +1,38 @@
+from django.conf import settings
+
+from tapir.wirgarten.service.query_metrics import (
+    QueryRecorder,
+    check_query_budget,
+    view_metrics,
+)
+
+
+class QueryMetricsMiddleware:
+    """
+    Records the wall time, SQL query count, SQL time and duplicate queries of every request per URL name
+    (see /metrics), logs slow requests and checks the query budgets.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        with recorder.record():
+            response = self.get_response(request)
+
+        resolver_match = getattr(request, "resolver_match", None)
+        url_name = (
+            resolver_match.view_name
+            if resolver_match is not None and resolver_match.view_name
+            else "unresolved"
+        )
+        view_metrics.observe(url_name, recorder)
+
+        if recorder.total_seconds > settings.SLOW_REQUEST_THRESHOLD:
+            print(
+                f"[slow request] {request.method} {request.path} ({url_name}): {recorder.describe()}"
+            )
+        check_query_budget(url_name, recorder)
+
+        return response
@@ -0,0 +1,43 @@
+import datetime
+
+from django.db import migrations, models
+
+
+def set_valid_to_dates(apps, schema_editor):
+    MemberPickupLocation = apps.get_model("wirgarten", "MemberPickupLocation")
+
+    previous = None
+    for member_pickup_location in MemberPickupLocation.objects.order_by(
+        "member_id", "valid_from"
+    ):
+        if (
+            previous is not None
+            and previous.member_id == member_pickup_location.member_id
+        ):
+            previous.valid_to = member_pickup_location.valid_from - datetime.timedelta(
+                days=1
+            )
+            previous.save(update_fields=["valid_to"])
+        previous = member_pickup_location
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("wirgarten", "0044_alter_productcapacity_capacity"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="memberpickuplocation",
+            name="valid_to",
+            field=models.DateField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="memberpickuplocation",
+            index=models.Index(
+                fields=["member", "valid_from", "valid_to"],
+                name="idx_memberpickuplocation_valid",
+            ),
+        ),
+        migrations.RunPython(set_valid_to_dates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,56 @@
+import hashlib
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import migrations, models
+
+
+def set_dedup_keys(apps, schema_editor):
+    ScheduledTask = apps.get_model("wirgarten", "ScheduledTask")
+
+    pending_keys = set()
+    for scheduled_task in ScheduledTask.objects.order_by("-created_at"):
+        scheduled_task.dedup_key = hashlib.sha256(
+            json.dumps(
+                [
+                    scheduled_task.task_function,
+                    list(scheduled_task.task_args),
+                    scheduled_task.task_kwargs,
+                ],
+                sort_keys=True,
+                cls=DjangoJSONEncoder,
+            ).encode()
+        ).hexdigest()
+
+        if scheduled_task.status == "PENDING":
+            if scheduled_task.dedup_key in pending_keys:
+                # only the most recently scheduled duplicate is kept, as schedule_task_unique used to do
+                scheduled_task.delete()
+                continue
+            pending_keys.add(scheduled_task.dedup_key)
+
+        scheduled_task.save(update_fields=["dedup_key"])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("wirgarten", "0046_scheduledtask_attempts"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="scheduledtask",
+            name="dedup_key",
+            field=models.CharField(default="", editable=False, max_length=64),
+            preserve_default=False,
+        ),
+        migrations.RunPython(set_dedup_keys, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="scheduledtask",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("status", "PENDING")),
+                fields=("dedup_key",),
+                name="unique_pending_scheduledtask",
+            ),
+        ),
+    ]
@@ -0,0 +1,92 @@
+import functools
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Sum
+from django.utils import timezone
+
+import tapir.core.models
+
+
+def fill_segment_memberships(apps, schema_editor):
+    CoopShareTransaction = apps.get_model("wirgarten", "CoopShareTransaction")
+    Subscription = apps.get_model("wirgarten", "Subscription")
+    MemberSegmentMembership = apps.get_model("wirgarten", "MemberSegmentMembership")
+
+    today = timezone.localdate()
+    coop_member_ids = (
+        CoopShareTransaction.objects.filter(valid_at__lte=today)
+        .values("member_id")
+        .annotate(total_shares=Sum("quantity"))
+        .filter(total_shares__gte=1)
+        .values_list("member_id", flat=True)
+    )
+    subscribed_member_ids = (
+        Subscription.objects.filter(start_date__lte=today, end_date__gte=today)
+        .values_list("member_id", flat=True)
+        .distinct()
+    )
+
+    MemberSegmentMembership.objects.bulk_create(
+        [
+            MemberSegmentMembership(segment=segment, member_id=member_id)
+            for segment, member_ids in [
+                ("coop_members", coop_member_ids),
+                ("active_subscription", subscribed_member_ids),
+            ]
+            for member_id in member_ids
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("wirgarten", "0047_scheduledtask_dedup_key"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MemberSegmentMembership",
+            fields=[
+                (
+                    "id",
+                    models.CharField(
+                        default=functools.partial(
+                            tapir.core.models.generate_id, *(), **{}
+                        ),
+                        max_length=10,
+                        primary_key=True,
+                        serialize=False,
+                        unique=True,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "segment",
+                    models.CharField(
+                        choices=[
+                            ("coop_members", "Coop members"),
+                            ("active_subscription", "With active subscription"),
+                        ],
+                        max_length=32,
+                    ),
+                ),
+                (
+                    "member",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="wirgarten.member",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="membersegmentmembership",
+            constraint=models.UniqueConstraint(
+                fields=("segment", "member"),
+                name="unique_member_segment_membership",
+            ),
+        ),
+        migrations.RunPython(fill_segment_memberships, migrations.RunPython.noop),
+    ]
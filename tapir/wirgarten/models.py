@@ -1,18 +1,27 @@
 import datetime
+import hashlib
+import json
 from functools import partial
 
 from dateutil.relativedelta import relativedelta
 from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models, transaction
 from django.db.models import (
+    Count,
     F,
     Index,
     JSONField,
+    Min,
     OuterRef,
+    Q,
     Subquery,
     Sum,
     UniqueConstraint,
 )
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from localflavor.generic.models import IBANField
@@ -273,12 +282,47 @@ class TapirUserManager(models.Manager.from_queryset(MemberQuerySet)):
         return KeycloakUserManager.normalize_email(email)
 
 
+class MemberComputedFieldsDescriptor:
+    """
+    Member.computed_fields: the values loaded by load_member_computed_fields, None if they are not loaded.
+
+    Supports prefetch_related, so that Member.objects.prefetch_related("computed_fields") loads the values for all
+    members of the queryset with a handful of queries once it is evaluated, e.g. for the recipients of a mail segment.
+    """
+
+    cache_name = "_computed_fields"
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        return getattr(instance, self.cache_name, None)
+
+    def is_cached(self, instance) -> bool:
+        return instance._get_computed_fields() is not None
+
+    def get_prefetch_queryset(self, instances, queryset=None):
+        from tapir.wirgarten.service.member_computed_fields import (
+            load_member_computed_fields,
+        )
+
+        load_member_computed_fields(instances)
+        return (
+            [getattr(instance, self.cache_name) for instance in instances],
+            lambda computed_fields: computed_fields.member_id,
+            lambda instance: instance.id,
+            True,
+            self.cache_name,
+            True,
+        )
+
+
 class Member(TapirUser):
     """
     A member of WirGarten. Usually a member has coop shares and optionally other subscriptions.
     """
 
     objects = TapirUserManager()
+    computed_fields = MemberComputedFieldsDescriptor()
 
     account_owner = models.CharField(_("Account owner"), max_length=150, null=True)
     iban = IBANField(_("IBAN"), null=True)
@@ -291,30 +335,30 @@ class Member(TapirUser):
     member_no = models.IntegerField(_("Mitgliedsnummer"), unique=True, null=True)
     is_student = models.BooleanField(_("Student*in"), default=False)
 
+    def _get_computed_fields(self):
+        """
+        :return: the values loaded by load_member_computed_fields, None if they are not loaded or not loaded for today
+        """
+        computed_fields = getattr(self, "_computed_fields", None)
+        if computed_fields is None or computed_fields.reference_date != get_today():
+            return None
+        return computed_fields
+
+    def refresh_from_db(self, *args, **kwargs):
+        self._computed_fields = None
+        super().refresh_from_db(*args, **kwargs)
+
     @property
     def pickup_location(self):
+        computed_fields = self._get_computed_fields()
+        if computed_fields is not None:
+            return computed_fields.pickup_location
         return self.get_pickup_location()
 
     def get_pickup_location(self, reference_date=None):
-        if reference_date is None:
-            reference_date = get_today()
-
-        all_locations = self.memberpickuplocation_set.all()
-
-        # If there's only one pickup_location, return it regardless of its valid_from date
-        if all_locations.count() == 1:
-            return all_locations.first().pickup_location
-        else:
-            found = (
-                self.memberpickuplocation_set.filter(valid_from__lte=reference_date)
-                .order_by("-valid_from")
-                .values("pickup_location")
-            )
-            return (
-                PickupLocation.objects.get(id=found[0]["pickup_location"])
-                if found.exists()
-                else None
-            )
+        return MemberPickupLocation.get_pickup_locations([self.id], reference_date).get(
+            self.id
+        )
 
     @classmethod
     def generate_member_no(cls):
@@ -338,6 +382,10 @@ class Member(TapirUser):
     def has_trial_contracts(self):
         from tapir.wirgarten.service.products import get_future_subscriptions
 
+        computed_fields = self._get_computed_fields()
+        if computed_fields is not None:
+            return computed_fields.has_trial_contracts
+
         subs = get_future_subscriptions().filter(member_id=self.id)
         today = get_today()
         for sub in subs:
@@ -346,6 +394,10 @@ class Member(TapirUser):
         return False
 
     def coop_shares_total_value(self):
+        computed_fields = self._get_computed_fields()
+        if computed_fields is not None:
+            return computed_fields.coop_shares_total_value
+
         today = get_today()
         return (
             self.coopsharetransaction_set.filter(valid_at__lte=today).aggregate(
@@ -356,6 +408,10 @@ class Member(TapirUser):
 
     @property
     def coop_shares_quantity(self):
+        computed_fields = self._get_computed_fields()
+        if computed_fields is not None:
+            return computed_fields.coop_shares_quantity
+
         today = get_today()
         return (
             self.coopsharetransaction_set.filter(valid_at__lte=today).aggregate(
@@ -367,6 +423,10 @@ class Member(TapirUser):
     def monthly_payment(self):
         from tapir.wirgarten.service.products import get_active_subscriptions
 
+        computed_fields = self._get_computed_fields()
+        if computed_fields is not None:
+            return computed_fields.monthly_payment
+
         today = get_today()
         return (
             get_active_subscriptions()
@@ -390,6 +450,10 @@ class Member(TapirUser):
 
     @property
     def coop_entry_date(self):
+        computed_fields = self._get_computed_fields()
+        if computed_fields is not None:
+            return computed_fields.coop_entry_date
+
         try:
             earliest_coopsharetransaction = self.coopsharetransaction_set.filter(
                 transaction_type__in=[
@@ -418,67 +482,162 @@ class Member(TapirUser):
         - “einen S-Ernteanteil + M-Ernteanteil + L-Ernteanteil”
         """
 
-        from collections import Counter
+        from tapir.wirgarten.service.member_computed_fields import (
+            get_base_subscriptions_text,
+        )
         from tapir.wirgarten.service.products import (
-            get_product_price,
+            ProductPriceTable,
             get_active_subscriptions,
         )
 
+        computed_fields = self._get_computed_fields()
+        if computed_fields is not None:
+            return computed_fields.base_subscriptions_text
+
         base_product_type_id = get_parameter_value(Parameter.COOP_BASE_PRODUCT_TYPE)
 
         # Get all active base subscriptions for the member
-        subscriptions = get_active_subscriptions().filter(
-            member_id=self.id, product__type__id=base_product_type_id
+        subscriptions = (
+            get_active_subscriptions()
+            .filter(member_id=self.id, product__type__id=base_product_type_id)
+            .select_related("product__type")
         )
 
-        if not subscriptions:
-            return ""
-
-        # Count the quantity of each base product subscribed
-        product_counts = Counter()
-        for sub in subscriptions:
-            product_counts[sub.product] += sub.quantity
-
-        # Create a list of tuples (product, quantity, price) and sort by price
-        product_info = []
-        today = get_today()
-        for product, quantity in product_counts.items():
-            price = get_product_price(product, today).price
-            product_info.append(
-                (
-                    f"{product.name}-{product.type.name[:-1] if quantity == 1 else product.type.name}",
-                    quantity,
-                    price,
-                )
-            )
-
-        # Sort products by price (ascending)
-        product_info.sort(key=lambda x: x[2])
-
-        # Create the human-readable text
-        base_subscription_texts = []
-        for product_name, quantity, _ in product_info:
-            if quantity == 1:
-                base_subscription_texts.append(f"einen {product_name}")
-            else:
-                base_subscription_texts.append(f"{quantity} {product_name}")
-
-        return " + ".join(base_subscription_texts)
+        return get_base_subscriptions_text(
+            subscriptions,
+            ProductPriceTable({sub.product for sub in subscriptions}),
+            get_today(),
+        )
 
     def __str__(self):
         return f"[{self.member_no if self.member_no else '---'}] {self.first_name} {self.last_name} ({self.email})"
 
 
+class MemberPickupLocationQuerySet(models.QuerySet):
+    def valid_at(self, reference_date: datetime.date):
+        return self.filter(valid_from__lte=reference_date).filter(
+            Q(valid_to__isnull=True) | Q(valid_to__gte=reference_date)
+        )
+
+
 class MemberPickupLocation(TapirModel):
     member = models.ForeignKey(Member, on_delete=models.CASCADE)
     pickup_location = models.ForeignKey(PickupLocation, on_delete=models.DO_NOTHING)
     valid_from = models.DateField()
+    # the day before the next pickup location of the member starts, None for the latest one. See update_valid_to_dates
+    valid_to = models.DateField(null=True, editable=False)
+
+    objects = MemberPickupLocationQuerySet.as_manager()
 
     class Meta:
         unique_together = (
             "member",
             "valid_from",
         )
+        indexes = [
+            Index(
+                fields=["member", "valid_from", "valid_to"],
+                name="idx_memberpickuplocation_valid",
+            )
+        ]
+
+    @classmethod
+    def update_valid_to_dates(cls, member_id: str):
+        """
+        Sets valid_to of each pickup location of the member to the day before the next one becomes valid.
+        Called automatically whenever a MemberPickupLocation is saved or deleted.
+        """
+        member_pickup_locations = list(
+            cls.objects.filter(member_id=member_id)
+            .order_by("valid_from")
+            .values_list("id", "valid_from", "valid_to")
+        )
+        next_valid_from_dates = [
+            valid_from for _, valid_from, _ in member_pickup_locations[1:]
+        ] + [None]
+        for (member_pickup_location_id, _, valid_to), next_valid_from in zip(
+            member_pickup_locations, next_valid_from_dates
+        ):
+            expected_valid_to = (
+                next_valid_from - datetime.timedelta(days=1)
+                if next_valid_from
+                else None
+            )
+            if valid_to != expected_valid_to:
+                cls.objects.filter(id=member_pickup_location_id).update(
+                    valid_to=expected_valid_to
+                )
+
+    @classmethod
+    def get_pickup_locations(
+        cls, member_ids, reference_date: datetime.date = None
+    ) -> dict:
+        """
+        Gets the pickup locations of several members with a single query.
+        If a member has only one pickup location, it is returned regardless of its valid_from date.
+
+        :param member_ids: the ids of the members
+        :param reference_date: the date at which the pickup location must be valid, default: today
+        :return: dict of member id -> PickupLocation, members without pickup location are missing
+        """
+        if reference_date is None:
+            reference_date = get_today()
+
+        # Rows that end before the reference date can't be the result. If a member has only one row left and it
+        # starts after the reference date, there are no earlier rows, so it's the member's only pickup location.
+        candidates_by_member_id = {}
+        for member_pickup_location in (
+            cls.objects.filter(member_id__in=member_ids)
+            .filter(Q(valid_to__isnull=True) | Q(valid_to__gte=reference_date))
+            .select_related("pickup_location")
+            .order_by("valid_from")
+        ):
+            candidates_by_member_id.setdefault(
+                member_pickup_location.member_id, []
+            ).append(member_pickup_location)
+
+        pickup_locations = {}
+        for member_id, candidates in candidates_by_member_id.items():
+            if len(candidates) == 1 or candidates[0].valid_from <= reference_date:
+                pickup_locations[member_id] = candidates[0].pickup_location
+        return pickup_locations
+
+    @classmethod
+    def pickup_location_at(
+        cls,
+        reference_date: datetime.date,
+        member_field: str = "member_id",
+        value_field: str = "pickup_location_id",
+    ):
+        """
+        Returns a subquery expression resolving the pickup location of the referenced member at the given date,
+        following the same rules as `get_pickup_locations()`.
+
+        :param reference_date: the date at which the pickup location must be valid
+        :param member_field: name/path of the member id field in the outer query. E.g. "subscription__member_id"
+        :param value_field: the field of the MemberPickupLocation to return. E.g. "pickup_location__name"
+        :return: the subquery expression
+        """
+        valid_pickup_location = Subquery(
+            cls.objects.filter(member_id=OuterRef(member_field))
+            .valid_at(reference_date)
+            .values(value_field)[:1]
+        )
+        # if there is only one pickup location, it is used regardless of its valid_from date
+        only_pickup_location = Subquery(
+            cls.objects.filter(member_id=OuterRef(member_field))
+            .values("member_id")
+            .annotate(location_count=Count("id"), only_value=Min(value_field))
+            .filter(location_count=1)
+            .values("only_value")[:1]
+        )
+        return Coalesce(valid_pickup_location, only_pickup_location)
+
+
+@receiver(post_save, sender=MemberPickupLocation)
+@receiver(post_delete, sender=MemberPickupLocation)
+def on_member_pickup_location_changed(sender, instance: MemberPickupLocation, **kwargs):
+    MemberPickupLocation.update_valid_to_dates(instance.member_id)
 
 
 class Product(TapirModel):
@@ -660,7 +819,7 @@ class Subscription(TapirModel, Payable, AdminConfirmableMixin):
         if not hasattr(self, "_total_price"):
             from tapir.wirgarten.service.products import get_product_price
 
-            price = get_product_price(self.product, reference_date).price
+            price = get_product_price(self.product_id, reference_date).price
 
             if self.solidarity_price_absolute is not None:
                 self._total_price = round(
@@ -681,20 +840,12 @@ class Subscription(TapirModel, Payable, AdminConfirmableMixin):
     def total_price_without_soli(self):
         today = get_today()
         if not hasattr(self, "_total_price_without_soli"):
-            product_prices = ProductPrice.objects.filter(
-                product_id=self.product_id, valid_from__lte=today
-            ).order_by("product_id", "-valid_from")
+            from tapir.wirgarten.service.products import get_product_price
+
+            product_price = get_product_price(self.product_id, today)
             self._total_price_without_soli = (
-                next(
-                    (
-                        product_price.price
-                        for product_price in product_prices
-                        if product_price.product_id == self.product_id
-                    ),
-                    0.0,
-                )
-                * self.quantity
-            )
+                product_price.price if product_price is not None else 0.0
+            ) * self.quantity
 
         return self._total_price_without_soli
 
@@ -704,7 +855,7 @@ class Subscription(TapirModel, Payable, AdminConfirmableMixin):
             from tapir.wirgarten.service.products import get_product_price
 
             current_product_price = get_product_price(
-                product=self.product, reference_date=today
+                product=self.product_id, reference_date=today
             )
 
             self._used_capacity = current_product_price.size * self.quantity
@@ -1134,23 +1285,104 @@ class ScheduledTask(TapirModel):
     error_message = models.TextField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # number of times the task was started, including the current run
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=3)
+    started_at = models.DateTimeField(null=True, blank=True)
+    # hash of task_function, task_args and task_kwargs, see get_dedup_key
+    dedup_key = models.CharField(max_length=64, editable=False)
+
+    class Meta:
+        indexes = [Index(fields=["status", "eta"], name="idx_scheduledtask_status_eta")]
+        constraints = [
+            UniqueConstraint(
+                fields=["dedup_key"],
+                condition=Q(status="PENDING"),
+                name="unique_pending_scheduledtask",
+            ),
+        ]
+
+    @staticmethod
+    def get_dedup_key(task_function: str, task_args, task_kwargs) -> str:
+        """
+        :return: a hash that is the same for all tasks that call the same function with the same arguments
+        """
+        return hashlib.sha256(
+            json.dumps(
+                [task_function, list(task_args), task_kwargs],
+                sort_keys=True,
+                cls=DjangoJSONEncoder,
+            ).encode()
+        ).hexdigest()
+
+    def save(self, *args, **kwargs):
+        self.dedup_key = self.get_dedup_key(
+            self.task_function, self.task_args, self.task_kwargs
+        )
+        super().save(*args, **kwargs)
 
     def execute(self):
-        from importlib import import_module
+        """
+        Runs the task function. If it fails and the task has attempts left, the task is rescheduled with
+        exponential backoff (see SCHEDULED_TASK_RETRY_DELAY), otherwise it is marked as failed.
+        """
+        from tapir.wirgarten.service.tasks import (
+            get_scheduled_task_retry_delay,
+            get_task_function,
+        )
 
-        module_name, function_name = self.task_function.rsplit(".", 1)
-        module = import_module(module_name)
-        function = getattr(module, function_name)
         try:
-            self.status = self.STATUS_IN_PROGRESS
-            self.save()
-            function(*self.task_args, **self.task_kwargs)
+            if self.status != self.STATUS_IN_PROGRESS:
+                self.status = self.STATUS_IN_PROGRESS
+                self.attempts += 1
+                self.started_at = timezone.now()
+                self.save()
+            get_task_function(self.task_function)(*self.task_args, **self.task_kwargs)
             self.status = self.STATUS_DONE
+            self.error_message = None
         except Exception as e:
-            self.status = self.STATUS_FAILED
             self.error_message = str(e)
+            # if the task has been scheduled again in the meantime, the new task replaces the retry
+            if (
+                self.attempts < self.max_attempts
+                and not ScheduledTask.objects.filter(
+                    dedup_key=self.dedup_key, status=self.STATUS_PENDING
+                ).exists()
+            ):
+                self.status = self.STATUS_PENDING
+                self.eta = timezone.now() + get_scheduled_task_retry_delay(
+                    self.attempts
+                )
+            else:
+                self.status = self.STATUS_FAILED
         finally:
             self.save()
 
     def __str__(self):
         return f"{self.task_function} | eta: {self.eta} | status: {self.status}"
+
+
+class MemberSegmentMembership(TapirModel):
+    """
+    Materialized membership of the members in the mail segments that depend on their shares and subscriptions,
+    see tapir.wirgarten.service.segment_membership
+    """
+
+    SEGMENT_COOP_MEMBERS = "coop_members"
+    SEGMENT_ACTIVE_SUBSCRIPTION = "active_subscription"
+
+    SEGMENT_CHOICES = [
+        (SEGMENT_COOP_MEMBERS, "Coop members"),
+        (SEGMENT_ACTIVE_SUBSCRIPTION, "With active subscription"),
+    ]
+
+    segment = models.CharField(max_length=32, choices=SEGMENT_CHOICES)
+    member = models.ForeignKey(Member, on_delete=models.CASCADE)
+
+    class Meta:
+        constraints = [
+            UniqueConstraint(
+                fields=["segment", "member"],
+                name="unique_member_segment_membership",
+            ),
+        ]
@@ -0,0 +1,627 @@
+"""
+Capacity ledgers keep the used capacity per (growing period, product type) and per
+(pickup location, product type) in Redis, so that capacity checks during checkout don't
+have to recompute the usage from all subscriptions.
+
+Each ledger belongs to one reference date (usually a contract start date). The used
+capacity is built lazily from the database on first access and then kept up to date
+incrementally whenever a subscription is saved or deleted. In-flight orders (for example
+a registration wizard that has passed the product step but isn't done yet) hold a
+reservation on the ledger, which expires after CAPACITY_RESERVATION_TIMEOUT seconds.
+
+Every change applied to a ledger also increments its version. A rebuild only stores the usage it
+computed if the version didn't change in the meantime, so that a concurrent change is never overwritten.
+
+All amounts are stored as integers scaled by SCALE to avoid float rounding in Redis.
+If Redis is not available, the ledgers fall back to computing the usage from the database.
+"""
+
+import abc
+import uuid
+from datetime import date
+from functools import partial
+
+from dateutil.relativedelta import relativedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+
+from tapir.wirgarten.models import (
+    MemberPickupLocation,
+    PickupLocationCapability,
+    Product,
+    ProductPrice,
+    Subscription,
+)
+from tapir.wirgarten.service.products import (
+    get_active_product_capacities,
+    get_product_price,
+    get_used_product_capacities,
+)
+from tapir.wirgarten.utils import get_now
+
+SCALE = 10_000
+KEY_PREFIX = "capacity_ledger"
+
+SCOPE_GROWING_PERIOD = "period"
+SCOPE_PICKUP_LOCATION = "pickup_location"
+
+# Number of times a rebuild or a reservation is retried if the ledger changed concurrently.
+MAX_ATTEMPTS = 3
+
+# KEYS: used, reservations, reservation expiry
+# ARGV: capacity, amount, reservation id (empty to only check), now, reservation expires at, key ttl
+# Returns 1 if the amount fits into the capacity and has been reserved, 0 otherwise,
+# -1 if the ledger is not built (e.g. the used key expired), then it has to be rebuilt first.
+RESERVE_SCRIPT = """
+local used = redis.call('GET', KEYS[1])
+if not used then
+    return -1
+end
+used = tonumber(used)
+
+local expired = redis.call('ZRANGEBYSCORE', KEYS[3], '-inf', ARGV[4])
+for _, reservation_id in ipairs(expired) do
+    redis.call('HDEL', KEYS[2], reservation_id)
+end
+redis.call('ZREMRANGEBYSCORE', KEYS[3], '-inf', ARGV[4])
+redis.call('HDEL', KEYS[2], ARGV[3])
+redis.call('ZREM', KEYS[3], ARGV[3])
+
+local reserved = 0
+for _, reserved_amount in ipairs(redis.call('HVALS', KEYS[2])) do
+    reserved = reserved + tonumber(reserved_amount)
+end
+
+local amount = tonumber(ARGV[2])
+if used + reserved + amount > tonumber(ARGV[1]) then
+    return 0
+end
+
+if amount > 0 and ARGV[3] ~= '' then
+    redis.call('HSET', KEYS[2], ARGV[3], amount)
+    redis.call('ZADD', KEYS[3], ARGV[5], ARGV[3])
+    redis.call('EXPIRE', KEYS[2], ARGV[6])
+    redis.call('EXPIRE', KEYS[3], ARGV[6])
+end
+return 1
+"""
+
+# KEYS: used, version
+# ARGV: delta, key ttl
+# Only applies the delta if the ledger has already been built, otherwise it gets built from the DB on the next read.
+# The version is incremented in both cases, so that a rebuild running at the same time discards its result.
+INCREMENT_IF_EXISTS_SCRIPT = """
+redis.call('INCR', KEYS[2])
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return redis.call('INCRBY', KEYS[1], ARGV[1])
+end
+return nil
+"""
+
+# KEYS: used, version
+# ARGV: used, version read before the usage was computed, key ttl
+# Returns 1 if the usage has been stored, 0 if the ledger changed since the version was read.
+STORE_IF_UNCHANGED_SCRIPT = """
+if (redis.call('GET', KEYS[2]) or '0') ~= ARGV[2] then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[3])
+return 1
+"""
+
+
+def get_ledger_connection():
+    """
+    Returns the raw Redis connection used for the ledgers, or None if the cache backend is not Redis.
+    """
+    try:
+        return get_redis_connection("default")
+    except NotImplementedError:
+        return None
+
+
+def to_ledger_units(amount) -> int:
+    return round(float(amount) * SCALE)
+
+
+def from_ledger_units(units) -> float:
+    return int(units) / SCALE
+
+
+def get_ledger_ttl() -> int:
+    return getattr(settings, "CAPACITY_LEDGER_TTL", 60 * 60 * 24)
+
+
+def get_reservation_timeout() -> int:
+    return getattr(settings, "CAPACITY_RESERVATION_TIMEOUT", 60 * 30)
+
+
+def get_index_key(scope: str, product_type_id: str) -> str:
+    return f"{KEY_PREFIX}:{scope}:{product_type_id}:index"
+
+
+def get_ledger_key(
+    scope: str, scope_id: str, product_type_id: str, reference_date: date
+) -> str:
+    return f"{KEY_PREFIX}:{scope}:{scope_id}:{product_type_id}:{reference_date.isoformat()}"
+
+
+class CapacityLedger(abc.ABC):
+    """
+    Base class for a ledger of the used capacity of one product type at one reference date.
+    Subclasses define the scope (growing period or pickup location) and how to compute the usage from the DB.
+    """
+
+    scope = None
+
+    def __init__(
+        self, scope_id: str, product_type_id: str, reference_date: date, capacity
+    ):
+        self.scope_id = scope_id
+        self.product_type_id = product_type_id
+        self.reference_date = reference_date
+        self.capacity = float(capacity or 0)
+
+        key = get_ledger_key(self.scope, scope_id, product_type_id, reference_date)
+        self.used_key = f"{key}:used"
+        self.version_key = f"{key}:version"
+        self.reservations_key = f"{key}:reservations"
+        self.reservation_expiry_key = f"{key}:reservation_expiry"
+        self.index_key = get_index_key(self.scope, product_type_id)
+        self.index_entry = f"{scope_id}|{reference_date.isoformat()}"
+
+    @abc.abstractmethod
+    def compute_used_capacity(self) -> float:
+        pass
+
+    def rebuild(self, connection=None) -> float:
+        """
+        Recomputes the used capacity from the database and stores it in the ledger,
+        unless the ledger changed while the usage was computed. Then the rebuild is retried.
+
+        :param connection: the Redis connection, defaults to the cache connection
+        :return: the used capacity
+        """
+        connection = connection or get_ledger_connection()
+        if connection is None:
+            return self.compute_used_capacity()
+
+        ttl = get_ledger_ttl()
+        # indexed first, so that the subscription changes during the rebuild increment the version
+        pipeline = connection.pipeline()
+        pipeline.sadd(self.index_key, self.index_entry)
+        pipeline.expire(self.index_key, ttl)
+        pipeline.execute()
+
+        for _ in range(MAX_ATTEMPTS):
+            version = (connection.get(self.version_key) or b"0").decode()
+            used_capacity = self.compute_used_capacity()
+            stored = connection.eval(
+                STORE_IF_UNCHANGED_SCRIPT,
+                2,
+                self.used_key,
+                self.version_key,
+                to_ledger_units(used_capacity),
+                version,
+                ttl,
+            )
+            if stored:
+                return used_capacity
+
+        print(f"Capacity ledger {self.used_key} changed during every rebuild attempt")
+        return used_capacity
+
+    def get_used_capacity(self) -> float:
+        """
+        :return: the capacity used by the subscriptions, without reservations
+        """
+        connection = get_ledger_connection()
+        if connection is None:
+            return self.compute_used_capacity()
+
+        try:
+            used_units = connection.get(self.used_key)
+            if used_units is None:
+                return self.rebuild(connection)
+            return from_ledger_units(used_units)
+        except RedisError as e:
+            print(f"Capacity ledger {self.used_key} not available: {e}")
+            return self.compute_used_capacity()
+
+    def get_reserved_capacity(self, exclude_reservation_id: str = None) -> float:
+        """
+        :param exclude_reservation_id: don't count the reservation with this id, e.g. the reservation of the current order
+        :return: the capacity held by reservations that are not expired yet
+        """
+        connection = get_ledger_connection()
+        if connection is None:
+            return 0.0
+
+        try:
+            active_reservation_ids = set(
+                reservation_id.decode()
+                for reservation_id in connection.zrangebyscore(
+                    self.reservation_expiry_key, get_now().timestamp(), "+inf"
+                )
+            )
+            reservations = connection.hgetall(self.reservations_key)
+        except RedisError as e:
+            print(f"Capacity ledger {self.reservations_key} not available: {e}")
+            return 0.0
+
+        return sum(
+            from_ledger_units(amount)
+            for reservation_id, amount in reservations.items()
+            if reservation_id.decode() in active_reservation_ids
+            and reservation_id.decode() != exclude_reservation_id
+        )
+
+    def get_free_capacity(self, exclude_reservation_id: str = None) -> float:
+        return (
+            self.capacity
+            - self.get_used_capacity()
+            - self.get_reserved_capacity(exclude_reservation_id)
+        )
+
+    def reserve(self, amount: float, reservation_id: str) -> bool:
+        """
+        Atomically checks that the amount fits into the free capacity and reserves it.
+        Reserving again with the same reservation id replaces the previous reservation.
+        Negative amounts (an order that reduces the usage) are checked but not reserved.
+
+        :param amount: the additional capacity needed by the order
+        :param reservation_id: identifies the order, e.g. the member or the wizard session.
+            If None, the amount is only checked against the free capacity and nothing is reserved.
+        :return: True if the capacity is available (and has been reserved)
+        """
+        connection = get_ledger_connection()
+        if connection is None:
+            return self.get_free_capacity() >= amount
+
+        try:
+            for _ in range(MAX_ATTEMPTS):
+                now = get_now().timestamp()
+                result = connection.eval(
+                    RESERVE_SCRIPT,
+                    3,
+                    self.used_key,
+                    self.reservations_key,
+                    self.reservation_expiry_key,
+                    to_ledger_units(self.capacity),
+                    to_ledger_units(amount),
+                    reservation_id or "",
+                    now,
+                    now + get_reservation_timeout(),
+                    get_ledger_ttl(),
+                )
+                if result != -1:
+                    return bool(result)
+                self.rebuild(connection)
+        except RedisError as e:
+            print(f"Could not reserve capacity on {self.used_key}: {e}")
+            return self.compute_used_capacity() + amount <= self.capacity
+
+        print(
+            f"Capacity ledger {self.used_key} could not be built, checking without reservation"
+        )
+        return self.get_free_capacity(reservation_id) >= amount
+
+    def release(self, reservation_id: str):
+        """
+        Releases the reservation, usually after the order has been saved or cancelled.
+        """
+        connection = get_ledger_connection()
+        if connection is None or reservation_id is None:
+            return
+
+        try:
+            pipeline = connection.pipeline()
+            pipeline.hdel(self.reservations_key, reservation_id)
+            pipeline.zrem(self.reservation_expiry_key, reservation_id)
+            pipeline.execute()
+        except RedisError as e:
+            print(f"Could not release reservation on {self.used_key}: {e}")
+
+
+class ProductCapacityLedger(CapacityLedger):
+    """
+    Ledger of the used capacity of a product type in the growing period that contains the reference date.
+    """
+
+    scope = SCOPE_GROWING_PERIOD
+
+    def __init__(self, product_type_id: str, reference_date: date):
+        product_capacity = (
+            get_active_product_capacities(reference_date)
+            .filter(product_type_id=product_type_id)
+            .first()
+        )
+        super().__init__(
+            scope_id=product_capacity.period_id if product_capacity else "none",
+            product_type_id=product_type_id,
+            reference_date=reference_date,
+            capacity=product_capacity.capacity if product_capacity else 0,
+        )
+
+    def compute_used_capacity(self) -> float:
+        return get_used_product_capacities(
+            self.reference_date, [self.product_type_id]
+        ).get(self.product_type_id, 0.0)
+
+
+class PickupLocationCapacityLedger(CapacityLedger):
+    """
+    Ledger of the used capacity of a product type at a pickup location.
+    """
+
+    scope = SCOPE_PICKUP_LOCATION
+
+    def __init__(self, capability: PickupLocationCapability, reference_date: date):
+        super().__init__(
+            scope_id=capability.pickup_location_id,
+            product_type_id=capability.product_type_id,
+            reference_date=reference_date,
+            capacity=capability.max_capacity,
+        )
+        self.capability = capability
+
+    def compute_used_capacity(self) -> float:
+        from tapir.wirgarten.forms.pickup_location import get_current_capacity_usage
+
+        return get_current_capacity_usage(
+            {
+                "pickup_location_id": self.capability.pickup_location_id,
+                "product_type_id": self.capability.product_type_id,
+            },
+            self.reference_date,
+        )
+
+
+def release_capacity_reservations(ledgers, reservation_id: str):
+    for ledger in ledgers:
+        ledger.release(reservation_id)
+
+
+def delete_ledgers(scope: str = None):
+    """
+    Deletes the ledgers (including reservations) of the given scope, or all ledgers if no scope is given.
+    They get rebuilt from the DB on the next access.
+
+    :return: the number of deleted keys
+    """
+    connection = get_ledger_connection()
+    if connection is None:
+        return 0
+
+    pattern = f"{KEY_PREFIX}:{scope}:*" if scope else f"{KEY_PREFIX}:*"
+    keys = list(connection.scan_iter(match=pattern, count=1000))
+    if keys:
+        connection.delete(*keys)
+    return len(keys)
+
+
+def get_indexed_ledgers(connection, product_type_id: str):
+    """
+    :return: (scope, scope id, reference date) of every ledger of the given product type that has been built
+    """
+    for scope in (SCOPE_GROWING_PERIOD, SCOPE_PICKUP_LOCATION):
+        for entry in connection.smembers(get_index_key(scope, product_type_id)):
+            scope_id, reference_date = entry.decode().split("|")
+            yield scope, scope_id, date.fromisoformat(reference_date)
+
+
+def get_subscription_snapshot(subscription: Subscription):
+    return {
+        "member_id": subscription.member_id,
+        "product_id": subscription.product_id,
+        "quantity": subscription.quantity,
+        "start_date": subscription.start_date,
+        "end_date": subscription.end_date,
+    }
+
+
+def get_pickup_location_id_at(member_id: str, reference_date: date):
+    return (
+        MemberPickupLocation.objects.filter(member_id=member_id)
+        .valid_at(reference_date)
+        .values_list("pickup_location_id", flat=True)
+        .first()
+    )
+
+
+def get_used_capacity_delta(snapshot, reference_date: date) -> int:
+    if not snapshot["start_date"] <= reference_date <= snapshot["end_date"]:
+        return 0
+    product_price = get_product_price(snapshot["product_id"], reference_date)
+    if product_price is None:
+        return 0
+    return to_ledger_units(product_price.size * snapshot["quantity"])
+
+
+def apply_subscription_change(old_snapshot, new_snapshot):
+    """
+    Updates the ledgers that have already been built with the difference between the old and the new version of a subscription.
+
+    :param old_snapshot: the subscription before the change, None if it has been created
+    :param new_snapshot: the subscription after the change, None if it has been deleted
+    """
+    connection = get_ledger_connection()
+    if connection is None:
+        return
+
+    try:
+        increment_if_exists = connection.register_script(INCREMENT_IF_EXISTS_SCRIPT)
+        for snapshot, sign in ((old_snapshot, -1), (new_snapshot, 1)):
+            if snapshot is None:
+                continue
+
+            product_type_id = Product.objects.values_list("type_id", flat=True).get(
+                id=snapshot["product_id"]
+            )
+            for scope, scope_id, reference_date in get_indexed_ledgers(
+                connection, product_type_id
+            ):
+                delta = get_used_capacity_delta(snapshot, reference_date)
+                if not delta:
+                    continue
+                if (
+                    scope == SCOPE_PICKUP_LOCATION
+                    and scope_id
+                    != get_pickup_location_id_at(snapshot["member_id"], reference_date)
+                ):
+                    continue
+                key = get_ledger_key(scope, scope_id, product_type_id, reference_date)
+                increment_if_exists(
+                    keys=[f"{key}:used", f"{key}:version"],
+                    args=[sign * delta, get_ledger_ttl()],
+                )
+    except RedisError as e:
+        print(f"Could not update the capacity ledgers, deleting them: {e}")
+        try:
+            delete_ledgers()
+        except RedisError:
+            pass
+
+
+@receiver(pre_save, sender=Subscription)
+def on_subscription_pre_save(sender, instance: Subscription, **kwargs):
+    previous = None
+    if not instance._state.adding:
+        previous = (
+            Subscription.objects.filter(id=instance.id)
+            .values("member_id", "product_id", "quantity", "start_date", "end_date")
+            .first()
+        )
+    instance._capacity_ledger_previous_snapshot = previous
+
+
+@receiver(post_save, sender=Subscription)
+def on_subscription_saved(sender, instance: Subscription, **kwargs):
+    old_snapshot = getattr(instance, "_capacity_ledger_previous_snapshot", None)
+    new_snapshot = get_subscription_snapshot(instance)
+    if old_snapshot == new_snapshot:
+        return
+    transaction.on_commit(
+        partial(apply_subscription_change, old_snapshot, new_snapshot)
+    )
+
+
+@receiver(post_delete, sender=Subscription)
+def on_subscription_deleted(sender, instance: Subscription, **kwargs):
+    transaction.on_commit(
+        partial(apply_subscription_change, get_subscription_snapshot(instance), None)
+    )
+
+
+def on_subscriptions_bulk_created(subscriptions: list[Subscription]):
+    """
+    bulk_create doesn't send post_save, so the callers have to apply the new subscriptions to the ledgers themselves.
+    """
+    for subscription in subscriptions:
+        transaction.on_commit(
+            partial(
+                apply_subscription_change,
+                None,
+                get_subscription_snapshot(subscription),
+            )
+        )
+
+
+def on_ledger_inputs_changed(scope: str = None):
+    try:
+        delete_ledgers(scope)
+    except RedisError as e:
+        print(f"Could not delete the capacity ledgers: {e}")
+
+
+def invalidate_pickup_location_ledgers(pickup_location_ids: set, from_date: date):
+    """
+    Drops the used capacity of the ledgers of the given pickup locations with a reference date on or after from_date,
+    it gets rebuilt from the DB on the next access. The reservations are kept.
+    """
+    connection = get_ledger_connection()
+    if connection is None or not pickup_location_ids:
+        return
+
+    try:
+        ttl = get_ledger_ttl()
+        pipeline = connection.pipeline()
+        for index_key in connection.scan_iter(
+            match=get_index_key(SCOPE_PICKUP_LOCATION, "*"), count=1000
+        ):
+            product_type_id = index_key.decode().split(":")[2]
+            for entry in connection.smembers(index_key):
+                scope_id, reference_date = entry.decode().split("|")
+                reference_date = date.fromisoformat(reference_date)
+                if scope_id not in pickup_location_ids or reference_date < from_date:
+                    continue
+                key = get_ledger_key(
+                    SCOPE_PICKUP_LOCATION, scope_id, product_type_id, reference_date
+                )
+                pipeline.delete(f"{key}:used")
+                # makes a rebuild running at the same time discard its result
+                pipeline.incr(f"{key}:version")
+                pipeline.expire(f"{key}:version", ttl)
+        pipeline.execute()
+    except RedisError as e:
+        print(f"Could not invalidate the pickup location capacity ledgers: {e}")
+
+
+@receiver(pre_save, sender=MemberPickupLocation)
+def on_member_pickup_location_pre_save(
+    sender, instance: MemberPickupLocation, **kwargs
+):
+    previous = None
+    if not instance._state.adding:
+        previous = (
+            MemberPickupLocation.objects.filter(id=instance.id)
+            .values("pickup_location_id", "valid_from")
+            .first()
+        )
+    instance._capacity_ledger_previous_location = previous
+
+
+@receiver(post_save, sender=MemberPickupLocation)
+@receiver(post_delete, sender=MemberPickupLocation)
+def on_member_pickup_location_changed(
+    sender, instance: MemberPickupLocation, raw=False, **kwargs
+):
+    """
+    Only the usage of the pickup locations the member moves between changes, from the date of the change on.
+    """
+    if raw:
+        return
+
+    pickup_location_ids = {instance.pickup_location_id}
+    from_date = instance.valid_from
+    previous = getattr(instance, "_capacity_ledger_previous_location", None)
+    if previous is not None:
+        pickup_location_ids.add(previous["pickup_location_id"])
+        from_date = min(from_date, previous["valid_from"])
+
+    def invalidate():
+        # the location the member had before the change (or has again after a delete)
+        pickup_location_ids.add(
+            get_pickup_location_id_at(
+                instance.member_id, from_date - relativedelta(days=1)
+            )
+        )
+        pickup_location_ids.discard(None)
+        invalidate_pickup_location_ledgers(pickup_location_ids, from_date)
+
+    transaction.on_commit(invalidate)
+
+
+@receiver(post_save, sender=ProductPrice)
+@receiver(post_delete, sender=ProductPrice)
+def on_product_price_changed(sender, **kwargs):
+    transaction.on_commit(on_ledger_inputs_changed)
+
+
+def new_reservation_id() -> str:
+    return uuid.uuid4().hex
@@ -0,0 +1,169 @@
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from datetime import date
+from typing import Iterable
+
+from dateutil.relativedelta import relativedelta
+from django.db.models import Max
+
+from tapir.wirgarten.models import Payment, Subscription
+from tapir.wirgarten.service.payment import get_next_payment_date
+from tapir.wirgarten.service.products import ProductPriceTable
+
+COOP_SHARES_PAYMENT_TYPE = "Genossenschaftsanteile"
+
+
+def get_projection_due_dates(start_date: date = None) -> list[date]:
+    """
+    Returns the monthly payment dates from the next payment date until the end of the last contract.
+
+    :param start_date: the payment date to start with, default: the next payment date
+    :return: the list of due dates, empty if there are no contracts
+    """
+    if start_date is None:
+        start_date = get_next_payment_date()
+
+    last_contract_end = Subscription.objects.aggregate(max_date=Max("end_date"))[
+        "max_date"
+    ]
+    if last_contract_end is None:
+        return []
+
+    due_dates = [start_date]
+    while due_dates[-1] < last_contract_end:
+        due_dates.append(due_dates[-1] + relativedelta(months=1))
+    return due_dates
+
+
+class CashflowProjection:
+    """
+    Projected payment amounts per due date and payment type (product type name or coop shares).
+
+    Subscriptions, price histories and persisted payments are loaded once for all due dates (3 queries),
+    the amounts of all months are then computed in memory. The rules are the same as for the payment export:
+    if a payment for a mandate, type and due date is already persisted, its amount is used,
+    otherwise the sum of Subscription.total_price(due_date) of the active subscriptions of that mandate and type.
+    """
+
+    def __init__(self, due_dates: Iterable[date]):
+        """
+        :param due_dates: the payment dates to compute the amounts for
+        """
+        self.due_dates = sorted(set(due_dates))
+        self.types = []
+        self._amounts = [defaultdict(float) for _ in self.due_dates]
+        if self.due_dates:
+            self._compute()
+
+    def _compute(self):
+        first_due_date = self.due_dates[0]
+        last_due_date = self.due_dates[-1]
+        date_indices = {due_date: i for i, due_date in enumerate(self.due_dates)}
+
+        subscriptions = list(
+            Subscription.objects.filter(
+                start_date__lte=last_due_date, end_date__gte=first_due_date
+            )
+            .order_by()
+            .values(
+                "mandate_ref_id",
+                "product_id",
+                "product__type__name",
+                "quantity",
+                "start_date",
+                "end_date",
+                "solidarity_price",
+                "solidarity_price_absolute",
+                "price_override",
+            )
+        )
+        price_table = ProductPriceTable({sub["product_id"] for sub in subscriptions})
+
+        persisted_payments = {}
+        coop_share_payments = [0.0] * len(self.due_dates)
+        for payment in (
+            Payment.objects.filter(due_date__in=self.due_dates)
+            .order_by()
+            .values("mandate_ref_id", "type", "due_date", "amount")
+        ):
+            index = date_indices[payment["due_date"]]
+            if payment["type"] == COOP_SHARES_PAYMENT_TYPE:
+                coop_share_payments[index] += float(payment["amount"])
+            persisted_payments[(index, payment["mandate_ref_id"], payment["type"])] = (
+                float(payment["amount"])
+            )
+
+        # product prices only change a few times, so they are resolved once per product and due date
+        prices = {}
+
+        def get_price(product_id: str, index: int) -> float:
+            key = (product_id, index)
+            if key not in prices:
+                prices[key] = float(
+                    price_table.get_price(product_id, self.due_dates[index]).price
+                )
+            return prices[key]
+
+        projected = defaultdict(float)
+        for sub in subscriptions:
+            first_index = bisect_left(self.due_dates, sub["start_date"])
+            last_index = bisect_right(self.due_dates, sub["end_date"])
+            key_suffix = (sub["mandate_ref_id"], sub["product__type__name"])
+            for index in range(first_index, last_index):
+                projected[(index, *key_suffix)] += self._get_total_price(
+                    sub, get_price(sub["product_id"], index)
+                )
+
+        types = set()
+        for (index, mandate_ref_id, type_name), amount in projected.items():
+            self._amounts[index][type_name] += (
+                persisted_payments.get((index, mandate_ref_id, type_name)) or amount
+            )
+            types.add(type_name)
+
+        for index, amount in enumerate(coop_share_payments):
+            if amount:
+                self._amounts[index][COOP_SHARES_PAYMENT_TYPE] += amount
+                types.add(COOP_SHARES_PAYMENT_TYPE)
+
+        self.types = sorted(types, key=lambda t: t == COOP_SHARES_PAYMENT_TYPE)
+
+    @staticmethod
+    def _get_total_price(sub: dict, price: float) -> float:
+        """Same as Subscription.total_price(), for a subscription loaded as dict."""
+        if sub["price_override"] is not None:
+            return float(sub["price_override"])
+        if sub["solidarity_price_absolute"] is not None:
+            return round(
+                float(sub["quantity"]) * price
+                + float(sub["solidarity_price_absolute"]),
+                2,
+            )
+        return round(
+            float(sub["quantity"]) * price * float(1 + sub["solidarity_price"]),
+            2,
+        )
+
+    def get_total(self, due_date: date) -> float:
+        """
+        :return: the total amount of all payments due on this date
+        """
+        return sum(self._amounts[self.due_dates.index(due_date)].values())
+
+    def get_totals(self) -> list[float]:
+        """
+        :return: the total amounts, in the order of self.due_dates
+        """
+        return [sum(amounts.values()) for amounts in self._amounts]
+
+    def get_amounts_by_type(self) -> list[dict[str, float]]:
+        """
+        :return: per due date (in the order of self.due_dates), dict of payment type -> amount
+        """
+        return [
+            {
+                payment_type: amounts.get(payment_type, 0.0)
+                for payment_type in self.types
+            }
+            for amounts in self._amounts
+        ]
@@ -0,0 +1,484 @@
+"""
+Key figures and chart data of the admin dashboard.
+
+All figures are computed with aggregate queries and stored as one snapshot in the cache.
+The snapshot expires after DASHBOARD_KPI_CACHE_TIMEOUT seconds, is dropped as soon as one of the
+models it is computed from changes and can be precomputed by the `precompute_dashboard_kpis` task.
+"""
+
+import datetime
+import json
+
+from dateutil.relativedelta import relativedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import (
+    Count,
+    DateField,
+    Exists,
+    ExpressionWrapper,
+    F,
+    OuterRef,
+    Q,
+    Sum,
+)
+from django.db.models.functions import ExtractMonth, ExtractYear
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from django.urls import reverse
+
+from tapir.configuration.models import TapirParameter
+from tapir.configuration.parameter import get_parameter_value
+from tapir.wirgarten.models import (
+    CoopShareTransaction,
+    GrowingPeriod,
+    Member,
+    Product,
+    ProductCapacity,
+    ProductPrice,
+    ProductType,
+    QuestionaireCancellationReasonResponse,
+    QuestionaireTrafficSourceOption,
+    QuestionaireTrafficSourceResponse,
+    Subscription,
+    WaitingListEntry,
+)
+from tapir.wirgarten.parameters import Parameter
+from tapir.wirgarten.service.payment import (
+    get_automatically_calculated_solidarity_excess,
+)
+from tapir.wirgarten.service.products import (
+    ProductPriceTable,
+    get_active_product_capacities,
+    get_current_growing_period,
+    get_free_product_capacities,
+    get_next_growing_period,
+)
+from tapir.wirgarten.utils import format_currency, get_today
+
+DASHBOARD_KPI_CACHE_KEY = "dashboard_kpis"
+
+
+def get_dashboard_kpi_cache_timeout() -> int:
+    return getattr(settings, "DASHBOARD_KPI_CACHE_TIMEOUT", 60 * 10)
+
+
+def get_dashboard_kpis() -> dict:
+    """
+    Returns the dashboard figures from the cache, or computes and caches them if there is no up-to-date snapshot.
+
+    :return: dict of template context values
+    """
+    today = get_today()
+    try:
+        snapshot = cache.get(DASHBOARD_KPI_CACHE_KEY)
+    except Exception as e:
+        print("Could not read the dashboard KPI snapshot: ", e)
+        return compute_dashboard_kpis()
+
+    if snapshot is not None and snapshot["reference_date"] == today:
+        return snapshot["kpis"]
+
+    return refresh_dashboard_kpis()
+
+
+def refresh_dashboard_kpis() -> dict:
+    """
+    Computes the dashboard figures and stores them in the cache.
+
+    :return: dict of template context values
+    """
+    today = get_today()
+    kpis = compute_dashboard_kpis()
+    try:
+        cache.set(
+            DASHBOARD_KPI_CACHE_KEY,
+            {"reference_date": today, "kpis": kpis},
+            get_dashboard_kpi_cache_timeout(),
+        )
+    except Exception as e:
+        print("Could not store the dashboard KPI snapshot: ", e)
+    return kpis
+
+
+def invalidate_dashboard_kpis():
+    try:
+        cache.delete(DASHBOARD_KPI_CACHE_KEY)
+    except Exception as e:
+        print("Could not delete the dashboard KPI snapshot: ", e)
+
+
+def compute_dashboard_kpis() -> dict:
+    """
+    Computes all figures of the admin dashboard.
+
+    :return: dict of template context values
+    """
+    from tapir.wirgarten.service.member import get_next_contract_start_date
+
+    kpis = {}
+
+    current_growing_period = get_current_growing_period()
+    if not current_growing_period:
+        kpis["no_growing_period"] = True
+        return kpis
+
+    base_product_type_id = get_parameter_value(Parameter.COOP_BASE_PRODUCT_TYPE)
+    harvest_share_type = ProductType.objects.filter(id=base_product_type_id).first()
+    if harvest_share_type is None:
+        kpis["no_base_product_type"] = True
+        return kpis
+
+    next_contract_start_date = get_next_contract_start_date()
+    next_growing_period = get_next_growing_period(next_contract_start_date)
+
+    kpis["next_contract_start_date"] = next_contract_start_date
+    kpis["next_period_start_date"] = (
+        next_growing_period.start_date if next_growing_period else None
+    )
+
+    add_capacity_chart_kpis(kpis, base_product_type_id, next_contract_start_date)
+    if next_growing_period:
+        add_capacity_chart_kpis(
+            kpis, base_product_type_id, next_growing_period.start_date, "next"
+        )
+    add_traffic_source_questionaire_chart_kpis(kpis)
+    add_cancellation_chart_kpis(kpis)
+    add_cancellation_reasons_chart_kpis(kpis)
+    add_cancelled_coop_shares_kpis(kpis)
+
+    kpis["active_members"] = Member.objects.with_shares().count()
+    kpis["coop_shares_value"] = format_currency(
+        (
+            CoopShareTransaction.objects.filter(
+                valid_at__lt=next_contract_start_date
+            ).aggregate(quantity=Sum("quantity"))["quantity"]
+            or 0
+        )
+        * settings.COOP_SHARE_PRICE
+    ).replace(",00", "")
+
+    kpis["cancellations_during_trial"] = Subscription.objects.filter(
+        cancellation_ts__isnull=False
+    ).count()
+
+    waiting_list_counts = {
+        r["type"]: r["count"]
+        for r in WaitingListEntry.objects.order_by()
+        .values("type")
+        .annotate(count=Count("type"))
+    }
+    kpis["waiting_list_coop_shares"] = waiting_list_counts.get(
+        WaitingListEntry.WaitingListType.COOP_SHARES, 0
+    )
+    kpis["waiting_list_harvest_shares"] = waiting_list_counts.get(
+        WaitingListEntry.WaitingListType.HARVEST_SHARES, 0
+    )
+
+    kpis["solidarity_overplus"] = get_automatically_calculated_solidarity_excess()
+
+    today = get_today()
+    variant_labels = []
+    variant_data = []
+    for x in (
+        Subscription.objects.filter(
+            start_date__lte=today,
+            end_date__gte=today,
+            product__type=harvest_share_type,
+        )
+        .order_by()
+        .values("product__name")
+        .annotate(count=Sum("quantity"))
+    ):
+        variant_labels.append(x["product__name"] + "-Anteile")
+        variant_data.append(x["count"])
+    kpis["harvest_share_variants_data"] = variant_data
+    kpis["harvest_share_variants_labels"] = variant_labels
+
+    return kpis
+
+
+def add_cancelled_coop_shares_kpis(kpis: dict):
+    cancellations = {
+        c["year"]: -c["total_quantity"] * settings.COOP_SHARE_PRICE
+        for c in (
+            CoopShareTransaction.objects.filter(
+                transaction_type=CoopShareTransaction.CoopShareTransactionType.CANCELLATION,
+                valid_at__gte=get_today(),
+            )
+            .annotate(year=ExtractYear("valid_at"))
+            .values("year")
+            .annotate(total_quantity=Sum("quantity"))
+            .order_by("year")
+        )
+    }
+    kpis["cancelled_coop_shares_labels"] = list(cancellations.keys())
+    kpis["cancelled_coop_shares_data"] = list(cancellations.values())
+
+
+def add_cancellation_reasons_chart_kpis(kpis: dict):
+    qs = QuestionaireCancellationReasonResponse.objects.filter(
+        timestamp__gte=get_today() + relativedelta(day=1, years=-1)
+    )
+    total = qs.count()
+    if total == 0:
+        kpis["cancellation_reason_labels"] = []
+        kpis["cancellation_reason_data"] = []
+        kpis["cancellations_other_reasons"] = []
+        return
+
+    responses = list(
+        qs.filter(custom=False)
+        .order_by()
+        .values("reason")
+        .annotate(count=Count("reason"))
+    )
+    custom_responses = list(
+        dict.fromkeys(
+            qs.filter(custom=True)
+            .order_by("-timestamp")
+            .values_list("reason", flat=True)
+        )
+    )
+
+    kpis["cancellation_reason_labels"] = [x["reason"] for x in responses] + ["Sonstige"]
+    kpis["cancellation_reason_data"] = [x["count"] / total * 100 for x in responses] + [
+        len(custom_responses) / total * 100
+    ]
+    kpis["cancellations_other_reasons"] = custom_responses
+
+
+def add_cancellation_chart_kpis(kpis: dict):
+    month_labels = [
+        get_today() + relativedelta(day=1, months=-i + 1) for i in range(13)
+    ][::-1]
+
+    trial_end_date = ExpressionWrapper(
+        F("start_date") + datetime.timedelta(days=30),
+        output_field=DateField(),
+    )
+    counts_per_month = {
+        row["start_date"]: row
+        for row in Subscription.objects.filter(start_date__in=month_labels)
+        .order_by()
+        .values("start_date")
+        .annotate(
+            total_count=Count("id"),
+            trial_cancelled_count=Count(
+                "id",
+                filter=Q(
+                    cancellation_ts__isnull=False,
+                    cancellation_ts__lte=trial_end_date,
+                ),
+            ),
+        )
+    }
+
+    cancellations_data = [
+        {"label": "Probeverträge", "data": [0] * 13},
+        {"label": "Gekündigte Verträge", "data": [0] * 13},
+    ]
+    for index, month in enumerate(month_labels):
+        if month in counts_per_month:
+            cancellations_data[0]["data"][index] = counts_per_month[month][
+                "total_count"
+            ]
+            cancellations_data[1]["data"][index] = counts_per_month[month][
+                "trial_cancelled_count"
+            ]
+
+    kpis["cancellations_data"] = json.dumps(cancellations_data)
+    kpis["cancellations_labels"] = [month.strftime("%m/%y") for month in month_labels]
+
+
+def add_capacity_chart_kpis(
+    kpis: dict,
+    base_type_id: str,
+    reference_date: datetime.date = None,
+    prefix: str = "current",
+):
+    if reference_date is None:
+        from tapir.wirgarten.service.member import get_next_contract_start_date
+
+        reference_date = get_next_contract_start_date()
+
+    active_product_capacities = {
+        c.product_type.id: c
+        for c in get_active_product_capacities(reference_date).select_related(
+            "product_type"
+        )
+    }
+
+    KEY_CAPACITY_LINKS = prefix + "_capacity_links"
+    KEY_CAPACITY_LABELS = prefix + "_capacity_labels"
+    KEY_USED_CAPACITY = prefix + "_used_capacity"
+    KEY_FREE_CAPACITY = prefix + "_free_capacity"
+
+    kpis[KEY_CAPACITY_LINKS] = []
+    kpis[KEY_CAPACITY_LABELS] = []
+    kpis[KEY_USED_CAPACITY] = []
+    kpis[KEY_FREE_CAPACITY] = []
+
+    sorted_product_capacities = sorted(
+        active_product_capacities.values(),
+        key=lambda c: c.product_type_id == base_type_id,
+        reverse=True,
+    )
+
+    base_products = {}
+    for product in Product.objects.filter(
+        type_id__in=active_product_capacities.keys(), base=True
+    ).order_by("id"):
+        base_products.setdefault(product.type_id, product)
+    price_table = ProductPriceTable(base_products.values())
+
+    free_capacities = get_free_product_capacities(reference_date)
+    for product_capacity in sorted_product_capacities:
+        product_type = product_capacity.product_type
+
+        total_capacity = (
+            float(product_capacity.capacity) or 1
+        )  # "or 1" to avoid a division by 0
+
+        free_capacity = free_capacities.get(product_type.id, 0)
+        used_capacity = total_capacity - free_capacity
+
+        kpis[KEY_USED_CAPACITY].append(used_capacity / total_capacity * 100)
+        kpis[KEY_FREE_CAPACITY].append(free_capacity / total_capacity * 100)
+        kpis[KEY_CAPACITY_LINKS].append(
+            f"{reverse('wirgarten:product')}?periodId={product_capacity.period_id}&capacityId={product_capacity.id}"
+        )
+
+        base_share_size = float(
+            price_table.get_price(base_products[product_type.id], reference_date).size
+        )
+
+        free_share_count = round(free_capacity / base_share_size, 2)
+        used_share_count = round(used_capacity / base_share_size, 2)
+
+        kpis[KEY_CAPACITY_LABELS].append(
+            [
+                product_type.name,
+                f"{used_share_count} Anteile vergeben",
+                (
+                    (f"{free_share_count} Anteile noch frei")
+                    if free_share_count > 0
+                    else "Keine Anteile mehr frei"
+                ),
+            ],
+        )
+
+
+def add_traffic_source_questionaire_chart_kpis(kpis: dict):
+    month_labels = [get_today() + relativedelta(day=1, months=-i) for i in range(13)][
+        ::-1
+    ]
+    month_indices = {
+        (month.year, month.month): index for index, month in enumerate(month_labels)
+    }
+
+    response_counts = {
+        (row["sources"], row["year"], row["month"]): row["count"]
+        for row in QuestionaireTrafficSourceResponse.objects.filter(
+            timestamp__date__gte=month_labels[0]
+        )
+        .annotate(year=ExtractYear("timestamp"), month=ExtractMonth("timestamp"))
+        .order_by()
+        .values("sources", "year", "month")
+        .annotate(count=Count("id", distinct=True))
+    }
+    no_response_counts = {
+        (row["year"], row["month"]): row["count"]
+        for row in Member.objects.filter(created_at__date__gte=month_labels[0])
+        .annotate(year=ExtractYear("created_at"), month=ExtractMonth("created_at"))
+        .annotate(
+            has_response=Exists(
+                QuestionaireTrafficSourceResponse.objects.filter(
+                    member_id=OuterRef("id"),
+                    timestamp__year=OuterRef("year"),
+                    timestamp__month=OuterRef("month"),
+                )
+            )
+        )
+        .filter(has_response=False)
+        .order_by()
+        .values("year", "month")
+        .annotate(count=Count("id"))
+    }
+
+    output = []
+    for option in QuestionaireTrafficSourceOption.objects.all():
+        output.append(
+            {
+                "label": option.name,
+                "data": [
+                    response_counts.get((option.id, year, month), 0)
+                    for year, month in month_indices.keys()
+                ],
+            }
+        )
+    output.append(
+        {
+            "label": "Keine Angabe",
+            "data": [
+                no_response_counts.get(year_and_month, 0)
+                for year_and_month in month_indices.keys()
+            ],
+        }
+    )
+
+    # Calculate the total responses per month
+    total_responses_per_month = [
+        sum(option["data"][index] for option in output)
+        for index in range(len(month_labels))
+    ]
+
+    # Convert the counts to percentages
+    for option_data in output:
+        for index, response_count in enumerate(option_data["data"]):
+            total_responses_in_month = total_responses_per_month[index]
+            option_data["data"][index] = (
+                round((response_count / total_responses_in_month) * 100, 2)
+                if total_responses_in_month > 0
+                else 0
+            )
+
+    kpis["traffic_source_data"] = json.dumps(output)
+    kpis["traffic_source_labels"] = [month.strftime("%m/%y") for month in month_labels]
+
+
+def on_dashboard_inputs_changed(**kwargs):
+    if kwargs.get("raw"):
+        return
+    transaction.on_commit(invalidate_dashboard_kpis)
+
+
+for model in [
+    CoopShareTransaction,
+    GrowingPeriod,
+    Product,
+    ProductCapacity,
+    ProductPrice,
+    ProductType,
+    QuestionaireCancellationReasonResponse,
+    QuestionaireTrafficSourceOption,
+    QuestionaireTrafficSourceResponse,
+    Subscription,
+    TapirParameter,
+    WaitingListEntry,
+]:
+    post_save.connect(on_dashboard_inputs_changed, sender=model)
+    post_delete.connect(on_dashboard_inputs_changed, sender=model)
+m2m_changed.connect(
+    on_dashboard_inputs_changed,
+    sender=QuestionaireTrafficSourceResponse.sources.through,
+)
+
+
+@receiver(post_save, sender=Member)
+@receiver(post_delete, sender=Member)
+def on_member_changed(sender, created=True, **kwargs):
+    # only new and deleted members change the dashboard, not e.g. a new last_login
+    if created:
+        on_dashboard_inputs_changed(**kwargs)
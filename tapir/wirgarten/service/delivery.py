@@ -1,17 +1,29 @@
+import time
 from datetime import date
 from typing import List
 
 from dateutil.relativedelta import relativedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 
+from tapir.configuration.models import TapirParameter
 from tapir.configuration.parameter import get_parameter_value
 from tapir.wirgarten.constants import EVEN_WEEKS, ODD_WEEKS, WEEKLY, NO_DELIVERY
 from tapir.wirgarten.models import (
+    DeliveryExceptionPeriod,
     GrowingPeriod,
     Member,
+    MemberPickupLocation,
     PickupLocation,
     PickupLocationCapability,
     PickupLocationOpeningTime,
+    Product,
+    ProductPrice,
     ProductType,
+    Subscription,
 )
 from tapir.wirgarten.parameters import OPTIONS_WEEKDAYS, Parameter
 from tapir.wirgarten.service.products import (
@@ -98,73 +110,298 @@ def get_next_delivery_date_for_product_type(
         )
 
 
-def generate_future_deliveries(member: Member, limit: int = None):
-    """
-    Generates a list of future deliveries for a given member.
+DELIVERY_CALENDAR_VERSION_CACHE_KEY = "delivery_calendar_version"
+
+
+def get_delivery_calendar_cache_timeout() -> int:
+    return getattr(settings, "DELIVERY_CALENDAR_CACHE_TIMEOUT", 60 * 60 * 24)
+
+
+class DeliveryCalendar:
     """
+    The delivery weeks from the next delivery date until the end of the last growing period.
 
-    deliveries = []
+    The weeks, their delivery cycles (weekly, even and odd weeks) and the delivery exception periods are computed once,
+    the deliveries of a member are then found by intersecting them with the member's subscriptions and pickup locations
+    in memory. Computing the deliveries of a member takes a fixed number of queries, independent of the number of weeks.
+    """
 
-    last_growing_period = GrowingPeriod.objects.order_by("-end_date").first()
-    if not last_growing_period:
-        return deliveries
+    def __init__(self, reference_date: date = None):
+        """
+        :param reference_date: the first delivery is the next one after this date, default: today
+        """
+        self.reference_date = reference_date or get_today()
+        self.weeks = []
+        self.exception_periods = []
+
+        last_growing_period = GrowingPeriod.objects.order_by("-end_date").first()
+        if not last_growing_period:
+            return
+
+        delivery_date = get_next_delivery_date(self.reference_date)
+        while delivery_date <= last_growing_period.end_date:
+            _, week_num, _ = delivery_date.isocalendar()
+            self.weeks.append(
+                (
+                    delivery_date,
+                    {WEEKLY[0], EVEN_WEEKS[0] if week_num % 2 == 0 else ODD_WEEKS[0]},
+                )
+            )
+            delivery_date += relativedelta(days=7)
 
-    next_delivery_date = get_next_delivery_date()
+        self.exception_periods = list(
+            DeliveryExceptionPeriod.objects.filter(
+                end_date__gte=self.weeks[0][0] if self.weeks else self.reference_date,
+                start_date__lte=last_growing_period.end_date,
+            ).values_list("start_date", "end_date", "product_type_id")
+        )
 
-    subs = get_future_subscriptions().filter(member=member)
-    while next_delivery_date <= last_growing_period.end_date and (
-        limit is None or len(deliveries) < limit
-    ):
-        _, week_num, _ = next_delivery_date.isocalendar()
-        even_week = week_num % 2 == 0
-
-        active_subs = subs.filter(
-            start_date__lte=next_delivery_date,
-            end_date__gte=next_delivery_date,
-            product__type__delivery_cycle__in=[
-                WEEKLY[0],
-                EVEN_WEEKS[0] if even_week else ODD_WEEKS[0],
-            ],
+    def is_delivered(self, product_type: ProductType, delivery_date: date) -> bool:
+        for start_date, end_date, product_type_id in self.exception_periods:
+            if start_date <= delivery_date <= end_date and product_type_id in [
+                None,
+                product_type.id,
+            ]:
+                return False
+        return True
+
+    def get_member_deliveries(self, member: Member) -> list[dict]:
+        """
+        :param member: the member
+        :return: the member's future deliveries: delivery date (iso format), pickup location, subscriptions and opening times
+        """
+        if not self.weeks:
+            return []
+
+        subs = list(
+            get_future_subscriptions(self.reference_date)
+            .filter(member=member)
+            .select_related("product__type")
         )
+        if not subs:
+            return []
 
-        if active_subs.count() > 0:
-            pickup_location = member.get_pickup_location(next_delivery_date)
-            opening_times = PickupLocationOpeningTime.objects.filter(
-                pickup_location=pickup_location
+        member_pickup_locations = list(
+            MemberPickupLocation.objects.filter(member=member)
+            .select_related("pickup_location")
+            .order_by("valid_from")
+        )
+        opening_times_by_location_id = {}
+        for opening_time in PickupLocationOpeningTime.objects.filter(
+            pickup_location_id__in=[
+                mpl.pickup_location_id for mpl in member_pickup_locations
+            ]
+        ).order_by("day_of_week"):
+            opening_times_by_location_id.setdefault(
+                opening_time.pickup_location_id, []
+            ).append(opening_time)
+
+        deliveries = []
+        for week_date, delivery_cycles in self.weeks:
+            active_subs = [
+                sub
+                for sub in subs
+                if sub.start_date <= week_date <= sub.end_date
+                and sub.product.type.delivery_cycle in delivery_cycles
+                and self.is_delivered(sub.product.type, week_date)
+            ]
+            if not active_subs:
+                continue
+
+            pickup_location = self.get_pickup_location(
+                member_pickup_locations, week_date
             )
-            next_delivery_date += relativedelta(
+            opening_times = opening_times_by_location_id.get(
+                pickup_location.id if pickup_location else None, []
+            )
+            delivery_date = week_date + relativedelta(
                 days=(
-                    opening_times[0].day_of_week - next_delivery_date.weekday()
+                    opening_times[0].day_of_week - week_date.weekday()
                     if opening_times
                     else 0
                 )
             )
 
-            opening_times = enumerate(
-                map(
-                    lambda x: {
-                        "day_of_week": OPTIONS_WEEKDAYS[x.day_of_week][1],
-                        "open_time": x.open_time,
-                        "close_time": x.close_time,
-                    },
-                    opening_times,
-                )
-            )
-
             deliveries.append(
                 {
-                    "delivery_date": next_delivery_date.isoformat(),
+                    "delivery_date": delivery_date.isoformat(),
                     "pickup_location": pickup_location,
                     "subs": active_subs,
-                    "opening_times": opening_times,
+                    "opening_times": list(
+                        enumerate(
+                            {
+                                "day_of_week": OPTIONS_WEEKDAYS[x.day_of_week][1],
+                                "open_time": x.open_time,
+                                "close_time": x.close_time,
+                            }
+                            for x in opening_times
+                        )
+                    ),
                 }
             )
 
-        next_delivery_date += relativedelta(days=7)
+        return deliveries
+
+    @staticmethod
+    def get_pickup_location(
+        member_pickup_locations: list[MemberPickupLocation], reference_date: date
+    ) -> PickupLocation | None:
+        """
+        Same rules as MemberPickupLocation.get_pickup_locations(), for the member pickup locations loaded ordered by valid_from.
+        """
+        candidates = [
+            mpl
+            for mpl in member_pickup_locations
+            if mpl.valid_to is None or mpl.valid_to >= reference_date
+        ]
+        if candidates and (
+            len(candidates) == 1 or candidates[0].valid_from <= reference_date
+        ):
+            return candidates[0].pickup_location
+        return None
+
+
+def _to_cached_deliveries(deliveries: list[dict]) -> list[dict]:
+    """
+    :return: the deliveries with the ids of the pickup location and subscriptions instead of the model instances,
+        so that no model instances are stored in the cache
+    """
+    return [
+        {
+            "delivery_date": delivery["delivery_date"],
+            "pickup_location_id": (
+                delivery["pickup_location"].id if delivery["pickup_location"] else None
+            ),
+            "sub_ids": [sub.id for sub in delivery["subs"]],
+            "opening_times": delivery["opening_times"],
+        }
+        for delivery in deliveries
+    ]
+
+
+def _from_cached_deliveries(cached_deliveries: list[dict]) -> list[dict]:
+    """
+    Loads the pickup locations and subscriptions of the cached deliveries, with one query each.
+    Subscriptions that don't exist anymore are left out, as are the deliveries without any subscription left.
+    """
+    subs_by_id = Subscription.objects.select_related("product__type").in_bulk(
+        {sub_id for delivery in cached_deliveries for sub_id in delivery["sub_ids"]}
+    )
+    pickup_locations_by_id = PickupLocation.objects.in_bulk(
+        {
+            delivery["pickup_location_id"]
+            for delivery in cached_deliveries
+            if delivery["pickup_location_id"] is not None
+        }
+    )
 
+    deliveries = []
+    for delivery in cached_deliveries:
+        subs = [
+            subs_by_id[sub_id] for sub_id in delivery["sub_ids"] if sub_id in subs_by_id
+        ]
+        if not subs:
+            continue
+        deliveries.append(
+            {
+                "delivery_date": delivery["delivery_date"],
+                "pickup_location": pickup_locations_by_id.get(
+                    delivery["pickup_location_id"]
+                ),
+                "subs": subs,
+                "opening_times": delivery["opening_times"],
+            }
+        )
     return deliveries
 
 
+def _get_member_deliveries_cache_key(member_id: str) -> str:
+    version = cache.get_or_set(
+        DELIVERY_CALENDAR_VERSION_CACHE_KEY, time.time_ns(), None
+    )
+    return f"member_deliveries_{version}_{member_id}"
+
+
+def generate_future_deliveries(member: Member, limit: int = None):
+    """
+    Generates a list of future deliveries for a given member.
+
+    The deliveries are cached per member until the member's subscriptions or pickup locations change.
+    The cache only holds the ids of the subscriptions and pickup locations, which are loaded again on every call.
+    """
+    today = get_today()
+    try:
+        cache_key = _get_member_deliveries_cache_key(member.id)
+        cached = cache.get(cache_key)
+    except Exception as e:
+        print("Could not read the cached deliveries: ", e)
+        cache_key = cached = None
+
+    if cached is not None and cached["reference_date"] == today:
+        deliveries = _from_cached_deliveries(cached["deliveries"])
+    else:
+        deliveries = DeliveryCalendar(today).get_member_deliveries(member)
+        if cache_key is not None:
+            try:
+                cache.set(
+                    cache_key,
+                    {
+                        "reference_date": today,
+                        "deliveries": _to_cached_deliveries(deliveries),
+                    },
+                    get_delivery_calendar_cache_timeout(),
+                )
+            except Exception as e:
+                print("Could not cache the deliveries: ", e)
+
+    return deliveries[:limit] if limit is not None else deliveries
+
+
+def invalidate_member_deliveries(member_id: str):
+    try:
+        cache.delete(_get_member_deliveries_cache_key(member_id))
+    except Exception as e:
+        print("Could not delete the cached deliveries: ", e)
+
+
+def invalidate_all_deliveries():
+    try:
+        cache.set(DELIVERY_CALENDAR_VERSION_CACHE_KEY, time.time_ns(), None)
+    except Exception as e:
+        print("Could not delete the cached deliveries: ", e)
+
+
+@receiver(post_save, sender=Subscription)
+@receiver(post_delete, sender=Subscription)
+@receiver(post_save, sender=MemberPickupLocation)
+@receiver(post_delete, sender=MemberPickupLocation)
+def on_member_deliveries_changed(instance, raw=False, **kwargs):
+    if raw:
+        return
+    member_id = instance.member_id
+    transaction.on_commit(lambda: invalidate_member_deliveries(member_id))
+
+
+def on_delivery_calendar_changed(raw=False, **kwargs):
+    if raw:
+        return
+    transaction.on_commit(invalidate_all_deliveries)
+
+
+for model in [
+    DeliveryExceptionPeriod,
+    GrowingPeriod,
+    PickupLocation,
+    PickupLocationOpeningTime,
+    Product,
+    ProductPrice,
+    ProductType,
+    TapirParameter,
+]:
+    post_save.connect(on_delivery_calendar_changed, sender=model)
+    post_delete.connect(on_delivery_calendar_changed, sender=model)
+
+
 def calculate_pickup_location_change_date(
     reference_date=None,
     next_delivery_date=None,
@@ -1,4 +1,6 @@
 import csv
+from typing import Iterable
+
 from django.utils.translation import gettext_lazy as _
 
 from django.core.mail import EmailMultiAlternatives
@@ -9,6 +11,10 @@ from tapir.wirgarten.models import ExportedFile
 from tapir.wirgarten.parameters import Parameter
 
 
+# number of objects loaded per query by the streamed exports
+EXPORT_CHUNK_SIZE = 1000
+
+
 class CsvTextBuilder(object):
     def __init__(self):
         self.csv_string = []
@@ -17,6 +23,79 @@ class CsvTextBuilder(object):
         self.csv_string.append(row)
 
 
+class Echo(object):
+    """
+    Pseudo buffer that returns the written row instead of storing it, used to stream CSV files.
+    """
+
+    def write(self, row):
+        return row
+
+
+def stream_csv(field_names: [str], rows: Iterable[dict], delimiter: str = ";"):
+    """
+    Generates a CSV file line by line, to be passed to a StreamingHttpResponse.
+    Uses the same format as begin_csv_string.
+
+    :param field_names: the field names which will be written in the header and used for the data map
+    :param rows: the data maps, e.g. a generator
+    :param delimiter: the CSV delimiter to use. Default: ';'
+    """
+    writer = csv.DictWriter(
+        Echo(),
+        fieldnames=field_names,
+        delimiter=delimiter,
+        quoting=csv.QUOTE_NONNUMERIC,
+    )
+    yield writer.writeheader()
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def stream_csv_rows(
+    header: list,
+    rows: Iterable[list],
+    delimiter: str = ";",
+    quoting: int = csv.QUOTE_MINIMAL,
+):
+    """
+    Generates a CSV file line by line from lists, to be passed to a StreamingHttpResponse.
+
+    :param header: the header row
+    :param rows: the data rows, e.g. a generator
+    :param delimiter: the CSV delimiter to use. Default: ';'
+    :param quoting: the csv quoting mode. Default: csv.QUOTE_MINIMAL
+    """
+    writer = csv.writer(Echo(), delimiter=delimiter, quoting=quoting)
+    yield writer.writerow(header)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def get_queryset_chunks(queryset, chunk_size: int = EXPORT_CHUNK_SIZE):
+    """
+    Loads the queryset chunk_size objects at a time, so that exports don't hold all objects in memory.
+    Unlike QuerySet.iterator(), prefetch_related() lookups are applied to each chunk.
+
+    :param queryset: the queryset, its ordering is kept
+    :param chunk_size: the number of objects loaded per query
+    :return: generator of lists of objects
+    """
+    ids = list(queryset.values_list("pk", flat=True))
+    for start in range(0, len(ids), chunk_size):
+        chunk_ids = ids[start : start + chunk_size]
+        objects_by_id = {obj.pk: obj for obj in queryset.filter(pk__in=chunk_ids)}
+        yield [objects_by_id[obj_id] for obj_id in chunk_ids if obj_id in objects_by_id]
+
+
+def iterate_in_chunks(queryset, chunk_size: int = EXPORT_CHUNK_SIZE):
+    """
+    Same as get_queryset_chunks, but yields the objects one by one.
+    """
+    for chunk in get_queryset_chunks(queryset, chunk_size):
+        yield from chunk
+
+
 def __send_email(file: ExportedFile, recipient: str = None):
     if recipient is None:
         recipient = [get_parameter_value(Parameter.SITE_ADMIN_EMAIL)]
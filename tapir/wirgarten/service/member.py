@@ -15,6 +15,7 @@ from django.db.models import (
     Case,
     When,
     FloatField,
+    Min,
 )
 from django.db.models.functions import Coalesce
 from tapir_mail.triggers.transactional_trigger import TransactionalTrigger
@@ -292,6 +293,7 @@ def change_pickup_location(
 
     1. Deletes all MemberPickupLocations with valid_from date >= change_date
     2. Creates a new MemberPickupLocations with valid_from = change_date
+    3. The valid_to dates of the member's pickup locations get updated by the MemberPickupLocation signals
 
     :param member_id: the member id
     :param new_pickup_location: the new pickup location
@@ -494,6 +496,27 @@ def send_order_confirmation(member: Member, subs: List[Subscription]):
     )
 
 
+def get_coop_entry_dates(member_ids) -> dict:
+    """
+    Same as Member.coop_entry_date for several members, with a single query.
+
+    :param member_ids: the ids of the members
+    :return: dict of member id -> coop entry date, members without coop shares are missing
+    """
+    return {
+        row["member_id"]: row["coop_entry_date"]
+        for row in CoopShareTransaction.objects.filter(
+            member_id__in=member_ids,
+            transaction_type__in=[
+                CoopShareTransaction.CoopShareTransactionType.PURCHASE,
+                CoopShareTransaction.CoopShareTransactionType.TRANSFER_IN,
+            ],
+        )
+        .values("member_id")
+        .annotate(coop_entry_date=Min("valid_at"))
+    }
+
+
 def annotate_member_queryset_with_coop_shares_total_value(queryset, outer_ref="id"):
     today = get_today()
     overnext_month = today + relativedelta(months=2)
@@ -0,0 +1,187 @@
+from collections import Counter, defaultdict
+from datetime import date
+from typing import Iterable
+
+from django.db.models import F, FloatField, OuterRef, Subquery, Sum
+
+from tapir.configuration.parameter import get_parameter_value
+from tapir.wirgarten.models import (
+    CoopShareTransaction,
+    Member,
+    MemberPickupLocation,
+    ProductPrice,
+)
+from tapir.wirgarten.parameters import Parameter
+from tapir.wirgarten.service.member import get_coop_entry_dates
+from tapir.wirgarten.service.products import (
+    ProductPriceTable,
+    get_active_subscriptions,
+    get_future_subscriptions,
+)
+from tapir.wirgarten.utils import get_today
+
+
+class MemberComputedFields:
+    """
+    Prefetched values of the computed properties of one member.
+
+    Member.coop_shares_quantity, coop_shares_total_value, coop_entry_date, monthly_payment, has_trial_contracts,
+    base_subscriptions_text and pickup_location read from this container instead of running their own queries,
+    as long as it has been loaded for the current day.
+    """
+
+    def __init__(self, member_id: str, reference_date: date):
+        self.member_id = member_id
+        self.reference_date = reference_date
+        self.coop_shares_quantity = 0
+        self.coop_shares_total_value = 0.0
+        self.coop_entry_date = None
+        self.monthly_payment = None
+        self.has_trial_contracts = False
+        self.base_subscriptions_text = ""
+        self.pickup_location = None
+
+
+def get_base_subscriptions_text(
+    subscriptions: Iterable, price_table: ProductPriceTable, reference_date: date
+) -> str:
+    """
+    Builds the text of Member.base_subscriptions_text from the base subscriptions of one member.
+
+    :param subscriptions: the active base subscriptions of the member, with product__type selected
+    :param price_table: a price table that contains the subscribed products
+    :param reference_date: the date of the prices used to sort the products
+    """
+    # Count the quantity of each base product subscribed
+    product_counts = Counter()
+    for sub in subscriptions:
+        product_counts[sub.product] += sub.quantity
+
+    if not product_counts:
+        return ""
+
+    # Create a list of tuples (product, quantity, price) and sort by price
+    product_info = []
+    for product, quantity in product_counts.items():
+        price = price_table.get_price(product, reference_date).price
+        product_info.append(
+            (
+                f"{product.name}-{product.type.name[:-1] if quantity == 1 else product.type.name}",
+                quantity,
+                price,
+            )
+        )
+
+    # Sort products by price (ascending)
+    product_info.sort(key=lambda x: x[2])
+
+    # Create the human-readable text
+    base_subscription_texts = []
+    for product_name, quantity, _ in product_info:
+        if quantity == 1:
+            base_subscription_texts.append(f"einen {product_name}")
+        else:
+            base_subscription_texts.append(f"{quantity} {product_name}")
+
+    return " + ".join(base_subscription_texts)
+
+
+def load_member_computed_fields(
+    members: Iterable[Member], reference_date: date = None
+) -> list[Member]:
+    """
+    Computes the computed properties of all given members with one query per property
+    and stores them on the member objects (see MemberComputedFields).
+    Call it where the properties of many members are read, e.g. for the members of a page or of a batch task,
+    or use Member.objects.prefetch_related("computed_fields").
+
+    :param members: the members, e.g. a queryset, which is evaluated
+    :param reference_date: the date at which the values are computed, today by default. The properties of the members
+        only use values loaded for today, the values at other dates are available as Member.computed_fields.
+    :return: the members, as list
+    """
+    if reference_date is None:
+        reference_date = get_today()
+
+    members = list(members)
+    if not members:
+        return members
+
+    member_ids = [member.id for member in members]
+    computed_fields = {
+        member_id: MemberComputedFields(member_id, reference_date)
+        for member_id in member_ids
+    }
+
+    for row in (
+        CoopShareTransaction.objects.filter(
+            member_id__in=member_ids, valid_at__lte=reference_date
+        )
+        .values("member_id")
+        .annotate(
+            quantity=Sum(F("quantity")),
+            total_value=Sum(F("quantity") * F("share_price")),
+        )
+    ):
+        fields = computed_fields[row["member_id"]]
+        fields.coop_shares_quantity = row["quantity"] or 0
+        fields.coop_shares_total_value = row["total_value"] or 0.0
+
+    for member_id, coop_entry_date in get_coop_entry_dates(member_ids).items():
+        computed_fields[member_id].coop_entry_date = coop_entry_date
+
+    for row in (
+        get_active_subscriptions(reference_date)
+        .filter(member_id__in=member_ids)
+        .order_by()
+        .annotate(
+            product_price=Subquery(
+                ProductPrice.objects.filter(
+                    product_id=OuterRef("product_id"), valid_from__lte=reference_date
+                )
+                .order_by("-valid_from")
+                .values("price")[:1],
+                output_field=FloatField(),
+            ),
+        )
+        .values("member_id")
+        .annotate(
+            total_value=Sum(
+                F("product_price") * F("quantity") * (1 + F("solidarity_price"))
+            )
+        )
+    ):
+        computed_fields[row["member_id"]].monthly_payment = row["total_value"]
+
+    for subscription in get_future_subscriptions(reference_date).filter(
+        member_id__in=member_ids, cancellation_ts__isnull=True
+    ):
+        if reference_date < subscription.trial_end_date:
+            computed_fields[subscription.member_id].has_trial_contracts = True
+
+    base_subscriptions = defaultdict(list)
+    for subscription in (
+        get_active_subscriptions(reference_date)
+        .filter(
+            member_id__in=member_ids,
+            product__type__id=get_parameter_value(Parameter.COOP_BASE_PRODUCT_TYPE),
+        )
+        .select_related("product__type")
+    ):
+        base_subscriptions[subscription.member_id].append(subscription)
+    price_table = ProductPriceTable(
+        {sub.product for subs in base_subscriptions.values() for sub in subs}
+    )
+    for member_id, subscriptions in base_subscriptions.items():
+        computed_fields[member_id].base_subscriptions_text = (
+            get_base_subscriptions_text(subscriptions, price_table, reference_date)
+        )
+
+    for member_id, pickup_location in MemberPickupLocation.get_pickup_locations(
+        member_ids, reference_date
+    ).items():
+        computed_fields[member_id].pickup_location = pickup_location
+
+    for member in members:
+        member._computed_fields = computed_fields[member.id]
+    return members
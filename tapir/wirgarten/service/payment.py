@@ -3,7 +3,19 @@ from datetime import date
 from decimal import Decimal
 
 from dateutil.relativedelta import relativedelta
-from django.db.models import Sum
+from django.db.models import (
+    Case,
+    DateField,
+    DecimalField,
+    ExpressionWrapper,
+    F,
+    Func,
+    OuterRef,
+    Sum,
+    Value,
+    When,
+)
+from django.db.models.functions import Cast, Greatest
 from nanoid import generate
 from unidecode import unidecode
 
@@ -11,9 +23,10 @@ from tapir.configuration.parameter import get_parameter_value
 from tapir.wirgarten.models import Member, Payment, ProductType, Subscription
 from tapir.wirgarten.parameters import Parameter
 from tapir.wirgarten.service.products import (
+    ProductPriceTable,
     get_active_subscriptions,
     get_future_subscriptions,
-    get_product_price,
+    product_price_at,
     product_type_order_by,
 )
 from tapir.wirgarten.utils import get_today
@@ -61,44 +74,95 @@ def get_next_payment_date(reference_date: date = None):
     return next_payment
 
 
+def get_payment_amounts(due_date: date) -> dict[tuple[str, str], Decimal]:
+    """
+    Sums up Subscription.total_price() of all subscriptions active at the due date per mandate reference and
+    product type, with a single query.
+    Like total_price(), the price of each subscription is the one valid at its start date, or today if it already started.
+
+    :param due_date: the date on which the payments are due
+    :return: dict of (mandate_ref_id, product type name) -> amount
+    """
+    price = product_price_at(
+        Greatest(OuterRef("start_date"), Value(get_today(), output_field=DateField()))
+    )
+    total_price = Case(
+        When(price_override__isnull=False, then=F("price_override")),
+        When(
+            solidarity_price_absolute__isnull=False,
+            then=ExpressionWrapper(
+                F("quantity") * price + F("solidarity_price_absolute"),
+                output_field=DecimalField(),
+            ),
+        ),
+        default=ExpressionWrapper(
+            F("quantity")
+            * price
+            * (
+                1
+                + Cast(
+                    "solidarity_price",
+                    output_field=DecimalField(max_digits=20, decimal_places=10),
+                )
+            ),
+            output_field=DecimalField(),
+        ),
+        output_field=DecimalField(),
+    )
+
+    return {
+        (row["mandate_ref_id"], row["product__type__name"]): row["amount"]
+        for row in Subscription.objects.filter(
+            start_date__lte=due_date, end_date__gte=due_date
+        )
+        .order_by()
+        .values("mandate_ref_id", "product__type__name")
+        .annotate(
+            amount=Sum(
+                Func(
+                    total_price,
+                    Value(2),
+                    function="ROUND",
+                    output_field=DecimalField(),
+                )
+            )
+        )
+    }
+
+
 def generate_new_payments(due_date: date) -> list[Payment]:
     """
     Generates payments for the given due date. The generated payments are not persisted!
+    If a payment for the same mandate, product type and due date already exists, the existing payment is returned instead.
 
     :param due_date: The date on which the payment will be due.
     :return: the list of new Payments
     """
-    payments = []
-
-    subscriptions = Subscription.objects.filter(
-        start_date__lte=due_date, end_date__gte=due_date
-    ).order_by("mandate_ref", "product__type")
-
-    grouped = {}
-    for sub in subscriptions:
-        key = (sub.mandate_ref, sub.product.type)
-        if key not in grouped:
-            grouped[key] = []
-        grouped[key].append(sub)
-
-    for (mandate_ref, product_type), subs in grouped.items():
-        existing = Payment.objects.filter(
-            mandate_ref=mandate_ref, due_date=due_date, type=product_type.name
+    amounts = get_payment_amounts(due_date)
+    existing_payments = {
+        (payment.mandate_ref_id, payment.type): payment
+        for payment in Payment.objects.filter(
+            due_date=due_date,
+            type__in={product_type_name for _, product_type_name in amounts.keys()},
         )
-        if not existing.exists():
-            amount = sum(sub.total_price() for sub in subs)
-
-            payments.append(
-                Payment(
-                    due_date=due_date,
-                    amount=Decimal(amount).quantize(Decimal("0.01")),
-                    mandate_ref=mandate_ref,
-                    status=Payment.PaymentStatus.DUE,
-                    type=product_type.name,
-                )
+    }
+
+    payments = []
+    for (mandate_ref_id, product_type_name), amount in sorted(amounts.items()):
+        existing = existing_payments.get((mandate_ref_id, product_type_name))
+        if existing is not None:
+            payments.append(existing)
+            continue
+
+        payments.append(
+            Payment(
+                due_date=due_date,
+                amount=Decimal(amount or 0).quantize(Decimal("0.01")),
+                mandate_ref_id=mandate_ref_id,
+                status=Payment.PaymentStatus.DUE,
+                type=product_type_name,
             )
-        else:
-            payments.extend(existing)
+        )
 
     return payments
 
@@ -136,36 +200,16 @@ def get_existing_payments(due_date: date) -> list[Payment]:
     return list(Payment.objects.filter(transaction__isnull=True, due_date=due_date))
 
 
-def get_total_payment_amount(due_date: date) -> list[Payment]:
+def get_total_payment_amount(due_date: date) -> float:
     """
     Returns the total € amount for all due payments on this date.
 
     :param due_date: the date on which the payments are due
-    :return: the list of existing and projected payments for the given date
+    :return: the sum of the existing and projected payments for the given date
     """
+    from tapir.wirgarten.service.cashflow import CashflowProjection
 
-    total_amount = 0.0
-
-    subscriptions = Subscription.objects.filter(
-        start_date__lte=due_date, end_date__gte=due_date
-    ).order_by("mandate_ref", "product__type")
-
-    existing_payments = {
-        f"{p.mandate_ref.ref}-{p.type}": float(p.amount)
-        for p in Payment.objects.filter(due_date=due_date)
-    }
-    for sub in subscriptions:
-        total_amount += existing_payments.get(
-            f"{sub.mandate_ref.ref}-{sub.product.type.name}", None
-        ) or sub.total_price(due_date)
-
-    total_amount += float(
-        Payment.objects.filter(
-            type="Genossenschaftsanteile", due_date=due_date
-        ).aggregate(Sum("amount"))["amount__sum"]
-        or 0.0
-    )
-    return total_amount
+    return CashflowProjection([due_date]).get_total(due_date)
 
 
 def get_automatically_calculated_solidarity_excess(
@@ -181,13 +225,18 @@ def get_automatically_calculated_solidarity_excess(
     if reference_date is None:
         reference_date = get_today()
 
+    subscriptions = list(
+        get_future_subscriptions(reference_date).values(
+            "quantity", "product", "solidarity_price"
+        )
+    )
+    price_table = ProductPriceTable({sub["product"] for sub in subscriptions})
+
     return sum(
         map(
             lambda sub: sub["quantity"]
             * sub["solidarity_price"]
-            * float(get_product_price(sub["product"]).price),
-            get_future_subscriptions(reference_date).values(
-                "quantity", "product", "solidarity_price"
-            ),
+            * float(price_table.get_price(sub["product"]).price),
+            subscriptions,
         )
     )
@@ -0,0 +1,189 @@
+from collections import defaultdict
+from datetime import date
+
+from dateutil.relativedelta import relativedelta
+from django.db.models import Q
+from django.utils.translation import gettext_lazy as _
+
+from tapir.wirgarten.models import CoopShareTransaction, Payment, Subscription
+from tapir.wirgarten.service.cashflow import COOP_SHARES_PAYMENT_TYPE
+from tapir.wirgarten.service.payment import get_next_payment_date
+from tapir.wirgarten.service.products import (
+    ProductPriceTable,
+    get_product_price,
+    product_type_order_by,
+    use_product_price_table,
+)
+from tapir.wirgarten.utils import get_today
+
+
+class MemberPaymentTimeline:
+    """
+    Persisted and projected payments of one member.
+
+    The payments, subscriptions, coop share transactions and product prices of the member are loaded once
+    (a fixed number of queries, independent of the length of the member's history), the timeline is then
+    assembled in memory.
+    """
+
+    def __init__(self, member_id: str):
+        self.member_id = member_id
+        self.today = get_today()
+
+        self.payments = list(
+            Payment.objects.filter(mandate_ref__member_id=member_id)
+            .select_related("mandate_ref")
+            .order_by("-due_date")
+        )
+
+        self.coop_share_transactions = defaultdict(list)
+        for tx in CoopShareTransaction.objects.filter(
+            payment__in=[
+                payment.id
+                for payment in self.payments
+                if payment.type == COOP_SHARES_PAYMENT_TYPE
+            ]
+        ):
+            self.coop_share_transactions[tx.payment_id].append(tx)
+
+        self.subscriptions = list(
+            Subscription.objects.filter(
+                Q(member_id=member_id) | Q(mandate_ref__member_id=member_id)
+            )
+            .select_related("product__type", "mandate_ref")
+            .order_by(*product_type_order_by("product__type_id", "product__type__name"))
+        )
+        self.price_table = ProductPriceTable(
+            {sub.product_id for sub in self.subscriptions}
+        )
+
+    def sub_to_dict(self, sub: Subscription) -> dict:
+        with use_product_price_table(self.price_table):
+            price = get_product_price(sub.product, sub.start_date).price
+            total_price = sub.total_price()
+
+        return {
+            "quantity": sub.quantity,
+            "product": {
+                "name": sub.product.name,
+                "type": {"name": sub.product.type.name},
+                "price": price,
+            },
+            "solidarity_price": sub.solidarity_price,
+            "solidarity_price_absolute": sub.solidarity_price_absolute,
+            "total_price": total_price,
+            "price_override": sub.price_override,
+        }
+
+    def payment_to_dict(self, payment: Payment) -> dict:
+        if payment.type == COOP_SHARES_PAYMENT_TYPE:
+            subs = [
+                {
+                    "quantity": tx.quantity,
+                    "product": {
+                        "name": _("Genossenschaftsanteile"),
+                        "price": tx.share_price,
+                    },
+                    "total_price": int(tx.quantity * tx.share_price),
+                }
+                for tx in self.coop_share_transactions[payment.id]
+            ]
+        else:
+            subs = [
+                self.sub_to_dict(sub)
+                for sub in self.subscriptions
+                if sub.mandate_ref_id == payment.mandate_ref_id
+                and sub.start_date <= payment.due_date < sub.end_date
+                and sub.product.type.name == payment.type
+            ]
+
+        return {
+            "id": payment.id,
+            "type": payment.type,
+            "due_date": payment.due_date,
+            "mandate_ref": payment.mandate_ref,
+            "amount": float(round(payment.amount, 2)),
+            "calculated_amount": round(
+                sum(map(lambda x: float(x["total_price"]), subs)), 2
+            ),
+            "subs": subs,
+            "status": payment.status,
+            "edited": payment.edited,
+            "upcoming": (self.today - payment.due_date).days < 0
+            and not payment.transaction_id,
+        }
+
+    def get_previous_payments(self) -> dict[date, list[dict]]:
+        """
+        :return: the persisted payments as dicts, grouped by due date
+        """
+        payments_dict = defaultdict(list)
+        for payment in self.payments:
+            payment_dict = self.payment_to_dict(payment)
+            payments_dict[payment_dict["due_date"]].append(payment_dict)
+
+        return dict(payments_dict)
+
+    def get_future_payments(self, limit: int = None) -> dict[date, list[dict]]:
+        """
+        Projects the payments of the active and future subscriptions, one payment per subscription and month.
+
+        :param limit: the maximum number of due dates
+        :return: the projected payments as dicts, grouped by due date
+        """
+        subs = [sub for sub in self.subscriptions if sub.end_date >= self.today]
+
+        payments_per_due_date = {}
+        if not subs:
+            return payments_per_due_date
+        max_end_date = max(sub.end_date for sub in subs)
+
+        next_payment_date = get_next_payment_date()
+        while next_payment_date <= max_end_date and (
+            limit is None or len(payments_per_due_date) < limit
+        ):
+            payments = []
+            for sub in subs:
+                if not sub.start_date <= next_payment_date <= sub.end_date:
+                    continue
+                sub_dict = self.sub_to_dict(sub)
+                payments.append(
+                    {
+                        "type": sub.product.type.name,
+                        "due_date": next_payment_date,
+                        "mandate_ref": sub.mandate_ref,
+                        "amount": sub_dict["total_price"],
+                        "calculated_amount": sub_dict["total_price"],
+                        "subs": [sub_dict],
+                        "status": Payment.PaymentStatus.DUE,
+                        "edited": False,
+                        "upcoming": True,
+                    }
+                )
+            if payments:
+                payments_per_due_date[next_payment_date] = payments
+
+            next_payment_date += relativedelta(months=1)
+
+        return payments_per_due_date
+
+    def get_payment_rows(self) -> list[dict]:
+        """
+        :return: the persisted payments plus the projected payments for the types that are not persisted yet, sorted by due date and type
+        """
+        prev_payments = self.get_previous_payments()
+        future_payments = self.get_future_payments()
+
+        for due_date, payments in future_payments.items():
+            if due_date in prev_payments:
+                persisted_types = {p.get("type", None) for p in prev_payments[due_date]}
+                prev_payments[due_date].extend(
+                    [p for p in payments if p.get("type", None) not in persisted_types]
+                )
+            else:
+                prev_payments[due_date] = payments
+
+        return sorted(
+            [v for sublist in prev_payments.values() for v in sublist],
+            key=lambda x: x["due_date"].isoformat() + x.get("type", ""),
+        )
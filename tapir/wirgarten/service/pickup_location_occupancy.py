@@ -0,0 +1,134 @@
+from datetime import date
+from typing import Iterable
+
+from django.db.models import Count, DecimalField, F, OuterRef, Subquery, Sum
+
+from tapir.wirgarten.models import MemberPickupLocation, Product, ProductPrice
+from tapir.wirgarten.service.products import ProductPriceTable, get_active_subscriptions
+
+
+class PickupLocationOccupancy:
+    """
+    Capacity usage and number of members of several pickup locations at several reference dates.
+
+    The usage of all locations and product types at one reference date is computed with a single grouped query
+    the first time the date is requested, so the same instance can be shared by everything that renders the
+    pickup locations (config page, map widget, choice field).
+    """
+
+    def __init__(
+        self,
+        reference_dates: Iterable[date] = (),
+        pickup_location_ids: Iterable[str] = None,
+    ):
+        """
+        :param reference_dates: the dates to load right away, other dates are loaded when they are first requested
+        :param pickup_location_ids: restricts the computation to these pickup locations, all locations if None
+        """
+        self.pickup_location_ids = (
+            list(pickup_location_ids) if pickup_location_ids is not None else None
+        )
+        self._usage = {}
+        self._member_counts = {}
+        self._base_products = None
+        self._base_product_prices = None
+
+        for reference_date in reference_dates:
+            self._load_usage(reference_date)
+
+    def _get_subscriptions(self, reference_date: date):
+        latest_member_pickup_location = (
+            MemberPickupLocation.objects.filter(member=OuterRef("member"))
+            .valid_at(reference_date)
+            .values("pickup_location_id")[:1]
+        )
+        subscriptions = (
+            get_active_subscriptions(reference_date)
+            .order_by()
+            .annotate(latest_pickup_location_id=Subquery(latest_member_pickup_location))
+        )
+        if self.pickup_location_ids is not None:
+            subscriptions = subscriptions.filter(
+                latest_pickup_location_id__in=self.pickup_location_ids
+            )
+        return subscriptions
+
+    def _load_usage(self, reference_date: date):
+        if reference_date in self._usage:
+            return
+
+        latest_valid_product_price = (
+            ProductPrice.objects.filter(
+                product=OuterRef("product"), valid_from__lte=reference_date
+            )
+            .order_by("-valid_from")
+            .values("size")[:1]
+        )
+        usage_per_location_and_product_type = (
+            self._get_subscriptions(reference_date)
+            .annotate(
+                latest_size=Subquery(
+                    latest_valid_product_price,
+                    output_field=DecimalField(decimal_places=4),
+                ),
+                total_size_per_subscription=F("latest_size") * F("quantity"),
+            )
+            .values("latest_pickup_location_id", "product__type_id")
+            .annotate(total_size=Sum("total_size_per_subscription"))
+        )
+
+        self._usage[reference_date] = {
+            (row["latest_pickup_location_id"], row["product__type_id"]): (
+                float(row["total_size"]) if row["total_size"] else 0
+            )
+            for row in usage_per_location_and_product_type
+        }
+
+    def get_usage(
+        self, pickup_location_id: str, product_type_id: str, reference_date: date
+    ) -> float:
+        """
+        Same as get_current_capacity_usage for the given location and product type.
+
+        :return: the summed size of the subscriptions of the members that pick up at this location at the reference date
+        """
+        self._load_usage(reference_date)
+        return self._usage[reference_date].get((pickup_location_id, product_type_id), 0)
+
+    def get_usage_in_base_product_units(
+        self, pickup_location_id: str, product_type_id: str, reference_date: date
+    ):
+        """
+        :return: the usage divided by the size of the base product of the product type, None if there is no base product
+        """
+        if self._base_products is None:
+            self._base_products = {}
+            for product in Product.objects.filter(base=True).order_by("id"):
+                self._base_products.setdefault(product.type_id, product)
+            self._base_product_prices = ProductPriceTable(self._base_products.values())
+
+        base_product = self._base_products.get(product_type_id)
+        if base_product is None:
+            return None
+        base_product_price = self._base_product_prices.get_price(
+            base_product, reference_date
+        )
+        if base_product_price is None:
+            return None
+
+        return self.get_usage(
+            pickup_location_id, product_type_id, reference_date
+        ) / float(base_product_price.size)
+
+    def get_member_count(self, pickup_location_id: str, reference_date: date) -> int:
+        """
+        :return: the number of distinct members with an active subscription that pick up at this location at the reference date
+        """
+        if reference_date not in self._member_counts:
+            self._member_counts[reference_date] = {
+                row["latest_pickup_location_id"]: row["member_count"]
+                for row in self._get_subscriptions(reference_date)
+                .values("latest_pickup_location_id")
+                .annotate(member_count=Count("member_id", distinct=True))
+            }
+        return self._member_counts[reference_date].get(pickup_location_id, 0)
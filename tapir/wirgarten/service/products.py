@@ -1,11 +1,29 @@
+from bisect import bisect_right
+from contextlib import contextmanager
+from contextvars import ContextVar
 from datetime import date
 from decimal import Decimal
-from typing import List
+from typing import Iterable, List
 
 from dateutil.relativedelta import relativedelta
 from django.core.exceptions import ObjectDoesNotExist
 from django.db import transaction
-from django.db.models import Case, IntegerField, Value, When
+from django.db.models import (
+    Case,
+    Count,
+    DecimalField,
+    F,
+    IntegerField,
+    Min,
+    OuterRef,
+    Subquery,
+    Sum,
+    Value,
+    When,
+)
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 
 from tapir.configuration.models import TapirParameter
 from tapir.configuration.parameter import get_parameter_value
@@ -93,7 +111,16 @@ def get_available_product_types(reference_date: date = None) -> list:
         reference_date = get_today()
 
     product_types = get_active_product_types(reference_date)
-    return [p for p in product_types if is_product_type_available(p, reference_date)]
+    free_capacities = get_free_product_capacities(
+        reference_date, [p.id for p in product_types]
+    )
+    return [
+        p
+        for p in product_types
+        if is_product_type_available(
+            p, reference_date, free_capacity=free_capacities.get(p.id, 0)
+        )
+    ]
 
 
 def get_next_growing_period(
@@ -261,6 +288,121 @@ def create_product(name: str, price: Decimal, capacity_id: str, base=False):
     return product
 
 
+class ProductPriceTable:
+    """
+    In-memory lookup of product prices.
+
+    The price history of each product is loaded once (for many products at once with `load()`) and kept sorted by
+    valid_from, so that the price valid at any date is found by bisection without further queries.
+    The lookup rules are the same as in `get_product_price()`.
+    """
+
+    def __init__(self, products: Iterable[str | Product] | None = None):
+        self._prices: dict[str, list[ProductPrice]] = {}
+        self._valid_from_dates: dict[str, list[date]] = {}
+        if products is not None:
+            self.load(products)
+
+    @classmethod
+    def for_product_types(cls, product_type_ids: Iterable[str]) -> "ProductPriceTable":
+        return cls(
+            Product.objects.filter(type_id__in=list(product_type_ids)).values_list(
+                "id", flat=True
+            )
+        )
+
+    @classmethod
+    def for_all_products(cls) -> "ProductPriceTable":
+        return cls(Product.objects.values_list("id", flat=True))
+
+    def load(self, products: Iterable[str | Product]):
+        """
+        Loads the price history of all given products that are not loaded yet, with a single query.
+
+        :param products: products or product ids
+        """
+        product_ids = {
+            product.id if isinstance(product, Product) else product
+            for product in products
+        }.difference(self._prices.keys())
+        if not product_ids:
+            return
+
+        for product_id in product_ids:
+            self._prices[product_id] = []
+
+        for price in ProductPrice.objects.filter(product_id__in=product_ids).order_by(
+            "product_id", "valid_from"
+        ):
+            self._prices[price.product_id].append(price)
+
+        for product_id in product_ids:
+            self._valid_from_dates[product_id] = [
+                price.valid_from for price in self._prices[product_id]
+            ]
+
+    def clear(self):
+        self._prices.clear()
+        self._valid_from_dates.clear()
+
+    def get_price(
+        self, product: str | Product, reference_date: date = None
+    ) -> ProductPrice | None:
+        """
+        Returns the product price valid at the reference date. Products that are not loaded yet are loaded on demand.
+
+        :param product: the product or product id
+        :param reference_date: reference date for when the price should be valid, default: today
+        :return: the ProductPrice instance or None if there is no valid price
+        """
+        if reference_date is None:
+            reference_date = get_today()
+        if isinstance(product, Product):
+            product = product.id
+
+        if product not in self._prices:
+            self.load([product])
+
+        prices = self._prices[product]
+        # If there's only one price, return it
+        if len(prices) == 1:
+            return prices[0]
+
+        index = bisect_right(self._valid_from_dates[product], reference_date)
+        return prices[index - 1] if index > 0 else None
+
+
+_active_product_price_table: ContextVar[ProductPriceTable | None] = ContextVar(
+    "active_product_price_table", default=None
+)
+
+
+@contextmanager
+def use_product_price_table(price_table: ProductPriceTable | None = None):
+    """
+    Makes `get_product_price()` (and with it Subscription.total_price() etc.) resolve prices from the given table
+    instead of querying the DB on every call. Used per request by the ProductPriceTableMiddleware.
+
+    :param price_table: the table to use. If None, a new, empty table is used which loads products on demand.
+    """
+    if price_table is None:
+        price_table = ProductPriceTable()
+
+    token = _active_product_price_table.set(price_table)
+    try:
+        yield price_table
+    finally:
+        _active_product_price_table.reset(token)
+
+
+@receiver(post_save, sender=ProductPrice)
+@receiver(post_delete, sender=ProductPrice)
+def _clear_active_product_price_table(**kwargs):
+    price_table = _active_product_price_table.get()
+    if price_table is not None:
+        price_table.clear()
+
+
 def get_product_price(product: str | Product, reference_date: date = None):
     """
     Returns the currently active product price.
@@ -269,6 +411,10 @@ def get_product_price(product: str | Product, reference_date: date = None):
     :param reference_date: reference date for when the price should be valid
     :return: the ProductPrice instance
     """
+    price_table = _active_product_price_table.get()
+    if price_table is not None:
+        return price_table.get_price(product, reference_date)
+
     if reference_date is None:
         reference_date = get_today()
     if isinstance(product, Product):
@@ -535,28 +681,125 @@ def create_or_update_default_tax_rate(
         )
 
 
-def get_free_product_capacity(product_type_id: str, reference_date: date = None):
+def product_price_field_at(
+    reference_date, field: str, product_field: str = "product_id"
+):
+    """
+    Returns a subquery expression resolving a field of the price of the referenced product at the given date,
+    following the same rules as `get_product_price()`.
+
+    :param reference_date: the date at which the price must be valid, or an expression of the outer query
+        (e.g. Greatest(OuterRef("start_date"), Value(today))) for a different date per row
+    :param field: the ProductPrice field to return, "price" or "size"
+    :param product_field: name/path of the product id field in the outer query. E.g. "subscription__product_id"
+    :return: the subquery expression
+    """
+    valid_value = Subquery(
+        ProductPrice.objects.filter(
+            product_id=OuterRef(product_field), valid_from__lte=reference_date
+        )
+        .order_by("-valid_from")
+        .values(field)[:1]
+    )
+    # if there is only one price, it is used regardless of its valid_from date
+    only_value = Subquery(
+        ProductPrice.objects.filter(product_id=OuterRef(product_field))
+        .values("product_id")
+        .annotate(price_count=Count("id"), only_value=Min(field))
+        .filter(price_count=1)
+        .values("only_value")[:1]
+    )
+    return Coalesce(valid_value, only_value, output_field=DecimalField())
+
+
+def product_size_at(reference_date: date, product_field: str = "product_id"):
+    """
+    Returns a subquery expression resolving the size of the referenced product at the given date,
+    following the same rules as `get_product_price()`.
+    """
+    return product_price_field_at(reference_date, "size", product_field)
+
+
+def product_price_at(reference_date, product_field: str = "product_id"):
+    """
+    Returns a subquery expression resolving the price of the referenced product at the given date,
+    following the same rules as `get_product_price()`.
+    """
+    return product_price_field_at(reference_date, "price", product_field)
+
+
+def get_used_product_capacities(
+    reference_date: date = None, product_type_ids: Iterable[str] = None
+) -> dict[str, float]:
+    """
+    Sums up the capacity (product size × quantity) used by the active subscriptions per product type, in a single query.
+
+    :param reference_date: the date on which the subscriptions must be active
+    :param product_type_ids: if set, only these product types are included
+    :return: dict of product_type_id -> used capacity
+    """
     if reference_date is None:
         reference_date = get_today()
 
-    active_product_capacities = get_active_product_capacities(reference_date).filter(
-        product_type_id=product_type_id
-    )
+    subscriptions = get_active_subscriptions(reference_date)
+    if product_type_ids is not None:
+        subscriptions = subscriptions.filter(product__type_id__in=product_type_ids)
+
+    return {
+        row["product__type_id"]: float(row["used_capacity"] or 0)
+        for row in subscriptions.order_by()
+        .values("product__type_id")
+        .annotate(
+            used_capacity=Sum(
+                F("quantity") * product_size_at(reference_date),
+                output_field=DecimalField(),
+            )
+        )
+    }
 
-    if not active_product_capacities.exists():
-        return 0
 
-    total_capacity = float(active_product_capacities.first().capacity)
-    used_capacity = sum(
-        map(
-            lambda sub: float(get_product_price(sub.product, reference_date).size)
-            * sub.quantity,
-            get_active_subscriptions(reference_date).filter(
-                product__type_id=product_type_id
-            ),
+def get_free_product_capacities(
+    reference_date: date = None, product_type_ids: Iterable[str] = None
+) -> dict[str, float]:
+    """
+    Returns the free capacity of all product types that have a capacity in the growing period of the reference date.
+
+    :param reference_date: the date on which the capacity and subscriptions must be active
+    :param product_type_ids: if set, only these product types are included
+    :return: dict of product_type_id -> free capacity
+    """
+    if reference_date is None:
+        reference_date = get_today()
+    if product_type_ids is not None:
+        product_type_ids = list(product_type_ids)
+
+    active_product_capacities = get_active_product_capacities(reference_date)
+    if product_type_ids is not None:
+        active_product_capacities = active_product_capacities.filter(
+            product_type_id__in=product_type_ids
         )
+
+    total_capacities = {}
+    for product_capacity in active_product_capacities:
+        total_capacities.setdefault(
+            product_capacity.product_type_id, float(product_capacity.capacity)
+        )
+    if not total_capacities:
+        return {}
+
+    used_capacities = get_used_product_capacities(
+        reference_date, list(total_capacities.keys())
+    )
+    return {
+        product_type_id: total_capacity - used_capacities.get(product_type_id, 0.0)
+        for product_type_id, total_capacity in total_capacities.items()
+    }
+
+
+def get_free_product_capacity(product_type_id: str, reference_date: date = None):
+    return get_free_product_capacities(reference_date, [product_type_id]).get(
+        product_type_id, 0
     )
-    return total_capacity - used_capacity
 
 
 def get_smallest_product_size(
@@ -592,8 +835,13 @@ def get_smallest_product_size(
 
 
 def is_product_type_available(
-    product_type: ProductType | str, reference_date: date = None
+    product_type: ProductType | str,
+    reference_date: date = None,
+    free_capacity: float = None,
 ) -> bool:
+    """
+    :param free_capacity: the already computed free capacity of the product type at the reference date (optional)
+    """
     if reference_date is None:
         reference_date = get_today()
 
@@ -603,6 +851,9 @@ def is_product_type_available(
     if not Product.objects.filter(type_id=product_type, deleted=False).exists():
         return False
 
-    return get_free_product_capacity(
-        product_type_id=product_type, reference_date=reference_date
-    ) >= get_smallest_product_size(product_type, reference_date)
+    if free_capacity is None:
+        free_capacity = get_free_product_capacity(
+            product_type_id=product_type, reference_date=reference_date
+        )
+
+    return free_capacity >= get_smallest_product_size(product_type, reference_date)
@@ -0,0 +1,319 @@
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from celery.signals import task_postrun, task_prerun
+from django.conf import settings
+from django.db import connections
+from django.dispatch import receiver
+
+from tapir.wirgarten.service.capacity_ledger import get_ledger_connection
+
+DURATION_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+QUERY_COUNT_BUCKETS = (0, 1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000)
+
+# Maximum number of SQL queries per URL name. A request above its budget is logged, or fails if
+# settings.QUERY_BUDGET_STRICT is set (as in the tests), so that a view that starts querying per row becomes visible.
+QUERY_BUDGETS: dict[str, int] = {
+    "wirgarten:member_list": 100,
+    "wirgarten:admin_dashboard": 150,
+}
+
+_WHITESPACE = re.compile(r"\s+")
+_PLACEHOLDER_LIST = re.compile(r"\(\s*%s(?:\s*,\s*%s)+\s*\)")
+_VALUES_ROWS = re.compile(r"(\([^()]*\))(?:\s*,\s*\([^()]*\))+")
+
+
+def get_query_fingerprint(sql: str) -> str:
+    """
+    The parameters are not part of the SQL passed to the execute wrappers, so queries that only differ in their
+    parameters have the same fingerprint. Placeholder lists of any length (IN clauses, bulk inserts) are collapsed.
+    """
+    sql = _WHITESPACE.sub(" ", sql.strip())
+    sql = _PLACEHOLDER_LIST.sub("(%s, ...)", sql)
+    return _VALUES_ROWS.sub(r"\1, ...", sql)
+
+
+class QueryRecorder:
+    """
+    Counts the SQL queries, their total time and how often each query fingerprint ran while it is installed as
+    execute wrapper on the database connections of the current thread. Works without settings.DEBUG.
+    """
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.query_count = 0
+        self.query_seconds = 0.0
+        self.fingerprints = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.query_seconds += time.perf_counter() - start
+            self.query_count += 1
+            self.fingerprints[sql] += 1
+
+    @contextmanager
+    def record(self):
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(self))
+            yield self
+
+    @property
+    def total_seconds(self) -> float:
+        return time.perf_counter() - self.started_at
+
+    def get_duplicate_fingerprints(self) -> Counter:
+        """
+        :return: the number of executions per fingerprint, only for fingerprints that were executed more than once
+        """
+        # fingerprinted only here, so that recording a query stays cheap
+        fingerprints = Counter()
+        for sql, count in self.fingerprints.items():
+            fingerprints[get_query_fingerprint(sql)] += count
+        return Counter({sql: count for sql, count in fingerprints.items() if count > 1})
+
+    def describe(self) -> str:
+        duplicates = self.get_duplicate_fingerprints()
+        description = f"{self.total_seconds:.3f}s, {self.query_count} queries in {self.query_seconds:.3f}s, {sum(duplicates.values()) - len(duplicates)} duplicates"
+        if duplicates:
+            sql, count = duplicates.most_common(1)[0]
+            description += f", most repeated ({count}x): {sql[:300]}"
+        return description
+
+
+def _escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_bound(bound) -> str:
+    return "+Inf" if bound == float("inf") else str(bound)
+
+
+class Histogram:
+    """
+    Cumulative histogram with one label, kept in the memory of the current process (e.g. one gunicorn worker).
+    """
+
+    def __init__(self, name: str, documentation: str, label_name: str, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.label_name = label_name
+        self.bounds = tuple(buckets) + (float("inf"),)
+        self.lock = threading.Lock()
+        # label value -> (counts per bucket, sum, count)
+        self.samples: dict[str, tuple[list[int], float, int]] = {}
+
+    def observe(self, label: str, value: float):
+        with self.lock:
+            bucket_counts, total, count = self.samples.get(
+                label, ([0] * len(self.bounds), 0.0, 0)
+            )
+            for index, bound in enumerate(self.bounds):
+                if value <= bound:
+                    bucket_counts[index] += 1
+            self.samples[label] = (bucket_counts, total + value, count + 1)
+
+    def get_samples(self) -> dict[str, tuple[list[int], float, int]]:
+        with self.lock:
+            return {
+                label: (list(bucket_counts), total, count)
+                for label, (bucket_counts, total, count) in self.samples.items()
+            }
+
+    def clear(self):
+        with self.lock:
+            self.samples = {}
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        for label, (bucket_counts, total, count) in sorted(self.get_samples().items()):
+            label = f'{self.label_name}="{_escape_label_value(label)}"'
+            for bound, bucket_count in zip(self.bounds, bucket_counts):
+                lines.append(
+                    f'{self.name}_bucket{{{label},le="{_format_bound(bound)}"}} {bucket_count}'
+                )
+            lines.append(f"{self.name}_sum{{{label}}} {total}")
+            lines.append(f"{self.name}_count{{{label}}} {count}")
+        return lines
+
+
+class SharedHistogram(Histogram):
+    """
+    Histogram kept in Redis, for observations made in other processes than the one serving /metrics (celery workers).
+    Falls back to the memory of the current process if Redis is not available.
+    """
+
+    KEY_PREFIX = "tapir:metrics"
+
+    def get_key(self) -> str:
+        return f"{self.KEY_PREFIX}:{self.name}"
+
+    def observe(self, label: str, value: float):
+        try:
+            connection = get_ledger_connection()
+        except Exception as e:
+            print(f"Could not connect to Redis to record {self.name}: ", e)
+            connection = None
+        if connection is None:
+            return super().observe(label, value)
+
+        pipeline = connection.pipeline()
+        for index, bound in enumerate(self.bounds):
+            if value <= bound:
+                pipeline.hincrby(self.get_key(), f"{label}|{index}", 1)
+        pipeline.hincrbyfloat(self.get_key(), f"{label}|sum", value)
+        pipeline.hincrby(self.get_key(), f"{label}|count", 1)
+        try:
+            pipeline.execute()
+        except Exception as e:
+            print(f"Could not record {self.name} in Redis: ", e)
+            super().observe(label, value)
+
+    def get_samples(self) -> dict[str, tuple[list[int], float, int]]:
+        samples = super().get_samples()
+        try:
+            connection = get_ledger_connection()
+            values = connection.hgetall(self.get_key()) if connection else {}
+        except Exception as e:
+            print(f"Could not read {self.name} from Redis: ", e)
+            values = {}
+
+        for field, value in values.items():
+            label, _, part = field.decode().rpartition("|")
+            bucket_counts, total, count = samples.get(
+                label, ([0] * len(self.bounds), 0.0, 0)
+            )
+            if part == "sum":
+                total += float(value)
+            elif part == "count":
+                count += int(value)
+            else:
+                bucket_counts[int(part)] += int(value)
+            samples[label] = (bucket_counts, total, count)
+        return samples
+
+    def clear(self):
+        super().clear()
+        try:
+            connection = get_ledger_connection()
+            if connection is not None:
+                connection.delete(self.get_key())
+        except Exception as e:
+            print(f"Could not delete {self.name} from Redis: ", e)
+
+
+class ExecutionMetrics:
+    """
+    The histograms of one kind of execution (views or celery tasks).
+    """
+
+    def __init__(self, prefix: str, label_name: str, histogram_class=Histogram):
+        def histogram(name, documentation, buckets):
+            return histogram_class(
+                f"{prefix}_{name}", documentation, label_name, buckets
+            )
+
+        self.duration = histogram(
+            "duration_seconds", "Total wall time", DURATION_BUCKETS
+        )
+        self.queries = histogram(
+            "queries", "Number of SQL queries", QUERY_COUNT_BUCKETS
+        )
+        self.query_duration = histogram(
+            "query_duration_seconds", "Time spent in SQL queries", DURATION_BUCKETS
+        )
+        self.duplicate_queries = histogram(
+            "duplicate_queries",
+            "Number of SQL queries whose fingerprint already ran before (N+1 patterns)",
+            QUERY_COUNT_BUCKETS,
+        )
+
+    def get_histograms(self) -> list[Histogram]:
+        return [
+            self.duration,
+            self.queries,
+            self.query_duration,
+            self.duplicate_queries,
+        ]
+
+    def observe(self, label: str, recorder: QueryRecorder):
+        duplicates = recorder.get_duplicate_fingerprints()
+        self.duration.observe(label, recorder.total_seconds)
+        self.queries.observe(label, recorder.query_count)
+        self.query_duration.observe(label, recorder.query_seconds)
+        self.duplicate_queries.observe(
+            label, sum(duplicates.values()) - len(duplicates)
+        )
+
+    def clear(self):
+        for histogram in self.get_histograms():
+            histogram.clear()
+
+
+view_metrics = ExecutionMetrics("tapir_view", "view")
+task_metrics = ExecutionMetrics("tapir_task", "task", SharedHistogram)
+
+
+def render_metrics() -> str:
+    """
+    :return: all metrics in the Prometheus text exposition format
+    """
+    lines = []
+    for metrics in [view_metrics, task_metrics]:
+        for histogram in metrics.get_histograms():
+            lines.extend(histogram.render())
+    return "\n".join(lines) + "\n"
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def check_query_budget(url_name: str, recorder: QueryRecorder):
+    budget = QUERY_BUDGETS.get(url_name)
+    if budget is None or recorder.query_count <= budget:
+        return
+
+    message = (
+        f"Query budget of {url_name} exceeded ({budget} queries): {recorder.describe()}"
+    )
+    if getattr(settings, "QUERY_BUDGET_STRICT", False):
+        raise QueryBudgetExceeded(message)
+    print(f"[query budget] {message}")
+
+
+_task_recorders: dict[str, tuple[QueryRecorder, ExitStack]] = {}
+
+
+@receiver(task_prerun)
+def start_task_recording(task_id=None, **kwargs):
+    recorder = QueryRecorder()
+    stack = ExitStack()
+    stack.enter_context(recorder.record())
+    _task_recorders[task_id] = (recorder, stack)
+
+
+@receiver(task_postrun)
+def finish_task_recording(task_id=None, task=None, **kwargs):
+    recorder, stack = _task_recorders.pop(task_id, (None, None))
+    if recorder is None:
+        return
+    stack.close()
+
+    task_name = getattr(task, "name", None) or "unknown"
+    try:
+        task_metrics.observe(task_name, recorder)
+    except Exception as e:
+        print("Could not record the task metrics: ", e)
+
+    if recorder.total_seconds > getattr(settings, "SLOW_TASK_THRESHOLD", 60):
+        print(f"[slow task] {task_name}: {recorder.describe()}")
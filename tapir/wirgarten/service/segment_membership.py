@@ -0,0 +1,100 @@
+"""
+Materialized membership of the members in the mail segments that depend on their coop shares and subscriptions
+(see MemberSegmentMembership), so that resolving such a segment is an index scan instead of an aggregate over all
+transactions and subscriptions.
+
+The memberships of a member are updated with every change of their coop share transactions or subscriptions
+(bulk_create doesn't send signals, call update_segment_memberships after it).
+Since the memberships also change with the date (transactions becoming valid, subscriptions starting or ending),
+all memberships are updated once per night by the update_segment_memberships task.
+"""
+
+import datetime
+from typing import Callable, Iterable
+
+from django.db import transaction
+from django.db.models import QuerySet
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from tapir.wirgarten.models import (
+    CoopShareTransaction,
+    Member,
+    MemberQuerySet,
+    MemberSegmentMembership,
+    Subscription,
+)
+
+# per segment, the queryset method that selects its members
+SEGMENT_MEMBER_QUERIES: dict[str, Callable[[QuerySet, datetime.date], QuerySet]] = {
+    MemberSegmentMembership.SEGMENT_COOP_MEMBERS: MemberQuerySet.with_shares,
+    MemberSegmentMembership.SEGMENT_ACTIVE_SUBSCRIPTION: MemberQuerySet.with_active_subscription,
+}
+
+
+def get_segment_member_ids(segment: str) -> QuerySet:
+    """
+    :return: subquery of the ids of the members in the segment
+    """
+    return MemberSegmentMembership.objects.filter(segment=segment).values("member_id")
+
+
+def update_segment_memberships(
+    member_ids: Iterable[str] | None = None,
+    reference_date: datetime.date | None = None,
+) -> dict:
+    """
+    Adds and removes memberships so that the table matches the segment definitions in SEGMENT_MEMBER_QUERIES.
+
+    :param member_ids: the members to update, all members if None
+    :param reference_date: the date at which the segments are evaluated, today by default
+    :return: the number of added and removed memberships
+    """
+    members = Member.objects.all()
+    memberships = MemberSegmentMembership.objects.all()
+    if member_ids is not None:
+        member_ids = list(member_ids)
+        members = members.filter(id__in=member_ids)
+        memberships = memberships.filter(member_id__in=member_ids)
+
+    statistics = {"added": 0, "removed": 0}
+    with transaction.atomic():
+        for segment, get_members in SEGMENT_MEMBER_QUERIES.items():
+            expected = set(
+                get_members(members, reference_date).values_list("id", flat=True)
+            )
+            segment_memberships = memberships.filter(segment=segment)
+            existing = set(segment_memberships.values_list("member_id", flat=True))
+
+            removed = existing - expected
+            if removed:
+                statistics["removed"] += segment_memberships.filter(
+                    member_id__in=removed
+                ).delete()[0]
+
+            added = expected - existing
+            MemberSegmentMembership.objects.bulk_create(
+                [
+                    MemberSegmentMembership(segment=segment, member_id=member_id)
+                    for member_id in added
+                ],
+                batch_size=1000,
+                ignore_conflicts=True,
+            )
+            statistics["added"] += len(added)
+
+    return statistics
+
+
+@receiver(post_save, sender=CoopShareTransaction)
+@receiver(post_delete, sender=CoopShareTransaction)
+@receiver(post_save, sender=Subscription)
+@receiver(post_delete, sender=Subscription)
+def on_segment_source_changed(instance, raw=False, **kwargs):
+    if raw:
+        return
+    member_ids = {instance.member_id}
+    if getattr(instance, "transfer_member_id", None) is not None:
+        member_ids.add(instance.transfer_member_id)
+    # in the same transaction, so that the segments never disagree with the data they are computed from
+    update_segment_memberships(member_ids)
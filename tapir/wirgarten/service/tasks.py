@@ -1,28 +1,230 @@
-from datetime import datetime
+from datetime import datetime, timedelta
+from functools import lru_cache
+from importlib import import_module
+from typing import Callable
 
 from celery import Celery
-from django.db import transaction
+from django.db import IntegrityError, transaction
 
 from django.conf import settings
+from django.db.models import F, Q
 
 app = Celery("tapir", broker=settings.CELERY_BROKER_URL)
 
 
 from tapir.wirgarten.models import ScheduledTask
+from tapir.wirgarten.utils import get_now
 
 
 @transaction.atomic
-def schedule_task_unique(task, eta: datetime, args=(), kwargs={}):
-    st_args = {
-        "task_function": f"{task.__module__}.{task.__name__}",
-        "task_args": args,
-        "task_kwargs": kwargs,
-    }
-
-    existing = ScheduledTask.objects.filter(**st_args)
-    if existing.exists():
-        existing.delete()
-    print("Deleted duplicate task: ", ", ".join([e for e in existing]))
-
-    scheduled_task = ScheduledTask.objects.create(**st_args, eta=eta)
-    print("Scheduled new task: ", scheduled_task)
+def schedule_task_unique(task, eta: datetime, args=(), kwargs={}) -> ScheduledTask:
+    """
+    Schedules the task, or moves the pending task with the same function and arguments to the new eta.
+    The lookup uses the unique index on the dedup key of the pending tasks.
+
+    :return: the created or updated task
+    """
+    task_function = f"{task.__module__}.{task.__name__}"
+    dedup_key = ScheduledTask.get_dedup_key(task_function, args, kwargs)
+
+    for _ in range(2):
+        scheduled_task = (
+            ScheduledTask.objects.select_for_update()
+            .filter(dedup_key=dedup_key, status=ScheduledTask.STATUS_PENDING)
+            .first()
+        )
+        if scheduled_task is not None:
+            scheduled_task.eta = eta
+            scheduled_task.save(update_fields=["eta", "updated_at"])
+            print("Rescheduled task: ", scheduled_task)
+            return scheduled_task
+
+        try:
+            with transaction.atomic():
+                scheduled_task = ScheduledTask.objects.create(
+                    task_function=task_function,
+                    task_args=list(args),
+                    task_kwargs=kwargs,
+                    eta=eta,
+                )
+            print("Scheduled new task: ", scheduled_task)
+            return scheduled_task
+        except IntegrityError:
+            # created concurrently, update that one instead
+            continue
+
+    raise IntegrityError(f"Could not schedule task {task_function}")
+
+
+def get_scheduled_task_retention_days() -> int:
+    return getattr(settings, "SCHEDULED_TASK_RETENTION_DAYS", 180)
+
+
+def prune_finished_scheduled_tasks(batch_size: int = 1000) -> int:
+    """
+    Deletes the done and failed tasks that were last updated more than SCHEDULED_TASK_RETENTION_DAYS ago.
+
+    :return: the number of deleted tasks
+    """
+    updated_before = get_now() - timedelta(days=get_scheduled_task_retention_days())
+    finished_tasks = ScheduledTask.objects.filter(
+        status__in=[ScheduledTask.STATUS_DONE, ScheduledTask.STATUS_FAILED],
+        updated_at__lt=updated_before,
+    )
+
+    deleted = 0
+    while True:
+        batch = list(finished_tasks.values_list("id", flat=True)[:batch_size])
+        if not batch:
+            return deleted
+        deleted += ScheduledTask.objects.filter(id__in=batch).delete()[0]
+
+
+def get_scheduled_task_concurrency() -> int:
+    return getattr(settings, "SCHEDULED_TASK_CONCURRENCY", 8)
+
+
+def get_scheduled_task_run_timeout() -> int:
+    return getattr(settings, "SCHEDULED_TASK_RUN_TIMEOUT", 60 * 30)
+
+
+def get_scheduled_task_time_limit() -> int:
+    """
+    :return: the hard time limit of a task run in seconds, after which celery kills the worker process. Later than
+        SCHEDULED_TASK_RUN_TIMEOUT (the soft time limit), so that the task can clean up after the soft limit.
+    """
+    return get_scheduled_task_run_timeout() + 60
+
+
+def get_scheduled_task_retry_delay(attempts: int) -> timedelta:
+    """
+    :param attempts: the number of failed attempts so far
+    :return: the time to wait before the next attempt, doubled with every failed attempt
+    """
+    base_delay = getattr(settings, "SCHEDULED_TASK_RETRY_DELAY", 60 * 5)
+    return timedelta(seconds=base_delay * 2 ** max(attempts - 1, 0))
+
+
+@lru_cache(maxsize=None)
+def get_task_function(task_function: str) -> Callable:
+    """
+    :param task_function: the dotted path of the function, see ScheduledTask.task_function
+    :return: the function, imported only once per process
+    """
+    module_name, function_name = task_function.rsplit(".", 1)
+    return getattr(import_module(module_name), function_name)
+
+
+@transaction.atomic
+def claim_due_scheduled_tasks(limit: int) -> list[tuple[str, int]]:
+    """
+    Marks the oldest due pending tasks as in progress.
+    Rows locked by a concurrent call are skipped, so no task is claimed twice.
+    The task is only started by start_claimed_scheduled_task, which also sets started_at.
+
+    :param limit: the maximum number of tasks to claim
+    :return: the id and the attempt number of each claimed task. The attempt number identifies the claim, see start_claimed_scheduled_task.
+    """
+    scheduled_task_ids = list(
+        ScheduledTask.objects.select_for_update(skip_locked=True)
+        .filter(status=ScheduledTask.STATUS_PENDING, eta__lte=get_now())
+        .order_by("eta")
+        .values_list("id", flat=True)[:limit]
+    )
+    ScheduledTask.objects.filter(id__in=scheduled_task_ids).update(
+        status=ScheduledTask.STATUS_IN_PROGRESS,
+        attempts=F("attempts") + 1,
+        started_at=None,
+        # update() doesn't set the auto_now field, release_timed_out_scheduled_tasks needs the claim time
+        updated_at=get_now(),
+    )
+    return list(
+        ScheduledTask.objects.filter(id__in=scheduled_task_ids)
+        .order_by("eta")
+        .values_list("id", "attempts")
+    )
+
+
+@transaction.atomic
+def start_claimed_scheduled_task(
+    scheduled_task_id: str, attempt: int | None
+) -> ScheduledTask | None:
+    """
+    Sets started_at of the claimed task, if the claim is still valid: the task is still in progress, has not been
+    started yet and has not been released and claimed again in the meantime (the attempt number changed).
+    The row is locked while checking, so that a duplicate delivery of the celery message doesn't run the task twice.
+
+    :param attempt: the attempt number returned by claim_due_scheduled_tasks, None to skip that check
+    :return: the task to execute, or None if the claim isn't valid anymore
+    """
+    scheduled_task = (
+        ScheduledTask.objects.select_for_update()
+        .filter(
+            id=scheduled_task_id,
+            status=ScheduledTask.STATUS_IN_PROGRESS,
+            started_at__isnull=True,
+        )
+        .first()
+    )
+    if scheduled_task is None or (
+        attempt is not None and scheduled_task.attempts != attempt
+    ):
+        return None
+
+    scheduled_task.started_at = get_now()
+    scheduled_task.save(update_fields=["started_at", "updated_at"])
+    return scheduled_task
+
+
+@transaction.atomic
+def release_timed_out_scheduled_tasks() -> int:
+    """
+    Tasks that are in progress for longer than the hard time limit (see get_scheduled_task_time_limit) are assumed to
+    be dead (e.g. the worker was killed), as are claimed tasks that were not started within that time (e.g. the celery
+    message was lost). They are retried right away if they have attempts left, otherwise marked as failed.
+    A released task gets a new attempt number when it is claimed again, so a late start of the old claim is ignored.
+
+    :return: the number of released tasks
+    """
+    started_before = get_now() - timedelta(seconds=get_scheduled_task_time_limit())
+    timed_out_tasks = list(
+        ScheduledTask.objects.select_for_update(skip_locked=True)
+        .filter(
+            Q(started_at__lt=started_before)
+            | Q(started_at__isnull=True, updated_at__lt=started_before),
+            status=ScheduledTask.STATUS_IN_PROGRESS,
+        )
+        .order_by("eta")
+        .values_list("id", "dedup_key", "attempts", "max_attempts")
+    )
+    # the pending task that has been scheduled in the meantime replaces the retry
+    pending_dedup_keys = set(
+        ScheduledTask.objects.filter(
+            status=ScheduledTask.STATUS_PENDING,
+            dedup_key__in={dedup_key for _, dedup_key, _, _ in timed_out_tasks},
+        ).values_list("dedup_key", flat=True)
+    )
+
+    retried_ids = []
+    failed_ids = []
+    for scheduled_task_id, dedup_key, attempts, max_attempts in timed_out_tasks:
+        if attempts < max_attempts and dedup_key not in pending_dedup_keys:
+            # only one pending task per dedup key is allowed, see unique_pending_scheduledtask
+            pending_dedup_keys.add(dedup_key)
+            retried_ids.append(scheduled_task_id)
+        else:
+            failed_ids.append(scheduled_task_id)
+
+    error_message = "Timed out"
+    ScheduledTask.objects.filter(id__in=retried_ids).update(
+        status=ScheduledTask.STATUS_PENDING,
+        eta=get_now(),
+        error_message=error_message,
+        updated_at=get_now(),
+    )
+    ScheduledTask.objects.filter(id__in=failed_ids).update(
+        status=ScheduledTask.STATUS_FAILED,
+        error_message=error_message,
+        updated_at=get_now(),
+    )
+    return len(retried_ids) + len(failed_ids)
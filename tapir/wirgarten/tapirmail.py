@@ -1,7 +1,13 @@
+import threading
+import time
+from collections import defaultdict
 from datetime import timedelta
 
+from celery.signals import task_prerun
 from dateutil.relativedelta import relativedelta
-from django.db import models
+from django.core.cache import cache
+from django.core.signals import request_started
+from django.db import models, transaction
 from django.db.models import ExpressionWrapper, F
 from django.db.models.functions import TruncMonth
 from django.db.models.signals import post_delete, post_save
@@ -17,11 +23,17 @@ from tapir_mail.service.triggers import register_trigger
 from tapir_mail.triggers.transactional_trigger import TransactionalTrigger
 
 from tapir.configuration.parameter import get_parameter_value
-from tapir.wirgarten.models import Member, PickupLocation, WaitingListEntry
+from tapir.wirgarten.models import (
+    Member,
+    MemberSegmentMembership,
+    PickupLocation,
+    WaitingListEntry,
+)
 from tapir.wirgarten.parameters import Parameter
 from tapir.wirgarten.service.products import (
     get_next_growing_period,
 )
+from tapir.wirgarten.service.segment_membership import get_segment_member_ids
 from tapir.wirgarten.triggers.onboarding_trigger import OnboardingTrigger
 from tapir.wirgarten.utils import get_today
 
@@ -75,36 +87,55 @@ class Filters:
 
 
 def configure_mail_module():
+    """
+    Registers the segments, filters, tokens and triggers. Called on startup of every process, so it must not use the DB:
+    the pickup location filters are registered lazily (see PickupLocationFilters) and the waitlist segments are
+    synchronized by the synchronize_waitlist_segments task.
+    """
     _register_segments()
     _register_filters()
     _register_tokens()
     _register_triggers()
 
-    synchronize_waitlist_segments()
+
+def _get_recipients():
+    # the user tokens (see _register_tokens) read computed member properties, loaded for all recipients at once
+    return Member.objects.prefetch_related("computed_fields")
 
 
 def _register_segments():
-    base = Member.objects.all()
-    register_base_segment(base)
+    register_base_segment(_get_recipients())
 
     register_segment(
         Segments.COOP_MEMBERS,
-        lambda: Member.objects.with_shares(),
+        lambda: _get_recipients().filter(
+            id__in=get_segment_member_ids(MemberSegmentMembership.SEGMENT_COOP_MEMBERS)
+        ),
     )
 
     register_segment(
         Segments.NON_COOP_MEMBERS,
-        lambda: Member.objects.without_shares(),
+        lambda: _get_recipients().exclude(
+            id__in=get_segment_member_ids(MemberSegmentMembership.SEGMENT_COOP_MEMBERS)
+        ),
     )
 
     register_segment(
         Segments.WITH_ACTIVE_SUBSCRIPTION,
-        lambda: Member.objects.with_active_subscription(),
+        lambda: _get_recipients().filter(
+            id__in=get_segment_member_ids(
+                MemberSegmentMembership.SEGMENT_ACTIVE_SUBSCRIPTION
+            )
+        ),
     )
 
     register_segment(
         Segments.WITHOUT_ACTIVE_SUBSCRIPTION,
-        lambda: Member.objects.without_active_subscription(),
+        lambda: _get_recipients().exclude(
+            id__in=get_segment_member_ids(
+                MemberSegmentMembership.SEGMENT_ACTIVE_SUBSCRIPTION
+            )
+        ),
     )
 
 
@@ -158,11 +189,93 @@ def _register_filters():
         create_contract_status_filter("no reaction"),
     )
 
-    for pl in PickupLocation.objects.all():
-        register_filter(
-            f"Abholort: {pl.name}",
-            lambda qs, pl=pl: qs.filter(memberpickuplocation__pickup_location=pl),
-        )
+
+class PickupLocationFilters:
+    """
+    Registers one filter per pickup location. This needs the DB, so it is not done on startup but before the first
+    request or celery task of the process that may use the filters.
+
+    Changes of the pickup locations are announced to all processes via a version counter in the shared Django cache,
+    which is checked at most every VERSION_CHECK_INTERVAL seconds.
+    """
+
+    VERSION_CACHE_KEY = "tapir.wirgarten.pickup_location_filters_version"
+    VERSION_CHECK_INTERVAL = 5
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._registered = False
+        self._version = None
+        self._next_version_check = 0.0
+
+    def ensure_registered(self):
+        now = time.monotonic()
+        if self._registered and now < self._next_version_check:
+            return
+
+        with self._lock:
+            version = self._get_remote_version()
+            if not self._registered or version is None or version != self._version:
+                self.register()
+                self._registered = True
+                self._version = version
+            self._next_version_check = now + self.VERSION_CHECK_INTERVAL
+
+    @staticmethod
+    def register():
+        for pickup_location_id, name in PickupLocation.objects.values_list(
+            "id", "name"
+        ):
+            register_filter(
+                f"Abholort: {name}",
+                lambda qs, pickup_location_id=pickup_location_id: qs.filter(
+                    memberpickuplocation__pickup_location_id=pickup_location_id
+                ),
+            )
+
+    def invalidate(self):
+        """Registers the filters again in all processes once the current transaction is committed."""
+        transaction.on_commit(self._increment_version)
+
+    def _increment_version(self):
+        self._registered = False
+        try:
+            cache.incr(self.VERSION_CACHE_KEY)
+        except ValueError:  # key does not exist (yet), e.g. after the cache was flushed
+            cache.add(self.VERSION_CACHE_KEY, time.time_ns())
+        except Exception as e:
+            print("Could not increment the pickup location filters version: ", e)
+
+    def _get_remote_version(self):
+        try:
+            version = cache.get(self.VERSION_CACHE_KEY)
+            if version is None:
+                cache.add(self.VERSION_CACHE_KEY, time.time_ns())
+                version = cache.get(self.VERSION_CACHE_KEY)
+            return version
+        except Exception as e:
+            print("Could not read the pickup location filters version: ", e)
+            return None
+
+
+pickup_location_filters = PickupLocationFilters()
+
+
+@receiver(request_started)
+@receiver(task_prerun)
+def register_pickup_location_filters(**kwargs):
+    try:
+        pickup_location_filters.ensure_registered()
+    except Exception as e:
+        print("Could not register the pickup location filters: ", e)
+
+
+@receiver(post_save, sender=PickupLocation)
+@receiver(post_delete, sender=PickupLocation)
+def on_pickup_location_changed(raw=False, **kwargs):
+    if raw:
+        return
+    pickup_location_filters.invalidate()
 
 
 def _register_tokens():
@@ -294,21 +407,68 @@ def synchronize_waitlist_segment_for_entry(entry):
         recipient.save()
 
 
-def synchronize_waitlist_segments():
-    for entry in WaitingListEntry.objects.all():
-        synchronize_waitlist_segment_for_entry(entry)
+def synchronize_waitlist_segments() -> dict:
+    """
+    Makes the static waitlist segments match the waiting list entries: one recipient per entry and type.
+    The signal receivers below keep them in sync, this is the full pass that repairs whatever they missed.
+
+    :return: the number of created, updated and deleted recipients
+    """
+    entries_by_type = defaultdict(dict)
+    for entry in WaitingListEntry.objects.order_by("created_at"):
+        entries_by_type[entry.type][entry.email] = entry
 
-    # Handle deletion of recipients no longer in WaitingList
+    statistics = {"created": 0, "updated": 0, "deleted": 0}
     for waitlist_type in WaitingListEntry.WaitingListType:
-        segment_name = get_waitlist_segment_name(waitlist_type)
-        for recipient in StaticSegmentRecipient.objects.filter(
-            segment__name=segment_name
-        ):
-            if not WaitingListEntry.objects.filter(email=recipient.email).exists():
-                print(
-                    f"Deleting recipient {recipient.email} from segment {segment_name}"
-                )
-                recipient.delete()
+        static_segment, _ = StaticSegment.objects.get_or_create(
+            name=get_waitlist_segment_name(waitlist_type)
+        )
+        entries = entries_by_type[waitlist_type]
+        recipients = {
+            recipient.email: recipient
+            for recipient in StaticSegmentRecipient.objects.filter(
+                segment=static_segment
+            )
+        }
+
+        deleted_ids = [
+            recipient.id
+            for email, recipient in recipients.items()
+            if email not in entries
+        ]
+        if deleted_ids:
+            StaticSegmentRecipient.objects.filter(id__in=deleted_ids).delete()
+        statistics["deleted"] += len(deleted_ids)
+
+        changed_recipients = []
+        for email, entry in entries.items():
+            recipient = recipients.get(email)
+            if recipient is not None and (
+                recipient.first_name != entry.first_name
+                or recipient.last_name != entry.last_name
+            ):
+                recipient.first_name = entry.first_name
+                recipient.last_name = entry.last_name
+                changed_recipients.append(recipient)
+        StaticSegmentRecipient.objects.bulk_update(
+            changed_recipients, ["first_name", "last_name"], batch_size=1000
+        )
+        statistics["updated"] += len(changed_recipients)
+
+        new_recipients = [
+            StaticSegmentRecipient(
+                segment=static_segment,
+                email=email,
+                first_name=entry.first_name,
+                last_name=entry.last_name,
+            )
+            for email, entry in entries.items()
+            if email not in recipients
+        ]
+        StaticSegmentRecipient.objects.bulk_create(new_recipients, batch_size=1000)
+        statistics["created"] += len(new_recipients)
+
+    return statistics
 
 
 @receiver(post_save, sender=WaitingListEntry)
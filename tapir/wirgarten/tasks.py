@@ -1,16 +1,20 @@
 import itertools
+import time
 from collections import defaultdict
 
 from celery import shared_task
 from dateutil.relativedelta import relativedelta
 from django.db import transaction
+from django.db.models import DecimalField, F, Sum
 from tapir_mail.triggers.transactional_trigger import TransactionalTrigger
 
+from tapir.accounts.models import TapirUser
 from tapir.configuration.parameter import get_parameter_value
 from tapir.wirgarten.constants import EVEN_WEEKS, ODD_WEEKS, WEEKLY
 from tapir.wirgarten.models import (
     ExportedFile,
     Member,
+    MemberPickupLocation,
     Payment,
     PaymentTransaction,
     Product,
@@ -21,34 +25,89 @@ from tapir.wirgarten.parameters import Parameter
 from tapir.wirgarten.service.delivery import get_next_delivery_date
 from tapir.wirgarten.service.email import send_email
 from tapir.wirgarten.service.file_export import begin_csv_string, export_file
-from tapir.wirgarten.service.payment import generate_new_payments, get_existing_payments
+from tapir.wirgarten.service.member_computed_fields import load_member_computed_fields
+from tapir.wirgarten.service.payment import generate_new_payments
 from tapir.wirgarten.service.products import (
     get_active_product_types,
     get_active_subscriptions,
     get_future_subscriptions,
-    get_product_price,
+    ProductPriceTable,
+    product_price_at,
+)
+from tapir.wirgarten.service.tasks import (
+    claim_due_scheduled_tasks,
+    get_scheduled_task_concurrency,
+    get_scheduled_task_run_timeout,
+    get_scheduled_task_time_limit,
+    prune_finished_scheduled_tasks,
+    release_timed_out_scheduled_tasks,
+    start_claimed_scheduled_task,
 )
 from tapir.wirgarten.tapirmail import Events
 from tapir.wirgarten.utils import (
     format_date,
     format_subscription_list_html,
-    get_now,
     get_today,
 )
 
+# number of payments inserted per query by the monthly payment run
+PAYMENT_BATCH_SIZE = 1000
+
 
 @shared_task
 def execute_scheduled_tasks():
     """
-    Executes all scheduled tasks that are due.
+    Executes the scheduled tasks that are due, each in its own celery task.
     """
+    released = release_timed_out_scheduled_tasks()
+    if released:
+        print(f"[task] execute_scheduled_tasks: released {released} timed out tasks")
+    dispatch_due_scheduled_tasks()
+
 
-    scheduled_tasks = ScheduledTask.objects.filter(
-        eta__lte=get_now(), status=ScheduledTask.STATUS_PENDING
+def dispatch_due_scheduled_tasks():
+    """
+    Claims as many due tasks as there are free slots (see SCHEDULED_TASK_CONCURRENCY) and sends each to a worker.
+    Called by the beat schedule and after every finished task, so that bursts of due tasks are worked off continuously.
+    """
+    free_slots = (
+        get_scheduled_task_concurrency()
+        - ScheduledTask.objects.filter(status=ScheduledTask.STATUS_IN_PROGRESS).count()
     )
-    for scheduled_task in scheduled_tasks:
-        print("Executing scheduled task: ", scheduled_task)
-        scheduled_task.execute()
+    if free_slots <= 0:
+        return
+
+    for scheduled_task_id, attempt in claim_due_scheduled_tasks(free_slots):
+        execute_scheduled_task.apply_async(
+            args=[scheduled_task_id, attempt],
+            soft_time_limit=get_scheduled_task_run_timeout(),
+            time_limit=get_scheduled_task_time_limit(),
+        )
+
+
+@shared_task
+def execute_scheduled_task(scheduled_task_id: str, attempt: int = None):
+    """
+    :param attempt: the attempt number of the claim, see claim_due_scheduled_tasks. None for messages sent before the
+        attempt number was passed.
+    """
+    scheduled_task = start_claimed_scheduled_task(scheduled_task_id, attempt)
+    if scheduled_task is None:
+        # deleted, released or already started in the meantime
+        return
+
+    print("Executing scheduled task: ", scheduled_task)
+    scheduled_task.execute()
+    dispatch_due_scheduled_tasks()
+
+
+@shared_task
+def prune_scheduled_tasks():
+    """
+    Deletes the old done and failed scheduled tasks, see SCHEDULED_TASK_RETENTION_DAYS.
+    """
+    deleted = prune_finished_scheduled_tasks()
+    print(f"[task] prune_scheduled_tasks: deleted {deleted} finished tasks")
 
 
 def _export_pick_list(product_type, include_equivalents=True):
@@ -82,18 +141,35 @@ def _export_pick_list(product_type, include_equivalents=True):
     KEY_PICKUP_LOCATION = "Abholort"
     KEY_M_EQUIVALENT = "M-Äquivalent"
 
-    subscriptions = get_active_subscriptions(next_delivery_date).filter(
-        product__type_id=product_type.id
+    # quantity and price (without solidarity) per pickup location and variant, in a single grouped query
+    rows = (
+        get_active_subscriptions(next_delivery_date)
+        .filter(product__type_id=product_type.id)
+        .order_by()
+        .annotate(
+            pickup_location_name=MemberPickupLocation.pickup_location_at(
+                next_delivery_date, value_field="pickup_location__name"
+            )
+        )
+        .values("pickup_location_name", "product__name")
+        .annotate(
+            quantity_sum=Sum("quantity"),
+            price_sum=Sum(
+                F("quantity") * product_price_at(get_today()),
+                output_field=DecimalField(),
+            ),
+        )
     )
-    grouped_subscriptions = defaultdict(list)
-
-    for subscription in subscriptions:
-        grouped_subscriptions[
-            subscription.member.get_pickup_location(next_delivery_date).name
-        ].append(subscription)
+    grouped_quantities = defaultdict(dict)
+    sums_without_soli = defaultdict(int)
+    for row in rows:
+        pickup_location = row["pickup_location_name"] or ""
+        grouped_quantities[pickup_location][row["product__name"]] = row["quantity_sum"]
+        sums_without_soli[pickup_location] += row["price_sum"] or 0
 
     variants = list(Product.objects.filter(type_id=product_type.id))
-    variants.sort(key=lambda x: get_product_price(x).price)
+    price_table = ProductPriceTable(variants)
+    variants.sort(key=lambda x: price_table.get_price(x).price)
     variant_names = [x.name for x in variants]
 
     header = [
@@ -104,27 +180,19 @@ def _export_pick_list(product_type, include_equivalents=True):
         header.append(KEY_M_EQUIVALENT)
     output, writer = begin_csv_string(header)
 
-    base_price = get_product_price(
-        Product.objects.filter(type_id=product_type.id, base=True).first()
+    base_price = price_table.get_price(
+        next(variant for variant in variants if variant.base)
     ).price
 
-    for pickup_location, subs in sorted(
-        grouped_subscriptions.items(), key=lambda x: x[0]
-    ):
-        subs.sort(key=lambda x: x.product.name)
-        grouped_subs = {
-            key: sum([x.quantity for x in group])
-            for key, group in itertools.groupby(subs, key=lambda sub: sub.product.name)
-        }
-
-        sum_without_soli = sum(map(lambda x: x.total_price_without_soli, subs))
-
+    for pickup_location in sorted(grouped_quantities.keys()):
         data = {
             KEY_PICKUP_LOCATION: pickup_location,
-            **grouped_subs,
+            **grouped_quantities[pickup_location],
         }
         if include_equivalents:
-            data[KEY_M_EQUIVALENT] = round(sum_without_soli / base_price, 2)
+            data[KEY_M_EQUIVALENT] = round(
+                sums_without_soli[pickup_location] / base_price, 2
+            )
         writer.writerow(data)
 
     export_file(
@@ -211,9 +279,18 @@ def send_email_member_contract_end_reminder(member_id: str):
 @shared_task
 @transaction.atomic
 def export_payment_parts_csv(reference_date=None):
+    """
+    Monthly payment run: persists the payments due this month, exports one CSV file per product type
+    (and one for coop shares) and links the payments to the transaction of their file.
+
+    :return: the run statistics, which are also stored as the celery task result
+    """
     if reference_date is None:
         reference_date = get_today()
 
+    start_time = time.monotonic()
+    linked_payments = 0
+
     def export_product_or_coop_payment_csv(
         product_type: bool | ProductType, payments: list[Payment]
     ):
@@ -261,9 +338,9 @@ def export_payment_parts_csv(reference_date=None):
             send_email=True,
         )
         transaction = PaymentTransaction.objects.create(file=file, type=payment_type)
-        for p in payments:
-            p.transaction = transaction
-            p.save()
+        return Payment.objects.filter(id__in=[p.id for p in payments]).update(
+            transaction=transaction
+        )
 
     due_date = reference_date.replace(
         day=get_parameter_value(Parameter.PAYMENT_DUE_DAY)
@@ -274,35 +351,49 @@ def export_payment_parts_csv(reference_date=None):
     )
 
     payments = generate_new_payments(due_date)
-    for p in payments:
-        if p.id is None:
-            p.save()
+    new_payments = [p for p in payments if p._state.adding]
+    Payment.objects.bulk_create(new_payments, batch_size=PAYMENT_BATCH_SIZE)
 
-    payments.sort(key=lambda x: x.type if x.type else "")
+    payments = list(
+        Payment.objects.filter(id__in=[p.id for p in payments])
+        .select_related("mandate_ref__member")
+        .order_by("type", "mandate_ref_id")
+    )
     payments_grouped = {
         key: list(group)
         for key, group in itertools.groupby(payments, key=lambda x: x.type)
     }
 
     # export for product types
-    for pt in get_active_product_types():
-        export_product_or_coop_payment_csv(
+    product_types = list(get_active_product_types())
+    for pt in product_types:
+        linked_payments += export_product_or_coop_payment_csv(
             pt, payments_grouped[pt.name] if pt.name in payments_grouped else []
         )
 
     # export for coop shares
     coop_share_payments = Payment.objects.filter(
         transaction__isnull=True, due_date__lte=due_date, type="Genossenschaftsanteile"
-    )
-    export_product_or_coop_payment_csv(
+    ).select_related("mandate_ref__member")
+    linked_payments += export_product_or_coop_payment_csv(
         False,
-        coop_share_payments,
+        list(coop_share_payments),
     )
 
+    statistics = {
+        "due_date": due_date.isoformat(),
+        "created_payments": len(new_payments),
+        "linked_payments": linked_payments,
+        "exported_files": len(product_types) + 1,
+        "duration_seconds": round(time.monotonic() - start_time, 3),
+    }
+    print(f"[task] export_payment_parts_csv: finished payment run {statistics}")
+    return statistics
+
 
 @shared_task
 def generate_member_numbers():
-    members = Member.objects.filter(member_no__isnull=True)
+    members = load_member_computed_fields(Member.objects.filter(member_no__isnull=True))
     today = get_today()
     for member in members:
         with transaction.atomic():
@@ -315,3 +406,66 @@ def generate_member_numbers():
                 print(
                     f"[task] generate_member_numbers: generated member_no for {member}"
                 )
+
+
+@shared_task
+def precompute_dashboard_kpis():
+    """
+    Computes the admin dashboard figures and stores them in the cache, so that the dashboard doesn't have to.
+    """
+    from tapir.wirgarten.service.dashboard import refresh_dashboard_kpis
+
+    refresh_dashboard_kpis()
+
+
+@shared_task
+def update_segment_memberships():
+    """
+    Updates the materialized mail segment memberships of all members, for the changes that come with the date
+    (e.g. coop shares becoming valid, subscriptions ending). See tapir.wirgarten.service.segment_membership.
+    """
+    from tapir.wirgarten.service import segment_membership
+
+    statistics = segment_membership.update_segment_memberships()
+    print(f"[task] update_segment_memberships: {statistics}")
+
+
+@shared_task
+def update_onboarding_triggers(member_ids: list[str]):
+    """
+    Schedules the onboarding emails of the members again, see OnboardingTrigger.
+    """
+    from tapir.wirgarten.triggers.onboarding_trigger import OnboardingTrigger
+
+    OnboardingTrigger.on_subscriptions_updated(member_ids)
+
+
+@shared_task
+def synchronize_waitlist_segments():
+    """
+    Makes the static mail segments of the waiting lists match the waiting list entries.
+    """
+    from tapir.wirgarten import tapirmail
+
+    statistics = tapirmail.synchronize_waitlist_segments()
+    print(f"[task] synchronize_waitlist_segments: {statistics}")
+
+
+@shared_task
+def sync_email_verified_from_keycloak():
+    """
+    Copies the email verification status of all keycloak users to the local users, see TapirUser.keycloak_email_verified.
+    """
+    statistics = TapirUser.sync_email_verified_from_keycloak()
+    print(f"[task] sync_email_verified_from_keycloak: {statistics}")
+    return statistics
+
+
+@shared_task
+def retry_pending_keycloak_updates():
+    """
+    Sends the user data again to keycloak for the users whose last update failed, see TapirUser.keycloak_sync_pending.
+    """
+    statistics = TapirUser.retry_pending_keycloak_updates()
+    print(f"[task] retry_pending_keycloak_updates: {statistics}")
+    return statistics
@@ -0,0 +1,87 @@
+import unittest
+from unittest.mock import patch
+
+from nanoid import generate
+
+from tapir.accounts.models import KeycloakUser
+
+
+class FakeKeycloakAdmin:
+    """
+    In-memory stand-in for the keycloak admin API client (keycloak.KeycloakAdmin).
+
+    Only the methods used by tapir are implemented, with the same arguments and return values as the real client.
+    Every call is recorded in `requests`, so that tests can check how many HTTP requests would have been sent.
+    """
+
+    def __init__(self):
+        self.users = {}
+        self.requests = []
+
+    def add_user(self, email: str, email_verified: bool = False) -> str:
+        keycloak_id = generate(size=36)
+        self.users[keycloak_id] = {
+            "id": keycloak_id,
+            "username": email,
+            "email": email,
+            "emailVerified": email_verified,
+            "enabled": True,
+        }
+        return keycloak_id
+
+    def get_users(self, query: dict = None) -> list[dict]:
+        self.requests.append(("get_users", query))
+        query = query or {}
+        users = sorted(self.users.values(), key=lambda user: user["username"])
+        first = query.get("first", 0)
+        if "max" in query:
+            return [dict(user) for user in users[first : first + query["max"]]]
+        return [dict(user) for user in users[first:]]
+
+    def get_user(self, user_id: str) -> dict:
+        self.requests.append(("get_user", user_id))
+        return dict(self.users[user_id])
+
+    def get_user_id(self, username: str) -> str | None:
+        self.requests.append(("get_user_id", username))
+        for user in self.users.values():
+            if user["username"] == username:
+                return user["id"]
+        return None
+
+    def create_user(self, payload: dict) -> str:
+        self.requests.append(("create_user", payload))
+        keycloak_id = self.add_user(
+            payload["email"], payload.get("emailVerified", False)
+        )
+        return keycloak_id
+
+    def update_user(self, user_id: str, payload: dict):
+        self.requests.append(("update_user", user_id, payload))
+        self.users[user_id].update(payload)
+
+    def delete_user(self, user_id: str):
+        self.requests.append(("delete_user", user_id))
+        del self.users[user_id]
+
+    def send_verify_email(self, user_id: str, **kwargs):
+        self.requests.append(("send_verify_email", user_id))
+
+    def get_group_by_path(self, path: str):
+        self.requests.append(("get_group_by_path", path))
+        return None
+
+
+def mock_keycloak(test: unittest.TestCase) -> FakeKeycloakAdmin:
+    """
+    Makes all users of the test use a FakeKeycloakAdmin instead of the real keycloak admin client.
+
+    :return: the fake client
+    """
+    fake_keycloak = FakeKeycloakAdmin()
+    patcher = patch.object(
+        KeycloakUser, "get_keycloak_client", return_value=fake_keycloak
+    )
+    patcher.start()
+    test.addCleanup(patcher.stop)
+    return fake_keycloak
@@ -3,6 +3,7 @@ import datetime
 from django.urls import reverse
 
 from tapir.configuration.models import TapirParameter
+from tapir.wirgarten.constants import WEEKLY
 from tapir.wirgarten.models import (
     ProductType,
     GrowingPeriod,
@@ -11,6 +12,7 @@ from tapir.wirgarten.models import (
     PickupLocation,
 )
 from tapir.wirgarten.parameters import ParameterDefinitions, Parameter
+from tapir.wirgarten.service.delivery import generate_future_deliveries
 from tapir.wirgarten.tests.factories import (
     ProductFactory,
     ProductPriceFactory,
@@ -108,3 +110,27 @@ class TestAdditionalProductForm(TapirIntegrationTest):
             product=additional_product.id
         ).first()
         self.assertIsNone(new_subscription)
+
+    def test_additionalProductForm_deliveriesCachedBeforeOrder_deliveriesContainNewSubscription(
+        self,
+    ):
+        member = self.create_member_and_login()
+        [base_product, additional_product] = self.create_additional_product()
+        ProductType.objects.filter(id=additional_product.type_id).update(
+            delivery_cycle=WEEKLY[0]
+        )
+        SubscriptionFactory.create(
+            member=member, period=GrowingPeriod.objects.get(), product=base_product
+        )
+        self.assertEqual([], generate_future_deliveries(member))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.try_to_order_additional_product(member, additional_product)
+
+        self.assertStatusCode(response, 200)
+        deliveries = generate_future_deliveries(member)
+        self.assertNotEqual([], deliveries)
+        self.assertIn(
+            additional_product.id,
+            [sub.product_id for sub in deliveries[0]["subs"]],
+        )
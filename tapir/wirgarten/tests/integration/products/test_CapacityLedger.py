@@ -0,0 +1,202 @@
+import datetime
+from unittest.mock import patch
+
+from django.urls import reverse
+
+from tapir.wirgarten.models import Subscription
+from tapir.wirgarten.parameters import ParameterDefinitions
+from tapir.wirgarten.service.capacity_ledger import (
+    PickupLocationCapacityLedger,
+    ProductCapacityLedger,
+    get_ledger_connection,
+)
+from tapir.wirgarten.tests.factories import (
+    GrowingPeriodFactory,
+    MemberPickupLocationFactory,
+    PickupLocationCapabilityFactory,
+    ProductCapacityFactory,
+    ProductFactory,
+    ProductPriceFactory,
+    SubscriptionFactory,
+)
+from tapir.wirgarten.tests.test_utils import (
+    TapirIntegrationTest,
+    mock_timezone,
+    set_bypass_keycloak,
+)
+
+
+class TestCapacityLedger(TapirIntegrationTest):
+    def setUp(self):
+        super().setUp()
+        set_bypass_keycloak()
+        self.growing_period = GrowingPeriodFactory.create(
+            start_date=datetime.date(year=2022, month=1, day=1),
+            end_date=datetime.date(year=2022, month=12, day=31),
+        )
+        self.product = ProductFactory.create()
+        ProductPriceFactory.create(
+            product=self.product, size=1, valid_from=self.growing_period.start_date
+        )
+        ProductCapacityFactory.create(
+            period=self.growing_period, product_type=self.product.type, capacity=10
+        )
+        self.reference_date = datetime.date(year=2022, month=6, day=1)
+
+    def create_ledger(self):
+        return ProductCapacityLedger(self.product.type_id, self.reference_date)
+
+    def test_getUsedCapacity_default_returnsCapacityUsedBySubscriptions(self):
+        SubscriptionFactory.create(
+            period=self.growing_period, product=self.product, quantity=4
+        )
+
+        self.assertEqual(4, self.create_ledger().get_used_capacity())
+
+    def test_reserve_amountFitsIntoFreeCapacity_returnsTrue(self):
+        ledger = self.create_ledger()
+
+        self.assertTrue(ledger.reserve(10, "order-1"))
+        self.assertEqual(0, ledger.get_free_capacity())
+
+    def test_reserve_capacityReservedByOtherOrder_returnsFalse(self):
+        ledger = self.create_ledger()
+        ledger.reserve(7, "order-1")
+
+        self.assertFalse(ledger.reserve(4, "order-2"))
+        self.assertEqual(3, ledger.get_free_capacity("order-2"))
+
+    def test_reserve_sameReservationId_replacesPreviousReservation(self):
+        ledger = self.create_ledger()
+        ledger.reserve(7, "order-1")
+
+        self.assertTrue(ledger.reserve(9, "order-1"))
+        self.assertEqual(9, ledger.get_reserved_capacity())
+
+    def test_release_default_freesReservedCapacity(self):
+        ledger = self.create_ledger()
+        ledger.reserve(7, "order-1")
+
+        ledger.release("order-1")
+
+        self.assertTrue(ledger.reserve(4, "order-2"))
+
+    def test_subscriptionSaved_ledgerAlreadyBuilt_updatesUsedCapacity(self):
+        ledger = self.create_ledger()
+        ledger.get_used_capacity()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            subscription = SubscriptionFactory.create(
+                period=self.growing_period, product=self.product, quantity=3
+            )
+        self.assertEqual(3, ledger.get_used_capacity())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            subscription.quantity = 5
+            subscription.save()
+        self.assertEqual(5, ledger.get_used_capacity())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            subscription.delete()
+        self.assertEqual(0, ledger.get_used_capacity())
+
+    def test_rebuild_subscriptionSavedDuringRebuild_concurrentChangeIsKept(self):
+        ledger = self.create_ledger()
+        ledger.get_used_capacity()
+        compute_used_capacity = ledger.compute_used_capacity
+        concurrent_changes = []
+
+        def compute_used_capacity_with_concurrent_change():
+            used_capacity = compute_used_capacity()
+            if not concurrent_changes:
+                with self.captureOnCommitCallbacks(execute=True):
+                    concurrent_changes.append(
+                        SubscriptionFactory.create(
+                            period=self.growing_period, product=self.product, quantity=2
+                        )
+                    )
+            return used_capacity
+
+        with patch.object(
+            ledger,
+            "compute_used_capacity",
+            side_effect=compute_used_capacity_with_concurrent_change,
+        ):
+            ledger.rebuild()
+
+        self.assertEqual(2, ledger.get_used_capacity())
+
+    def test_reserve_usedCapacityExpired_rebuildsBeforeChecking(self):
+        ledger = self.create_ledger()
+        ledger.get_used_capacity()
+        # not applied to the ledger because the on_commit callbacks don't run
+        SubscriptionFactory.create(
+            period=self.growing_period, product=self.product, quantity=4
+        )
+        get_ledger_connection().delete(ledger.used_key)
+
+        self.assertFalse(ledger.reserve(7, "order-1"))
+        self.assertEqual(4, ledger.get_used_capacity())
+
+    def test_reserve_noReservationId_onlyChecks(self):
+        ledger = self.create_ledger()
+
+        self.assertTrue(ledger.reserve(5, None))
+        self.assertEqual(0, ledger.get_reserved_capacity())
+
+    def test_memberPickupLocationSaved_onlyLedgersOfThatLocationInvalidated(self):
+        capability = PickupLocationCapabilityFactory.create(
+            product_type=self.product.type, max_capacity=10
+        )
+        other_capability = PickupLocationCapabilityFactory.create(
+            product_type=self.product.type, max_capacity=10
+        )
+        ledger = PickupLocationCapacityLedger(capability, self.reference_date)
+        other_ledger = PickupLocationCapacityLedger(
+            other_capability, self.reference_date
+        )
+        ledger.reserve(3, "order-1")
+        other_ledger.reserve(3, "order-1")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            MemberPickupLocationFactory.create(
+                pickup_location=capability.pickup_location,
+                valid_from=self.reference_date - datetime.timedelta(days=10),
+            )
+
+        connection = get_ledger_connection()
+        self.assertFalse(connection.exists(ledger.used_key))
+        self.assertTrue(connection.exists(other_ledger.used_key))
+        self.assertEqual(3, ledger.get_reserved_capacity())
+
+    @patch("tapir.wirgarten.views.member.details.actions.send_order_confirmation")
+    def test_renewContractSameConditions_ledgerOfNextPeriodAlreadyBuilt_countsRenewedSubscriptions(
+        self, *_
+    ):
+        ParameterDefinitions().import_definitions()
+        mock_timezone(self, datetime.datetime(year=2022, month=6, day=1))
+        next_period = GrowingPeriodFactory.create(
+            start_date=datetime.date(year=2023, month=1, day=1),
+            end_date=datetime.date(year=2023, month=12, day=31),
+        )
+        ProductCapacityFactory.create(
+            period=next_period, product_type=self.product.type, capacity=10
+        )
+        subscription = SubscriptionFactory.create(
+            period=self.growing_period, product=self.product, quantity=3
+        )
+        ledger = ProductCapacityLedger(self.product.type_id, next_period.start_date)
+        self.assertEqual(0, ledger.get_used_capacity())
+
+        self.client.force_login(subscription.member)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.get(
+                reverse(
+                    "wirgarten:member_renew_same_conditions",
+                    args=[subscription.member.id],
+                )
+            )
+
+        self.assertStatusCode(response, 302)
+        self.assertEqual(2, Subscription.objects.count())
+        self.assertEqual(3, ledger.get_used_capacity())
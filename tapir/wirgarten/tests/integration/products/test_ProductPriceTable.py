@@ -0,0 +1,88 @@
+import datetime
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from tapir.wirgarten.service.products import (
+    ProductPriceTable,
+    get_product_price,
+    use_product_price_table,
+)
+from tapir.wirgarten.tests.factories import ProductFactory, ProductPriceFactory
+from tapir.wirgarten.tests.test_utils import TapirIntegrationTest, set_bypass_keycloak
+
+
+class TestProductPriceTable(TapirIntegrationTest):
+    def setUp(self):
+        set_bypass_keycloak()
+
+    @staticmethod
+    def create_product_with_price_history():
+        product = ProductFactory.create()
+        old_price = ProductPriceFactory.create(
+            product=product, valid_from=datetime.date(year=2023, month=1, day=1)
+        )
+        new_price = ProductPriceFactory.create(
+            product=product, valid_from=datetime.date(year=2023, month=7, day=1)
+        )
+        return product, old_price, new_price
+
+    def test_getPrice_severalPrices_returnsPriceValidAtReferenceDate(self):
+        product, old_price, new_price = self.create_product_with_price_history()
+        price_table = ProductPriceTable([product])
+
+        self.assertEqual(
+            old_price, price_table.get_price(product, datetime.date(2023, 6, 30))
+        )
+        self.assertEqual(
+            new_price, price_table.get_price(product, datetime.date(2023, 7, 1))
+        )
+        self.assertIsNone(price_table.get_price(product, datetime.date(2022, 12, 31)))
+
+    def test_getPrice_onlyOnePrice_ignoresValidFrom(self):
+        product_price = ProductPriceFactory.create(
+            valid_from=datetime.date(year=2023, month=12, day=31)
+        )
+        price_table = ProductPriceTable([product_price.product])
+
+        self.assertEqual(
+            product_price,
+            price_table.get_price(product_price.product, datetime.date(2023, 1, 1)),
+        )
+
+    def test_getPrice_manyProducts_loadsAllPricesWithOneQuery(self):
+        products = [self.create_product_with_price_history()[0] for _ in range(5)]
+
+        with CaptureQueriesContext(connection) as context:
+            price_table = ProductPriceTable([product.id for product in products])
+            for product in products:
+                price_table.get_price(product.id, datetime.date(2023, 8, 1))
+
+        self.assertEqual(1, len(context.captured_queries))
+
+    def test_getProductPrice_insidePriceTableScope_returnsSameResultAsQuery(self):
+        product, old_price, new_price = self.create_product_with_price_history()
+        reference_dates = [
+            datetime.date(2022, 12, 31),
+            datetime.date(2023, 1, 1),
+            datetime.date(2023, 8, 1),
+        ]
+        expected = [get_product_price(product, d) for d in reference_dates]
+
+        with use_product_price_table():
+            actual = [get_product_price(product, d) for d in reference_dates]
+
+        self.assertEqual(expected, actual)
+
+    def test_getProductPrice_priceCreatedInsideScope_returnsNewPrice(self):
+        product, old_price, new_price = self.create_product_with_price_history()
+
+        with use_product_price_table():
+            get_product_price(product, datetime.date(2024, 1, 1))
+            newest_price = ProductPriceFactory.create(
+                product=product, valid_from=datetime.date(year=2024, month=1, day=1)
+            )
+
+            self.assertEqual(
+                newest_price, get_product_price(product, datetime.date(2024, 1, 1))
+            )
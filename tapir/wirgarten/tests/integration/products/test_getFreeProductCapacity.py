@@ -1,6 +1,12 @@
 import datetime
 
-from tapir.wirgarten.service.products import get_free_product_capacity
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from tapir.wirgarten.service.products import (
+    get_free_product_capacities,
+    get_free_product_capacity,
+)
 from tapir.wirgarten.tests.factories import (
     GrowingPeriodFactory,
     ProductTypeFactory,
@@ -161,3 +167,61 @@ class TestGetFreeProductCapacity(TapirIntegrationTest):
                 reference_date=datetime.date(year=2022, month=4, day=15),
             ),
         )
+
+    def test_getFreeProductCapacity_onlyOneFuturePrice_priceIsUsedRegardlessOfDate(
+        self,
+    ):
+        growing_period = GrowingPeriodFactory.create(
+            start_date=datetime.date(year=2022, month=1, day=1),
+            end_date=datetime.date(year=2022, month=12, day=31),
+        )
+        product = ProductFactory.create()
+        ProductPriceFactory.create(
+            product=product,
+            size=2,
+            valid_from=datetime.date(year=2022, month=6, day=1),
+        )
+        ProductCapacityFactory.create(
+            period=growing_period, product_type=product.type, capacity=100
+        )
+        SubscriptionFactory.create(period=growing_period, quantity=3, product=product)
+
+        self.assertEqual(
+            94,
+            get_free_product_capacity(
+                product.type.id,
+                reference_date=datetime.date(year=2022, month=3, day=1),
+            ),
+        )
+
+    def test_getFreeProductCapacities_severalProductTypes_returnsCapacityPerType(
+        self,
+    ):
+        (
+            growing_period,
+            product_m,
+        ) = self.create_growing_period_and_product_price_and_product_capacity()
+        other_product = ProductFactory.create()
+        ProductPriceFactory.create(
+            product=other_product,
+            size=0.5,
+            valid_from=growing_period.start_date,
+        )
+        ProductCapacityFactory.create(
+            period=growing_period, product_type=other_product.type, capacity=10
+        )
+
+        SubscriptionFactory.create(period=growing_period, quantity=2, product=product_m)
+        SubscriptionFactory.create(
+            period=growing_period, quantity=4, product=other_product
+        )
+
+        with CaptureQueriesContext(connection) as context:
+            free_capacities = get_free_product_capacities(
+                reference_date=datetime.date(year=2022, month=4, day=1)
+            )
+
+        self.assertEqual(
+            {product_m.type.id: 98, other_product.type.id: 8}, free_capacities
+        )
+        self.assertLessEqual(len(context.captured_queries), 2)
@@ -9,6 +9,7 @@ from tapir.wirgarten.tapirmail import (
     Segments,
     _register_filters,
     _register_segments,
+    pickup_location_filters,
 )
 from tapir.wirgarten.tests.factories import (
     GrowingPeriodFactory,
@@ -43,6 +44,7 @@ class SegmentFilterTest(TapirIntegrationTest):
 
         _register_segments()
         _register_filters()
+        pickup_location_filters.register()
 
     def ids(self, collection):
         return set([m.id for m in collection])
@@ -5,6 +5,7 @@ from tapir_mail.service.segment import resolve_segments
 
 from tapir.wirgarten.models import Subscription
 from tapir.wirgarten.service.member import get_next_contract_start_date
+from tapir.wirgarten.service.segment_membership import update_segment_memberships
 from tapir.wirgarten.tapirmail import Segments, _register_segments
 from tapir.wirgarten.tests.factories import (
     MemberFactory,
@@ -105,6 +106,8 @@ class SegmentTest(TapirIntegrationTest):
         self.assertSetEqual(self.ids(segment_members), set(expected_member_ids))
 
         mock_timezone(self, self.NOW + datetime.timedelta(days=30))
+        # the nightly pass that updates the segments for the new date
+        update_segment_memberships()
 
         expected_member_ids = set()
         segment_members = resolve_segments(
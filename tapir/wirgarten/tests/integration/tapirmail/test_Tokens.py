@@ -1,11 +1,17 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from tapir_mail.service.segment import resolve_segments
 from tapir_mail.service.token import token_registry
 
 from tapir.configuration.models import TapirParameterDefinitionImporter
-from tapir.wirgarten.tapirmail import _register_tokens
+from tapir.wirgarten.tapirmail import Segments, _register_segments, _register_tokens
 from tapir.wirgarten.tests.factories import (
     MemberWithSubscriptionFactory,
 )
-from tapir.wirgarten.tests.test_utils import TapirIntegrationTest
+from tapir.wirgarten.tests.test_utils import (
+    TapirIntegrationTest,
+    set_bypass_keycloak,
+)
 
 
 class TokenTest(TapirIntegrationTest):
@@ -34,3 +40,24 @@ class TokenTest(TapirIntegrationTest):
                 result = v() if callable(v) else v
             except Exception as e:
                 self.fail(f"Failed to resolve general token '{k}': {e}")
+
+    def resolve_user_tokens_for_segment(self):
+        for member in resolve_segments(add_segments=[Segments.COOP_MEMBERS]):
+            for v in token_registry["Empfänger"].values():
+                result = getattr(member, v)
+                if callable(result):
+                    result()
+
+    def test_tokens_userTokensForMoreRecipients_sameNumberOfQueries(self):
+        set_bypass_keycloak()
+        _register_segments()
+        MemberWithSubscriptionFactory.create_batch(2)
+        with CaptureQueriesContext(connection) as context:
+            self.resolve_user_tokens_for_segment()
+        query_count = len(context.captured_queries)
+
+        MemberWithSubscriptionFactory.create_batch(4)
+        with CaptureQueriesContext(connection) as context:
+            self.resolve_user_tokens_for_segment()
+
+        self.assertEqual(query_count, len(context.captured_queries))
@@ -0,0 +1,62 @@
+import datetime
+
+from tapir_mail.models import StaticSegment, StaticSegmentRecipient
+
+from tapir.wirgarten.models import WaitingListEntry
+from tapir.wirgarten.tapirmail import (
+    get_waitlist_segment_name,
+    synchronize_waitlist_segments,
+)
+from tapir.wirgarten.tests.test_utils import TapirIntegrationTest
+
+
+class WaitlistSegmentsTest(TapirIntegrationTest):
+    def create_entry(self, email, waitlist_type, first_name="Erika"):
+        return WaitingListEntry.objects.create(
+            first_name=first_name,
+            last_name="Mustermann",
+            email=email,
+            type=waitlist_type,
+            privacy_consent=datetime.datetime(2023, 1, 1, tzinfo=datetime.timezone.utc),
+        )
+
+    def get_recipients(self, waitlist_type) -> dict:
+        return {
+            recipient.email: recipient.first_name
+            for recipient in StaticSegmentRecipient.objects.filter(
+                segment__name=get_waitlist_segment_name(waitlist_type)
+            )
+        }
+
+    def test_synchronizeWaitlistSegments_segmentsOutOfSync_repairsThem(self):
+        harvest_shares = WaitingListEntry.WaitingListType.HARVEST_SHARES
+        coop_shares = WaitingListEntry.WaitingListType.COOP_SHARES
+        self.create_entry("missing@example.com", harvest_shares)
+        self.create_entry("renamed@example.com", harvest_shares)
+        self.create_entry("coop@example.com", coop_shares)
+
+        StaticSegmentRecipient.objects.filter(email="missing@example.com").delete()
+        StaticSegmentRecipient.objects.filter(email="renamed@example.com").update(
+            first_name="Old name"
+        )
+        StaticSegmentRecipient.objects.create(
+            segment=StaticSegment.objects.get(
+                name=get_waitlist_segment_name(harvest_shares)
+            ),
+            email="stale@example.com",
+        )
+
+        statistics = synchronize_waitlist_segments()
+
+        self.assertEqual({"created": 1, "updated": 1, "deleted": 1}, statistics)
+        self.assertEqual(
+            {"missing@example.com": "Erika", "renamed@example.com": "Erika"},
+            self.get_recipients(harvest_shares),
+        )
+        self.assertEqual(
+            {"coop@example.com": "Erika"}, self.get_recipients(coop_shares)
+        )
+        self.assertEqual(
+            {"created": 0, "updated": 0, "deleted": 0},
+            synchronize_waitlist_segments(),
+        )
@@ -0,0 +1,98 @@
+import datetime
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from tapir.wirgarten.models import Payment
+from tapir.wirgarten.service.cashflow import CashflowProjection
+from tapir.wirgarten.tests.factories import (
+    GrowingPeriodFactory,
+    ProductFactory,
+    ProductPriceFactory,
+    SubscriptionFactory,
+)
+from tapir.wirgarten.tests.test_utils import TapirIntegrationTest, set_bypass_keycloak
+
+
+class TestCashflowProjection(TapirIntegrationTest):
+    def setUp(self):
+        set_bypass_keycloak()
+        self.growing_period = GrowingPeriodFactory.create(
+            start_date=datetime.date(year=2023, month=1, day=1),
+            end_date=datetime.date(year=2023, month=12, day=31),
+        )
+        self.product = ProductFactory.create()
+        ProductPriceFactory.create(
+            product=self.product, price=10, valid_from=datetime.date(2023, 1, 1)
+        )
+        ProductPriceFactory.create(
+            product=self.product, price=20, valid_from=datetime.date(2023, 7, 1)
+        )
+        self.due_dates = [datetime.date(2023, month, 15) for month in range(1, 13)] + [
+            datetime.date(2024, 1, 15)
+        ]
+
+    def create_subscription(self, **kwargs):
+        return SubscriptionFactory.create(
+            period=self.growing_period,
+            product=self.product,
+            quantity=2,
+            solidarity_price=0.1,
+            **kwargs,
+        )
+
+    def test_getTotals_priceChangesDuringThePeriod_usesThePriceValidAtEachDueDate(
+        self,
+    ):
+        self.create_subscription()
+
+        totals = CashflowProjection(self.due_dates).get_totals()
+
+        self.assertEqual([22.0] * 6 + [44.0] * 6 + [0], totals)
+
+    def test_getTotals_paymentPersisted_usesPersistedAmount(self):
+        subscription = self.create_subscription()
+        self.create_subscription(mandate_ref=subscription.mandate_ref)
+        Payment.objects.create(
+            due_date=datetime.date(2023, 3, 15),
+            mandate_ref=subscription.mandate_ref,
+            amount=30,
+            type=self.product.type.name,
+        )
+
+        totals = CashflowProjection(self.due_dates).get_totals()
+
+        self.assertEqual([44.0, 44.0, 30.0, 44.0], totals[:4])
+
+    def test_getAmountsByType_coopSharePayment_isListedAsSeparateType(self):
+        subscription = self.create_subscription()
+        Payment.objects.create(
+            due_date=datetime.date(2023, 1, 15),
+            mandate_ref=subscription.mandate_ref,
+            amount=100,
+            type="Genossenschaftsanteile",
+        )
+
+        projection = CashflowProjection(self.due_dates)
+
+        self.assertEqual(
+            [self.product.type.name, "Genossenschaftsanteile"], projection.types
+        )
+        self.assertEqual(
+            {self.product.type.name: 22.0, "Genossenschaftsanteile": 100.0},
+            projection.get_amounts_by_type()[0],
+        )
+
+    def test_init_moreSubscriptions_sameNumberOfQueries(self):
+        self.create_subscription()
+        with CaptureQueriesContext(connection) as context:
+            CashflowProjection(self.due_dates)
+        query_count = len(context.captured_queries)
+
+        for _ in range(5):
+            self.create_subscription()
+
+        with CaptureQueriesContext(connection) as context:
+            CashflowProjection(self.due_dates)
+
+        self.assertEqual(query_count, len(context.captured_queries))
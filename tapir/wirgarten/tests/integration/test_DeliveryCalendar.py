@@ -0,0 +1,132 @@
+import datetime
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from tapir.wirgarten.constants import EVEN_WEEKS, WEEKLY
+from tapir.wirgarten.models import (
+    DeliveryExceptionPeriod,
+    PickupLocationOpeningTime,
+    Product,
+)
+from tapir.wirgarten.parameters import ParameterDefinitions
+from tapir.wirgarten.service.delivery import generate_future_deliveries
+from tapir.wirgarten.tests.factories import (
+    GrowingPeriodFactory,
+    MemberFactory,
+    MemberPickupLocationFactory,
+    ProductFactory,
+    ProductTypeFactory,
+    SubscriptionFactory,
+)
+from tapir.wirgarten.tests.test_utils import (
+    TapirIntegrationTest,
+    mock_timezone,
+    set_bypass_keycloak,
+)
+
+
+class TestDeliveryCalendar(TapirIntegrationTest):
+    def setUp(self):
+        super().setUp()
+        ParameterDefinitions().import_definitions()
+        set_bypass_keycloak()
+        # Wednesday, same weekday as the default delivery day
+        mock_timezone(self, datetime.datetime(year=2023, month=3, day=1))
+
+        self.growing_period = GrowingPeriodFactory.create(
+            start_date=datetime.date(year=2023, month=1, day=1),
+            end_date=datetime.date(year=2023, month=3, day=31),
+        )
+        self.member = MemberFactory.create()
+        self.member_pickup_location = MemberPickupLocationFactory.create(
+            member=self.member, valid_from=datetime.date(2023, 1, 1)
+        )
+
+    def create_subscription(self, delivery_cycle):
+        return SubscriptionFactory.create(
+            member=self.member,
+            period=self.growing_period,
+            product=ProductFactory.create(
+                type=ProductTypeFactory.create(delivery_cycle=delivery_cycle)
+            ),
+        )
+
+    def get_delivery_dates(self):
+        return [
+            delivery["delivery_date"]
+            for delivery in generate_future_deliveries(self.member)
+        ]
+
+    def test_generateFutureDeliveries_evenWeeks_onlyEvenWeeksAreListed(self):
+        self.create_subscription(EVEN_WEEKS[0])
+
+        self.assertEqual(["2023-03-08", "2023-03-22"], self.get_delivery_dates())
+
+    def test_generateFutureDeliveries_exceptionPeriod_weekIsSkipped(self):
+        subscription = self.create_subscription(WEEKLY[0])
+        DeliveryExceptionPeriod.objects.create(
+            start_date=datetime.date(2023, 3, 10),
+            end_date=datetime.date(2023, 3, 16),
+            product_type=subscription.product.type,
+        )
+
+        self.assertEqual(
+            ["2023-03-01", "2023-03-08", "2023-03-22", "2023-03-29"],
+            self.get_delivery_dates(),
+        )
+
+    def test_generateFutureDeliveries_openingTime_deliveryIsOnTheOpeningDay(self):
+        self.create_subscription(WEEKLY[0])
+        PickupLocationOpeningTime.objects.create(
+            pickup_location=self.member_pickup_location.pickup_location,
+            day_of_week=4,
+            open_time=datetime.time(10),
+            close_time=datetime.time(12),
+        )
+
+        deliveries = generate_future_deliveries(self.member, 1)
+
+        self.assertEqual(1, len(deliveries))
+        self.assertEqual("2023-03-03", deliveries[0]["delivery_date"])
+        self.assertEqual(
+            self.member_pickup_location.pickup_location,
+            deliveries[0]["pickup_location"],
+        )
+
+    def test_generateFutureDeliveries_calledTwice_secondCallOnlyLoadsTheCachedIds(
+        self,
+    ):
+        self.create_subscription(WEEKLY[0])
+        generate_future_deliveries(self.member)
+
+        with CaptureQueriesContext(connection) as context:
+            generate_future_deliveries(self.member)
+
+        # the subscriptions and the pickup locations
+        self.assertEqual(2, len(context.captured_queries))
+
+    def test_generateFutureDeliveries_productRenamedAfterCaching_currentNameIsReturned(
+        self,
+    ):
+        subscription = self.create_subscription(WEEKLY[0])
+        generate_future_deliveries(self.member)
+        Product.objects.filter(id=subscription.product_id).update(name="Renamed")
+
+        deliveries = generate_future_deliveries(self.member)
+
+        self.assertEqual("Renamed", deliveries[0]["subs"][0].product.name)
+        self.assertEqual(
+            self.member_pickup_location.pickup_location,
+            deliveries[0]["pickup_location"],
+        )
+
+    def test_generateFutureDeliveries_subscriptionCreated_deliveriesAreRecomputed(
+        self,
+    ):
+        self.assertEqual([], self.get_delivery_dates())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_subscription(WEEKLY[0])
+
+        self.assertEqual(5, len(self.get_delivery_dates()))
@@ -0,0 +1,115 @@
+import json
+import time
+from unittest.mock import patch
+
+import jwt
+from cryptography.hazmat.primitives.asymmetric import rsa
+from django.db import connection
+from django.test import RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from tapir.accounts.middleware import (
+    JwksKeyCache,
+    KeycloakMiddleware,
+    token_user_cache,
+)
+from tapir.wirgarten.parameters import ParameterDefinitions
+from tapir.wirgarten.tests.factories import MemberFactory
+from tapir.wirgarten.tests.test_utils import TapirIntegrationTest, set_bypass_keycloak
+
+
+@override_settings(KEYCLOAK_VERIFY_TOKEN_SIGNATURE=True)
+class TestKeycloakMiddleware(TapirIntegrationTest):
+    def setUp(self):
+        super().setUp()
+        ParameterDefinitions().import_definitions()
+        set_bypass_keycloak()
+        token_user_cache.clear()
+        self.addCleanup(token_user_cache.clear)
+
+        self.private_key = rsa.generate_private_key(
+            public_exponent=65537, key_size=2048
+        )
+        public_jwk = json.loads(
+            jwt.algorithms.RSAAlgorithm.to_jwk(self.private_key.public_key())
+        )
+        self.jwks_keys = {"key-1": jwt.PyJWK(public_jwk, "RS256").key}
+        patcher = patch.object(
+            JwksKeyCache, "fetch_keys", side_effect=lambda: dict(self.jwks_keys)
+        )
+        self.mock_fetch_keys = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.member = MemberFactory.create(keycloak_id="keycloak-id-1")
+        self.middleware = KeycloakMiddleware(lambda request: request)
+
+    def create_token(self, key_id="key-1", private_key=None, **claims):
+        payload = {
+            "sub": self.member.keycloak_id,
+            "exp": int(time.time()) + 300,
+            "email_verified": True,
+            "realm_access": {"roles": ["role.a", "offline_access"]},
+            **claims,
+        }
+        return jwt.encode(
+            payload,
+            private_key or self.private_key,
+            algorithm="RS256",
+            headers={"kid": key_id},
+        )
+
+    def call_middleware(self, token):
+        request = RequestFactory().get("/")
+        request.COOKIES["token"] = token
+        return self.middleware(request)
+
+    def test_call_validToken_setsUserWithRoles(self):
+        request = self.call_middleware(self.create_token())
+
+        self.assertEqual(self.member.id, request.user.id)
+        self.assertEqual(["role.a"], request.user.roles)
+        self.assertTrue(request.user.email_verified)
+
+    def test_call_sameTokenTwice_secondRequestNeedsNoQuery(self):
+        token = self.create_token()
+        self.call_middleware(token)
+
+        with CaptureQueriesContext(connection) as context:
+            request = self.call_middleware(token)
+
+        self.assertEqual(0, len(context.captured_queries))
+        self.assertEqual(self.member.id, request.user.id)
+        self.assertEqual(self.member.email, request.user.email)
+        self.assertEqual(["role.a"], request.user.roles)
+
+    def test_call_userSaved_cachedUserIsDropped(self):
+        token = self.create_token()
+        self.call_middleware(token)
+
+        self.member.first_name = "Changed"
+        self.member.save()
+
+        self.assertEqual("Changed", self.call_middleware(token).user.first_name)
+
+    def test_call_invalidSignature_userIsNotSet(self):
+        other_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+        request = self.call_middleware(self.create_token(private_key=other_key))
+
+        self.assertIsNone(getattr(request, "user", None))
+
+    def test_call_keyRotated_keysAreFetchedAgain(self):
+        self.call_middleware(self.create_token())
+        new_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        self.jwks_keys["key-2"] = jwt.PyJWK(
+            json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(new_key.public_key())),
+            "RS256",
+        ).key
+        self.middleware.jwks_key_cache.min_refresh_interval = 0
+
+        request = self.call_middleware(
+            self.create_token(key_id="key-2", private_key=new_key)
+        )
+
+        self.assertEqual(self.member.id, request.user.id)
+        self.assertEqual(2, self.mock_fetch_keys.call_count)
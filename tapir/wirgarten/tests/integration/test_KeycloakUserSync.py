@@ -0,0 +1,146 @@
+from unittest.mock import patch
+
+from tapir.wirgarten.models import Member
+from tapir.wirgarten.parameters import ParameterDefinitions
+from tapir.wirgarten.tests.factories import MemberFactory
+from tapir.wirgarten.tests.fake_keycloak import mock_keycloak
+from tapir.wirgarten.tests.test_utils import TapirIntegrationTest, set_bypass_keycloak
+
+
+class TestKeycloakUserSync(TapirIntegrationTest):
+    def setUp(self):
+        super().setUp()
+        ParameterDefinitions().import_definitions()
+        set_bypass_keycloak()
+        self.fake_keycloak = mock_keycloak(self)
+
+    def get_requests(self, method: str) -> list:
+        return [r for r in self.fake_keycloak.requests if r[0] == method]
+
+    def test_save_newUser_accountIsCreatedAfterCommit(self):
+        member = MemberFactory.build()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            member.save(bypass_keycloak=False)
+            self.assertEqual([], self.fake_keycloak.requests)
+
+        member.refresh_from_db()
+        self.assertIn(member.keycloak_id, self.fake_keycloak.users)
+        self.assertEqual(
+            [("send_verify_email", member.keycloak_id)],
+            self.get_requests("send_verify_email"),
+        )
+
+    def test_save_transactionNotCommitted_noKeycloakRequest(self):
+        member = MemberFactory.build()
+
+        with self.captureOnCommitCallbacks(execute=False):
+            member.save(bypass_keycloak=False)
+
+        self.assertEqual([], self.fake_keycloak.requests)
+        member.refresh_from_db()
+        self.assertIsNone(member.keycloak_id)
+
+    def test_save_nameChanged_sendsOnlyChangedFields(self):
+        member = MemberFactory.create()
+        member.keycloak_id = self.fake_keycloak.add_user(member.email)
+        member.save(bypass_keycloak=True)
+
+        member.first_name = "Changed"
+        with self.captureOnCommitCallbacks(execute=True):
+            member.save(bypass_keycloak=False)
+
+        self.assertEqual(
+            [("update_user", member.keycloak_id, {"firstName": "Changed"})],
+            self.get_requests("update_user"),
+        )
+
+    def test_createKeycloakAccounts_severalUsers_createsOrLinksAccounts(self):
+        members = [MemberFactory.create() for _ in range(5)]
+        existing_keycloak_id = self.fake_keycloak.add_user(members[0].email)
+
+        statistics = Member.create_keycloak_accounts(members)
+
+        self.assertEqual({"created": 4, "linked": 1, "failed": 0}, statistics)
+        keycloak_ids = dict(
+            Member.objects.filter(id__in=[m.id for m in members]).values_list(
+                "id", "keycloak_id"
+            )
+        )
+        self.assertEqual(existing_keycloak_id, keycloak_ids[members[0].id])
+        self.assertEqual(5, len(set(keycloak_ids.values())))
+        self.assertEqual(4, len(self.get_requests("send_verify_email")))
+
+    def test_save_keycloakAccountMissing_accountIsRecreated(self):
+        member = MemberFactory.create()
+        member.keycloak_id = "deleted-keycloak-id"
+        member.save(bypass_keycloak=True)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            member.save(bypass_keycloak=False)
+
+        member.refresh_from_db()
+        self.assertNotEqual("deleted-keycloak-id", member.keycloak_id)
+        self.assertIn(member.keycloak_id, self.fake_keycloak.users)
+
+    def test_createKeycloakAccounts_sameEmailTwice_createsOnlyOneAccount(self):
+        members = [MemberFactory.create() for _ in range(2)]
+        Member.objects.filter(id=members[1].id).update(email=members[0].email.upper())
+        members[1].refresh_from_db()
+
+        statistics = Member.create_keycloak_accounts(members)
+
+        self.assertEqual({"created": 1, "linked": 0, "failed": 1}, statistics)
+        self.assertEqual(1, len(self.fake_keycloak.users))
+        members[1].refresh_from_db()
+        self.assertIsNone(members[1].keycloak_id)
+
+    def test_save_emailChangedOfUnverifiedUser_noKeycloakRequestBeforeCommit(self):
+        member = MemberFactory.create()
+        member.keycloak_id = self.fake_keycloak.add_user(member.email)
+        member.save(bypass_keycloak=True)
+
+        member.email = "changed@example.com"
+        with self.captureOnCommitCallbacks(execute=True):
+            member.save(bypass_keycloak=False)
+            self.assertEqual([], self.fake_keycloak.requests)
+
+        self.assertEqual(
+            [
+                (
+                    "update_user",
+                    member.keycloak_id,
+                    {"email": "changed@example.com"},
+                )
+            ],
+            self.get_requests("update_user"),
+        )
+        self.assertEqual(
+            [("send_verify_email", member.keycloak_id)],
+            self.get_requests("send_verify_email"),
+        )
+
+    def test_retryPendingKeycloakUpdates_updateFailedAfterCommit_updateIsSentAgain(
+        self,
+    ):
+        member = MemberFactory.create()
+        member.keycloak_id = self.fake_keycloak.add_user(member.email)
+        member.save(bypass_keycloak=True)
+
+        member.first_name = "Changed"
+        with patch.object(
+            self.fake_keycloak, "update_user", side_effect=ConnectionError()
+        ):
+            with self.captureOnCommitCallbacks(execute=True):
+                member.save(bypass_keycloak=False)
+        member.refresh_from_db()
+        self.assertTrue(member.keycloak_sync_pending)
+
+        statistics = Member.retry_pending_keycloak_updates()
+
+        self.assertEqual({"updated": 1, "failed": 0}, statistics)
+        member.refresh_from_db()
+        self.assertFalse(member.keycloak_sync_pending)
+        self.assertEqual(
+            "Changed", self.fake_keycloak.users[member.keycloak_id]["firstName"]
+        )
@@ -0,0 +1,85 @@
+from django.core.mail import EmailMessage
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from tapir.log.models import EmailLogEntry, LogEntry, TextLogEntry
+from tapir.wirgarten.parameters import ParameterDefinitions
+from tapir.wirgarten.tests.factories import MemberFactory
+from tapir.wirgarten.tests.test_utils import TapirIntegrationTest, set_bypass_keycloak
+
+
+class TestLogEntryList(TapirIntegrationTest):
+    def setUp(self):
+        super().setUp()
+        ParameterDefinitions().import_definitions()
+        set_bypass_keycloak()
+        self.member = MemberFactory.create()
+
+    def create_entries(self, count: int) -> list[LogEntry]:
+        entries = []
+        for index in range(count):
+            if index % 2:
+                entry = TextLogEntry().populate(text=f"Note {index}", user=self.member)
+            else:
+                entry = EmailLogEntry().populate(
+                    email_message=EmailMessage(subject=f"Email {index}", body="Hi"),
+                    user=self.member,
+                )
+            entry.save()
+            entries.append(entry)
+        return entries
+
+    def test_getUserLogEntries_twoPages_returnsAllEntriesNewestFirstAsLeafClasses(
+        self,
+    ):
+        entries = self.create_entries(25)
+
+        first_page, cursor = LogEntry.get_user_log_entries(self.member, limit=20)
+        second_page, last_cursor = LogEntry.get_user_log_entries(
+            self.member, before=LogEntry.parse_cursor(cursor), limit=20
+        )
+
+        self.assertEqual(
+            [entry.pk for entry in reversed(entries)],
+            [entry.pk for entry in first_page + second_page],
+        )
+        self.assertEqual(
+            [type(entry) for entry in reversed(entries)],
+            [type(entry) for entry in first_page + second_page],
+        )
+        self.assertIsNone(last_cursor)
+
+    def test_getUserLogEntries_moreEntries_sameNumberOfQueries(self):
+        self.create_entries(2)
+        LogEntry.get_user_log_entries(self.member)  # fills the content type cache
+        with CaptureQueriesContext(connection) as context:
+            LogEntry.get_user_log_entries(self.member)
+        query_count = len(context.captured_queries)
+
+        self.create_entries(10)
+        with CaptureQueriesContext(connection) as context:
+            LogEntry.get_user_log_entries(self.member)
+
+        self.assertEqual(query_count, len(context.captured_queries))
+
+    def test_userLogEntries_malformedCursor_badRequest(self):
+        self.client.force_login(MemberFactory.create(is_superuser=True))
+        url = reverse("log:user_log_entries", args=[self.member.pk])
+
+        for cursor in ["no-separator", "not-a-date_1", "2023-01-01T00:00:00_x"]:
+            response = self.client.get(url, {"before": cursor})
+            self.assertStatusCode(response, 400)
+
+    def test_userLogEntries_cursorOfFirstPage_returnsSecondPage(self):
+        self.create_entries(25)
+        self.client.force_login(MemberFactory.create(is_superuser=True))
+        _, cursor = LogEntry.get_user_log_entries(self.member)
+
+        response = self.client.get(
+            reverse("log:user_log_entries", args=[self.member.pk]), {"before": cursor}
+        )
+
+        self.assertStatusCode(response, 200)
+        self.assertEqual(5, len(response.context["log_entries"]))
+        self.assertNotIn("X-Next-Cursor", response)
@@ -0,0 +1,149 @@
+import datetime
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from tapir.configuration.models import TapirParameter
+from tapir.wirgarten.models import Member
+from tapir.wirgarten.parameters import Parameter, ParameterDefinitions
+from tapir.wirgarten.service.member_computed_fields import load_member_computed_fields
+from tapir.wirgarten.tests.factories import (
+    CoopShareTransactionFactory,
+    GrowingPeriodFactory,
+    MemberFactory,
+    MemberPickupLocationFactory,
+    ProductFactory,
+    ProductPriceFactory,
+    SubscriptionFactory,
+)
+from tapir.wirgarten.tests.test_utils import (
+    TapirIntegrationTest,
+    mock_timezone,
+    set_bypass_keycloak,
+)
+
+COMPUTED_FIELDS = [
+    "coop_shares_quantity",
+    "coop_entry_date",
+    "has_trial_contracts",
+    "base_subscriptions_text",
+    "pickup_location",
+]
+
+
+class TestMemberComputedFields(TapirIntegrationTest):
+    def setUp(self):
+        super().setUp()
+        ParameterDefinitions().import_definitions()
+        set_bypass_keycloak()
+        mock_timezone(self, datetime.datetime(year=2023, month=3, day=10))
+
+        self.growing_period = GrowingPeriodFactory.create(
+            start_date=datetime.date(year=2023, month=1, day=1),
+            end_date=datetime.date(year=2023, month=12, day=31),
+        )
+        self.product = ProductFactory.create()
+        ProductPriceFactory.create(
+            product=self.product, price=50, valid_from=self.growing_period.start_date
+        )
+        TapirParameter.objects.filter(key=Parameter.COOP_BASE_PRODUCT_TYPE).update(
+            value=self.product.type_id
+        )
+
+    def create_member(self, start_date: datetime.date):
+        member = MemberFactory.create()
+        CoopShareTransactionFactory.create(
+            member=member, valid_at=datetime.date(2023, 1, 1)
+        )
+        SubscriptionFactory.create(
+            member=member,
+            period=self.growing_period,
+            product=self.product,
+            start_date=start_date,
+        )
+        MemberPickupLocationFactory.create(
+            member=member, valid_from=datetime.date(2023, 1, 1)
+        )
+        return member
+
+    def get_values(self, member: Member):
+        return [getattr(member, field) for field in COMPUTED_FIELDS] + [
+            member.coop_shares_total_value(),
+            member.monthly_payment(),
+        ]
+
+    def test_loadMemberComputedFields_default_sameValuesAsWithoutPrefetch(self):
+        self.create_member(self.growing_period.start_date)
+        self.create_member(datetime.date(2023, 3, 1))
+        MemberFactory.create()
+
+        expected = {
+            member.id: self.get_values(member)
+            for member in Member.objects.order_by("id")
+        }
+
+        with CaptureQueriesContext(connection) as context:
+            actual = {
+                member.id: self.get_values(member)
+                for member in load_member_computed_fields(Member.objects.order_by("id"))
+            }
+
+        self.assertEqual(expected, actual)
+        self.assertLessEqual(len(context.captured_queries), 10)
+
+    def test_loadMemberComputedFields_moreMembers_sameNumberOfQueries(self):
+        self.create_member(self.growing_period.start_date)
+        with CaptureQueriesContext(connection) as context:
+            for member in load_member_computed_fields(Member.objects.all()):
+                self.get_values(member)
+        query_count = len(context.captured_queries)
+
+        for _ in range(5):
+            self.create_member(self.growing_period.start_date)
+
+        with CaptureQueriesContext(connection) as context:
+            for member in load_member_computed_fields(Member.objects.all()):
+                self.get_values(member)
+
+        self.assertEqual(query_count, len(context.captured_queries))
+
+    def test_loadMemberComputedFields_explicitReferenceDate_onlyComputedFieldsHaveValuesAtThatDate(
+        self,
+    ):
+        member = self.create_member(datetime.date(2023, 4, 1))
+
+        [member] = load_member_computed_fields(
+            Member.objects.filter(id=member.id), datetime.date(2023, 4, 1)
+        )
+
+        self.assertNotEqual("", member.computed_fields.base_subscriptions_text)
+        self.assertEqual(
+            datetime.date(2023, 4, 1), member.computed_fields.reference_date
+        )
+        self.assertEqual("", member.base_subscriptions_text)
+
+    def test_prefetchRelated_default_sameValuesAsWithoutPrefetch(self):
+        self.create_member(self.growing_period.start_date)
+        self.create_member(datetime.date(2023, 3, 1))
+
+        expected = {
+            member.id: self.get_values(member)
+            for member in Member.objects.order_by("id")
+        }
+        actual = {
+            member.id: self.get_values(member)
+            for member in Member.objects.prefetch_related("computed_fields").order_by(
+                "id"
+            )
+        }
+
+        self.assertEqual(expected, actual)
+
+    def test_loadMemberComputedFields_dayChanged_valuesAreReloaded(self):
+        member = self.create_member(datetime.date(2023, 4, 1))
+        [member] = load_member_computed_fields(Member.objects.filter(id=member.id))
+        self.assertEqual("", member.base_subscriptions_text)
+
+        mock_timezone(self, datetime.datetime(year=2023, month=4, day=1))
+
+        self.assertNotEqual("", member.base_subscriptions_text)
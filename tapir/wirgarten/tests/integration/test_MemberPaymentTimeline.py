@@ -0,0 +1,98 @@
+import datetime
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from tapir.wirgarten.models import Payment
+from tapir.wirgarten.parameters import ParameterDefinitions
+from tapir.wirgarten.service.payment_timeline import MemberPaymentTimeline
+from tapir.wirgarten.tests.factories import (
+    GrowingPeriodFactory,
+    MemberFactory,
+    ProductFactory,
+    ProductPriceFactory,
+    SubscriptionFactory,
+)
+from tapir.wirgarten.tests.test_utils import (
+    TapirIntegrationTest,
+    mock_timezone,
+    set_bypass_keycloak,
+)
+
+
+class TestMemberPaymentTimeline(TapirIntegrationTest):
+    def setUp(self):
+        super().setUp()
+        ParameterDefinitions().import_definitions()
+        set_bypass_keycloak()
+        mock_timezone(self, datetime.datetime(year=2023, month=3, day=1))
+
+        self.growing_period = GrowingPeriodFactory.create(
+            start_date=datetime.date(year=2023, month=1, day=1),
+            end_date=datetime.date(year=2023, month=12, day=31),
+        )
+        self.product = ProductFactory.create()
+        ProductPriceFactory.create(
+            product=self.product, price=10, valid_from=datetime.date(2023, 1, 1)
+        )
+        self.member = MemberFactory.create()
+
+    def create_subscription(self, **kwargs):
+        return SubscriptionFactory.create(
+            member=self.member,
+            period=self.growing_period,
+            product=self.product,
+            quantity=2,
+            solidarity_price=0.05,
+            **kwargs,
+        )
+
+    def test_getPaymentRows_paymentPersisted_projectedPaymentOfThatMonthIsReplaced(
+        self,
+    ):
+        subscription = self.create_subscription()
+        Payment.objects.create(
+            due_date=datetime.date(2023, 3, 15),
+            mandate_ref=subscription.mandate_ref,
+            amount=30,
+            type=self.product.type.name,
+        )
+
+        rows = MemberPaymentTimeline(self.member.id).get_payment_rows()
+
+        self.assertEqual(10, len(rows))
+        self.assertEqual(datetime.date(2023, 3, 15), rows[0]["due_date"])
+        self.assertEqual(30.0, rows[0]["amount"])
+        self.assertEqual(21.0, rows[0]["calculated_amount"])
+        self.assertTrue(rows[0]["upcoming"])
+        self.assertEqual([21.0] * 9, [row["amount"] for row in rows[1:]])
+
+    def test_getFuturePayments_limit_returnsOnlyTheFirstDueDates(self):
+        self.create_subscription()
+
+        future_payments = MemberPaymentTimeline(self.member.id).get_future_payments(2)
+
+        self.assertEqual(
+            [datetime.date(2023, 3, 15), datetime.date(2023, 4, 15)],
+            list(future_payments.keys()),
+        )
+
+    def test_getPaymentRows_longerHistory_sameNumberOfQueries(self):
+        subscription = self.create_subscription()
+        with CaptureQueriesContext(connection) as context:
+            MemberPaymentTimeline(self.member.id).get_payment_rows()
+        query_count = len(context.captured_queries)
+
+        self.create_subscription(mandate_ref=subscription.mandate_ref)
+        for month in range(1, 3):
+            Payment.objects.create(
+                due_date=datetime.date(2023, month, 15),
+                mandate_ref=subscription.mandate_ref,
+                amount=42,
+                type=self.product.type.name,
+            )
+
+        with CaptureQueriesContext(connection) as context:
+            MemberPaymentTimeline(self.member.id).get_payment_rows()
+
+        self.assertEqual(query_count, len(context.captured_queries))
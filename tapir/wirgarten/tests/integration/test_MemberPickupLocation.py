@@ -0,0 +1,96 @@
+import datetime
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from tapir.wirgarten.models import MemberPickupLocation
+from tapir.wirgarten.service.member import change_pickup_location
+from tapir.wirgarten.tests.factories import (
+    MemberFactory,
+    MemberPickupLocationFactory,
+    PickupLocationFactory,
+)
+from tapir.wirgarten.tests.test_utils import TapirIntegrationTest, set_bypass_keycloak
+
+
+class TestMemberPickupLocation(TapirIntegrationTest):
+    def setUp(self):
+        set_bypass_keycloak()
+
+    def test_changePickupLocation_default_updatesValidToDates(self):
+        member = MemberFactory.create()
+        first = MemberPickupLocationFactory.create(
+            member=member, valid_from=datetime.date(2023, 1, 1)
+        )
+        second = MemberPickupLocationFactory.create(
+            member=member, valid_from=datetime.date(2023, 6, 1)
+        )
+
+        change_pickup_location(
+            member.id, PickupLocationFactory.create(), datetime.date(2023, 4, 1)
+        )
+
+        first.refresh_from_db()
+        self.assertEqual(datetime.date(2023, 3, 31), first.valid_to)
+        self.assertFalse(MemberPickupLocation.objects.filter(id=second.id).exists())
+        latest = MemberPickupLocation.objects.get(
+            member=member, valid_from=datetime.date(2023, 4, 1)
+        )
+        self.assertIsNone(latest.valid_to)
+
+    def test_getPickupLocations_severalMembers_returnsLocationValidAtDateWithOneQuery(
+        self,
+    ):
+        members_and_locations = []
+        for _ in range(3):
+            member = MemberFactory.create()
+            MemberPickupLocationFactory.create(
+                member=member, valid_from=datetime.date(2023, 1, 1)
+            )
+            current = MemberPickupLocationFactory.create(
+                member=member, valid_from=datetime.date(2023, 6, 1)
+            )
+            MemberPickupLocationFactory.create(
+                member=member, valid_from=datetime.date(2023, 9, 1)
+            )
+            members_and_locations.append((member, current.pickup_location))
+
+        with CaptureQueriesContext(connection) as context:
+            pickup_locations = MemberPickupLocation.get_pickup_locations(
+                [member.id for member, _ in members_and_locations],
+                datetime.date(2023, 7, 15),
+            )
+            for member, _ in members_and_locations:
+                pickup_locations[member.id].name
+
+        self.assertEqual(1, len(context.captured_queries))
+        for member, pickup_location in members_and_locations:
+            self.assertEqual(pickup_location, pickup_locations[member.id])
+
+    def test_getPickupLocations_onlyOneLocationInTheFuture_returnsThatLocation(self):
+        member_pickup_location = MemberPickupLocationFactory.create(
+            valid_from=datetime.date(2023, 6, 1)
+        )
+
+        self.assertEqual(
+            member_pickup_location.pickup_location,
+            member_pickup_location.member.get_pickup_location(
+                datetime.date(2023, 1, 1)
+            ),
+        )
+
+    def test_getPickupLocations_severalLocationsAllInTheFuture_memberIsMissing(self):
+        member = MemberFactory.create()
+        MemberPickupLocationFactory.create(
+            member=member, valid_from=datetime.date(2023, 6, 1)
+        )
+        MemberPickupLocationFactory.create(
+            member=member, valid_from=datetime.date(2023, 9, 1)
+        )
+
+        self.assertEqual(
+            {},
+            MemberPickupLocation.get_pickup_locations(
+                [member.id], datetime.date(2023, 1, 1)
+            ),
+        )
@@ -0,0 +1,77 @@
+import datetime
+
+from tapir.wirgarten.models import MemberSegmentMembership
+from tapir.wirgarten.service.segment_membership import update_segment_memberships
+from tapir.wirgarten.tests.factories import (
+    CoopShareTransactionFactory,
+    MemberFactory,
+    SubscriptionFactory,
+)
+from tapir.wirgarten.tests.test_utils import (
+    TapirIntegrationTest,
+    mock_timezone,
+    set_bypass_keycloak,
+)
+
+
+class TestMemberSegmentMembership(TapirIntegrationTest):
+    NOW = datetime.datetime(2023, 4, 15, 12, 0, tzinfo=datetime.timezone.utc)
+
+    def setUp(self):
+        super().setUp()
+        mock_timezone(self, self.NOW)
+        set_bypass_keycloak()
+        self.member = MemberFactory.create()
+
+    def get_segments(self) -> set[str]:
+        return set(
+            MemberSegmentMembership.objects.filter(member=self.member).values_list(
+                "segment", flat=True
+            )
+        )
+
+    def test_coopShareTransactionSaved_default_addsAndRemovesCoopMembersSegment(self):
+        transaction = CoopShareTransactionFactory.create(
+            member=self.member, quantity=2, valid_at=self.NOW.date()
+        )
+        self.assertEqual(
+            {MemberSegmentMembership.SEGMENT_COOP_MEMBERS}, self.get_segments()
+        )
+
+        transaction.delete()
+        self.assertEqual(set(), self.get_segments())
+
+    def test_subscriptionSaved_default_addsActiveSubscriptionSegment(self):
+        SubscriptionFactory.create(
+            member=self.member,
+            start_date=datetime.date(2023, 1, 1),
+            end_date=datetime.date(2023, 12, 31),
+        )
+
+        self.assertEqual(
+            {MemberSegmentMembership.SEGMENT_ACTIVE_SUBSCRIPTION}, self.get_segments()
+        )
+
+    def test_updateSegmentMemberships_dateChanged_updatesAllMembers(self):
+        CoopShareTransactionFactory.create(
+            member=self.member,
+            quantity=1,
+            valid_at=self.NOW.date() + datetime.timedelta(days=10),
+        )
+        SubscriptionFactory.create(
+            member=self.member,
+            start_date=datetime.date(2023, 1, 1),
+            end_date=self.NOW.date() + datetime.timedelta(days=5),
+        )
+        self.assertEqual(
+            {MemberSegmentMembership.SEGMENT_ACTIVE_SUBSCRIPTION}, self.get_segments()
+        )
+
+        mock_timezone(self, self.NOW + datetime.timedelta(days=30))
+        statistics = update_segment_memberships()
+
+        self.assertEqual({"added": 1, "removed": 1}, statistics)
+        self.assertEqual(
+            {MemberSegmentMembership.SEGMENT_COOP_MEMBERS}, self.get_segments()
+        )
+        self.assertEqual({"added": 0, "removed": 0}, update_segment_memberships())
@@ -0,0 +1,56 @@
+import datetime
+from unittest.mock import patch
+
+from tapir.wirgarten.tasks import update_onboarding_triggers
+from tapir.wirgarten.triggers import onboarding_trigger
+from tapir.wirgarten.tests.factories import MemberFactory, SubscriptionFactory
+from tapir.wirgarten.tests.test_utils import (
+    TapirIntegrationTest,
+    mock_timezone,
+    set_bypass_keycloak,
+)
+
+
+class TestOnboardingTriggerQueue(TapirIntegrationTest):
+    def setUp(self):
+        super().setUp()
+        set_bypass_keycloak()
+        mock_timezone(self, datetime.datetime(year=2023, month=3, day=1))
+        patcher = patch.object(update_onboarding_triggers, "delay")
+        self.mock_delay = patcher.start()
+        self.addCleanup(patcher.stop)
+        # drop the members queued by earlier tests, whose transactions were rolled back
+        onboarding_trigger._pending_member_ids.member_ids = None
+
+    def test_subscriptionsSaved_severalMembersInOneTransaction_oneTaskForAllMembers(
+        self,
+    ):
+        members = MemberFactory.create_batch(2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            for member in members:
+                SubscriptionFactory.create_batch(2, member=member)
+
+        self.mock_delay.assert_called_once_with(sorted(member.id for member in members))
+
+    def test_subscriptionSaved_startDateUnchanged_noTask(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            subscription = SubscriptionFactory.create()
+        self.mock_delay.reset_mock()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            subscription.quantity += 1
+            subscription.save()
+
+        self.mock_delay.assert_not_called()
+
+    def test_subscriptionSaved_startDateChanged_taskForTheMember(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            subscription = SubscriptionFactory.create()
+        self.mock_delay.reset_mock()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            subscription.start_date += datetime.timedelta(days=7)
+            subscription.save()
+
+        self.mock_delay.assert_called_once_with([subscription.member_id])
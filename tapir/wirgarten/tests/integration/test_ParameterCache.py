@@ -0,0 +1,94 @@
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from tapir.configuration.models import TapirParameter
+from tapir.configuration.parameter import get_parameter_value, parameter_cache
+from tapir.wirgarten.parameters import ParameterDefinitions, Parameter
+from tapir.wirgarten.tests.test_utils import TapirIntegrationTest
+
+
+class TestParameterCache(TapirIntegrationTest):
+    def setUp(self):
+        super().setUp()
+        ParameterDefinitions().import_definitions()
+
+    def test_getParameterValue_calledSeveralTimes_loadsParametersOnlyOnce(self):
+        get_parameter_value(Parameter.SITE_NAME)
+
+        with CaptureQueriesContext(connection) as context:
+            get_parameter_value(Parameter.SITE_NAME)
+            get_parameter_value(Parameter.COOP_MIN_SHARES)
+            get_parameter_value(Parameter.MEMBER_BYPASS_KEYCLOAK)
+
+        self.assertEqual(0, len(context.captured_queries))
+
+    def test_getParameterValue_parameterSaved_returnsNewValue(self):
+        get_parameter_value(Parameter.COOP_MIN_SHARES)
+
+        parameter = TapirParameter.objects.get(key=Parameter.COOP_MIN_SHARES)
+        parameter.value = "7"
+        parameter.save()
+
+        self.assertEqual(7, get_parameter_value(Parameter.COOP_MIN_SHARES))
+
+    def test_getParameterValue_parameterUpdatedInBulk_returnsNewValue(self):
+        get_parameter_value(Parameter.COOP_MIN_SHARES)
+
+        TapirParameter.objects.filter(key=Parameter.COOP_MIN_SHARES).update(value="9")
+
+        self.assertEqual(9, get_parameter_value(Parameter.COOP_MIN_SHARES))
+
+    def test_getParameterValue_unknownKey_raisesKeyError(self):
+        with self.assertRaises(KeyError):
+            get_parameter_value("this.key.does.not.exist")
+
+    def test_getParameterValue_cacheCleared_reloadsFromDatabase(self):
+        get_parameter_value(Parameter.COOP_MIN_SHARES)
+        parameter_cache.clear()
+
+        with CaptureQueriesContext(connection) as context:
+            get_parameter_value(Parameter.COOP_MIN_SHARES)
+
+        self.assertEqual(1, len(context.captured_queries))
+
+    def test_getParameterValue_changeRolledBack_returnsCommittedValue(self):
+        committed_value = get_parameter_value(Parameter.COOP_MIN_SHARES)
+
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                TapirParameter.objects.filter(key=Parameter.COOP_MIN_SHARES).update(
+                    value=str(committed_value + 1)
+                )
+                self.assertEqual(
+                    committed_value + 1, get_parameter_value(Parameter.COOP_MIN_SHARES)
+                )
+                raise ValueError("roll back")
+
+        self.assertEqual(
+            committed_value, get_parameter_value(Parameter.COOP_MIN_SHARES)
+        )
+
+    def test_getParameterValue_changedInReleasedSavepoint_returnsNewValue(self):
+        committed_value = get_parameter_value(Parameter.COOP_MIN_SHARES)
+
+        with transaction.atomic():
+            TapirParameter.objects.filter(key=Parameter.COOP_MIN_SHARES).update(
+                value=str(committed_value + 1)
+            )
+            get_parameter_value(Parameter.COOP_MIN_SHARES)
+
+        self.assertEqual(
+            committed_value + 1, get_parameter_value(Parameter.COOP_MIN_SHARES)
+        )
+
+    def test_getParameterValue_calledSeveralTimesAfterChange_loadsParametersOnlyOnce(
+        self,
+    ):
+        TapirParameter.objects.filter(key=Parameter.COOP_MIN_SHARES).update(value="7")
+        get_parameter_value(Parameter.COOP_MIN_SHARES)
+
+        with CaptureQueriesContext(connection) as context:
+            get_parameter_value(Parameter.COOP_MIN_SHARES)
+            get_parameter_value(Parameter.SITE_NAME)
+
+        self.assertEqual(0, len(context.captured_queries))
@@ -0,0 +1,94 @@
+import datetime
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from tapir.wirgarten.forms.pickup_location import get_current_capacity_usage
+from tapir.wirgarten.service.pickup_location_occupancy import PickupLocationOccupancy
+from tapir.wirgarten.tests.factories import (
+    GrowingPeriodFactory,
+    MemberPickupLocationFactory,
+    PickupLocationCapabilityFactory,
+    ProductFactory,
+    ProductPriceFactory,
+    SubscriptionFactory,
+)
+from tapir.wirgarten.tests.test_utils import TapirIntegrationTest, set_bypass_keycloak
+
+
+class TestPickupLocationOccupancy(TapirIntegrationTest):
+    def setUp(self):
+        set_bypass_keycloak()
+        self.growing_period = GrowingPeriodFactory.create(
+            start_date=datetime.date(year=2022, month=1, day=1),
+            end_date=datetime.date(year=2022, month=12, day=31),
+        )
+        self.reference_date = datetime.date(year=2022, month=6, day=1)
+        self.product = ProductFactory.create()
+        ProductPriceFactory.create(
+            product=self.product, size=0.5, valid_from=self.growing_period.start_date
+        )
+
+        self.capabilities = []
+        for quantity in [1, 2, 3]:
+            capability = PickupLocationCapabilityFactory.create(
+                product_type=self.product.type
+            )
+            self.capabilities.append(capability)
+            for _ in range(2):
+                subscription = SubscriptionFactory.create(
+                    period=self.growing_period, product=self.product, quantity=quantity
+                )
+                MemberPickupLocationFactory.create(
+                    member=subscription.member,
+                    pickup_location=capability.pickup_location,
+                    valid_from=self.growing_period.start_date,
+                )
+
+    def test_getUsage_default_sameResultAsGetCurrentCapacityUsage(self):
+        occupancy = PickupLocationOccupancy()
+
+        for capability in self.capabilities:
+            self.assertEqual(
+                get_current_capacity_usage(capability, self.reference_date),
+                occupancy.get_usage(
+                    capability.pickup_location_id,
+                    capability.product_type_id,
+                    self.reference_date,
+                ),
+            )
+
+    def test_getUsage_severalLocations_usesOneQueryPerReferenceDate(self):
+        with CaptureQueriesContext(connection) as context:
+            occupancy = PickupLocationOccupancy()
+            for capability in self.capabilities:
+                occupancy.get_usage(
+                    capability.pickup_location_id,
+                    capability.product_type_id,
+                    self.reference_date,
+                )
+
+        self.assertEqual(1, len(context.captured_queries))
+
+    def test_getUsageInBaseProductUnits_default_returnsNumberOfBaseProducts(self):
+        occupancy = PickupLocationOccupancy([self.reference_date])
+
+        self.assertEqual(
+            4,
+            occupancy.get_usage_in_base_product_units(
+                self.capabilities[1].pickup_location_id,
+                self.product.type_id,
+                self.reference_date,
+            ),
+        )
+
+    def test_getMemberCount_default_returnsNumberOfMembersPerLocation(self):
+        occupancy = PickupLocationOccupancy()
+
+        for capability in self.capabilities:
+            self.assertEqual(
+                2,
+                occupancy.get_member_count(
+                    capability.pickup_location_id, self.reference_date
+                ),
+            )
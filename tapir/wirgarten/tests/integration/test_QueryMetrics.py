@@ -0,0 +1,127 @@
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from django.http import HttpResponse
+from django.test import RequestFactory, override_settings
+from django.urls import resolve, reverse
+
+from tapir.wirgarten.middleware.query_metrics import QueryMetricsMiddleware
+from tapir.wirgarten.models import Member
+from tapir.wirgarten.service.query_metrics import (
+    QUERY_BUDGETS,
+    QueryBudgetExceeded,
+    QueryRecorder,
+    finish_task_recording,
+    get_query_fingerprint,
+    start_task_recording,
+    task_metrics,
+    view_metrics,
+)
+from tapir.wirgarten.tests.factories import MemberFactory
+from tapir.wirgarten.tests.test_utils import (
+    TapirIntegrationTest,
+    set_bypass_keycloak,
+)
+
+URL_NAME = "wirgarten:member_list"
+
+
+def query_members_one_by_one(request):
+    request.resolver_match = resolve(reverse(URL_NAME))
+    for member_id in Member.objects.values_list("id", flat=True):
+        Member.objects.get(id=member_id)
+    return HttpResponse()
+
+
+class QueryMetricsTest(TapirIntegrationTest):
+    def setUp(self):
+        super().setUp()
+        view_metrics.clear()
+        task_metrics.clear()
+        set_bypass_keycloak()
+        MemberFactory.create_batch(3)
+
+    def call_middleware(self):
+        middleware = QueryMetricsMiddleware(query_members_one_by_one)
+        return middleware(RequestFactory().get("/"))
+
+    def test_middleware_recordsQueriesPerUrlName(self):
+        self.call_middleware()
+
+        bucket_counts, total, count = view_metrics.queries.get_samples()[URL_NAME]
+        self.assertEqual(1, count)
+        self.assertEqual(4, total)
+        _, duplicates, _ = view_metrics.duplicate_queries.get_samples()[URL_NAME]
+        self.assertEqual(2, duplicates)
+
+    def test_middleware_queryBudgetExceededInStrictMode_raisesError(self):
+        with patch.dict(QUERY_BUDGETS, {URL_NAME: 3}):
+            with self.assertRaises(QueryBudgetExceeded):
+                self.call_middleware()
+
+    @override_settings(QUERY_BUDGET_STRICT=False)
+    def test_middleware_queryBudgetExceededNotStrict_onlyLogged(self):
+        with patch.dict(QUERY_BUDGETS, {URL_NAME: 3}):
+            response = self.call_middleware()
+
+        self.assertStatusCode(response, 200)
+
+    def test_getQueryFingerprint_differentListLengths_sameFingerprint(self):
+        self.assertEqual(
+            get_query_fingerprint('SELECT * FROM "a" WHERE "id" IN (%s, %s)'),
+            get_query_fingerprint('SELECT * FROM "a"  WHERE "id" IN (%s,%s,%s)'),
+        )
+        self.assertEqual(
+            get_query_fingerprint('INSERT INTO "a" VALUES (%s, %s), (%s, %s)'),
+            get_query_fingerprint(
+                'INSERT INTO "a" VALUES (%s, %s), (%s, %s), (%s, %s)'
+            ),
+        )
+
+    def test_queryRecorder_describe_containsMostRepeatedQuery(self):
+        recorder = QueryRecorder()
+        with recorder.record():
+            for member in Member.objects.all():
+                Member.objects.get(id=member.id)
+
+        self.assertEqual(4, recorder.query_count)
+        self.assertIn("most repeated (3x)", recorder.describe())
+
+    def test_taskSignals_recordQueriesPerTaskName(self):
+        task = SimpleNamespace(name="tapir.wirgarten.tasks.test_task")
+
+        start_task_recording(task_id="task-1", task=task)
+        list(Member.objects.all())
+        finish_task_recording(task_id="task-1", task=task)
+
+        _, total, count = task_metrics.queries.get_samples()[task.name]
+        self.assertEqual(1, count)
+        self.assertEqual(1, total)
+
+    @override_settings(METRICS_TOKEN="secret")
+    def test_metricsView_validToken_rendersHistograms(self):
+        self.call_middleware()
+
+        response = self.client.get(
+            reverse("metrics"), HTTP_AUTHORIZATION="Bearer secret"
+        )
+
+        self.assertStatusCode(response, 200)
+        self.assertIn(
+            f'tapir_view_queries_count{{view="{URL_NAME}"}} 1',
+            response.content.decode(),
+        )
+
+    @override_settings(METRICS_TOKEN="secret")
+    def test_metricsView_wrongToken_forbidden(self):
+        response = self.client.get(
+            reverse("metrics"), HTTP_AUTHORIZATION="Bearer wrong"
+        )
+
+        self.assertStatusCode(response, 403)
+
+    @override_settings(METRICS_TOKEN="")
+    def test_metricsView_noTokenConfigured_notFound(self):
+        response = self.client.get(reverse("metrics"))
+
+        self.assertStatusCode(response, 404)
@@ -0,0 +1,223 @@
+import datetime
+import itertools
+from unittest.mock import patch
+
+from tapir.wirgarten.models import ScheduledTask
+from tapir.wirgarten.service.tasks import (
+    claim_due_scheduled_tasks,
+    release_timed_out_scheduled_tasks,
+)
+from tapir.wirgarten.tasks import execute_scheduled_task, execute_scheduled_tasks
+from tapir.wirgarten.tests.test_utils import TapirIntegrationTest, mock_timezone
+
+NOW = datetime.datetime(year=2023, month=6, day=1, hour=12)
+
+
+def succeeding_task(*args):
+    pass
+
+
+def failing_task(*args):
+    raise Exception("failed on purpose")
+
+
+class TestScheduledTaskExecutor(TapirIntegrationTest):
+    def setUp(self):
+        super().setUp()
+        mock_timezone(self, NOW)
+        self.task_counter = itertools.count()
+
+    def create_task(self, function, eta=NOW, **kwargs) -> ScheduledTask:
+        # different arguments, so that the tasks are not duplicates of each other
+        return ScheduledTask.objects.create(
+            task_function=f"{__name__}.{function.__name__}",
+            task_args=[next(self.task_counter)],
+            eta=eta,
+            **kwargs,
+        )
+
+    def test_claimDueScheduledTasks_default_claimsOnlyDueTasksUpToLimit(self):
+        due_tasks = [
+            self.create_task(succeeding_task, eta=NOW - datetime.timedelta(hours=i))
+            for i in range(3)
+        ]
+        future_task = self.create_task(
+            succeeding_task, eta=NOW + datetime.timedelta(hours=1)
+        )
+
+        claimed_ids = claim_due_scheduled_tasks(2)
+
+        # the oldest tasks first
+        self.assertEqual([(due_tasks[2].id, 1), (due_tasks[1].id, 1)], claimed_ids)
+        for task in due_tasks + [future_task]:
+            task.refresh_from_db()
+        self.assertEqual(ScheduledTask.STATUS_IN_PROGRESS, due_tasks[2].status)
+        self.assertEqual(1, due_tasks[2].attempts)
+        self.assertIsNone(due_tasks[2].started_at)
+        self.assertEqual(ScheduledTask.STATUS_PENDING, due_tasks[0].status)
+        self.assertEqual(ScheduledTask.STATUS_PENDING, future_task.status)
+        self.assertEqual([(due_tasks[0].id, 1)], claim_due_scheduled_tasks(2))
+
+    def test_execute_taskFails_retriedWithBackoffThenFailed(self):
+        task = self.create_task(failing_task, max_attempts=2)
+
+        task.execute()
+
+        task.refresh_from_db()
+        self.assertEqual(ScheduledTask.STATUS_PENDING, task.status)
+        self.assertEqual(1, task.attempts)
+        self.assertGreater(task.eta, NOW)
+        self.assertEqual("failed on purpose", task.error_message)
+
+        task.execute()
+
+        task.refresh_from_db()
+        self.assertEqual(ScheduledTask.STATUS_FAILED, task.status)
+        self.assertEqual(2, task.attempts)
+
+    def test_executeScheduledTask_taskSucceeds_markedAsDone(self):
+        task = self.create_task(succeeding_task)
+        [(_, attempt)] = claim_due_scheduled_tasks(1)
+
+        execute_scheduled_task(task.id, attempt)
+
+        task.refresh_from_db()
+        self.assertEqual(ScheduledTask.STATUS_DONE, task.status)
+        self.assertEqual(1, task.attempts)
+        self.assertEqual(NOW, task.started_at)
+
+    def test_executeScheduledTask_messageDeliveredTwice_taskRunsOnce(self):
+        task = self.create_task(succeeding_task)
+        [(_, attempt)] = claim_due_scheduled_tasks(1)
+
+        with patch.object(ScheduledTask, "execute") as mock_execute:
+            execute_scheduled_task(task.id, attempt)
+            execute_scheduled_task(task.id, attempt)
+
+        self.assertEqual(1, mock_execute.call_count)
+
+    def test_executeScheduledTask_releasedAndClaimedAgain_oldClaimIsIgnored(self):
+        task = self.create_task(succeeding_task)
+        [(_, first_attempt)] = claim_due_scheduled_tasks(1)
+        ScheduledTask.objects.filter(id=task.id).update(
+            status=ScheduledTask.STATUS_PENDING
+        )
+        [(_, second_attempt)] = claim_due_scheduled_tasks(1)
+
+        with patch.object(ScheduledTask, "execute") as mock_execute:
+            execute_scheduled_task(task.id, first_attempt)
+            self.assertEqual(0, mock_execute.call_count)
+            execute_scheduled_task(task.id, second_attempt)
+
+        self.assertEqual(1, mock_execute.call_count)
+
+    def test_releaseTimedOutScheduledTasks_default_retriesOrFailsStuckTasks(self):
+        started_at = NOW - datetime.timedelta(hours=2)
+        retried_task = self.create_task(
+            succeeding_task,
+            status=ScheduledTask.STATUS_IN_PROGRESS,
+            attempts=1,
+            started_at=started_at,
+        )
+        failed_task = self.create_task(
+            succeeding_task,
+            status=ScheduledTask.STATUS_IN_PROGRESS,
+            attempts=3,
+            started_at=started_at,
+        )
+        running_task = self.create_task(
+            succeeding_task,
+            status=ScheduledTask.STATUS_IN_PROGRESS,
+            attempts=1,
+            started_at=NOW,
+        )
+        # past the soft time limit, but not past the hard time limit yet
+        cleaning_up_task = self.create_task(
+            succeeding_task,
+            status=ScheduledTask.STATUS_IN_PROGRESS,
+            attempts=1,
+            started_at=NOW - datetime.timedelta(seconds=30),
+        )
+
+        with self.settings(SCHEDULED_TASK_RUN_TIMEOUT=10):
+            self.assertEqual(2, release_timed_out_scheduled_tasks())
+
+        for task in [retried_task, failed_task, running_task, cleaning_up_task]:
+            task.refresh_from_db()
+        self.assertEqual(ScheduledTask.STATUS_PENDING, retried_task.status)
+        self.assertEqual(ScheduledTask.STATUS_FAILED, failed_task.status)
+        self.assertEqual(ScheduledTask.STATUS_IN_PROGRESS, running_task.status)
+        self.assertEqual(ScheduledTask.STATUS_IN_PROGRESS, cleaning_up_task.status)
+
+    def test_releaseTimedOutScheduledTasks_scheduledLongAgoAndJustClaimed_notReleased(
+        self,
+    ):
+        task = self.create_task(succeeding_task)
+        ScheduledTask.objects.filter(id=task.id).update(
+            updated_at=NOW - datetime.timedelta(days=30)
+        )
+        claim_due_scheduled_tasks(1)
+
+        self.assertEqual(0, release_timed_out_scheduled_tasks())
+
+        task.refresh_from_db()
+        self.assertEqual(ScheduledTask.STATUS_IN_PROGRESS, task.status)
+
+    def test_releaseTimedOutScheduledTasks_claimedButNeverStarted_released(self):
+        task = self.create_task(
+            succeeding_task, status=ScheduledTask.STATUS_IN_PROGRESS, attempts=1
+        )
+        ScheduledTask.objects.filter(id=task.id).update(
+            updated_at=NOW - datetime.timedelta(hours=2)
+        )
+
+        self.assertEqual(1, release_timed_out_scheduled_tasks())
+
+        task.refresh_from_db()
+        self.assertEqual(ScheduledTask.STATUS_PENDING, task.status)
+
+    def test_releaseTimedOutScheduledTasks_twoTasksWithSameDedupKey_onlyOneRetried(
+        self,
+    ):
+        tasks = [
+            ScheduledTask.objects.create(
+                task_function=f"{__name__}.{succeeding_task.__name__}",
+                task_args=["same"],
+                eta=NOW,
+                status=ScheduledTask.STATUS_IN_PROGRESS,
+                attempts=1,
+                started_at=NOW - datetime.timedelta(hours=2),
+            )
+            for _ in range(2)
+        ]
+
+        self.assertEqual(2, release_timed_out_scheduled_tasks())
+
+        self.assertEqual(
+            [ScheduledTask.STATUS_FAILED, ScheduledTask.STATUS_PENDING],
+            sorted(
+                ScheduledTask.objects.filter(
+                    id__in=[task.id for task in tasks]
+                ).values_list("status", flat=True)
+            ),
+        )
+
+    def test_executeScheduledTasks_moreDueTasksThanConcurrency_dispatchesOnlyFreeSlots(
+        self,
+    ):
+        self.create_task(succeeding_task, status=ScheduledTask.STATUS_IN_PROGRESS)
+        for _ in range(3):
+            self.create_task(succeeding_task)
+
+        with self.settings(SCHEDULED_TASK_CONCURRENCY=3), patch.object(
+            execute_scheduled_task, "apply_async"
+        ) as mock_apply_async:
+            execute_scheduled_tasks()
+
+        self.assertEqual(2, mock_apply_async.call_count)
+        self.assertEqual(
+            3,
+            ScheduledTask.objects.filter(
+                status=ScheduledTask.STATUS_IN_PROGRESS
+            ).count(),
+        )
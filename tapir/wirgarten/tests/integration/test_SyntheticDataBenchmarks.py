@@ -0,0 +1,125 @@
+import datetime
+
+from tapir.accounts.models import TapirUser
+from tapir.log.models import TextLogEntry
+from tapir.wirgarten.benchmarks.suite import (
+    BenchmarkResult,
+    find_regressions,
+    run_benchmarks,
+)
+from tapir.wirgarten.benchmarks.synthetic_data import (
+    SyntheticDataGenerator,
+    SyntheticDataSize,
+    clear_synthetic_data,
+)
+from tapir.wirgarten.models import (
+    CoopShareTransaction,
+    Member,
+    MemberSegmentMembership,
+    Subscription,
+)
+from tapir.wirgarten.parameters import ParameterDefinitions
+from tapir.wirgarten.tests.test_utils import (
+    TapirIntegrationTest,
+    mock_timezone,
+    set_bypass_keycloak,
+)
+
+SIZE = SyntheticDataSize(
+    members=30, pickup_locations=3, growing_periods=2, log_entries_per_member=2
+)
+
+
+class SyntheticDataGeneratorTest(TapirIntegrationTest):
+    def setUp(self):
+        super().setUp()
+        ParameterDefinitions().import_definitions()
+        set_bypass_keycloak()
+        mock_timezone(self, datetime.datetime(year=2024, month=5, day=15))
+
+    def test_generate_createsMembersWithTheirData(self):
+        created = SyntheticDataGenerator(SIZE, seed=1).generate()
+
+        self.assertEqual(30, Member.objects.count())
+        self.assertEqual(30, created["Member"])
+        self.assertEqual(60, TextLogEntry.objects.count())
+        self.assertEqual(created["Subscription"], Subscription.objects.count())
+        self.assertEqual(
+            30,
+            Member.objects.filter(coopsharetransaction__isnull=False)
+            .distinct()
+            .count(),
+        )
+        self.assertTrue(
+            MemberSegmentMembership.objects.filter(
+                segment=MemberSegmentMembership.SEGMENT_COOP_MEMBERS
+            ).exists()
+        )
+
+    def test_generate_sameSeed_sameDataset(self):
+        SyntheticDataGenerator(SIZE, seed=1).generate()
+        first_run = list(
+            Subscription.objects.order_by("id").values_list(
+                "id", "member_id", "product__name", "start_date", "quantity"
+            )
+        )
+        clear_synthetic_data()
+        SyntheticDataGenerator(SIZE, seed=1).generate()
+        second_run = list(
+            Subscription.objects.order_by("id").values_list(
+                "id", "member_id", "product__name", "start_date", "quantity"
+            )
+        )
+
+        self.assertEqual(first_run, second_run)
+
+    def test_clearSyntheticData_deletesAllGeneratedMembers(self):
+        SyntheticDataGenerator(SIZE, seed=1).generate()
+
+        clear_synthetic_data()
+
+        self.assertFalse(Member.objects.exists())
+        self.assertFalse(TapirUser.objects.exists())
+        self.assertFalse(CoopShareTransaction.objects.exists())
+        self.assertFalse(TextLogEntry.objects.exists())
+
+    def test_runBenchmarks_serviceFunctions_noErrors(self):
+        SyntheticDataGenerator(SIZE, seed=1).generate()
+
+        results = run_benchmarks(
+            [
+                "get_free_product_capacity",
+                "generate_new_payments",
+                "generate_future_deliveries",
+                "compute_dashboard_kpis",
+            ],
+            repeat=1,
+        )
+
+        self.assertEqual(4, len(results))
+        for result in results:
+            self.assertIsNone(result.error, result.name)
+            self.assertGreater(result.queries, 0)
+
+    def test_runBenchmarks_unknownName_raisesError(self):
+        with self.assertRaises(ValueError):
+            run_benchmarks(["unknown"])
+
+    def test_findRegressions_moreQueriesOrSlower_reported(self):
+        baseline = {
+            "same": {"seconds": 1.0, "queries": 10},
+            "more_queries": {"seconds": 1.0, "queries": 10},
+            "slower": {"seconds": 1.0, "queries": 10},
+        }
+        results = [
+            BenchmarkResult("same", seconds=1.1, queries=10),
+            BenchmarkResult("more_queries", seconds=1.0, queries=11),
+            BenchmarkResult("slower", seconds=1.5, queries=10),
+            BenchmarkResult("not_in_baseline", seconds=5.0, queries=100),
+        ]
+
+        regressions = find_regressions(results, baseline, threshold=0.2)
+
+        self.assertEqual(2, len(regressions))
+        self.assertTrue(regressions[0].startswith("more_queries"))
+        self.assertTrue(regressions[1].startswith("slower"))
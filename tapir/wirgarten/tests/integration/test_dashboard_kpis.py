@@ -0,0 +1,88 @@
+import datetime
+import json
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from tapir.configuration.models import TapirParameter
+from tapir.wirgarten.parameters import Parameter, ParameterDefinitions
+from tapir.wirgarten.service.dashboard import get_dashboard_kpis
+from tapir.wirgarten.tests.factories import (
+    CoopShareTransactionFactory,
+    GrowingPeriodFactory,
+    MemberFactory,
+    ProductCapacityFactory,
+    ProductFactory,
+    ProductPriceFactory,
+    SubscriptionFactory,
+)
+from tapir.wirgarten.tests.test_utils import (
+    TapirIntegrationTest,
+    mock_timezone,
+    set_bypass_keycloak,
+)
+
+
+class TestDashboardKpis(TapirIntegrationTest):
+    def setUp(self):
+        super().setUp()
+        ParameterDefinitions().import_definitions()
+        set_bypass_keycloak()
+        mock_timezone(self, datetime.datetime(year=2023, month=3, day=15))
+
+        self.growing_period = GrowingPeriodFactory.create(
+            start_date=datetime.date(year=2023, month=1, day=1),
+            end_date=datetime.date(year=2023, month=12, day=31),
+        )
+        self.product = ProductFactory.create()
+        ProductPriceFactory.create(
+            product=self.product, price=50, size=1, valid_from=datetime.date(2023, 1, 1)
+        )
+        ProductCapacityFactory.create(
+            period=self.growing_period, product_type=self.product.type, capacity=100
+        )
+        TapirParameter.objects.filter(key=Parameter.COOP_BASE_PRODUCT_TYPE).update(
+            value=self.product.type_id
+        )
+
+    def create_member_with_subscription(self, start_date: datetime.date):
+        member = MemberFactory.create()
+        CoopShareTransactionFactory.create(
+            member=member, valid_at=datetime.date(2023, 1, 1)
+        )
+        return SubscriptionFactory.create(
+            member=member,
+            period=self.growing_period,
+            product=self.product,
+            start_date=start_date,
+        )
+
+    def test_getDashboardKpis_default_countsActiveMembersAndNewContractsPerMonth(self):
+        self.create_member_with_subscription(datetime.date(2023, 2, 1))
+        subscription = self.create_member_with_subscription(datetime.date(2023, 3, 1))
+        subscription.cancellation_ts = datetime.datetime(2023, 3, 10)
+        subscription.save()
+
+        kpis = get_dashboard_kpis()
+
+        self.assertEqual(2, kpis["active_members"])
+        cancellations_data = json.loads(kpis["cancellations_data"])
+        # the last label is the next month, the one before the current month
+        self.assertEqual([1, 1, 0], cancellations_data[0]["data"][-3:])
+        self.assertEqual([0, 1, 0], cancellations_data[1]["data"][-3:])
+
+    def test_getDashboardKpis_calledTwice_secondCallUsesTheCache(self):
+        get_dashboard_kpis()
+
+        with CaptureQueriesContext(connection) as context:
+            get_dashboard_kpis()
+
+        self.assertEqual(0, len(context.captured_queries))
+
+    def test_getDashboardKpis_subscriptionCreated_snapshotIsRecomputed(self):
+        self.assertEqual(0, get_dashboard_kpis()["active_members"])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_member_with_subscription(datetime.date(2023, 2, 1))
+
+        self.assertEqual(1, get_dashboard_kpis()["active_members"])
@@ -0,0 +1,60 @@
+import csv
+import datetime
+
+from django.db import connection
+from django.http import StreamingHttpResponse
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from tapir.wirgarten.tests.factories import CoopShareTransactionFactory, MemberFactory
+from tapir.wirgarten.tests.test_utils import (
+    TapirIntegrationTest,
+    mock_timezone,
+    set_bypass_keycloak,
+)
+
+
+class TestExportCoopMemberList(TapirIntegrationTest):
+    def setUp(self):
+        super().setUp()
+        set_bypass_keycloak()
+        mock_timezone(self, datetime.datetime(year=2023, month=6, day=1))
+        self.client.force_login(MemberFactory.create(is_superuser=True))
+
+    def create_member_with_shares(self, quantities, valid_at):
+        member = MemberFactory.create()
+        for quantity in quantities:
+            CoopShareTransactionFactory.create(
+                member=member, quantity=quantity, valid_at=valid_at
+            )
+        return member
+
+    def get_exported_rows(self):
+        response = self.client.get(reverse("wirgarten:member_list_coop_export"))
+        self.assertIsInstance(response, StreamingHttpResponse)
+        content = b"".join(response.streaming_content).decode("utf-8")
+        return list(csv.DictReader(content.splitlines(), delimiter=";"))
+
+    def test_exportCoopMemberList_default_containsOnlyCurrentMembers(self):
+        member = self.create_member_with_shares([2, 3], datetime.date(2023, 1, 1))
+        self.create_member_with_shares([1], datetime.date(2023, 9, 1))
+
+        rows = self.get_exported_rows()
+
+        self.assertEqual([str(member.member_no)], [row["Nr"] for row in rows])
+        self.assertEqual("5", rows[0]["GAnteile gesamt"])
+
+    def test_exportCoopMemberList_moreMembers_sameNumberOfQueries(self):
+        self.create_member_with_shares([1], datetime.date(2023, 1, 1))
+        with CaptureQueriesContext(connection) as context:
+            self.get_exported_rows()
+        query_count = len(context.captured_queries)
+
+        for _ in range(5):
+            self.create_member_with_shares([1, 2], datetime.date(2023, 1, 1))
+
+        with CaptureQueriesContext(connection) as context:
+            rows = self.get_exported_rows()
+
+        self.assertEqual(6, len(rows))
+        self.assertEqual(query_count, len(context.captured_queries))
@@ -0,0 +1,123 @@
+import datetime
+from decimal import Decimal
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from tapir.wirgarten.models import Payment
+from tapir.wirgarten.parameters import ParameterDefinitions
+from tapir.wirgarten.service.payment import generate_new_payments
+from tapir.wirgarten.tasks import export_payment_parts_csv
+from tapir.wirgarten.tests.factories import (
+    GrowingPeriodFactory,
+    ProductCapacityFactory,
+    ProductFactory,
+    ProductPriceFactory,
+    SubscriptionFactory,
+)
+from tapir.wirgarten.tests.test_utils import (
+    TapirIntegrationTest,
+    mock_timezone,
+    set_bypass_keycloak,
+)
+
+
+class TestExportPaymentPartsCsv(TapirIntegrationTest):
+    def setUp(self):
+        super().setUp()
+        ParameterDefinitions().import_definitions()
+        set_bypass_keycloak()
+        mock_timezone(self, datetime.datetime(year=2023, month=3, day=1))
+
+        self.growing_period = GrowingPeriodFactory.create(
+            start_date=datetime.date(year=2023, month=1, day=1),
+            end_date=datetime.date(year=2023, month=12, day=31),
+        )
+        self.product = ProductFactory.create()
+        ProductPriceFactory.create(
+            product=self.product, price=10, valid_from=datetime.date(2023, 1, 1)
+        )
+        ProductCapacityFactory.create(
+            period=self.growing_period, product_type=self.product.type
+        )
+
+    def create_subscription(self, **kwargs):
+        return SubscriptionFactory.create(
+            period=self.growing_period,
+            product=self.product,
+            quantity=2,
+            solidarity_price=0.05,
+            **kwargs,
+        )
+
+    def test_generateNewPayments_severalSubscriptionsPerMandate_sumsTheirTotalPrices(
+        self,
+    ):
+        subscription = self.create_subscription()
+        self.create_subscription(
+            mandate_ref=subscription.mandate_ref, solidarity_price_absolute=3
+        )
+
+        payments = generate_new_payments(datetime.date(2023, 3, 15))
+
+        self.assertEqual(1, len(payments))
+        self.assertEqual(Decimal("44.00"), payments[0].amount)
+        self.assertEqual(subscription.mandate_ref_id, payments[0].mandate_ref_id)
+
+    def test_generateNewPayments_priceChangedBeforeDueDate_usesSamePricesAsTotalPrice(
+        self,
+    ):
+        ProductPriceFactory.create(
+            product=self.product, price=20, valid_from=datetime.date(2023, 3, 10)
+        )
+        # already started: the price of today, not the one of the due date
+        started_subscription = self.create_subscription(
+            start_date=datetime.date(2023, 1, 1), end_date=datetime.date(2023, 12, 31)
+        )
+        # starts in the future: the price at its start date
+        future_subscription = self.create_subscription(
+            start_date=datetime.date(2023, 4, 1), end_date=datetime.date(2023, 12, 31)
+        )
+
+        payments = generate_new_payments(datetime.date(2023, 4, 15))
+
+        amounts = {payment.mandate_ref_id: payment.amount for payment in payments}
+        self.assertEqual(
+            {
+                started_subscription.mandate_ref_id: Decimal("21.00"),
+                future_subscription.mandate_ref_id: Decimal("42.00"),
+            },
+            amounts,
+        )
+        for subscription in [started_subscription, future_subscription]:
+            self.assertEqual(
+                Decimal(subscription.total_price()).quantize(Decimal("0.01")),
+                amounts[subscription.mandate_ref_id],
+            )
+
+    def test_exportPaymentPartsCsv_default_persistsAndLinksPayments(self):
+        for _ in range(3):
+            self.create_subscription()
+
+        statistics = export_payment_parts_csv()
+
+        self.assertEqual(3, statistics["created_payments"])
+        payments = Payment.objects.filter(due_date__month=3)
+        self.assertEqual(3, payments.count())
+        self.assertFalse(payments.filter(transaction__isnull=True).exists())
+        self.assertEqual(1, len({payment.transaction_id for payment in payments}))
+
+    def test_exportPaymentPartsCsv_moreMandates_sameNumberOfQueries(self):
+        self.create_subscription()
+        with CaptureQueriesContext(connection) as context:
+            export_payment_parts_csv()
+        query_count = len(context.captured_queries)
+
+        Payment.objects.all().delete()
+        for _ in range(5):
+            self.create_subscription()
+
+        with CaptureQueriesContext(connection) as context:
+            export_payment_parts_csv()
+
+        self.assertEqual(query_count, len(context.captured_queries))
@@ -0,0 +1,98 @@
+import csv
+import datetime
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from tapir.wirgarten.models import ExportedFile
+from tapir.wirgarten.parameters import ParameterDefinitions
+from tapir.wirgarten.tasks import _export_pick_list
+from tapir.wirgarten.tests.factories import (
+    GrowingPeriodFactory,
+    MemberPickupLocationFactory,
+    PickupLocationFactory,
+    ProductFactory,
+    ProductPriceFactory,
+    ProductTypeFactory,
+    SubscriptionFactory,
+)
+from tapir.wirgarten.tests.test_utils import TapirIntegrationTest, mock_timezone
+
+
+class TestExportPickList(TapirIntegrationTest):
+    def setUp(self):
+        super().setUp()
+        ParameterDefinitions().import_definitions()
+        mock_timezone(self, datetime.datetime(year=2023, month=3, day=15))
+
+        self.growing_period = growing_period = GrowingPeriodFactory.create(
+            start_date=datetime.date(year=2023, month=1, day=1),
+            end_date=datetime.date(year=2023, month=12, day=31),
+        )
+        self.product_type = ProductTypeFactory.create(name="Ernteanteile")
+        self.product_m = product_m = ProductFactory.create(
+            type=self.product_type, name="M", base=True
+        )
+        product_l = ProductFactory.create(type=self.product_type, name="L", base=False)
+        ProductPriceFactory.create(
+            product=product_m, price=10, size=1, valid_from=growing_period.start_date
+        )
+        ProductPriceFactory.create(
+            product=product_l, price=20, size=2, valid_from=growing_period.start_date
+        )
+
+        location_a = PickupLocationFactory.create(name="A")
+        location_b = PickupLocationFactory.create(name="B")
+        for pickup_location, product, quantity in [
+            (location_a, product_m, 2),
+            (location_a, product_l, 1),
+            (location_b, product_l, 3),
+            (location_b, product_l, 1),
+        ]:
+            subscription = SubscriptionFactory.create(
+                period=growing_period, product=product, quantity=quantity
+            )
+            MemberPickupLocationFactory.create(
+                member=subscription.member,
+                pickup_location=pickup_location,
+                valid_from=growing_period.start_date,
+            )
+
+    def get_exported_rows(self):
+        exported_file = ExportedFile.objects.get()
+        return list(
+            csv.DictReader(
+                bytes(exported_file.file).decode("utf-8").splitlines(),
+                delimiter=";",
+            )
+        )
+
+    def test_exportPickList_default_sumsQuantitiesPerPickupLocationAndVariant(self):
+        _export_pick_list(self.product_type, include_equivalents=True)
+
+        rows = self.get_exported_rows()
+        self.assertEqual(
+            [("A", "2", "1"), ("B", "", "4")],
+            [(row["Abholort"], row["M"], row["L"]) for row in rows],
+        )
+        self.assertEqual([4, 8], [float(row["M-Äquivalent"]) for row in rows])
+
+    def test_exportPickList_moreSubscriptions_sameNumberOfQueries(self):
+        with CaptureQueriesContext(connection) as context:
+            _export_pick_list(self.product_type, include_equivalents=False)
+        query_count = len(context.captured_queries)
+
+        for _ in range(5):
+            subscription = SubscriptionFactory.create(
+                period=self.growing_period, product=self.product_m
+            )
+            MemberPickupLocationFactory.create(
+                member=subscription.member,
+                valid_from=self.growing_period.start_date,
+            )
+        ExportedFile.objects.all().delete()
+
+        with CaptureQueriesContext(connection) as context:
+            _export_pick_list(self.product_type, include_equivalents=False)
+
+        self.assertEqual(query_count, len(context.captured_queries))
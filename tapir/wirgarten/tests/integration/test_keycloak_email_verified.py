@@ -0,0 +1,75 @@
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from tapir.accounts.middleware import KeycloakMiddleware
+from tapir.wirgarten.models import Member
+from tapir.wirgarten.parameters import ParameterDefinitions
+from tapir.wirgarten.tests.factories import MemberFactory
+from tapir.wirgarten.tests.fake_keycloak import mock_keycloak
+from tapir.wirgarten.tests.test_utils import TapirIntegrationTest, set_bypass_keycloak
+from tapir.wirgarten.views.member.list.member_list import MemberFilter
+
+
+class TestKeycloakEmailVerified(TapirIntegrationTest):
+    def setUp(self):
+        super().setUp()
+        ParameterDefinitions().import_definitions()
+        set_bypass_keycloak()
+        self.fake_keycloak = mock_keycloak(self)
+
+    def create_member(self, email_verified: bool) -> Member:
+        member = MemberFactory.create()
+        member.keycloak_id = self.fake_keycloak.add_user(member.email, email_verified)
+        member.save(bypass_keycloak=True)
+        return member
+
+    def test_syncEmailVerifiedFromKeycloak_severalPages_updatesAllUsers(self):
+        verified_members = [self.create_member(True) for _ in range(3)]
+        unverified_member = self.create_member(False)
+
+        statistics = Member.sync_email_verified_from_keycloak(page_size=2)
+
+        self.assertEqual({"keycloak_users": 4, "updated_users": 3}, statistics)
+        self.assertEqual(
+            3, len([r for r in self.fake_keycloak.requests if r[0] == "get_users"])
+        )
+        self.assertEqual(
+            {member.id for member in verified_members},
+            set(
+                Member.objects.filter(keycloak_email_verified=True).values_list(
+                    "id", flat=True
+                )
+            ),
+        )
+        unverified_member.refresh_from_db()
+        self.assertFalse(unverified_member.keycloak_email_verified)
+
+    def test_filterEmailVerified_default_filtersWithoutKeycloakRequests(self):
+        verified_member = self.create_member(True)
+        self.create_member(False)
+        Member.sync_email_verified_from_keycloak()
+        self.fake_keycloak.requests.clear()
+
+        member_filter = MemberFilter(
+            {"email_verified": "True"}, queryset=Member.objects.all()
+        )
+
+        with CaptureQueriesContext(connection) as context:
+            members = list(member_filter.qs)
+
+        self.assertEqual([verified_member], members)
+        self.assertEqual(1, len(context.captured_queries))
+        self.assertEqual([], self.fake_keycloak.requests)
+
+    def test_setUser_emailVerifiedClaim_updatesLocalFlag(self):
+        member = self.create_member(False)
+        request = RequestFactory().get("/")
+
+        KeycloakMiddleware(lambda r: None).set_user(
+            request, {"sub": member.keycloak_id, "email_verified": True}
+        )
+
+        member.refresh_from_db()
+        self.assertTrue(member.keycloak_email_verified)
+        self.assertTrue(request.user.email_verified)
@@ -0,0 +1,84 @@
+import datetime
+
+from tapir.wirgarten.models import ScheduledTask
+from tapir.wirgarten.service.tasks import (
+    prune_finished_scheduled_tasks,
+    schedule_task_unique,
+)
+from tapir.wirgarten.tests.test_utils import TapirIntegrationTest, mock_timezone
+
+NOW = datetime.datetime(year=2023, month=6, day=1, hour=12)
+
+
+def reminder_task(member_id):
+    pass
+
+
+class TestScheduleTaskUnique(TapirIntegrationTest):
+    def setUp(self):
+        super().setUp()
+        mock_timezone(self, NOW)
+
+    def test_scheduleTaskUnique_samePendingTaskExists_movesItsEta(self):
+        first = schedule_task_unique(
+            reminder_task, eta=NOW, kwargs={"member_id": "member_1"}
+        )
+        later_eta = NOW + datetime.timedelta(days=3)
+
+        second = schedule_task_unique(
+            reminder_task, eta=later_eta, kwargs={"member_id": "member_1"}
+        )
+
+        self.assertEqual(first.id, second.id)
+        self.assertEqual(1, ScheduledTask.objects.count())
+        self.assertEqual(later_eta, ScheduledTask.objects.get().eta)
+
+    def test_scheduleTaskUnique_differentArguments_createsSeparateTasks(self):
+        schedule_task_unique(reminder_task, eta=NOW, kwargs={"member_id": "member_1"})
+        schedule_task_unique(reminder_task, eta=NOW, kwargs={"member_id": "member_2"})
+
+        self.assertEqual(2, ScheduledTask.objects.count())
+
+    def test_scheduleTaskUnique_sameTaskAlreadyDone_createsNewPendingTask(self):
+        done_task = schedule_task_unique(
+            reminder_task, eta=NOW, kwargs={"member_id": "member_1"}
+        )
+        done_task.status = ScheduledTask.STATUS_DONE
+        done_task.save()
+
+        new_task = schedule_task_unique(
+            reminder_task, eta=NOW, kwargs={"member_id": "member_1"}
+        )
+
+        self.assertNotEqual(done_task.id, new_task.id)
+        self.assertEqual(done_task.dedup_key, new_task.dedup_key)
+        self.assertEqual(ScheduledTask.STATUS_PENDING, new_task.status)
+
+    def test_pruneFinishedScheduledTasks_default_deletesOnlyOldFinishedTasks(self):
+        for index, status in enumerate(
+            [
+                ScheduledTask.STATUS_DONE,
+                ScheduledTask.STATUS_FAILED,
+                ScheduledTask.STATUS_PENDING,
+            ]
+        ):
+            schedule_task_unique(
+                reminder_task, eta=NOW, kwargs={"member_id": f"member_{index}"}
+            )
+            ScheduledTask.objects.filter(
+                task_kwargs={"member_id": f"member_{index}"}
+            ).update(status=status)
+        mock_timezone(self, NOW + datetime.timedelta(days=365))
+        recent_task = schedule_task_unique(
+            reminder_task, eta=NOW, kwargs={"member_id": "member_recent"}
+        )
+        ScheduledTask.objects.filter(id=recent_task.id).update(
+            status=ScheduledTask.STATUS_DONE
+        )
+
+        self.assertEqual(2, prune_finished_scheduled_tasks(batch_size=1))
+
+        self.assertEqual(
+            {"member_2", "member_recent"},
+            {task.task_kwargs["member_id"] for task in ScheduledTask.objects.all()},
+        )
@@ -0,0 +1,85 @@
+import datetime
+
+from django.urls import reverse
+
+from tapir.configuration.models import TapirParameter
+from tapir.wirgarten.parameters import Parameter, ParameterDefinitions
+from tapir.wirgarten.tests.factories import (
+    CoopShareTransactionFactory,
+    GrowingPeriodFactory,
+    MemberFactory,
+    MemberPickupLocationFactory,
+    PickupLocationFactory,
+    ProductCapacityFactory,
+    ProductFactory,
+    ProductPriceFactory,
+    ProductTypeFactory,
+    SubscriptionFactory,
+)
+from tapir.wirgarten.tests.test_utils import (
+    TapirIntegrationTest,
+    mock_timezone,
+    set_bypass_keycloak,
+)
+
+MEMBER_COUNT = 40
+
+
+class TestViewQueryBudgets(TapirIntegrationTest):
+    """
+    The tests run with QUERY_BUDGET_STRICT, so a request above the budget of its view (see QUERY_BUDGETS) fails.
+    """
+
+    def setUp(self):
+        super().setUp()
+        ParameterDefinitions().import_definitions()
+        set_bypass_keycloak()
+        mock_timezone(self, datetime.datetime(year=2023, month=6, day=1))
+
+        growing_period = GrowingPeriodFactory.create(
+            start_date=datetime.date(year=2023, month=1, day=1),
+            end_date=datetime.date(year=2023, month=12, day=31),
+        )
+        product_type = ProductTypeFactory.create()
+        TapirParameter.objects.filter(key=Parameter.COOP_BASE_PRODUCT_TYPE).update(
+            value=product_type.id
+        )
+        ProductCapacityFactory.create(
+            period=growing_period, product_type=product_type, capacity=1000
+        )
+        products = [ProductFactory.create(type=product_type) for _ in range(2)]
+        for product in products:
+            ProductPriceFactory.create(
+                product=product, valid_from=growing_period.start_date
+            )
+        pickup_location = PickupLocationFactory.create()
+
+        for index in range(MEMBER_COUNT):
+            member = MemberFactory.create()
+            CoopShareTransactionFactory.create(
+                member=member, valid_at=datetime.date(year=2022, month=12, day=1)
+            )
+            SubscriptionFactory.create(
+                member=member,
+                period=growing_period,
+                product=products[index % len(products)],
+            )
+            MemberPickupLocationFactory.create(
+                member=member,
+                pickup_location=pickup_location,
+                valid_from=growing_period.start_date,
+            )
+
+        self.client.force_login(MemberFactory.create(is_superuser=True))
+
+    def test_memberList_severalDozenMembers_withinQueryBudget(self):
+        response = self.client.get(reverse("wirgarten:member_list"))
+
+        self.assertStatusCode(response, 200)
+        self.assertEqual(20, len(response.context_data["object_list"]))
+
+    def test_adminDashboard_severalDozenMembers_withinQueryBudget(self):
+        response = self.client.get(reverse("wirgarten:admin_dashboard"))
+
+        self.assertStatusCode(response, 200)
+        self.assertEqual(MEMBER_COUNT, response.context_data["active_members"])
@@ -4,11 +4,11 @@ from unittest.mock import patch
 
 import factory.random
 from django.core.cache import cache
-from django.test import TestCase, Client, SimpleTestCase
+from django.test import TestCase, Client, SimpleTestCase, override_settings
 from rest_framework.test import APIClient
 
 from tapir.configuration.models import TapirParameterDatatype
-from tapir.configuration.parameter import parameter_definition
+from tapir.configuration.parameter import parameter_definition, parameter_cache
 from tapir.wirgarten.parameters import Parameter
 from tapir.wirgarten.tapirmail import configure_mail_module
 
@@ -18,6 +18,8 @@ class TapirFactoryMixin:
         factory.random.reseed_random(self.__class__.__name__)
 
 
+# views above their query budget fail the test instead of only being logged
+@override_settings(QUERY_BUDGET_STRICT=True)
 class TapirIntegrationTest(TapirFactoryMixin, TestCase):
     def setUp(self) -> None:
         super().setUp()
@@ -25,6 +27,7 @@ class TapirIntegrationTest(TapirFactoryMixin, TestCase):
         self.client = Client()
         self.apiClient = APIClient()
         cache.clear()
+        parameter_cache.clear()
         configure_mail_module()
 
     def assertStatusCode(self, response, expected_status_code):
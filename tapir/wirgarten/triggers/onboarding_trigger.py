@@ -1,8 +1,13 @@
 import logging
+import threading
 from dataclasses import dataclass
+from datetime import date, datetime
 
 from dateutil.relativedelta import relativedelta
-from django.db import models, transaction
+from django.db import transaction
+from django.db.models import Min, Q
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
 from django.utils import timezone
 from tapir_mail.models import (
     EmailConfigurationDispatch,
@@ -18,6 +23,9 @@ from tapir.wirgarten.utils import get_now
 
 LOG = logging.getLogger(__name__)
 
+# number of dispatches deleted or created per query
+DISPATCH_BATCH_SIZE = 500
+
 
 @dataclass
 class OnboardingTriggerData:
@@ -41,10 +49,8 @@ class OnboardingTrigger(Trigger[OnboardingTriggerData]):
         email_configuration_version: EmailConfigurationVersion,
         trigger_data: OnboardingTriggerData,
     ):
-        for recipient in resolve_segments(**email_configuration_version.segment_data):
-            cls._delete_unsent_config_dispatch(
-                version=email_configuration_version, recipient=recipient
-            )
+        recipients = list(resolve_segments(**email_configuration_version.segment_data))
+        for recipient in recipients:
             if not hasattr(recipient, "subscription_set"):
                 LOG.warning(
                     f"Recipient can't receive trigger because of a missing attribute."
@@ -52,17 +58,20 @@ class OnboardingTrigger(Trigger[OnboardingTriggerData]):
                     f"\n\tTrigger: {cls}"
                     f"\n\tAttribute: subscription_set"
                 )
-                continue
 
-            cls._create_new_config_dispatch(
-                version=email_configuration_version,
-                recipient=recipient,
-                trigger_data=trigger_data,
-            )
+        cls._replace_unsent_config_dispatches(
+            versions=[(email_configuration_version, trigger_data)],
+            recipients=recipients,
+        )
 
     @classmethod
     @transaction.atomic
-    def on_subscription_updated(cls, subscription: Subscription):
+    def on_subscriptions_updated(cls, member_ids: list[str]):
+        """
+        Schedules the onboarding emails of the given members again, for all released email configurations.
+        The number of queries doesn't depend on the number of members.
+        """
+        versions = []
         for version in EmailConfigurationVersion.objects.filter(
             status=ReleaseStatus.RELEASED
         ):
@@ -80,57 +89,91 @@ class OnboardingTrigger(Trigger[OnboardingTriggerData]):
                     f"Trigger data not found for trigger {cls.get_id()}, EmailConfigurationVersion#{version.id}"
                 )
                 continue
+            versions.append((version, trigger_data))
 
-            cls._delete_unsent_config_dispatch(
-                version=version, recipient=subscription.member
-            )
-            cls._create_new_config_dispatch(
-                version=version,
-                recipient=subscription.member,
-                trigger_data=trigger_data,
-            )
+        if not versions:
+            return
 
-    @classmethod
-    def _delete_unsent_config_dispatch(
-        cls, version: EmailConfigurationVersion, recipient: Member
-    ):
-        EmailConfigurationDispatch.objects.filter(
-            email_configuration_version=version,
-            override_recipients=[recipient.email],
-            is_sent=False,
-        ).delete()
+        cls._replace_unsent_config_dispatches(
+            versions=versions,
+            recipients=list(
+                Member.objects.filter(id__in=member_ids).only("id", "email")
+            ),
+        )
 
     @classmethod
-    def _create_new_config_dispatch(
+    def _replace_unsent_config_dispatches(
         cls,
-        version: EmailConfigurationVersion,
-        recipient: Member,
-        trigger_data: OnboardingTriggerData,
+        versions: list[tuple[EmailConfigurationVersion, OnboardingTriggerData]],
+        recipients: list,
     ):
-        first_subscription = recipient.subscription_set.order_by("start_date").first()
-        if not first_subscription:
-            return
+        version_ids = [version.id for version, _ in versions]
+        emails = [recipient.email for recipient in recipients]
+        for start in range(0, len(emails), DISPATCH_BATCH_SIZE):
+            recipients_filter = Q()
+            for email in emails[start : start + DISPATCH_BATCH_SIZE]:
+                recipients_filter |= Q(override_recipients=[email])
+            EmailConfigurationDispatch.objects.filter(
+                recipients_filter,
+                email_configuration_version_id__in=version_ids,
+                is_sent=False,
+            ).delete()
+
+        members = [
+            recipient
+            for recipient in recipients
+            if hasattr(recipient, "subscription_set")
+        ]
+        first_subscription_start_dates = dict(
+            Subscription.objects.filter(member_id__in=[member.id for member in members])
+            .values("member_id")
+            .annotate(first_start_date=Min("start_date"))
+            .values_list("member_id", "first_start_date")
+        )
+
+        first_delivery_dates = {}
+        now = get_now()
+        dispatches = []
+        for member in members:
+            start_date = first_subscription_start_dates.get(member.id)
+            if start_date is None:
+                continue
+            if start_date not in first_delivery_dates:
+                first_delivery_dates[start_date] = get_next_delivery_date(start_date)
+
+            for version, trigger_data in versions:
+                scheduled_time = cls._get_scheduled_time(
+                    first_delivery_dates[start_date], trigger_data
+                )
+                # don't dispatch if scheduled time is in the past
+                if scheduled_time < now:
+                    continue
+
+                dispatches.append(
+                    EmailConfigurationDispatch(
+                        email_configuration_version=version,
+                        override_recipients=[member.email],
+                        scheduled_time=scheduled_time,
+                        is_sent=False,
+                    )
+                )
+
+        EmailConfigurationDispatch.objects.bulk_create(
+            dispatches, batch_size=DISPATCH_BATCH_SIZE
+        )
 
-        first_delivery_date = get_next_delivery_date(first_subscription.start_date)
+    @staticmethod
+    def _get_scheduled_time(
+        first_delivery_date: date, trigger_data: OnboardingTriggerData
+    ) -> datetime:
         weeks_offset = int(trigger_data["delivery"])
         days_offset = int(trigger_data["days_offset"])
         target_delivery_date = first_delivery_date + relativedelta(weeks=weeks_offset)
 
-        scheduled_time = timezone.make_aware(
+        return timezone.make_aware(
             target_delivery_date + relativedelta(days=days_offset, hour=12)
         )
 
-        # don't dispatch if scheduled time is in the past
-        if scheduled_time < get_now():
-            return
-
-        EmailConfigurationDispatch.objects.create(
-            email_configuration_version=version,
-            override_recipients=[recipient.email],
-            scheduled_time=scheduled_time,
-            is_sent=False,
-        )
-
     @classmethod
     def validate_field_values_and_return_object(cls, field_values):
         return field_values
@@ -157,9 +200,65 @@ class OnboardingTrigger(Trigger[OnboardingTriggerData]):
         ]
 
 
-models.signals.post_save.connect(
-    receiver=lambda instance, **kwargs: OnboardingTrigger.on_subscription_updated(
-        instance
-    ),
-    sender=Subscription,
-)
+# members whose onboarding emails must be scheduled again, collected per thread until the transaction is committed
+_pending_member_ids = threading.local()
+
+
+def queue_onboarding_update(member_id: str):
+    """
+    Schedules the onboarding emails of the member again once the current transaction is committed, in a celery task.
+    All members queued in the same transaction are handled by a single task.
+    """
+    member_ids = getattr(_pending_member_ids, "member_ids", None)
+    if member_ids is None:
+        member_ids = _pending_member_ids.member_ids = set()
+    member_ids.add(member_id)
+    transaction.on_commit(_dispatch_onboarding_updates)
+
+
+def _dispatch_onboarding_updates():
+    # the first callback of the transaction takes all queued members, the others find nothing left.
+    # Members left over from a rolled back transaction are handled with the next one, which does no harm.
+    member_ids = getattr(_pending_member_ids, "member_ids", None)
+    if not member_ids:
+        return
+    _pending_member_ids.member_ids = None
+
+    from tapir.wirgarten.tasks import update_onboarding_triggers
+
+    try:
+        update_onboarding_triggers.delay(sorted(member_ids))
+    except Exception as e:
+        print("Could not queue the onboarding trigger update, running it now: ", e)
+        OnboardingTrigger.on_subscriptions_updated(sorted(member_ids))
+
+
+@receiver(pre_save, sender=Subscription)
+def on_subscription_pre_save(instance: Subscription, raw=False, **kwargs):
+    previous_start_date = None
+    if not raw and not instance._state.adding:
+        previous_start_date = (
+            Subscription.objects.filter(id=instance.id)
+            .values_list("start_date", flat=True)
+            .first()
+        )
+    instance._onboarding_previous_start_date = previous_start_date
+
+
+@receiver(post_save, sender=Subscription)
+def on_subscription_saved(instance: Subscription, created=False, raw=False, **kwargs):
+    if raw:
+        return
+    if (
+        not created
+        and getattr(instance, "_onboarding_previous_start_date", None)
+        == instance.start_date
+    ):
+        # the onboarding emails only depend on the start dates
+        return
+    queue_onboarding_update(instance.member_id)
+
+
+@receiver(post_delete, sender=Subscription)
+def on_subscription_deleted(instance: Subscription, **kwargs):
+    queue_onboarding_update(instance.member_id)
@@ -1,6 +1,7 @@
 from django.urls import path
 
 from tapir.wirgarten.views import exported_files
+from tapir.wirgarten.views.admin_dashboard import export_cashflow_projection
 from tapir.wirgarten.views.contracts import (
     ExportSubscriptionList,
     NewContractsView,
@@ -133,6 +134,11 @@ urlpatterns = [
         dynamic_view("admin_dashboard_cashflow_data"),
         name="admin_dashboard_cashflow_data",
     ),
+    path(
+        "admin/dashboard/data/cashflow/export",
+        export_cashflow_projection,
+        name="admin_dashboard_cashflow_export",
+    ),
     path(
         "admin/exportedfiles",
         exported_files.ExportedFilesListView.as_view(),
@@ -7,7 +7,7 @@ from django.contrib.auth.mixins import PermissionRequiredMixin
 from django.db import transaction
 from django.db.models import OuterRef, Subquery, Sum
 from django.forms import CheckboxInput
-from django.http import HttpResponse, HttpResponseRedirect
+from django.http import HttpResponseRedirect, StreamingHttpResponse
 from django.urls import reverse_lazy
 from django.utils.translation import gettext_lazy as _
 from django.views.generic import TemplateView, View
@@ -27,6 +27,7 @@ from tapir.wirgarten.models import (
     Subscription,
 )
 from tapir.wirgarten.parameters import Parameter
+from tapir.wirgarten.service.file_export import get_queryset_chunks, stream_csv_rows
 from tapir.wirgarten.service.member import (
     annotate_member_queryset_with_coop_shares_total_value,
 )
@@ -167,9 +168,8 @@ class SubscriptionListFilter(FilterSet):
             latest_pickup_location_subquery = Subquery(
                 MemberPickupLocation.objects.filter(
                     member_id=OuterRef("member_id"),  # references Member.id
-                    valid_from__lte=get_today(),
                 )
-                .order_by("-valid_from")[:1]
+                .valid_at(get_today())[:1]
                 .values("id")
             )
 
@@ -270,43 +270,41 @@ class ExportSubscriptionList(View):
     def get(self, request, *args, **kwargs):
         # Get queryset based on filters and ordering
         filter_class = SubscriptionListFilter
-        queryset = filter_class(request.GET, queryset=self.get_queryset()).qs
-
-        # Create response object with CSV content
-        response = HttpResponse(content_type="text/csv")
-        response["Content-Disposition"] = (
-            f'attachment; filename="Verträge_gefiltert_{get_now().strftime("%Y%m%d_%H%M%S")}.csv"'
-        )
-        writer = csv.writer(response, delimiter=";", quoting=csv.QUOTE_ALL)
-
-        # Write header row
-        writer.writerow(
-            [
-                "Mitgliedsnr.",
-                "Vorname",
-                "Nachname",
-                "Email",
-                "Abgeschlossen am",
-                "Gekündigt am",
-                "Vertragsbeginn",
-                "Vertragsende",
-                "Produkt",
-                "Variante",
-                "Solipreis",
-                "Abholort",
-            ]
-        )
-
-        # Write data rows
-        for sub in queryset:
-            soliprice_str = (
-                f"{sub.solidarity_price_absolute} €"
-                if sub.solidarity_price_absolute
-                else (f"{sub.solidarity_price * 100} %" if sub.solidarity_price else "")
-            )
-            for _ in range(sub.quantity):
-                writer.writerow(
-                    [
+        queryset = filter_class(
+            request.GET, queryset=self.get_queryset()
+        ).qs.select_related("member", "product__type")
+
+        header = [
+            "Mitgliedsnr.",
+            "Vorname",
+            "Nachname",
+            "Email",
+            "Abgeschlossen am",
+            "Gekündigt am",
+            "Vertragsbeginn",
+            "Vertragsende",
+            "Produkt",
+            "Variante",
+            "Solipreis",
+            "Abholort",
+        ]
+
+        def generate_rows():
+            for chunk in get_queryset_chunks(queryset):
+                pickup_locations = MemberPickupLocation.get_pickup_locations(
+                    {sub.member_id for sub in chunk}
+                )
+                for sub in chunk:
+                    soliprice_str = (
+                        f"{sub.solidarity_price_absolute} €"
+                        if sub.solidarity_price_absolute
+                        else (
+                            f"{sub.solidarity_price * 100} %"
+                            if sub.solidarity_price
+                            else ""
+                        )
+                    )
+                    row = [
                         sub.member.member_no,
                         sub.member.first_name,
                         sub.member.last_name,
@@ -319,13 +317,21 @@ class ExportSubscriptionList(View):
                         sub.product.name,
                         soliprice_str,
                         (
-                            sub.member.pickup_location.name
-                            if sub.member.pickup_location
+                            pickup_locations[sub.member_id].name
+                            if sub.member_id in pickup_locations
                             else ""
                         ),
                     ]
-                )
+                    for _ in range(sub.quantity):
+                        yield row
 
+        response = StreamingHttpResponse(
+            stream_csv_rows(header, generate_rows(), quoting=csv.QUOTE_ALL),
+            content_type="text/csv",
+        )
+        response["Content-Disposition"] = (
+            f'attachment; filename="Verträge_gefiltert_{get_now().strftime("%Y%m%d_%H%M%S")}.csv"'
+        )
         return response
 
     def get_queryset(self):
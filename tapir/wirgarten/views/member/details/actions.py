@@ -1,5 +1,6 @@
 import base64
 import json
+from functools import partial
 
 from dateutil.relativedelta import relativedelta
 from django.conf import settings
@@ -21,6 +22,8 @@ from tapir.wirgarten.models import (
     SubscriptionChangeLogEntry,
 )
 from tapir.wirgarten.parameters import Parameter
+from tapir.wirgarten.service.capacity_ledger import on_subscriptions_bulk_created
+from tapir.wirgarten.service.delivery import invalidate_member_deliveries
 from tapir.wirgarten.service.email import send_email
 from tapir.wirgarten.service.member import send_order_confirmation
 from tapir.wirgarten.service.products import (
@@ -29,6 +32,7 @@ from tapir.wirgarten.service.products import (
     get_future_subscriptions,
     get_next_growing_period,
 )
+from tapir.wirgarten.service.segment_membership import update_segment_memberships
 from tapir.wirgarten.tapirmail import Events
 from tapir.wirgarten.utils import format_date, get_now, member_detail_url
 
@@ -115,6 +119,10 @@ def renew_contract_same_conditions(request, **kwargs):
             )
 
     Subscription.objects.bulk_create(new_subs)
+    on_subscriptions_bulk_created(new_subs)
+    # bulk_create doesn't send post_save, which invalidates the cached deliveries otherwise
+    transaction.on_commit(partial(invalidate_member_deliveries, member_id))
+    update_segment_memberships([member_id])
 
     member = Member.objects.get(id=member_id)
     member.sepa_consent = get_now()
@@ -23,6 +23,7 @@ from tapir.wirgarten.service.payment import (
     get_active_subscriptions_grouped_by_product_type,
     get_next_payment_date,
 )
+from tapir.wirgarten.service.payment_timeline import MemberPaymentTimeline
 from tapir.wirgarten.service.products import (
     get_active_product_types,
     get_active_subscriptions,
@@ -31,10 +32,6 @@ from tapir.wirgarten.service.products import (
     get_next_growing_period,
 )
 from tapir.wirgarten.utils import format_date, get_today
-from tapir.wirgarten.views.member.list.member_payments import (
-    generate_future_payments,
-    get_previous_payments,
-)
 from tapir.wirgarten.views.mixin import PermissionOrSelfRequiredMixin
 
 
@@ -113,10 +110,11 @@ class MemberDetailView(PermissionOrSelfRequiredMixin, generic.DetailView):
         # FIXME: it should be easier than this to get the next payments, refactor to service somehow
         next_due_date = get_next_payment_date()
 
-        persisted_payments = get_previous_payments(self.object.pk)
+        payment_timeline = MemberPaymentTimeline(self.object.pk)
+        persisted_payments = payment_timeline.get_previous_payments()
         next_payments = persisted_payments.get(next_due_date, [])
 
-        projected = generate_future_payments(self.object.id, 2)
+        projected = payment_timeline.get_future_payments(2)
         if len(projected) > 0:
             projected = projected.get(next_due_date, [])
             for p in projected:
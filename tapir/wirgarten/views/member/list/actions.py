@@ -1,10 +1,10 @@
-import csv
 import mimetypes
+from collections import defaultdict
 
 from django.conf import settings
 from django.contrib.auth.decorators import permission_required
-from django.db.models import Count, Max, Q, Sum
-from django.http import HttpResponse, HttpResponseRedirect
+from django.db.models import Count, Max, Prefetch, Q
+from django.http import HttpResponseRedirect, StreamingHttpResponse
 from django.urls import reverse_lazy
 from django.views.decorators.csrf import csrf_protect
 from django.views.decorators.http import require_GET
@@ -12,7 +12,13 @@ from django.views.generic import View
 
 from tapir.wirgarten.constants import Permission
 from tapir.wirgarten.models import CoopShareTransaction, Member
-from tapir.wirgarten.service.file_export import begin_csv_string
+from tapir.wirgarten.service.file_export import (
+    get_queryset_chunks,
+    iterate_in_chunks,
+    stream_csv,
+    stream_csv_rows,
+)
+from tapir.wirgarten.service.member_computed_fields import load_member_computed_fields
 from tapir.wirgarten.utils import format_currency, format_date, get_now, get_today
 from tapir.wirgarten.views.member.list.member_list import MemberFilter, MemberListView
 
@@ -67,124 +73,152 @@ def export_coop_member_list(request, **kwargs):
         share_cols[f"KEY_COOP_SHARES_{i}_EURO"] = f"GAnteile in € {i}. Zeichnung"
         share_cols[f"KEY_COOP_SHARES_{i}_ENTRY_DATE"] = f"Eintrittsdatum {i}. Zeichnung"
 
-    output, writer = begin_csv_string(
-        [
-            KEY_MEMBER_NO,
-            KEY_FIRST_NAME,
-            KEY_LAST_NAME,
-            KEY_ADDRESS,
-            KEY_ADDRESS2,
-            KEY_POSTCODE,
-            KEY_CITY,
-            KEY_BIRTHDATE,
-            KEY_TELEPHONE,
-            KEY_EMAIL,
-            KEY_COOP_SHARES_TOTAL,
-            KEY_COOP_SHARES_TOTAL_EURO,
-            *share_cols.values(),
-            KEY_COOP_SHARES_CANCELLATION_DATE,
-            KEY_COOP_SHARES_CANCELLATION_AMOUNT,
-            KEY_COOP_SHARES_CANCELLATION_CONTRACT_END_DATE,
-            KEY_COOP_SHARES_TRANSFER_EURO,
-            KEY_COOP_SHARES_TRANSFER_FROM_TO,
-            KEY_COOP_SHARES_TRANSFER_DATE,
-            KEY_COOP_SHARES_PAYBACK_EURO,
-            KEY_COMMENT,
-        ]
-    )
-    for entry in Member.objects.order_by("member_no"):
-        coop_shares = entry.coopsharetransaction_set.filter(
-            transaction_type=CoopShareTransaction.CoopShareTransactionType.PURCHASE
-        ).order_by("timestamp")
-        cancelled_coop_shares = entry.coopsharetransaction_set.filter(
-            transaction_type=CoopShareTransaction.CoopShareTransactionType.CANCELLATION
-        ).order_by("timestamp")
-        cancelled_coop_shares_dates = "\n".join(
-            [format_date(t.timestamp) for t in cancelled_coop_shares]
-        )
-        cancelled_coop_shares_amounts = "\n".join(
-            [format_currency(t.total_price) for t in cancelled_coop_shares]
-        )
-        cancelled_coop_shares_valid_at = "\n".join(
-            [format_date(t.valid_at) for t in cancelled_coop_shares]
+    field_names = [
+        KEY_MEMBER_NO,
+        KEY_FIRST_NAME,
+        KEY_LAST_NAME,
+        KEY_ADDRESS,
+        KEY_ADDRESS2,
+        KEY_POSTCODE,
+        KEY_CITY,
+        KEY_BIRTHDATE,
+        KEY_TELEPHONE,
+        KEY_EMAIL,
+        KEY_COOP_SHARES_TOTAL,
+        KEY_COOP_SHARES_TOTAL_EURO,
+        *share_cols.values(),
+        KEY_COOP_SHARES_CANCELLATION_DATE,
+        KEY_COOP_SHARES_CANCELLATION_AMOUNT,
+        KEY_COOP_SHARES_CANCELLATION_CONTRACT_END_DATE,
+        KEY_COOP_SHARES_TRANSFER_EURO,
+        KEY_COOP_SHARES_TRANSFER_FROM_TO,
+        KEY_COOP_SHARES_TRANSFER_DATE,
+        KEY_COOP_SHARES_PAYBACK_EURO,
+        KEY_COMMENT,
+    ]
+
+    def get_transaction_verb(t: CoopShareTransaction):
+        return (
+            "an"
+            if t.transaction_type
+            == CoopShareTransaction.CoopShareTransactionType.TRANSFER_OUT
+            else "von"
         )
 
+    def generate_rows():
         today = get_today()
-        # skip future members. TODO: check cancellation, when must old members be removed from the list?
-        if entry.coop_entry_date is None or entry.coop_entry_date > today:
-            continue
-
-        transfers = entry.coopsharetransaction_set.filter(
-            transaction_type__in=[
-                CoopShareTransaction.CoopShareTransactionType.TRANSFER_OUT,
-                CoopShareTransaction.CoopShareTransactionType.TRANSFER_IN,
-            ]
-        ).order_by("timestamp")
-
-        data = {
-            KEY_MEMBER_NO: entry.member_no,
-            KEY_FIRST_NAME: entry.first_name,
-            KEY_LAST_NAME: entry.last_name,
-            KEY_ADDRESS: entry.street,
-            KEY_ADDRESS2: entry.street_2,
-            KEY_POSTCODE: entry.postcode,
-            KEY_CITY: entry.city,
-            KEY_BIRTHDATE: format_date(entry.birthdate),
-            KEY_TELEPHONE: entry.phone_number,
-            KEY_EMAIL: entry.email,
-            KEY_COOP_SHARES_TOTAL: entry.coop_shares_quantity,
-            KEY_COOP_SHARES_TOTAL_EURO: format_currency(
-                entry.coop_shares_total_value()
-            ),
-            KEY_COOP_SHARES_CANCELLATION_DATE: cancelled_coop_shares_dates,
-            KEY_COOP_SHARES_CANCELLATION_AMOUNT: cancelled_coop_shares_amounts,
-            KEY_COOP_SHARES_CANCELLATION_CONTRACT_END_DATE: cancelled_coop_shares_valid_at,
-            KEY_COOP_SHARES_PAYBACK_EURO: "",  # TODO: how??? Cancelled coop shares?
-            KEY_COMMENT: "",  # TODO: join comment log entries?
-        }
+        members = Member.objects.order_by("member_no").prefetch_related(
+            Prefetch(
+                "coopsharetransaction_set",
+                queryset=CoopShareTransaction.objects.select_related(
+                    "transfer_member"
+                ).order_by("timestamp"),
+            )
+        )
+        for entry in iterate_in_chunks(members):
+            transactions_by_type = defaultdict(list)
+            for coop_share_transaction in entry.coopsharetransaction_set.all():
+                transactions_by_type[coop_share_transaction.transaction_type].append(
+                    coop_share_transaction
+                )
 
-        for i, share in enumerate(coop_shares, start=1):
-            data[share_cols[f"KEY_COOP_SHARES_{i}_EURO"]] = format_currency(
-                share.total_price
+            # skip future members. TODO: check cancellation, when must old members be removed from the list?
+            coop_entry_date = min(
+                [
+                    t.valid_at
+                    for t in transactions_by_type[
+                        CoopShareTransaction.CoopShareTransactionType.PURCHASE
+                    ]
+                    + transactions_by_type[
+                        CoopShareTransaction.CoopShareTransactionType.TRANSFER_IN
+                    ]
+                ],
+                default=None,
             )
-            data[share_cols[f"KEY_COOP_SHARES_{i}_ENTRY_DATE"]] = format_date(
-                share.valid_at
+            if coop_entry_date is None or coop_entry_date > today:
+                continue
+
+            coop_shares = transactions_by_type[
+                CoopShareTransaction.CoopShareTransactionType.PURCHASE
+            ]
+            cancelled_coop_shares = transactions_by_type[
+                CoopShareTransaction.CoopShareTransactionType.CANCELLATION
+            ]
+            transfers = sorted(
+                transactions_by_type[
+                    CoopShareTransaction.CoopShareTransactionType.TRANSFER_OUT
+                ]
+                + transactions_by_type[
+                    CoopShareTransaction.CoopShareTransactionType.TRANSFER_IN
+                ],
+                key=lambda t: t.timestamp,
             )
+            valid_transactions = [
+                t for t in entry.coopsharetransaction_set.all() if t.valid_at <= today
+            ]
 
-        transfer_total_quantity = transfers.aggregate(total=Sum("quantity"))["total"]
-        transfer_euro_string = (
-            format_currency(settings.COOP_SHARE_PRICE * transfer_total_quantity)
-            if transfer_total_quantity
-            else ""
-        )
+            data = {
+                KEY_MEMBER_NO: entry.member_no,
+                KEY_FIRST_NAME: entry.first_name,
+                KEY_LAST_NAME: entry.last_name,
+                KEY_ADDRESS: entry.street,
+                KEY_ADDRESS2: entry.street_2,
+                KEY_POSTCODE: entry.postcode,
+                KEY_CITY: entry.city,
+                KEY_BIRTHDATE: format_date(entry.birthdate),
+                KEY_TELEPHONE: entry.phone_number,
+                KEY_EMAIL: entry.email,
+                KEY_COOP_SHARES_TOTAL: sum(t.quantity for t in valid_transactions),
+                KEY_COOP_SHARES_TOTAL_EURO: format_currency(
+                    sum(t.quantity * t.share_price for t in valid_transactions)
+                ),
+                KEY_COOP_SHARES_CANCELLATION_DATE: "\n".join(
+                    [format_date(t.timestamp) for t in cancelled_coop_shares]
+                ),
+                KEY_COOP_SHARES_CANCELLATION_AMOUNT: "\n".join(
+                    [format_currency(t.total_price) for t in cancelled_coop_shares]
+                ),
+                KEY_COOP_SHARES_CANCELLATION_CONTRACT_END_DATE: "\n".join(
+                    [format_date(t.valid_at) for t in cancelled_coop_shares]
+                ),
+                KEY_COOP_SHARES_PAYBACK_EURO: "",  # TODO: how??? Cancelled coop shares?
+                KEY_COMMENT: "",  # TODO: join comment log entries?
+            }
 
-        def get_transaction_verb(t: CoopShareTransaction):
-            return (
-                "an"
-                if t.transaction_type
-                == CoopShareTransaction.CoopShareTransactionType.TRANSFER_OUT
-                else "von"
-            )
+            for i, share in enumerate(coop_shares, start=1):
+                data[share_cols[f"KEY_COOP_SHARES_{i}_EURO"]] = format_currency(
+                    share.total_price
+                )
+                data[share_cols[f"KEY_COOP_SHARES_{i}_ENTRY_DATE"]] = format_date(
+                    share.valid_at
+                )
 
-        data[KEY_COOP_SHARES_TRANSFER_EURO] = transfer_euro_string
-        data[KEY_COOP_SHARES_TRANSFER_FROM_TO] = "\n".join(
-            map(
-                lambda x: f"Übertragung {format_currency(abs(x.quantity) * settings.COOP_SHARE_PRICE)} € {get_transaction_verb(x)} {x.transfer_member.first_name} {x.transfer_member.last_name} (Nr. {x.transfer_member.member_no})",
-                transfers,
+            transfer_total_quantity = sum(t.quantity for t in transfers)
+            data[KEY_COOP_SHARES_TRANSFER_EURO] = (
+                format_currency(settings.COOP_SHARE_PRICE * transfer_total_quantity)
+                if transfer_total_quantity
+                else ""
             )
-        )
-        data[KEY_COOP_SHARES_TRANSFER_DATE] = "\n".join(
-            map(
-                lambda x: f"{get_transaction_verb(x)} {x.transfer_member.first_name} {x.transfer_member.last_name}: {format_date(x.valid_at)}",
-                transfers,
+            data[KEY_COOP_SHARES_TRANSFER_FROM_TO] = "\n".join(
+                map(
+                    lambda x: f"Übertragung {format_currency(abs(x.quantity) * settings.COOP_SHARE_PRICE)} € {get_transaction_verb(x)} {x.transfer_member.first_name} {x.transfer_member.last_name} (Nr. {x.transfer_member.member_no})",
+                    transfers,
+                )
+            )
+            data[KEY_COOP_SHARES_TRANSFER_DATE] = "\n".join(
+                map(
+                    lambda x: f"{get_transaction_verb(x)} {x.transfer_member.first_name} {x.transfer_member.last_name}: {format_date(x.valid_at)}",
+                    transfers,
+                )
             )
-        )
 
-        writer.writerow(data)
+            yield data
 
     filename = f"Mitgliederliste_{get_now().strftime('%Y%m%d_%H%M%S')}.csv"
     mime_type, _ = mimetypes.guess_type(filename)
-    response = HttpResponse("".join(output.csv_string), content_type=mime_type)
+    response = StreamingHttpResponse(
+        stream_csv(field_names, generate_rows()), content_type=mime_type
+    )
     response["Content-Disposition"] = "attachment; filename=%s" % filename
     return response
 
@@ -195,54 +229,53 @@ class ExportMembersView(View):
         filter_class = MemberFilter
         queryset = filter_class(request.GET, queryset=self.get_queryset()).qs
 
-        # Create response object with CSV content
-        response = HttpResponse(content_type="text/csv")
+        header = [
+            "#",
+            "Vorname",
+            "Nachname",
+            "Email",
+            "Telefon",
+            "Adresse",
+            "PLZ",
+            "Ort",
+            "Land",
+            "Registriert am",
+            "Geno-Beitritt am",
+            "Geschäftsanteile (€)",
+            "Umsatz/Monat (€)",
+            "Abholort",
+        ]
+
+        def generate_rows():
+            for members in get_queryset_chunks(queryset):
+                for member in load_member_computed_fields(members):
+                    yield [
+                        member.member_no,
+                        member.first_name,
+                        member.last_name,
+                        member.email,
+                        member.phone_number,
+                        (
+                            member.street + (", " + member.street_2)
+                            if member.street_2
+                            else ""
+                        ),
+                        member.postcode,
+                        member.city,
+                        member.country,
+                        format_date(member.created_at.date()),
+                        format_date(member.coop_entry_date),
+                        format_currency(member.coop_shares_total_value),
+                        format_currency(member.monthly_payment),
+                        (member.pickup_location.name if member.pickup_location else ""),
+                    ]
+
+        response = StreamingHttpResponse(
+            stream_csv_rows(header, generate_rows()), content_type="text/csv"
+        )
         response["Content-Disposition"] = (
             f'attachment; filename="Mitglieder_gefiltert_{get_now().strftime("%Y%m%d_%H%M%S")}.csv"'
         )
-        writer = csv.writer(response, delimiter=";")
-
-        # Write header row
-        writer.writerow(
-            [
-                "#",
-                "Vorname",
-                "Nachname",
-                "Email",
-                "Telefon",
-                "Adresse",
-                "PLZ",
-                "Ort",
-                "Land",
-                "Registriert am",
-                "Geno-Beitritt am",
-                "Geschäftsanteile (€)",
-                "Umsatz/Monat (€)",
-                "Abholort",
-            ]
-        )
-
-        # Write data rows
-        for member in queryset:
-            writer.writerow(
-                [
-                    member.member_no,
-                    member.first_name,
-                    member.last_name,
-                    member.email,
-                    member.phone_number,
-                    member.street + (", " + member.street_2) if member.street_2 else "",
-                    member.postcode,
-                    member.city,
-                    member.country,
-                    format_date(member.created_at.date()),
-                    format_date(member.coop_entry_date),
-                    format_currency(member.coop_shares_total_value),
-                    format_currency(member.monthly_payment),
-                    member.pickup_location.name if member.pickup_location else "",
-                ]
-            )
-
         return response
 
     def get_queryset(self):
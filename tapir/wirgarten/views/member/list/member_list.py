@@ -27,6 +27,7 @@ from tapir.wirgarten.service.member import (
     annotate_member_queryset_with_coop_shares_total_value,
     annotate_member_queryset_with_monthly_payment,
 )
+from tapir.wirgarten.service.member_computed_fields import load_member_computed_fields
 from tapir.wirgarten.service.products import get_next_growing_period
 from tapir.wirgarten.utils import get_today
 from tapir.wirgarten.views.filters import MultiFieldFilter
@@ -162,9 +163,8 @@ class MemberFilter(FilterSet):
             latest_pickup_location_subquery = Subquery(
                 MemberPickupLocation.objects.filter(
                     member_id=OuterRef("id"),  # references Member.id
-                    valid_from__lte=today,
                 )
-                .order_by("-valid_from")[:1]
+                .valid_at(today)[:1]
                 .values("id")
             )
 
@@ -177,11 +177,7 @@ class MemberFilter(FilterSet):
             return queryset.all()
 
     def filter_email_verified(self, queryset, name, value):
-        new_queryset = queryset.all()
-        for member in queryset:
-            if member.email_verified() != value:
-                new_queryset = new_queryset.exclude(id=member.id)
-        return new_queryset
+        return queryset.filter(keycloak_email_verified=value)
 
     def filter_membership_type(self, queryset, name, value):
         if value == "mitglied":
@@ -224,6 +220,8 @@ class MemberListView(PermissionRequiredMixin, FilterView):
         query_dict.pop("page", None)
         new_query_string = urlencode(query_dict, doseq=True)
         context["filter_query"] = new_query_string
+        # the rows show computed properties of the members, loaded for the whole page at once
+        context["object_list"] = load_member_computed_fields(context["object_list"])
         return context
 
     def get_queryset(self):
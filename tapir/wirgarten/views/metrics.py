@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.http import Http404, HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.http import require_GET
+
+from tapir.wirgarten.service.query_metrics import render_metrics
+
+
+@require_GET
+def metrics_view(request):
+    """
+    Prometheus scrape endpoint. Disabled unless settings.METRICS_TOKEN is set, the token must be sent as bearer token.
+    """
+    if not settings.METRICS_TOKEN:
+        raise Http404()
+
+    authorization = request.headers.get("Authorization", "")
+    if not constant_time_compare(authorization, f"Bearer {settings.METRICS_TOKEN}"):
+        return HttpResponseForbidden()
+
+    return HttpResponse(
+        render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
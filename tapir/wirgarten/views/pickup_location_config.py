@@ -1,3 +1,5 @@
+import json
+
 from django.contrib.auth.decorators import permission_required
 from django.contrib.auth.mixins import PermissionRequiredMixin
 from django.http import HttpResponseRedirect, HttpResponse
@@ -8,12 +10,12 @@ from django.views.decorators.http import require_http_methods
 
 from tapir.wirgarten.constants import Permission
 from tapir.wirgarten.forms.pickup_location import (
-    get_pickup_locations_map_data,
     pickup_location_to_dict,
     PickupLocationEditForm,
 )
 from tapir.wirgarten.models import PickupLocation, PickupLocationCapability
 from tapir.wirgarten.service.delivery import get_active_pickup_location_capabilities
+from tapir.wirgarten.service.pickup_location_occupancy import PickupLocationOccupancy
 from tapir.wirgarten.service.products import get_active_product_types
 from tapir.wirgarten.views.modal import get_form_modal
 
@@ -38,14 +40,19 @@ class PickupLocationCfgView(PermissionRequiredMixin, generic.TemplateView):
             "product_type__name",
             "product_type__icon_link",
         )
-        context["data"] = get_pickup_locations_map_data(
-            pickup_locations=pickup_locations,
-            location_capabilities=capabilities,
+        occupancy = PickupLocationOccupancy()
+        pickup_location_dicts = [
+            pickup_location_to_dict(capabilities, pickup_location, occupancy)
+            for pickup_location in pickup_locations
+        ]
+        context["data"] = json.dumps(
+            {
+                f"{pickup_location_dict['id']}": pickup_location_dict
+                for pickup_location_dict in pickup_location_dicts
+            }
         )
         context["all_product_types"] = get_active_product_types().values("name")
-        context["pickup_locations"] = list(
-            map(lambda x: pickup_location_to_dict(capabilities, x), pickup_locations)
-        )
+        context["pickup_locations"] = pickup_location_dicts
 
         return context
 
@@ -80,7 +87,7 @@ def get_pickup_location_edit_form(request, **kwargs):
         form_class=PickupLocationEditForm,
         handler=lambda x: x.save(),
         redirect_url_resolver=lambda x: PAGE_ROOT + "?selected=" + x.id,
-        **kwargs
+        **kwargs,
     )
 
 
@@ -30,6 +30,7 @@ from tapir.wirgarten.models import (
     Member,
 )
 from tapir.wirgarten.parameters import Parameter
+from tapir.wirgarten.service.capacity_ledger import new_reservation_id
 from tapir.wirgarten.service.member import (
     buy_cooperative_shares,
     create_mandate_ref,
@@ -239,6 +240,15 @@ class RegistrationWizardViewBase(CookieWizardView):
             return ["registration/steps/summary.html"]
         return ["wirgarten/registration/registration_form.html"]
 
+    def get_form_kwargs(self, step=None):
+        kwargs = super().get_form_kwargs(step)
+        if step in [STEP_BASE_PRODUCT, *self.dynamic_steps]:
+            # keeps the capacity reservation of this registration stable across the wizard steps
+            kwargs["capacity_reservation_id"] = self.storage.extra_data.setdefault(
+                "capacity_reservation_id", new_reservation_id()
+            )
+        return kwargs
+
     # gather data from dependent forms
     def get_form_initial(self, step=None):
         initial = self.initial_dict